@@ -0,0 +1,454 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+
+from aerismodsdk.aio.transport import SerialTransport, READ_SIZE
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.modules.module import Module
+from aerismodsdk.modules.quectel import QuectelModule
+from aerismodsdk.modules.telit import TelitModule
+from aerismodsdk.modules.ublox import UbloxModule
+from aerismodsdk.utils import rmutils, aerisutils, portutils
+from aerismodsdk.utils.loggerutils import logger
+from aerismodsdk.utils.serialreader import UrcDemultiplexer
+from aerismodsdk.utils.shoulder_tap import parse_shoulder_tap, ShoulderTapWindow
+
+
+class AsyncModule:
+    '''asyncio counterpart of Module.
+
+    All serial I/O is non-blocking, so many modules (and anything else) can share one event loop.
+    Commands are serialized per module; URCs are routed to subscribers as they arrive.
+    Create instances with open_module.
+    '''
+
+    # The response parsing does not touch the port, so share it with the blocking API
+    parse_cmd_response = Module.parse_cmd_response
+    parse_cmd_single_response = Module.parse_cmd_single_response
+    parse_response = Module.parse_response
+
+    def __init__(self, modem_mfg, com_port, apn, verbose=True, loop=None):
+        # The port as configured; a usb: port is resolved again whenever it is opened
+        self.port_spec = com_port
+        self.com_port = portutils.resolve_com_port(com_port) or com_port
+        self.apn = apn
+        self.verbose = verbose
+        self.modem_mfg = modem_mfg
+        self.cmd_iccid = 'CCID'
+        self.loop = loop or asyncio.get_event_loop()
+        self.transport = None
+        self.stream = None
+        self.demux = UrcDemultiplexer(self._emit, verbose=verbose)
+        self._lock = None
+
+    async def open(self, ser=None):
+        '''Opens the serial port (or uses ser, if given) and turns off echo. Returns False if the port could not be opened.'''
+        if ser is None:
+            self.com_port = portutils.resolve_com_port(self.port_spec) or self.port_spec
+            ser = rmutils.open_serial(self.com_port)
+            if ser is None:
+                return False
+        self._lock = asyncio.Lock()
+        self.stream = asyncio.StreamReader()
+        self.transport = SerialTransport(ser, self.demux.feed, loop=self.loop,
+                                         connection_lost=self._connection_lost)
+        logger.info('Established Serial Connection')
+        await self.command('ATE0')  # Turn off echo
+        return True
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def _emit(self, data):
+        self.stream.feed_data(data)
+
+    def _connection_lost(self, exc):
+        if exc is None:
+            self.stream.feed_eof()
+        else:
+            aerisutils.print_log('Serial port closed: ' + str(exc))
+            self.stream.set_exception(exc)
+
+    # ========================================================================
+    #
+    # Commands and URCs
+    #
+
+    async def command(self, cmd, moredata=None, timeout=1.0, verbose=None, terminators=None,
+                      prompt=rmutils.DATA_PROMPT, send_timeout=None):
+        '''Writes an AT command to the module and returns its response; see rmutils.write.
+        Parameters
+        ----------
+        cmd : str
+            The command to send, without the trailing CR/LF.
+        moredata : str or bytes, optional
+            Data to send once the module prompts for it. The response then also includes the result
+            of sending the data (SEND OK, SEND FAIL, OK or an error).
+        timeout : float, optional
+            Seconds to wait for the final result code.
+        verbose : bool, optional
+            Defaults to the module's verbose setting.
+        terminators : iterable of str, optional
+            Custom terminators that end the response instead of 'OK'.
+        prompt : str, optional
+            The prompt the module sends before accepting moredata. Default: '>'.
+        send_timeout : float, optional
+            Seconds to wait for the result of sending moredata. Default: the same as timeout.
+        Returns
+        -------
+        The response decoded from UTF-8, or None if the serial port is not open.
+        '''
+        if self.transport is None:
+            print('Serial port is not open')
+            return None
+        if verbose is None:
+            verbose = self.verbose
+        async with self._lock:
+            aerisutils.vprint(verbose, '>> ' + cmd)
+            data = (cmd + '\r\n').encode()
+            self.demux.command_sent(data)
+            self.transport.write(data)
+            await self.transport.drain()
+            if moredata is None:
+                response, final = await self._read_response(timeout, terminators)
+            else:
+                response, final = await self._read_response(timeout, terminators or (prompt,))
+                if final == prompt:
+                    if isinstance(moredata, str):
+                        moredata = moredata.encode()
+                    aerisutils.vprint(verbose, 'More data: ' + aerisutils.bytes_to_utf_or_hex(moredata))
+                    self.transport.write(moredata)
+                    await self.transport.drain()
+                    send_timeout = timeout if send_timeout is None else send_timeout
+                    more, final = await self._read_response(send_timeout, rmutils.SEND_RESULT_CODES)
+                    response += more
+            if final is None:
+                aerisutils.vprint(verbose, 'No final result code within {0}s'.format(timeout))
+            response = response.decode('utf-8', errors='replace')
+            aerisutils.vprint(verbose, '<< ' + response.strip())
+            return response
+
+    async def _read_response(self, timeout, terminators=None):
+        response = bytearray()
+        final = None
+        line_start = 0
+        deadline = self.loop.time() + timeout
+        while final is None:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(self.stream.read(READ_SIZE), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            response += chunk
+            final, line_start = rmutils.scan_response(response, line_start, terminators)
+        return bytes(response), final
+
+    async def wait_urc(self, timeout, returnonvalue=None, verbose=None, returnbytes=False):
+        '''Collects unsubscribed output from the module for up to timeout seconds; see rmutils.wait_urc.
+        Returns early once returnonvalue has been seen.
+        '''
+        if self.transport is None:
+            print('Serial port is not open')
+            return None
+        if verbose is None:
+            verbose = self.verbose
+        value = returnonvalue.encode() if returnonvalue else None
+        urcs = bytearray()
+        async with self._lock:
+            deadline = self.loop.time() + timeout
+            while value is None or value not in urcs:
+                remaining = deadline - self.loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    chunk = await asyncio.wait_for(self.stream.read(READ_SIZE), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not chunk:
+                    break
+                urcs += chunk
+        aerisutils.vprint(verbose, '<< ' + aerisutils.bytes_to_utf_or_hex(bytes(urcs)).strip())
+        if returnbytes:
+            return bytes(urcs)
+        return urcs.decode('utf-8', errors='replace')
+
+    def subscribe(self, prefix):
+        '''Routes URCs that start with prefix to the returned asyncio.Queue, which receives a Urc for each.'''
+        urcs = asyncio.Queue()
+        self.demux.subscribe(prefix, urcs.put_nowait)
+        return urcs
+
+    def unsubscribe(self, prefix, urcs):
+        self.demux.unsubscribe(prefix, urcs.put_nowait)
+
+    async def wait_for(self, prefix, timeout):
+        '''Waits up to timeout seconds for the next URC starting with prefix. Returns the Urc or None.'''
+        urcs = self.subscribe(prefix)
+        try:
+            return await asyncio.wait_for(urcs.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.unsubscribe(prefix, urcs)
+
+    # ========================================================================
+    #
+    # Module info
+    #
+
+    async def atcmd(self, myatcmd):
+        return await self.command(myatcmd, timeout=2)
+
+    async def get_values_for_cmd(self, cmd, prefix, verbose=None):
+        response = await self.command(cmd, timeout=2, verbose=verbose)
+        return self.parse_response(response, prefix)
+
+    async def get_info_for_obj(self, cmd, keyname, info_obj):
+        value = self.parse_cmd_single_response(await self.command(cmd))
+        info_obj.update({keyname: value})
+        return value
+
+    async def get_info_for_obj_prefix(self, cmd, prefix, keyname, info_obj):
+        value = await self.get_values_for_cmd(cmd, prefix)
+        info_obj.update({keyname: value[0] if value else None})
+
+    async def get_info(self):
+        mod_info = {}
+        if self.parse_cmd_response(await self.command('ATI')) in (None, False):
+            logger.warn('WARNING : The ATI command is not working. Please review configuration.')
+            return mod_info
+        if not await self.get_info_for_obj('AT+CIMI', 'imsi', mod_info):
+            logger.warn('WARNING : The CIMI command is not working. Please check SIM.')
+            return mod_info
+        await self.get_info_for_obj_prefix('AT+' + self.cmd_iccid, '+' + self.cmd_iccid + ':', 'iccid', mod_info)
+        response = await self.command('AT+GMI')  # Module Manufacturer
+        mod_type = (response.split('\r\n')[1]).replace('-', '').strip().upper()
+        mod_info.update({'maker': mod_type})
+        if mod_type == self.modem_mfg.upper():
+            await self.get_info_for_obj('AT+GMM', 'model', mod_info)
+            await self.get_info_for_obj('AT+GSN', 'imei', mod_info)
+            await self.get_info_for_obj('AT+GMR', 'rev', mod_info)
+        else:
+            logger.warn('WARNING : The modem type connected is ' + mod_type + '. Please review configuration')
+        return mod_info
+
+    # ========================================================================
+    #
+    # Packet data
+    #
+
+    async def create_packet_session(self, verbose=True):
+        raise NotImplementedError('Not supported for modem manufacturer ' + self.modem_mfg)
+
+    async def udp_send(self, host, port, data, verbose=True):
+        '''Sends data to host:port in one UDP packet. Returns True if the module accepted the packet.'''
+        raise NotImplementedError('Not supported for modem manufacturer ' + self.modem_mfg)
+
+    async def shoulder_taps(self, port=23747, verbose=False, window=None):
+        '''Yields shoulder taps as they arrive; see Module.get_shoulder_taps. Is an async generator.'''
+        raise NotImplementedError('Not supported for modem manufacturer ' + self.modem_mfg)
+        yield
+
+
+class AsyncQuectelModule(AsyncModule):
+
+    parse_constate = QuectelModule.parse_constate
+
+    def __init__(self, modem_mfg, com_port, apn, verbose=True, loop=None):
+        super().__init__(modem_mfg, com_port, apn, verbose=verbose, loop=loop)
+        self.cmd_iccid = 'QCCID'
+        self._udp_remote = None
+
+    async def get_info(self):
+        await self.command('AT+QGMR?')
+        return await super().get_info()
+
+    async def create_packet_session(self, verbose=True):
+        await self.command('AT+QICSGP=1,1,"' + self.apn + '","","",0', verbose=verbose)
+        constate = await self.command('AT+QIACT?', verbose=verbose)  # Check if we are already connected
+        if not self.parse_constate(constate):  # Returns packet session info if in session
+            await self.command('AT+QIACT=1', timeout=150, verbose=verbose)  # Activate context / create packet session
+            constate = await self.command('AT+QIACT?', verbose=verbose)  # Verify that we connected
+            if not self.parse_constate(constate):
+                return False
+        return True
+
+    async def udp_listen(self, listen_port, verbose=True):
+        '''Opens the UDP service socket (connectID 1) on listen_port. Received packets arrive as +QIURC: "recv" URCs.'''
+        if not await self.create_packet_session(verbose=verbose):
+            return False
+        mycmd = 'AT+QIOPEN=1,1,"UDP SERVICE","127.0.0.1",0,' + str(listen_port) + ',1'
+        await self.command(mycmd, timeout=150, verbose=verbose, terminators=['+QIOPEN:'])
+        sostate = await self.command('AT+QISTATE=1,1', verbose=verbose)  # Check socket state
+        return 'UDP' in sostate
+
+    async def udp_send(self, host, port, data, verbose=True):
+        # Socket 0 is the client socket; only reopen it when the remote end changes
+        if self._udp_remote != (host, port):
+            if not await self.create_packet_session(verbose=verbose):
+                return False
+            await self.command('AT+QICLOSE=0', timeout=10, verbose=verbose)
+            mycmd = 'AT+QIOPEN=1,0,"UDP","' + host + '",' + str(port) + ',0,1'
+            response = await self.command(mycmd, timeout=150, verbose=verbose, terminators=['+QIOPEN:'])
+            if '+QIOPEN: 0,0' not in response:
+                self._udp_remote = None
+                return False
+            self._udp_remote = (host, port)
+        response = await self.command('AT+QISEND=0,' + str(len(data)), data, send_timeout=5, verbose=verbose)
+        return 'SEND OK' in response
+
+    async def shoulder_taps(self, port=23747, verbose=False, window=None):
+        imsi = self.parse_cmd_single_response(await self.command('AT+CIMI', verbose=verbose))
+        if not imsi:
+            aerisutils.print_log('IMSI not found -- is the module powered up?')
+        if window is None:
+            window = ShoulderTapWindow()
+        urcs = self.subscribe('+QIURC: "recv"')
+        try:
+            if not await self.udp_listen(port, verbose):
+                aerisutils.print_log('Failed to listen for shoulder taps. Is the module in a packet session?')
+                return
+            while True:
+                try:
+                    urc = await asyncio.wait_for(urcs.get(), window.reorder_timeout)
+                except asyncio.TimeoutError:
+                    for shoulder_tap in window.expire():
+                        yield shoulder_tap
+                    continue
+                if not urc.payload:
+                    continue
+                aerisutils.print_log('Got payload: ' + aerisutils.bytes_to_utf_or_hex(urc.payload), verbose)
+                shoulder_tap = parse_shoulder_tap(urc.payload, imsi)
+                if shoulder_tap is not None:
+                    for shoulder_tap in window.add(shoulder_tap):
+                        yield shoulder_tap
+        finally:
+            self.unsubscribe('+QIURC: "recv"', urcs)
+
+
+class AsyncUbloxModule(AsyncModule):
+
+    parse_constate = UbloxModule.parse_constate
+
+    def __init__(self, modem_mfg, com_port, apn, verbose=True, loop=None):
+        super().__init__(modem_mfg, com_port, apn, verbose=verbose, loop=loop)
+        self._socket_id = None
+
+    async def open(self, ser=None):
+        if not await super().open(ser):
+            return False
+        await self.command('AT+CGEREP=1,1')  # Enable URCs
+        return True
+
+    async def create_packet_session(self, verbose=True):
+        await self.command('AT+CGDCONT=1,"IP","' + self.apn + '"', verbose=verbose)
+        constate = await self.command('AT+CGDCONT?', verbose=verbose)  # Check if we are already connected
+        if not self.parse_constate(constate):  # Returns packet session info if in session
+            await self.command('AT+CGACT=1,1', timeout=150, verbose=verbose)  # Activate context / create packet session
+            constate = await self.command('AT+CGDCONT?', verbose=verbose)  # Verify that we connected
+            if not self.parse_constate(constate):
+                return False
+        return True
+
+    async def udp_send(self, host, port, data, verbose=True):
+        if self._socket_id is None:
+            if not await self.create_packet_session(verbose=verbose):
+                return False
+            vals = await self.get_values_for_cmd('AT+USOCR=17', '+USOCR:', verbose=verbose)
+            if not vals:
+                return False
+            self._socket_id = str(vals[0])
+        mycmd = 'AT+USOST=' + self._socket_id + ',"' + host + '",' + str(port) + ',' + str(len(data))
+        # SARA-R4 prompts with '@' before accepting the binary data
+        response = await self.command(mycmd, data, send_timeout=5, verbose=verbose, prompt='@')
+        return '+USOST:' in response
+
+
+class AsyncTelitModule(AsyncModule):
+
+    parse_connection_state = TelitModule.parse_connection_state
+    get_module_ip = TelitModule.get_module_ip
+
+    def __init__(self, modem_mfg, com_port, apn, verbose=True, loop=None):
+        super().__init__(modem_mfg, com_port, apn, verbose=verbose, loop=loop)
+        self._udp_remote = None
+
+    async def get_packet_info(self, verbose=True):
+        constate = await self.command('AT#SGACT?', verbose=verbose)  # Check if we are already connected
+        return self.parse_connection_state(constate)
+
+    async def create_packet_session(self, verbose=True):
+        if not await self.get_packet_info(verbose):  # Check if already in a packet session
+            await self.command('AT#SGACT=1,1', timeout=150, verbose=verbose)  # Activate context / create packet session
+            if not await self.get_packet_info(verbose):
+                return False
+        self.get_module_ip(await self.command('AT+CGPADDR=1', verbose=verbose))
+        return True
+
+    async def udp_send(self, host, port, data, verbose=True):
+        # Socket 1 is the client socket; only reopen it when the remote end changes
+        if self._udp_remote != (host, port):
+            if not await self.create_packet_session(verbose=verbose):
+                return False
+            await self.command('AT#SH=1', verbose=verbose)
+            mycmd = 'AT#SD=1,1,' + str(port) + ',"' + host + '",0,0,1'  # Command mode, so the port stays usable
+            response = await self.command(mycmd, timeout=60, verbose=verbose)
+            if 'OK' not in response:
+                self._udp_remote = None
+                return False
+            self._udp_remote = (host, port)
+        # SSENDEXT takes an exact byte count, so the data does not need a Ctrl-Z terminator
+        response = await self.command('AT#SSENDEXT=1,' + str(len(data)), data, send_timeout=5, verbose=verbose)
+        return response.strip().endswith('OK')
+
+
+async def open_module(modem_mfg, com_port, apn, verbose=True, loop=None, ser=None):
+    '''Creates and opens the async module for a manufacturer; the asyncio counterpart of ModuleFactory.get.
+    Parameters
+    ----------
+    modem_mfg : Manufacturer
+    com_port : str
+        The port as used by Module; see portutils.resolve_com_port.
+    apn : str
+    verbose : bool, optional
+    loop : asyncio event loop, optional
+    ser : serial port object, optional
+        An already open port to use instead of opening com_port.
+    Returns
+    -------
+    The open AsyncModule, or None if the port could not be opened.
+    '''
+    if modem_mfg == Manufacturer.telit:
+        module_class = AsyncTelitModule
+    elif modem_mfg == Manufacturer.quectel:
+        module_class = AsyncQuectelModule
+    elif modem_mfg == Manufacturer.ublox:
+        module_class = AsyncUbloxModule
+    else:
+        logger.info('No valid Module Found')
+        return None
+    module = module_class(modem_mfg.name, com_port, apn, verbose=verbose, loop=loop)
+    if not await module.open(ser):
+        return None
+    return module
@@ -0,0 +1,185 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+import os
+
+import aerismodsdk.utils.rmutils as rmutils
+
+READ_SIZE = 4096
+
+
+class SerialTransport:
+    '''Non-blocking serial I/O on an event loop.
+
+    The port's file descriptor is watched with loop.add_reader/add_writer, so reading and writing
+    never block the loop. Works with real ttys and with ptys. Data read from the port is passed to
+    data_received as soon as it arrives.
+    '''
+
+    def __init__(self, ser, data_received, loop=None, connection_lost=None):
+        '''
+        Parameters
+        ----------
+        ser : serial.Serial
+            An open serial port. The transport becomes its only reader and writer.
+        data_received : callable
+            Called on the event loop with each chunk of bytes read from the port.
+        loop : asyncio event loop, optional
+            Defaults to the current event loop.
+        connection_lost : callable, optional
+            Called with the exception (or None) when the port is closed.
+        '''
+        self.ser = ser
+        self.loop = loop or asyncio.get_event_loop()
+        self.data_received = data_received
+        self.connection_lost = connection_lost
+        self._fd = ser.fileno()
+        self._write_buffer = bytearray()
+        self._drain_waiters = []
+        self._closed = False
+        os.set_blocking(self._fd, False)
+        self.loop.add_reader(self._fd, self._read_ready)
+
+    def _read_ready(self):
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._close(e)
+            return
+        if data:
+            self.data_received(data)
+
+    def write(self, data):
+        if self._closed:
+            raise IOError('Serial port is closed')
+        if not self._write_buffer:
+            try:
+                written = os.write(self._fd, data)
+            except (BlockingIOError, InterruptedError):
+                written = 0
+            except OSError as e:
+                self._close(e)
+                raise
+            data = data[written:]
+            if not data:
+                return
+            self.loop.add_writer(self._fd, self._write_ready)
+        self._write_buffer += data
+
+    def _write_ready(self):
+        try:
+            written = os.write(self._fd, self._write_buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._close(e)
+            return
+        del self._write_buffer[:written]
+        if not self._write_buffer:
+            self.loop.remove_writer(self._fd)
+            self._wake_drain_waiters(None)
+
+    async def drain(self):
+        '''Waits until everything written has been handed to the port.'''
+        if self._closed:
+            raise IOError('Serial port is closed')
+        if not self._write_buffer:
+            return
+        waiter = self.loop.create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    def _wake_drain_waiters(self, exc):
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                if exc is None:
+                    waiter.set_result(None)
+                else:
+                    waiter.set_exception(exc)
+        self._drain_waiters = []
+
+    def is_closing(self):
+        return self._closed
+
+    def close(self):
+        self._close(None)
+
+    def _close(self, exc):
+        if self._closed:
+            return
+        self._closed = True
+        self.loop.remove_reader(self._fd)
+        self.loop.remove_writer(self._fd)
+        self._wake_drain_waiters(exc or IOError('Serial port is closed'))
+        self.ser.close()
+        if self.connection_lost is not None:
+            self.connection_lost(exc)
+
+
+class SerialStreamWriter:
+    '''The writing half returned by open_serial_connection, shaped like asyncio.StreamWriter.'''
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        await self.transport.drain()
+
+    def close(self):
+        self.transport.close()
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+
+async def open_serial_connection(port, loop=None, ser=None):
+    '''Opens a serial port for use with asyncio.
+    Parameters
+    ----------
+    port : str
+        The port to open, e.g. /dev/ttyUSB2 or a pty.
+    loop : asyncio event loop, optional
+        Defaults to the current event loop.
+    ser : serial.Serial, optional
+        An already open port to use instead of opening port.
+    Returns
+    -------
+    reader : asyncio.StreamReader
+    writer : SerialStreamWriter
+    Or (None, None) if the port could not be opened.
+    '''
+    loop = loop or asyncio.get_event_loop()
+    if ser is None:
+        ser = rmutils.open_serial(port)
+        if ser is None:
+            return None, None
+    reader = asyncio.StreamReader()
+
+    def connection_lost(exc):
+        if exc is None:
+            reader.feed_eof()
+        else:
+            reader.set_exception(exc)
+
+    transport = SerialTransport(ser, reader.feed_data, loop=loop, connection_lost=connection_lost)
+    return reader, SerialStreamWriter(transport)
@@ -14,21 +14,24 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import atexit
 import click
 import json
 import pathlib
 import time
-import subprocess
 import aerismodsdk.utils.rmutils as rmutils
-import aerismodsdk.modules.ublox as ublox
-import aerismodsdk.modules.quectel as quectel
-import aerismodsdk.modules.telit as telit
+import aerismodsdk.fleet as fleetrunner
 import aerismodsdk.utils.aerisutils as aerisutils
-import aerismodsdk.utils.gpioutils as gpioutils
+import aerismodsdk.utils.identitycache as identitycache
+import aerismodsdk.utils.instrumentation as instrumentation
+import aerismodsdk.utils.portutils as portutils
 
+from aerismodsdk.daemon import DaemonClient, DEFAULT_SOCKET_PATH, serve
 from aerismodsdk.manufacturer import Manufacturer
 from aerismodsdk.modulefactory import module_factory
 from aerismodsdk.utils import loggerutils
+from aerismodsdk.utils.shoulder_tap import ShoulderTapWindow
+from aerismodsdk.utils.tapdispatcher import ShoulderTapDispatcher, BLOCK, DROP
 
 # Resolve this user's home directory path
 home_directory = str(pathlib.Path.home())
@@ -37,12 +40,10 @@ default_config_filename = home_directory + "/.aeris_config"
 # Establish the modem type; send commands to appropriate modem module
 my_module = None
 
-# Mapper between manufacturer to the corresponding logic, add new ones here
-modules = {
-    'quectel': quectel,
-    'ublox': ublox,
-    'telit': telit
-}
+# Imported by the command groups that use them, so that other commands start faster:
+# gpioutils needs RPi.GPIO, which is only there on a Raspberry Pi
+gpioutils = None
+subprocess = None
 
 
 # Loads configuration from json file previously created during initialization
@@ -78,28 +79,59 @@ def default_from_context(default_name, default_value=' '):
 @click.option('-v', '--verbose', is_flag=True, default=False, help="Verbose output")
 @click.option("--config-file", "-cfg", default=default_config_filename,
               help="Path to config file.")
-@click.pass_context
-def mycli(ctx, verbose, config_file):
+@click.option('--use-daemon', is_flag=True, default=False,
+              help="Run commands on the module held open by 'aeriscli daemon'.")
+@click.option('--daemon-socket', default=DEFAULT_SOCKET_PATH, help="Unix socket of the module daemon.")
+@click.option('--capture', default=None, type=click.Path(dir_okay=False),
+              help="Record serial traffic to a file; replay it with comport replay:<file>.")
+@click.option('--metrics-jsonl', default=None, type=click.Path(dir_okay=False),
+              help="Append a JSON line with the timing and result of each AT command to a file.")
+@click.option('--metrics-textfile', default=None, type=click.Path(dir_okay=False),
+              help="Write AT command latency, error and timeout metrics to a Prometheus textfile.")
+@click.option('--identity-cache/--no-identity-cache', default=True,
+              help="Answer 'info' from ~/.aeris_identity while the module and SIM are unchanged.")
+@click.pass_context
+def mycli(ctx, verbose, config_file, use_daemon, daemon_socket, capture, metrics_jsonl, metrics_textfile,
+          identity_cache):
     if ctx.obj is None:
         ctx.obj = {}
     ctx.obj['verbose'] = verbose
+    ctx.obj['daemon_socket'] = daemon_socket
     loggerutils.set_level(verbose)
+    rmutils.set_capture_file(capture)
+    if metrics_jsonl:
+        instrumentation.add_sink(instrumentation.JsonLinesSink(metrics_jsonl))
+    if metrics_textfile:
+        instrumentation.add_sink(instrumentation.PrometheusTextfile(metrics_textfile))
+    if metrics_jsonl or metrics_textfile:
+        atexit.register(instrumentation.close_sinks)
     # print('context:\n' + str(ctx.invoked_subcommand))
-    doing_config = ctx.invoked_subcommand in ['config']
+    doing_config = ctx.invoked_subcommand in ['config', 'fleet']  # fleet opens its own modules
     doing_pi = ctx.invoked_subcommand in ['pi']
     if doing_pi:  # Get out of here if doing a pi gpio command
         return
     config_loaded = load_config(ctx, config_file)  # Load config if there is one
     if doing_config:  # Get out of ere if doing a config command
         return
+    global my_module
+    if use_daemon and ctx.invoked_subcommand != 'daemon':  # The daemon already has the module open
+        my_module = DaemonClient(daemon_socket)
+        if not my_module.ping():
+            print('Module daemon is not running on ' + daemon_socket)
+            print('Try running daemon command')
+            exit()
+        return
     if config_loaded:  # In all other cases, we need a valid config
-        global my_module
         my_module = module_factory().get(Manufacturer[ctx.obj['modemMfg']], ctx.obj['comPort'], 
-                                        ctx.obj['apn'], verbose=ctx.obj['verbose'])
+                                        ctx.obj['apn'], verbose=ctx.obj['verbose'],
+                                        baudrate=ctx.obj.get('baudRate', rmutils.DEFAULT_BAUDRATE),
+                                        negotiate_baudrate=ctx.obj.get('negotiateBaudRate', False))
         aerisutils.vprint(verbose, 'Valid configuration loaded.')
         if my_module.get_serial() is None:
             print('Could not open serial port')
             exit()
+        if identity_cache:
+            my_module.use_identity_cache(identitycache.IdentityCache())
     else:  # Not ok
         print('Valid configuration not found')
         print('Try running config command')
@@ -109,19 +141,26 @@ def mycli(ctx, verbose, config_file):
 @mycli.command()
 @click.option('--modemmfg', prompt='Modem mfg', type=click.Choice(['ublox', 'quectel', 'telit']),
               cls=default_from_context('modemMfg', 'ublox'), help="Modem manufacturer.")
-@click.option('--comport', prompt='COM port', 
-              type=click.Choice(['ACM0','S0', 'S1', 'USB0', 'USB1', 'USB2', 'USB3', 'USB4', 'USB5', 'USB6', 'USB7']),
-              cls=default_from_context('comPort', 'USB0'), help="Modem COM port.")
+@click.option('--comport', prompt='COM port',
+              cls=default_from_context('comPort', 'USB0'),
+              help="Modem COM port: ACM0, S0, S1, USB0 ... USB7, a device path, or usb:<vid>:<pid>:<interface>"
+                   " (e.g. usb:2c7c:0296:2) to find the port by USB IDs.")
 @click.option('--apn', prompt='APN', cls=default_from_context('apn', 'lpiot.aer.net'), help="APN to use")
+@click.option('--baudrate', type=int, cls=default_from_context('baudRate', rmutils.DEFAULT_BAUDRATE),
+              help="Baud rate to open the COM port at.")
+@click.option('--negotiate/--no-negotiate', cls=default_from_context('negotiateBaudRate', False),
+              help="Use AT+IPR to step up to the fastest baud rate the module accepts (460800/921600).")
 @click.pass_context
-def config(ctx, modemmfg, comport, apn):
+def config(ctx, modemmfg, comport, apn, baudrate, negotiate):
     """Set up the configuration for using this tool
     \f
 
     """
     config_values = {"modemMfg": modemmfg,
                      "comPort": comport,
-                     "apn": apn}
+                     "apn": apn,
+                     "baudRate": baudrate,
+                     "negotiateBaudRate": negotiate}
     with open(default_config_filename, 'w') as myconfigfile:
         json.dump(config_values, myconfigfile, indent=4)
 
@@ -133,7 +172,7 @@ def info(ctx):
     \f
 
     """
-    if rmutils.find_serial('/dev/tty'+ctx.obj['comPort'], verbose=True, timeout=5):
+    if rmutils.find_serial(ctx.obj['comPort'], verbose=True, timeout=5):
         mod_info = my_module.get_info()
         print(str(mod_info))
 
@@ -146,8 +185,17 @@ def wait(ctx, timeout):
     \f
 
     """
-    rmutils.wait_urc(my_module.myserial, timeout, my_module.com_port,
-                     verbose=ctx.obj['verbose'])  # Wait up to X seconds for urc
+    my_module.wait_urc(timeout, verbose=ctx.obj['verbose'])  # Wait up to X seconds for urc
+
+
+@mycli.command()
+@click.pass_context
+def daemon(ctx):
+    """Hold the module open and serve commands sent with --use-daemon
+    \f
+
+    """
+    serve(my_module, ctx.obj['daemon_socket'], verbose=ctx.obj['verbose'])
 
 
 @mycli.command()
@@ -436,15 +484,31 @@ def send(ctx, host, port):
 
 @udp.command()
 @click.option("--port", "-p", default=23747, help="Shoulder-Tap listen port")
+@click.option("--reorder", default=0, help="Hold up to this many Shoulder-Taps back to print them in order")
+@click.option("--workers", default=1, help="Threads that handle Shoulder-Taps while more are received")
+@click.option("--queue-depth", default=100, help="Shoulder-Taps that may wait for a worker")
+@click.option("--drop/--block", default=False, help="Drop Shoulder-Taps, or wait, when the queue is full")
+@click.option("--buffered", is_flag=True, help="Let the module buffer packets and read them in one go")
 @click.pass_context
-def shoulder_tap(ctx, port):
+def shoulder_tap(ctx, port, reorder, workers, queue_depth, drop, buffered):
     """Listen for Shoulder-Tap packets and print their details. Runs until terminated with a SIGINT (e.g., CTRL+C).
     Requires that the module is in a packet data session; see the 'packet start' command.
+    Repeated Shoulder-Taps are only printed once.
     """
-    shoulder_taps = my_module.get_shoulder_taps(port, ctx.obj["verbose"])
-    for st in shoulder_taps:
-        if st is not None:
-            print(f'Shoulder tap request ID: <<{st.getRequestId()}>> and payload: <<{st.payload}>>')
+    if isinstance(my_module, DaemonClient):
+        raise click.UsageError('udp shoulder-tap runs until interrupted, so it cannot run through the daemon')
+    def print_shoulder_tap(st):
+        print(f'Shoulder tap request ID: <<{st.getRequestId()}>> and payload: <<{st.payload}>>')
+
+    dispatcher = ShoulderTapDispatcher(workers, queue_depth, DROP if drop else BLOCK, ctx.obj["verbose"])
+    dispatcher.add_handler(print_shoulder_tap)
+    try:
+        dispatcher.run(my_module.get_shoulder_taps(port, ctx.obj["verbose"], ShoulderTapWindow(reorder=reorder),
+                                                   buffered))
+    finally:
+        dispatcher.stop()
+        if ctx.obj["verbose"]:
+            print(json.dumps(dispatcher.summary(), indent=2))
 
 
 # ========================================================================
@@ -620,11 +684,11 @@ def test(ctx, timeout, psmtau, psmat, delay):
         #my_module.udp_echo(delay, 4, verbose=ctx.obj['verbose'])
         success = my_module.udp_echo(echo_host, echo_port, echo_delay, echo_wait, verbose=ctx.obj['verbose'])        
         aerisutils.print_log('Success: ' + str(success))
-        rmutils.wait_urc(my_module.myserial, timeout, my_module.com_port, returnonreset=True, returnonvalue='APP RDY',
-                         verbose=ctx.obj['verbose'])  # Wait up to X seconds for app rdy
+        my_module.wait_urc(timeout, returnonreset=True, returnonvalue='APP RDY',
+                           verbose=ctx.obj['verbose'])  # Wait up to X seconds for app rdy
         time.sleep(5.0) # Sleep in case it helps telit be able to connect
         my_module.init_serial(ctx.obj['comPort'], ctx.obj['apn'], verbose=ctx.obj['verbose'])
-        rmutils.write(my_module.myserial, 'ATE0', verbose=ctx.obj['verbose'])  # Turn off echo
+        my_module.write('ATE0', verbose=ctx.obj['verbose'])  # Turn off echo
         aerisutils.print_log('Connection state: ' + str(my_module.get_packet_info(verbose=ctx.obj['verbose'])))
         elapsed_time = time.time() - start_time
     # Do some cleanup tasks
@@ -722,6 +786,8 @@ def pi(ctx):
     \f
 
     """
+    global gpioutils
+    import aerismodsdk.utils.gpioutils as gpioutils
 
 
 @pi.command()
@@ -1128,6 +1194,8 @@ def wvdial(ctx):
     \f
 
     """
+    global subprocess
+    import subprocess
 
 
 def get_process_output(process):
@@ -1159,10 +1227,10 @@ ISDN = 0
 Modem Type = Analog Modem
 New PPPD = yes
 Phone = *99#
-Modem = /dev/ttycomporttoreplace
+Modem = comporttoreplace
 Username = { }
 Password = { }
-Baud = 115200
+Baud = baudratetoreplace
 """
 
 
@@ -1188,7 +1256,10 @@ def config(ctx):
     try:
         with open(home_directory + '/wvdial.conf.aerismodsdk', 'w') as wvdial_config_file:
             new_wvdial_config = wvdial_config.replace('mnoapntoreplace', ctx.obj['apn'])
-            new_wvdial_config = new_wvdial_config.replace('comporttoreplace', ctx.obj['comPort'])
+            new_wvdial_config = new_wvdial_config.replace('baudratetoreplace',
+                                                          str(ctx.obj.get('baudRate', rmutils.DEFAULT_BAUDRATE)))
+            new_wvdial_config = new_wvdial_config.replace('comporttoreplace',
+                                                          portutils.resolve_com_port(ctx.obj['comPort']) or '')
             wvdial_config_file.write(new_wvdial_config)
             wvdial_config_file.close()
     except IOError:
@@ -1249,6 +1320,57 @@ def demo(ctx, project, region, registry, cacert, clientkey,algorithm, deviceid):
 
 
 
+# ========================================================================
+#
+# Running operations on many modules at once
+#
+
+@mycli.group()
+@click.pass_context
+def fleet(ctx):
+    """Fleet commands
+    \f
+
+    """
+
+
+@fleet.command()
+@click.argument('operation', type=click.Choice(sorted(fleetrunner.OPERATIONS)))
+@click.option('--ports', '-p', multiple=True,
+              help="COM ports of the modules; repeat the option or separate them with commas.")
+@click.option('--inventory', '-i', type=click.Path(exists=True, dir_okay=False),
+              help="YAML or JSON file listing the modules (see aerismodsdk.fleet.load_inventory).")
+@click.option('--modemmfg', type=click.Choice(['ublox', 'quectel', 'telit']),
+              cls=default_from_context('modemMfg', 'quectel'), help="Modem manufacturer of the --ports modules.")
+@click.option('--apn', cls=default_from_context('apn', 'lpiot.aer.net'), help="APN of the --ports modules.")
+@click.option('--workers', '-w', default=fleetrunner.DEFAULT_WORKERS,
+              help="Modules to work on at once.")
+@click.option('--processes', is_flag=True, default=False, help="Use worker processes instead of threads.")
+@click.option('--iterations', '-n', default=1, help="Times to run the operation on each module.")
+@click.option('--echo-wait', default=4, help="Seconds udp_echo waits for the echo.")
+@click.option('--output', '-o', type=click.File('w'), default='-',
+              help="File for the JSON lines with the result of each run. Default: stdout.")
+@click.pass_context
+def run(ctx, operation, ports, inventory, modemmfg, apn, workers, processes, iterations, echo_wait, output):
+    """Run an operation on many modules
+    \f
+
+    """
+    devices = fleetrunner.load_inventory(inventory) if inventory else []
+    for port in [p for option in ports for p in option.split(',') if p]:
+        devices.append(fleetrunner.device_from_config({'modemMfg': modemmfg, 'comPort': port, 'apn': apn}))
+    if not devices:
+        print('No modules given; use --ports or --inventory')
+        return
+    runner = fleetrunner.FleetRunner(devices, workers=workers, processes=processes, verbose=ctx.obj['verbose'])
+
+    def write_result(result):
+        output.write(fleetrunner.to_json_line(result) + '\n')
+        output.flush()
+    results, summary = runner.run(operation, iterations, {'wait': echo_wait}, on_result=write_result)
+    output.write(json.dumps({'summary': summary}, sort_keys=True) + '\n')
+
+
 # ========================================================================
 #
 # The main stuff ...
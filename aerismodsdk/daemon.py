@@ -0,0 +1,201 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import contextlib
+import inspect
+import io
+import json
+import logging
+import os
+import pathlib
+import socket
+import socketserver
+import sys
+import traceback
+import types
+
+from aerismodsdk.utils import aerisutils
+from aerismodsdk.utils.loggerutils import logger
+
+# Where the daemon listens unless told otherwise
+DEFAULT_SOCKET_PATH = str(pathlib.Path.home()) + '/.aeris_daemon.sock'
+
+
+class DaemonError(Exception):
+    '''Raised by DaemonClient when the daemon could not run a call.'''
+
+
+class ModuleDaemon(socketserver.UnixStreamServer):
+    '''Holds a Module open and runs its methods for clients on a Unix domain socket.
+
+    Each request is one JSON line {"method": ..., "args": [...], "kwargs": {...}}; each reply is one
+    JSON line {"result": ..., "output": ..., "error": ...}, where output is everything the call printed
+    or logged. Calls run one at a time, in the order they arrive.
+
+    The module's SerialReader keeps draining the port between calls, so URCs that arrive while no
+    client is connected are buffered until the next call (e.g. wait_urc) reads them.
+    '''
+
+    def __init__(self, module, socket_path=DEFAULT_SOCKET_PATH, verbose=False):
+        '''
+        Parameters
+        ----------
+        module : Module
+            The open module to serve.
+        socket_path : str, optional
+            Path of the Unix domain socket to listen on. A stale socket file is replaced.
+        verbose : bool, optional
+            True for verbose output.
+        '''
+        self.module = module
+        self.socket_path = socket_path
+        self.verbose = verbose
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, DaemonRequestHandler)
+        module.start_reader()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def call(self, request):
+        method = request.get('method')
+        if method == 'ping':
+            return {'result': True, 'output': '', 'error': None}
+        if not isinstance(method, str) or method.startswith('_') or not hasattr(self.module, method):
+            return {'result': None, 'output': '', 'error': 'Unknown method: ' + str(method)}
+        if inspect.isgeneratorfunction(getattr(self.module, method)):
+            return {'result': None, 'output': '',
+                    'error': method + ' returns a generator, which is not supported through the daemon'}
+        aerisutils.print_log('Daemon call: ' + method, self.verbose)
+        output = io.StringIO()
+        handler = logging.StreamHandler(output)
+        logger.addHandler(handler)
+        try:
+            with contextlib.redirect_stdout(output):
+                result = getattr(self.module, method)(*request.get('args', []), **request.get('kwargs', {}))
+            if isinstance(result, types.GeneratorType):
+                result.close()
+                raise DaemonError(method + ' returns a generator, which is not supported through the daemon')
+            try:
+                json.dumps(result)
+            except (TypeError, ValueError):
+                raise DaemonError(method + ' returns a ' + type(result).__name__ +
+                                  ', which cannot be sent from the daemon')
+            error = None
+        except Exception as e:
+            result = None
+            error = str(e) or type(e).__name__
+            aerisutils.print_log('Daemon call failed: ' + traceback.format_exc(), self.verbose)
+        finally:
+            logger.removeHandler(handler)
+        return {'result': result, 'output': output.getvalue(), 'error': error}
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                reply = self.server.call(request)
+            except ValueError as e:
+                reply = {'result': None, 'output': '', 'error': 'Bad request: ' + str(e)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class DaemonClient:
+    '''Stands in for a Module by forwarding method calls to a ModuleDaemon.
+
+    Any method call, e.g. client.get_info(), runs on the daemon's module; what it printed is written
+    to stdout here and its result is returned (after a round trip through JSON).
+    '''
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def connect(self):
+        '''Connects to the daemon. Returns False if it is not running.'''
+        if self._sock is not None:
+            return True
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            return False
+        self._sock = sock
+        self._file = sock.makefile('rb')
+        return True
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = None
+            self._file = None
+
+    def call(self, method, *args, **kwargs):
+        if not self.connect():
+            raise DaemonError('Daemon is not running on ' + self.socket_path)
+        try:
+            request = json.dumps({'method': method, 'args': args, 'kwargs': kwargs})
+        except (TypeError, ValueError) as e:
+            raise DaemonError('The arguments of ' + method + ' cannot be sent to the daemon: ' + str(e))
+        self._sock.sendall(request.encode('utf-8') + b'\n')
+        line = self._file.readline()
+        if not line:
+            self.close()
+            raise DaemonError('Daemon closed the connection')
+        reply = json.loads(line.decode('utf-8'))
+        if reply['output']:
+            sys.stdout.write(reply['output'])
+            sys.stdout.flush()
+        if reply['error'] is not None:
+            raise DaemonError(reply['error'])
+        return reply['result']
+
+    def ping(self):
+        try:
+            return self.call('ping')
+        except DaemonError:
+            return False
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def remote_method(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        return remote_method
+
+
+def serve(module, socket_path=DEFAULT_SOCKET_PATH, verbose=False):
+    '''Serves module on socket_path until interrupted.'''
+    with ModuleDaemon(module, socket_path, verbose) as daemon:
+        aerisutils.print_log('Module daemon listening on ' + socket_path)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            aerisutils.print_log('Module daemon stopped')
@@ -0,0 +1,207 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import json
+import sys
+import time
+
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.modulefactory import module_factory
+from aerismodsdk.utils import loggerutils, rmutils
+from aerismodsdk.utils.instrumentation import percentile
+
+# How many modules are worked on at once unless told otherwise; USB hubs cope badly with many more
+DEFAULT_WORKERS = 4
+
+# One module of the fleet; the fields match the keys of the aeriscli config file
+Device = collections.namedtuple('Device', ['name', 'modem_mfg', 'com_port', 'apn', 'baudrate'])
+
+# Operations the fleet runner knows; each takes the module and the operation options
+OPERATIONS = {
+    'get_info': lambda module, options: module.get_info(),
+    'network_info': lambda module, options: module.network_info(False, False),
+    'sim_info': lambda module, options: module.sim_info(False),
+    'packet_session': lambda module, options: module.create_packet_session(),
+    'udp_echo': lambda module, options: module.udp_echo(options.get('host', '35.212.147.4'),
+                                                        options.get('port', 3030), options.get('delay', 1),
+                                                        options.get('wait', 4), verbose=False),
+}
+
+
+def device_from_config(config, name=None, defaults=None):
+    '''Builds a Device from a dict with the keys of the aeriscli config file (modemMfg, comPort, apn, baudRate).
+    Keys missing from config are taken from defaults.'''
+    config = dict(defaults or {}, **config)
+    modem_mfg = config['modemMfg']
+    if modem_mfg not in Manufacturer.__members__:
+        raise ValueError('Unknown modem manufacturer: ' + str(modem_mfg))
+    return Device(config.get('name', name or config['comPort']), modem_mfg, config['comPort'],
+                  config.get('apn', 'lpiot.aer.net'), int(config.get('baudRate', rmutils.DEFAULT_BAUDRATE)))
+
+
+def load_inventory(path):
+    '''Reads the devices of a fleet from a YAML (.yaml, .yml; needs PyYAML) or JSON file:
+        defaults: {modemMfg: quectel, apn: lpiot.aer.net}
+        devices:
+          - {name: rack1-slot1, comPort: /dev/ttyUSB2}
+          - {name: rack1-slot2, comPort: usb:2c7c:0296:2, modemMfg: telit}
+    Returns
+    -------
+    A list of Devices.
+    '''
+    with open(path) as inventory_file:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError('Reading ' + path + ' needs PyYAML: pip install pyyaml')
+            inventory = yaml.safe_load(inventory_file)
+        else:
+            inventory = json.load(inventory_file)
+    defaults = inventory.get('defaults', {})
+    return [device_from_config(config, defaults=defaults) for config in inventory.get('devices', [])]
+
+
+def run_device(device, operation, iterations=1, options=None, verbose=False):
+    '''Opens one module and runs an operation on it. Runs in a worker thread or process.
+    Returns
+    -------
+    A list with a result dict per iteration (see FleetRunner.run); a single failed result if the
+    module could not be opened.
+    '''
+    options = options or {}
+    result = {'device': device.name, 'port': device.com_port, 'operation': operation}
+    start = time.monotonic()
+    try:
+        module = module_factory().get(Manufacturer[device.modem_mfg], device.com_port, device.apn,
+                                      verbose=verbose, baudrate=device.baudrate)
+        if module is None or module.get_serial() is None:
+            raise IOError('Could not open serial port ' + device.com_port)
+    except Exception as e:
+        return [dict(result, iteration=0, ok=False, error=str(e), elapsed=time.monotonic() - start, result=None)]
+    open_time = time.monotonic() - start
+    results = []
+    try:
+        for iteration in range(iterations):
+            started = time.monotonic()
+            try:
+                value = OPERATIONS[operation](module, options)
+                error = None
+            except Exception as e:
+                value = None
+                error = type(e).__name__ + ': ' + str(e)
+            results.append(dict(result, iteration=iteration, ok=error is None and value is not False, error=error,
+                                elapsed=time.monotonic() - started, open_time=open_time, result=value))
+    finally:
+        module.get_serial().close()
+    return results
+
+
+def _run_device_quietly(device, operation, iterations, options, verbose):
+    # Worker processes print and log to stderr, so that stdout only carries results
+    loggerutils.set_stream(sys.stderr)
+    with contextlib.redirect_stdout(sys.stderr):
+        return run_device(device, operation, iterations, options, verbose)
+
+
+class FleetRunner:
+    '''Runs an operation on many modules at once, each through its own Module, with bounded concurrency.'''
+
+    def __init__(self, devices, workers=DEFAULT_WORKERS, processes=False, verbose=False):
+        '''
+        Parameters
+        ----------
+        devices : list of Device
+            The modules to work on.
+        workers : int, optional
+            How many modules to work on at once. Default: DEFAULT_WORKERS.
+        processes : bool, optional
+            True to use worker processes instead of threads, e.g. when parsing competes for the GIL.
+        verbose : bool, optional
+            True for verbose output.
+        '''
+        self.devices = devices
+        self.workers = max(1, workers)
+        self.processes = processes
+        self.verbose = verbose
+
+    def run(self, operation, iterations=1, options=None, on_result=None):
+        '''Runs operation on every device.
+        Parameters
+        ----------
+        operation : str
+            A key of OPERATIONS.
+        iterations : int, optional
+            Times to run the operation on each module. Default: 1.
+        options : dict, optional
+            Options for the operation, e.g. host, port, delay and wait for udp_echo.
+        on_result : callable, optional
+            Called with each result as soon as its device is done. Module output goes to stderr meanwhile.
+        Returns
+        -------
+        results : list of dict
+            One per device and iteration: device, port, operation, iteration, ok, error, elapsed,
+            open_time and result (what the operation returned).
+        summary : dict
+            See summarize.
+        '''
+        if operation not in OPERATIONS:
+            raise ValueError('Unknown operation: ' + operation)
+        if self.processes:
+            executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        results = []
+        start = time.monotonic()
+        log_stream = loggerutils.set_stream(sys.stderr)
+        try:
+            with executor, contextlib.redirect_stdout(sys.stderr):
+                futures = [executor.submit(_run_device_quietly if self.processes else run_device,
+                                           device, operation, iterations, options, self.verbose)
+                           for device in self.devices]
+                for future in concurrent.futures.as_completed(futures):
+                    for result in future.result():
+                        results.append(result)
+                        if on_result is not None:
+                            on_result(result)
+        finally:
+            loggerutils.set_stream(log_stream)
+        return results, summarize(results, time.monotonic() - start)
+
+
+def summarize(results, wall_time):
+    '''Sums up fleet results: devices, runs, ok, failed, wall_time, throughput (runs per second) and
+    the p50/p95/p99/max seconds the successful runs took.'''
+    elapsed = [r['elapsed'] for r in results if r['ok']]
+    summary = {
+        'devices': len(set(r['device'] for r in results)),
+        'runs': len(results),
+        'ok': len(elapsed),
+        'failed': len(results) - len(elapsed),
+        'wall_time': wall_time,
+        'throughput': len(results) / wall_time if wall_time > 0 else 0.0,
+    }
+    if elapsed:
+        summary.update({'p50': percentile(elapsed, 50), 'p95': percentile(elapsed, 95),
+                        'p99': percentile(elapsed, 99), 'max': max(elapsed)})
+    return summary
+
+
+def to_json_line(result):
+    return json.dumps(result, default=str, sort_keys=True)
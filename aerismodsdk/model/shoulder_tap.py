@@ -1,4 +1,6 @@
 class BaseShoulderTap:
+    __slots__ = ('payload', 'payloadId', 'imsi')
+
     def __init__(self, payload, payloadId, imsi):
         '''Creates a representation of a Shoulder-Tap.
         Parameters
@@ -19,6 +21,8 @@ class BaseShoulderTap:
 
 
 class Udp0ShoulderTap(BaseShoulderTap):
+    __slots__ = ()
+
     def getRequestId(self):
         '''Returns the request ID of this shoulder-tap. It is formatted as this device's IMSI, a dash,
         and the sequence number (in base-10) from the payload. '''
@@ -5,17 +5,21 @@ from aerismodsdk.modules.quectel import QuectelModule
 from aerismodsdk.modules.telit import TelitModule
 from aerismodsdk.modules.ublox import UbloxModule
 from aerismodsdk.utils.loggerutils import logger
+from aerismodsdk.utils.rmutils import DEFAULT_BAUDRATE
 
 
 class ModuleFactory:
-    def get(self, modem_mfg, com_port, apn, verbose=True):
+    def get(self, modem_mfg, com_port, apn, verbose=True, baudrate=DEFAULT_BAUDRATE, negotiate_baudrate=False):
         module = None
         if modem_mfg == Manufacturer.telit:
-            module = TelitModule(modem_mfg.name, com_port, apn, verbose=verbose)
+            module = TelitModule(modem_mfg.name, com_port, apn, verbose=verbose, baudrate=baudrate,
+                                 negotiate_baudrate=negotiate_baudrate)
         elif modem_mfg == Manufacturer.quectel:
-            module = QuectelModule(modem_mfg.name, com_port, apn, verbose=verbose)
+            module = QuectelModule(modem_mfg.name, com_port, apn, verbose=verbose, baudrate=baudrate,
+                                   negotiate_baudrate=negotiate_baudrate)
         elif modem_mfg == Manufacturer.ublox:
-            module = UbloxModule(modem_mfg.name, com_port, apn, verbose=verbose)
+            module = UbloxModule(modem_mfg.name, com_port, apn, verbose=verbose, baudrate=baudrate,
+                                 negotiate_baudrate=negotiate_baudrate)
         else:
             logger.info('No valid Module Found')        
         return module
@@ -14,10 +14,17 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import contextlib
+import queue
+import time
+
 from aerismodsdk.utils import loggerutils
 from aerismodsdk.utils.loggerutils import logger
-from aerismodsdk.utils import rmutils, aerisutils
-from aerismodsdk.utils.shoulder_tap import parse_shoulder_tap
+from aerismodsdk.utils import atparser, rmutils, aerisutils, portutils
+from aerismodsdk.utils.shoulder_tap import parse_many, ShoulderTapWindow
+from aerismodsdk.utils.serialreader import SerialReader
+from aerismodsdk.utils.commandqueue import CommandQueue, URGENT
+from aerismodsdk.utils.registration import DOMAINS as REGISTRATION_DOMAINS, RegistrationState
 
 #getpacket = """GET / HTTP/1.1
 #Host: <hostname>
@@ -32,26 +39,78 @@ Accept: */*
 
 def reg_status(i):  # Registration status
     switcher = {
-        '0': '0: Not registered',
-        '1': '1: Registered; home network',
-        '2': '2: Not registered; scanning',
-        '3': '3: Registration denied',
-        '4': '4: Unknown',
-        '5': '5: Registered; roaming'}
+        0: '0: Not registered',
+        1: '1: Registered; home network',
+        2: '2: Not registered; scanning',
+        3: '3: Registration denied',
+        4: '4: Unknown',
+        5: '5: Registered; roaming'}
     return switcher.get(i, "Invalid value")
 
 
+class CommandBatch:
+    '''Collects AT commands and writes them with as few round trips as possible (see rmutils.write_batch)
+    when run is called or the with block ends. query returns the index of the command's CommandResult.'''
+
+    def __init__(self, ser, timeout=1.0, verbose=True):
+        self.ser = ser
+        self.timeout = timeout
+        self.verbose = verbose
+        self.commands = []
+        self.results = []
+
+    def query(self, cmd):
+        self.commands.append(cmd)
+        return len(self.commands) - 1
+
+    def run(self):
+        self.results = rmutils.write_batch(self.ser, self.commands, timeout=self.timeout, verbose=self.verbose)
+        return self.results
+
+    def response(self, index):
+        '''The response to the command at index, or '' if it was not answered.'''
+        return self.results[index].response or ''
+
+    def __getitem__(self, index):
+        return self.results[index]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.run()
+
+
 class Module:
-    def __init__(self, modem_mfg, com_port, apn, verbose=True):
-        self.com_port = '/dev/tty' + com_port
+    # For get_shoulder_taps: the prefix of the URC that delivers a packet to the socket udp_listen opens, and
+    # of the URCs that say that socket or the packet session is gone. None where that is not supported.
+    udp_recv_urc = None
+    udp_closed_urcs = ()
+    # For get_shoulder_taps(buffered=True): the URC that says packets are waiting to be read with drain_socket
+    udp_notify_urc = None
+
+    def __init__(self, modem_mfg, com_port, apn, verbose=True, baudrate=rmutils.DEFAULT_BAUDRATE,
+                 negotiate_baudrate=False):
+        # The port as configured; a usb: port is resolved again whenever it is reopened
+        self.port_spec = com_port
+        self.com_port = portutils.resolve_com_port(com_port) or com_port
         self.apn = apn
         self.verbose = verbose
         self.modem_mfg = modem_mfg
         self.cmd_iccid = 'CCID'
+        self.reader = None
+        self.command_queue = None
+        self.identity_cache = None
+        self.identity = None
+        self.registration = None
+        self.baudrate = baudrate
         #aerisutils.vprint(verbose, 'Using modem port: ' + com_port)
-        self.myserial = rmutils.open_serial(self.com_port)
+        self.myserial = rmutils.open_serial(self.com_port, baudrate)
         if self.myserial is not None:
             logger.info('Established Serial Connection')
+            if negotiate_baudrate:
+                self.baudrate = rmutils.negotiate_baudrate(self.myserial, verbose=verbose)
             rmutils.write(self.myserial, 'ATE0', verbose=verbose)  # Turn off echo
 
 
@@ -60,18 +119,86 @@ class Module:
 
 
     def init_serial(self, com_port, apn, verbose=True):
-        self.myserial = rmutils.open_serial('/dev/tty'+com_port)
+        self.registration = None  # Its URC subscriptions go with the reader
+        if self.command_queue is not None:
+            self.command_queue.stop()
+            self.command_queue = None
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+        self.port_spec = com_port
+        self.com_port = portutils.resolve_com_port(com_port) or com_port
+        self.myserial = rmutils.open_serial(self.com_port, self.baudrate)
 
 
     def get_serial(self):
         return self.myserial
 
 
+    def start_reader(self):
+        '''Starts a background thread that owns the serial port and routes URCs to subscribers.
+        From then on self.myserial is the SerialReader, which rmutils uses just like the port.
+        Returns
+        -------
+        The SerialReader, or None if the serial port is not open.
+        '''
+        if self.reader is None and self.myserial is not None:
+            if self.command_queue is not None:  # The reader goes under the queue, which still owns the port
+                self.reader = SerialReader(self.command_queue.ser, verbose=self.verbose).start()
+                self.command_queue.ser = self.reader
+            else:
+                self.reader = SerialReader(self.myserial, verbose=self.verbose).start()
+                self.myserial = self.reader
+        return self.reader
+
+
+    def start_command_queue(self):
+        '''Lets several threads use the module at once: from then on self.myserial is a CommandQueue, which
+        runs each command (and each wait for URCs) on its own, in priority order. See exclusive and priority.
+        Start the reader first if it is needed too.
+        Returns
+        -------
+        The CommandQueue, or None if the serial port is not open.
+        '''
+        if self.command_queue is None and self.myserial is not None:
+            self.command_queue = CommandQueue(self.myserial, verbose=self.verbose).start()
+            self.myserial = self.command_queue
+        return self.command_queue
+
+
+    def exclusive(self, priority=URGENT):
+        '''Context manager that keeps other threads off the module for its with block, e.g. for a file
+        transfer in data mode. Does nothing unless the command queue was started.'''
+        if self.command_queue is None:
+            return contextlib.suppress()
+        return self.command_queue.lease(priority)
+
+
+    def priority(self, priority):
+        '''Context manager that runs the calling thread's commands in the given lane of the command queue
+        (commandqueue.URGENT, NORMAL or BACKGROUND). Does nothing unless the command queue was started.'''
+        if self.command_queue is None:
+            return contextlib.suppress()
+        return self.command_queue.priority(priority)
+
+
+    def subscribe_urc(self, prefix, callback=None):
+        '''Routes URCs that start with prefix to callback, or to the returned queue. See SerialReader.subscribe.'''
+        return self.start_reader().subscribe(prefix, callback)
+
+
+    def unsubscribe_urc(self, prefix, handle):
+        if self.reader is not None:
+            self.reader.unsubscribe(prefix, handle)
+
+
     def reset(self):
         ser = self.myserial
+        self.forget_identity()
+        self.stop_tracking_registration()  # The module forgets the URC settings when it restarts
         self.disable_psm(verbose = True)
         self.disable_edrx(verbose = True)
-        rmutils.write(ser, 'AT+CFUN=4', delay=3)
+        rmutils.write(ser, 'AT+CFUN=4', timeout=15)
         rmutils.write(ser, 'AT+CFUN=1,1')
         return True
 
@@ -93,28 +220,114 @@ class Module:
         response = rmutils.write(ser, myatcmd, delay=1)
 
 
+    def batch(self, timeout=1.0, verbose=None):
+        '''Returns a CommandBatch that writes its commands to the module with as few round trips as possible.
+        Use it for independent queries:
+            with module.batch() as b:
+                creg = b.query('AT+CREG?')
+                csq = b.query('AT+CSQ')
+            print(b.response(creg))
+        '''
+        return CommandBatch(self.myserial, timeout, self.verbose if verbose is None else verbose)
+
+
+    def wait_urc(self, timeout, returnonreset=False, returnonvalue=False, verbose=True):
+        return rmutils.wait_urc(self.myserial, timeout, self.port_spec, returnonreset, returnonvalue,
+                                verbose=verbose)  # Wait up to X seconds for URC
+
+
+    def write(self, cmd, verbose=True, **kwargs):
+        '''Writes an AT command to the module and returns its response. See rmutils.write for the other arguments.'''
+        return rmutils.write(self.myserial, cmd, verbose=verbose, **kwargs)
+
+
+    def use_identity_cache(self, cache):
+        '''Lets get_info answer from an identitycache.IdentityCache once it has checked, with one round trip,
+        that the module (IMEI) and SIM (ICCID) are still the ones that were cached. Pass None to stop.'''
+        self.identity_cache = cache
+
+
+    def forget_identity(self):
+        '''Drops what get_info remembered about the module on this port, e.g. after a reset or firmware update.'''
+        self.identity = None
+        if self.identity_cache is not None:
+            self.identity_cache.remove(self.com_port)
+
+
+    def get_cached_info(self):
+        '''Returns the cached get_info result if the module and SIM still match it, else None.'''
+        if self.identity is None and self.identity_cache is None:
+            return None
+        with self.batch(timeout=2) as b:
+            gsn = b.query('AT+GSN')
+            iccid = b.query('AT+' + self.cmd_iccid)
+        imei = self.parse_cmd_single_response(b.response(gsn))
+        iccid = self.parse_response(b.response(iccid), '+' + self.cmd_iccid + ':')
+        if not imei or not iccid:
+            return None
+        info = self.identity
+        if info is None or info.get('imei') != imei:
+            info = self.identity_cache.get(self.com_port, imei) if self.identity_cache is not None else None
+        if info is None:
+            return None
+        if info.get('iccid') != iccid[0]:
+            aerisutils.print_log('SIM changed from ' + str(info.get('iccid')) + ' to ' + iccid[0], self.verbose)
+            self.forget_identity()
+            return None
+        self.identity = info
+        return dict(info)
+
+
+    def get_imsi(self):
+        '''Returns the IMSI of the SIM, from the identity cache if it can.'''
+        info = self.identity or self.get_cached_info()
+        if info:
+            return info.get('imsi')
+        return self.parse_cmd_single_response(rmutils.write(self.myserial, 'AT+CIMI'))
+
+
     def get_info(self):
+        mod_info = self.get_cached_info()
+        if mod_info is not None:
+            if mod_info.get('maker') == self.modem_mfg.upper():
+                rmutils.write(self.myserial, 'AT+CGDCONT=1,\"IP\","' + self.apn + '"')  # Setting  PDP Context Configuration
+            return mod_info
+        mod_info = self.query_info()
+        if mod_info.get('imei'):
+            self.identity = dict(mod_info)
+            if self.identity_cache is not None:
+                self.identity_cache.put(self.com_port, mod_info)
+        return mod_info
+
+
+    def query_info(self):
+        '''Queries the module and SIM information from the module. See get_info.'''
         ser = self.myserial
         mod_info = {}  # Initialize an empty dictionary object
-        if not self.parse_cmd_response(rmutils.write(ser, 'ATI')):
+        if self.parse_cmd_response(rmutils.write(ser, 'ATI')) in (None, False):
             logger.warn('WARNING : The ATI command is not working. Please review configuration.')
             return mod_info
         if not self.get_info_for_obj('AT+CIMI', 'imsi', mod_info):
             logger.warn('WARNING : The CIMI command is not working. Please check SIM.')
             return mod_info            
-        self.get_info_for_obj_prefix('AT+'+self.cmd_iccid, 
-            '+' + self.cmd_iccid + ':', 
-            'iccid', mod_info)
-        response = rmutils.write(ser, 'AT+GMI', delay=1)  # Module Manufacturer
-        mod_type = (response.split('\r\n')[1]).replace('-', '').strip().upper()
+        # The rest are independent queries; the ones with prefixed responses share a round trip
+        with self.batch(timeout=2) as b:
+            gmi = b.query('AT+GMI')  # Module Manufacturer
+            gmm = b.query('AT+GMM')
+            gsn = b.query('AT+GSN')
+            gmr = b.query('AT+GMR')
+            iccid = b.query('AT+' + self.cmd_iccid)
+            b.query('AT+CREG?')
+            b.query('AT+COPS?')
+            b.query('AT+CSQ')
+        iccid_vals = self.parse_response(b.response(iccid), '+' + self.cmd_iccid + ':')
+        mod_info.update( {'iccid':iccid_vals[0] if iccid_vals else None} )
+        mod_type = (b.response(gmi).split('\r\n')[1]).replace('-', '').strip().upper()
         mod_info.update( {'maker':mod_type} )
         if mod_type == self.modem_mfg.upper():
-            self.get_info_for_obj('AT+GMM', 'model', mod_info)
-            self.get_info_for_obj('AT+GSN', 'imei', mod_info)
-            self.get_info_for_obj('AT+GMR', 'rev', mod_info)
-            rmutils.write(ser, 'AT+CREG?')
-            rmutils.write(ser, 'AT+COPS?')
-            rmutils.write(ser, 'AT+CSQ')
+            mod_info.update( {'model':self.parse_cmd_single_response(b.response(gmm))} )
+            mod_info.update( {'imei':self.parse_cmd_single_response(b.response(gsn))} )
+            mod_info.update( {'rev':self.parse_cmd_single_response(b.response(gmr))} )
             rmutils.write(ser, 'AT+CGDCONT=1,\"IP\","' + self.apn + '"')  # Setting  PDP Context Configuration
             #logger.info('Modem successfully verified')
         else:
@@ -126,37 +339,83 @@ class Module:
     # Network stuff
     #
 
+    def track_registration(self):
+        '''Keeps self.registration, a RegistrationState, current from the +CREG, +CGREG and +CEREG URCs.
+        Starts the reader, turns the URCs on and queries the registration once to start from.
+        Returns
+        -------
+        The RegistrationState, or None if the serial port is not open.
+        '''
+        if self.registration is not None:
+            return self.registration
+        reader = self.start_reader()
+        if reader is None:
+            return None
+        state = RegistrationState(verbose=self.verbose)
+        for domain in REGISTRATION_DOMAINS:
+            reader.subscribe(domain + ':', state.handle_urc)
+        with self.batch(timeout=2) as b:
+            for domain in REGISTRATION_DOMAINS:
+                b.query('AT' + domain + '=2')  # URCs with the area, cell and access technology
+            queries = [b.query('AT' + domain + '?') for domain in REGISTRATION_DOMAINS]
+        for index in queries:
+            state.update_from_response(b.response(index))
+        self.registration = state
+        return state
+
+
+    def stop_tracking_registration(self):
+        if self.registration is not None:
+            for domain in REGISTRATION_DOMAINS:
+                self.unsubscribe_urc(domain + ':', self.registration.handle_urc)
+            self.registration = None
+
+
+    def wait_until_registered(self, timeout, domains=None):
+        '''Blocks until the module registers in any of domains ('+CREG', '+CGREG', '+CEREG'; default any)
+        or timeout seconds pass. Tracks the registration URCs (see track_registration) to do so.
+        Returns
+        -------
+        The registration.Registration, or None on timeout.
+        '''
+        state = self.track_registration()
+        if state is None:
+            return None
+        return state.wait_until_registered(timeout, domains)
+
+
     def network_info(self, scan, verbose):
         ser = self.myserial
-        # Enable unsolicited reg results
-        rmutils.write(ser, 'AT+CREG=2') 
-        rmutils.write(ser, 'AT+CGREG=2')    
-        rmutils.write(ser, 'AT+CEREG=2')    
+        state = self.registration
+        with self.batch(timeout=2) as b:
+            if state is None:  # Otherwise the URCs keep the state current
+                # Enable unsolicited reg results
+                b.query('AT+CREG=2')
+                b.query('AT+CGREG=2')
+                b.query('AT+CEREG=2')
+                registrations = [b.query('AT+CREG?'), b.query('AT+CGREG?'), b.query('AT+CEREG?')]
+            cops = b.query('AT+COPS?')
+            csq = b.query('AT+CSQ')
+        if state is None:
+            state = RegistrationState()
+            for index in registrations:
+                state.update_from_response(b.response(index))
         net_info = {}  # Initialize an empty dictionary object
-        # Registration status
-        values = self.get_values_for_cmd('AT+CREG?', '+CREG:')
-        if len(values) < 2:  # Check for problem condition
-            return net_info
-        net_info.update({'reg_status': reg_status(values[1])})
-        # Registration status - gprs
-        values = self.get_values_for_cmd('AT+CGREG?', '+CGREG:')
-        if len(values) < 2:  # Check for problem condition
-            return net_info
-        net_info.update({'reg_status_gprs': reg_status(values[1])})
-        # Registration status - eps
-        values = self.get_values_for_cmd('AT+CEREG?', '+CEREG:')
-        if len(values) < 2:  # Check for problem condition
-            return net_info
-        net_info.update({'reg_status_eps': reg_status(values[1])})
+        # Registration status: circuit switched, gprs, eps
+        for key, domain in (('reg_status', '+CREG'), ('reg_status_gprs', '+CGREG'), ('reg_status_eps', '+CEREG')):
+            registration = state.get(domain)
+            if registration is None:  # Check for problem condition
+                return net_info
+            net_info.update({key: reg_status(registration.stat)})
         # Operator selection
-        values = self.get_values_for_cmd('AT+COPS?', '+COPS:')
+        values = self.parse_response(b.response(cops), '+COPS:')
         net_info.update( {'op_mode':values[0]} )
         if len(values) > 1:
             net_info.update( {'op_format':values[1]} )        
             net_info.update( {'op_id':values[2]} )        
             net_info.update( {'op_act':values[3]} )
         # Signal quality
-        values = self.get_values_for_cmd('AT+CSQ', '+CSQ:')
+        values = self.parse_response(b.response(csq), '+CSQ:')
         net_info.update( {'rssi':(-113 + (2*int(values[0])))} )        
         net_info.update( {'ber':values[1]} )
         if scan:
@@ -165,7 +424,7 @@ class Module:
             if ops is None or ops == '':
                 #print('No return from cops=?')
                 #ops = rmutils.wait_urc(self.myserial, 180, self.com_port, returnonvalue='+COPS:')
-                ops = rmutils.wait_urc(self.myserial, 300, self.com_port, returnonvalue='+COPS:')
+                ops = rmutils.wait_urc(self.myserial, 300, self.port_spec, returnonvalue='+COPS:')
         return net_info
 
 
@@ -175,7 +434,7 @@ class Module:
         if ops is None or ops == '':
             #print('No return from cops=?')
             #ops = rmutils.wait_urc(self.myserial, 180, self.com_port, returnonvalue='+COPS:')
-            ops = rmutils.wait_urc(self.myserial, 300, self.com_port, returnonvalue='+COPS:')
+            ops = rmutils.wait_urc(self.myserial, 300, self.port_spec, returnonvalue='+COPS:')
         return net_scan
 
 
@@ -192,12 +451,12 @@ class Module:
             else:
                 mycmd = 'AT+COPS=1,' + str(format) + ',"' + operator_name + '",' + str(access_type)
         rmutils.write(self.myserial, mycmd)
-        rmutils.wait_urc(self.myserial, timewait, self.com_port)
+        rmutils.wait_urc(self.myserial, timewait, self.port_spec)
 
 
     def turn_off_network(self, verbose):
         rmutils.write(self.myserial, 'AT+COPS=2')
-        rmutils.wait_urc(self.myserial, 10,self.com_port)
+        rmutils.wait_urc(self.myserial, 10,self.port_spec)
 
 
     def get_http_packet(self, hostname):
@@ -225,7 +484,10 @@ class Module:
 
 
     def sms_wait(self, time, verbose):
-        vals = rmutils.wait_urc(self.myserial, time, self.com_port, returnonvalue='+CMTI:')
+        if self.reader is not None:
+            # Commands from other threads can keep running while we wait
+            return self.reader.wait_for('+CMTI:', time)
+        vals = rmutils.wait_urc(self.myserial, time, self.port_spec, returnonvalue='+CMTI:')
 
 
     def sms_send(self, destination, message, verbose):
@@ -234,12 +496,13 @@ class Module:
         # Set to submit-sm, 24 hour validity
         rmutils.write(self.myserial, 'AT+CSMP=17,167,0,0')
         if destination.startswith('+'):
-            rmutils.write(self.myserial, 'AT+CMGS="' + destination + '",145', delay=1)
+            mycmd = 'AT+CMGS="' + destination + '",145'
         else:
-            rmutils.write(self.myserial, 'AT+CMGS="' + destination + '"', delay=1)
-            #rmutils.write(self.myserial, 'AT+CMGS="' + destination + '",129', delay=1)
-        rmutils.write(self.myserial, message, delay=1)
-        rmutils.write(self.myserial, '\x1a', delay=1)  # End with crtl-z
+            mycmd = 'AT+CMGS="' + destination + '"'
+            #mycmd = 'AT+CMGS="' + destination + '",129'
+        # Write the message after the '>' prompt and end it with ctrl-z; the network can take a while to accept it
+        response = rmutils.write(self.myserial, mycmd, message + '\x1a', send_timeout=60)
+        return response is not None and '+CMGS:' in response
 
 
     # ========================================================================
@@ -325,10 +588,9 @@ class Module:
         # <cmd><fileid><p1><p2><p3><data>
         resp = rmutils.write(self.myserial, 'AT+CRSM=176,' + str(file_id) + ',0,0,0')
         vals = self.parse_response(resp, '+CRSM:')
-        if len(vals) < 2:
+        if len(vals) < 3:
             return 'Error'
-        resp = vals[2].rstrip('"').lstrip('"')
-        resp = resp.rstrip('FF')
+        resp = vals[2].rstrip('FF')
         if decode is 'rev':
             resp = self.decode_rev(resp)
         elif decode is 'plmn':
@@ -508,50 +770,36 @@ class Module:
 
 
     def parse_cmd_response(self, response):
-        # Make sure command ends with 'OK'
-        if 'OK\r\n' not in response:
+        '''Returns the information lines of a response that ends with OK, as text. False if the command
+        did not end with OK, None if there was no response (the port is not open).'''
+        if response is None:
+            return None
+        lines, final = atparser.tokenize(response, raw=True)
+        if final != 'OK':
             return False
-        else:
-            # Strip the 'OK' ending and spaces at start
-            response = response.rstrip('OK\r\n').lstrip()
-            # Split the remaining values with newline seperation
-            vals = response.split('\r\n')
-            #print(str(vals))
-            return vals
+        return lines
 
 
     def parse_cmd_single_response(self, response):
-        # Make sure command ends with 'OK'
-        if 'OK\r\n' not in response:
-            return False
-        else:
-            # Strip the 'OK' ending and spaces at start
-            response = response.rstrip('OK\r\n').lstrip()
-            # Split the remaining values with newline seperation
-            vals = response.split('\r\n')
-            #print(str(vals))
-            return vals[0]
+        '''Returns the first information line of a response that ends with OK, or '' if there is none.
+        False if the command did not end with OK, None if there was no response.'''
+        lines = self.parse_cmd_response(response)
+        if lines is None or lines is False:
+            return lines
+        return lines[0] if lines else ''
 
 
     def parse_response(self, response, prefix):
-        # Check for error
-        if 'ERROR' in response:
-            return []
-        # Strip the 'OK' ending and spaces at start
-        response = response.rstrip('OK\r\n').lstrip()
-        # Find the prefix we want to take out
-        findex = response.rfind(prefix) + len(prefix)
-        # Get the substring after the prefix
-        value = response[findex: len(response)].lstrip()
-        # Split the remaining values with comma seperation
-        vals = value.split(',')
-        return vals
+        '''Returns the typed fields of the last line of the response that starts with prefix,
+        or an empty list if there is none or the command failed. See atparser.values.'''
+        return atparser.values(response, prefix)
 
-    def get_shoulder_taps(self, port=23747, verbose=False):
+    def get_shoulder_taps(self, port=23747, verbose=False, window=None, buffered=False):
         '''Gets shoulder taps and prints their request IDs and payloads.
         Requires that module is in a packet data session.
         Currently only supports the Udp0 protocol and the Quectel BG96 modem.
-        Is a generator.
+        Is a generator that yields each shoulder tap as soon as it arrives. The listening socket stays open,
+        and is only opened again if the module reports that it or the packet session was closed.
 
         Parameters
         ----------
@@ -562,35 +810,82 @@ class Module:
             the AerFrame Shoulder-Tap API for how to send shoulder-taps to a different port.
         verbose : bool, optional
             True to enable verbose output.
+        window : ShoulderTapWindow, optional
+            Drops repeated shoulder taps and can put them back in order. By default, a window that
+            only drops repeats.
+        buffered : bool, optional
+            True to have the module buffer the packets, and read all of them with drain_socket when it
+            says the first one arrived, so that packets never come in between command responses.
 
         Raises
         ------
         NotImplementedError if this feature is not implemented for your radio module.
         '''
 
-        # The parsing of URCs to payloads is currently only implemented for
-        # Quectel modules, so fail early if the module in question doesn't
-        # support that...
-        if not hasattr(self, 'udp_urcs_to_payloads'):
+        recv_urc = self.udp_notify_urc if buffered else self.udp_recv_urc
+        if recv_urc is None:
             raise NotImplementedError('Not supported for modem manufacturer ' + self.modem_mfg)
-        DEFAULT_WAIT_DURATION = 30
-        mod_info = {}
-        self.get_info_for_obj('AT+CIMI', 'imsi', mod_info)
-        imsi = mod_info['imsi']
+        RETRY_DELAY = 1
+        imsi = self.get_imsi()
         if not imsi or len(imsi) == 0:
             aerisutils.print_log('IMSI not found -- is the module powered up?')
-        while True:
-            urcs = self.udp_listen(port, DEFAULT_WAIT_DURATION, verbose, returnbytes=True)
-            if urcs is False:
-                # module may not be in a packet session. Try again!
-                aerisutils.print_log('Failed to retrieve URCs. Is the module in a packet session?')
-                continue
-            payloads = self.udp_urcs_to_payloads(urcs, verbose)
-            for payload in payloads:
-                aerisutils.print_log('Got payload: ' + aerisutils.bytes_to_utf_or_hex(payload), verbose)
-                shoulder_tap = parse_shoulder_tap(payload, imsi)
-                if shoulder_tap is not None:
-                    yield shoulder_tap
+        if window is None:
+            window = ShoulderTapWindow()
+        # The reader hands over each packet, or the news that packets are buffered, as soon as it arrives
+        events = queue.Queue()
+        prefixes = (recv_urc,) + tuple(self.udp_closed_urcs)
+        for prefix in prefixes:
+            self.subscribe_urc(prefix, events.put)
+        try:
+            while True:
+                if not self.udp_listen(port, 0, verbose, buffered=buffered):
+                    aerisutils.print_log('Failed to listen for shoulder taps. Is the module in a packet session?')
+                    self.udp_listener_closed(None, verbose)
+                    time.sleep(RETRY_DELAY)
+                    continue
+                # Keep the socket open until the module says that it or the packet session is gone
+                while True:
+                    try:
+                        urc = events.get(timeout=RETRY_DELAY)
+                    except queue.Empty:
+                        if self.reader.error is not None:
+                            yield from window.flush()
+                            return
+                        yield from window.expire()
+                        continue
+                    if urc.prefix != recv_urc:
+                        aerisutils.print_log('Shoulder tap listener closed: ' + urc.line, verbose)
+                        self.udp_listener_closed(urc.line, verbose)
+                        break
+                    if buffered:
+                        if urc.line != recv_urc:
+                            continue  # Another socket
+                        payloads = [datagram.payload for datagram in self.drain_socket(verbose=verbose)]
+                    elif urc.payload:
+                        payloads = [urc.payload]
+                    else:
+                        continue
+                    if verbose:
+                        for payload in payloads:
+                            aerisutils.print_log('Got payload: ' + aerisutils.bytes_to_utf_or_hex(bytes(payload)))
+                    for shoulder_tap in parse_many(payloads, imsi):
+                        yield from window.add(shoulder_tap)
+        finally:
+            for prefix in prefixes:
+                self.unsubscribe_urc(prefix, events.put)
+
+    def udp_listener_closed(self, urc, verbose=False):
+        '''Releases what is left of the socket udp_listen opened, so that udp_listen can open it again.
+
+        Parameters
+        ----------
+        urc : str
+            The URC, one of udp_closed_urcs, that said the socket or the packet session is gone.
+            None if opening the socket failed.
+        verbose : bool, optional
+            True to enable verbose output.
+        '''
+        pass
 
     # ========================================================================
     #
@@ -656,15 +951,15 @@ class Module:
         ser = self.myserial
         psm_settings = {}  # Initialize an empty dictionary object
         # Query settings provided by network
-        psmsettings = rmutils.write(ser, 'AT' + custom_psm_cmd + '?', delay=1.0, verbose=verbose)
+        psmsettings = rmutils.write(ser, 'AT' + custom_psm_cmd + '?', verbose=verbose)
         #print('psmsettings: ' + psmsettings)
         vals = self.parse_response(psmsettings, custom_psm_cmd + ':')
         psm_settings.update( {'enabled_network':int(vals[0])} )
         if int(vals[0]) > 0:
             # Parse the settings provided by the network
             # The value_offset and value_base settings help handle module differences
-            tau_value = int(vals[1 + value_offset].strip('\"'), value_base)
-            active_time = int(vals[2 + value_offset].strip('\"'), value_base)
+            tau_value = int(str(vals[1 + value_offset]), value_base)
+            active_time = int(str(vals[2 + value_offset]), value_base)
             if value_base == 2:
                 tau_units = self.tau_units(self.timer_units(tau_value))
                 tau_value = self.timer_value(tau_value)
@@ -679,11 +974,11 @@ class Module:
             vals = self.parse_response(psmsettings, '+CPSMS:')
             psm_settings.update( {'enabled_request':int(vals[0])} )
             if int(vals[0]) > 0:
-                tau_value = int(vals[3].strip('\"'), 2)
+                tau_value = int(vals[3], 2)
                 tau_units = self.tau_units(self.timer_units(tau_value))
                 tau_value = self.timer_value(tau_value)
                 tau_value = tau_value * tau_units
-                active_time = int(vals[4].strip('\"'), 2)
+                active_time = int(vals[4], 2)
                 active_time_units = self.at_units(self.timer_units(active_time))
                 active_time_value = self.timer_value(active_time)
                 active_time = active_time_value * active_time_units
@@ -706,7 +1001,7 @@ class Module:
     def disable_psm(self, verbose):
         ser = self.myserial
         mycmd = 'AT+CPSMS=0'  # Disable PSM
-        rmutils.write(ser, mycmd, delay=2)
+        rmutils.write(ser, mycmd)
         aerisutils.print_log('PSM is disabled')
         return True
 
@@ -809,13 +1104,13 @@ class Module:
         if edrxsettings.strip() == 'ERROR':
             return False
         vals = self.parse_response(edrxsettings, '+CEDRXRDP: ')
-        a_type = self.act_type(int(vals[0].strip('\"')))
+        a_type = self.act_type(vals[0])
         if a_type is None:
             print('eDRX is disabled')
         else:
-            r_edrx = self.edrx_time(int(vals[1].strip('\"'), 2))
-            n_edrx = self.edrx_time(int(vals[2].strip('\"'), 2))
-            p_time = self.paging_time(int(vals[3].strip('\"'), 2))
+            r_edrx = self.edrx_time(int(vals[1], 2))
+            n_edrx = self.edrx_time(int(vals[2], 2))
+            p_time = self.paging_time(int(vals[3], 2))
             print('Access technology: ' + str(a_type))
             print('Requested edrx cycle time: ' + str(r_edrx))
             print('Network edrx cycle time: ' + str(n_edrx))
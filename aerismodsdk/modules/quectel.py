@@ -18,25 +18,31 @@ import os
 
 import aerismodsdk.utils.rmutils as rmutils
 import aerismodsdk.utils.aerisutils as aerisutils
+import aerismodsdk.utils.atparser as atparser
+from aerismodsdk.utils.qiurc import Datagram, DatagramParser
 from aerismodsdk.modules.module import Module
-import jwt
 import datetime
-import requests
 import pathlib
-import re
 
 class QuectelModule(Module):
-
-
-    def __init__(self, modem_mfg, com_port, apn, verbose=True):
-        super().__init__(modem_mfg, com_port, apn, verbose=True)
+    # udp_listen listens on connectID 1
+    udp_recv_urc = '+QIURC: "recv",1,'
+    udp_notify_urc = '+QIURC: "recv",1'
+    udp_closed_urcs = ('+QIURC: "closed",1', '+QIURC: "pdpdeact"')
+    # The most AT+QIRD reads at a time
+    QIRD_LENGTH = 1500
+
+    def __init__(self, modem_mfg, com_port, apn, verbose=True, baudrate=rmutils.DEFAULT_BAUDRATE,
+                 negotiate_baudrate=False):
+        super().__init__(modem_mfg, com_port, apn, verbose=True, baudrate=baudrate,
+                         negotiate_baudrate=negotiate_baudrate)
         super().set_cmd_iccid('QCCID')
 
 
-    def get_info(self):
+    def query_info(self):
         ser = self.myserial
         rmutils.write(ser, 'AT+QGMR?') 
-        return super().get_info()
+        return super().query_info()
 
 
     # ========================================================================
@@ -48,35 +54,36 @@ class QuectelModule(Module):
     def network_info(self, scan, verbose):
         ser = self.myserial
         net_info = {}  # Initialize an empty dictionary object
-        # Quectel-specific advanced configuration
-        rmutils.write(ser, 'AT+QPSMEXTCFG?') 
-        # Quectel - Network scan sequence
-        rmutils.write(ser, 'AT+QCFG="nwscanseq"') 
-        # Quectel - Network scan mode
-        rmutils.write(ser, 'AT+QCFG="nwscanmode"') 
-        # Quectel - IoT operating mode
-        rmutils.write(ser, 'AT+QCFG="iotopmode"') 
-        # Quectel - Roaming
-        rmutils.write(ser, 'AT+QCFG="roamservice"') 
-        # Quectel - Bands
-        rmutils.write(ser, 'AT+QCFG="band"') 
-        # Quectel - Service Domain
-        rmutils.write(ser, 'AT+QCFG="servicedomain"') 
-        # Quectel - NB band priority
-        rmutils.write(ser, 'AT+QCFG="nb/bandprior"') 
-        # Quectel-specific network info
-        #rmutils.write(ser, 'AT+QNWINFO') 
-        values = self.get_values_for_cmd('AT+QNWINFO', '+QNWINFO:')
+        with self.batch(timeout=2) as b:
+            # Quectel-specific advanced configuration
+            b.query('AT+QPSMEXTCFG?')
+            # Quectel - Network scan sequence
+            b.query('AT+QCFG="nwscanseq"')
+            # Quectel - Network scan mode
+            b.query('AT+QCFG="nwscanmode"')
+            # Quectel - IoT operating mode
+            b.query('AT+QCFG="iotopmode"')
+            # Quectel - Roaming
+            b.query('AT+QCFG="roamservice"')
+            # Quectel - Bands
+            b.query('AT+QCFG="band"')
+            # Quectel - Service Domain
+            b.query('AT+QCFG="servicedomain"')
+            # Quectel - NB band priority
+            b.query('AT+QCFG="nb/bandprior"')
+            # Quectel-specific network info
+            qnwinfo = b.query('AT+QNWINFO')
+            # Quectel-specific network info
+            b.query('AT+QENG="servingcell"')
+            # Quectel-specific network info
+            b.query('AT+QENG="neighbourcell"')
+        values = self.parse_response(b.response(qnwinfo), '+QNWINFO:')
         if len(values) < 1:  # Check for problem condition
             return net_info
-        net_info.update({'act': values[0].strip('"')})
-        net_info.update({'oper': values[1].strip('"')})
-        net_info.update({'band': values[2].strip('"')})
+        net_info.update({'act': values[0]})
+        net_info.update({'oper': values[1]})
+        net_info.update({'band': values[2]})
         net_info.update({'channel': values[3]})
-        # Quectel-specific network info
-        rmutils.write(ser, 'AT+QENG="servingcell"', waitoe = True) 
-        # Quectel-specific network info
-        rmutils.write(ser, 'AT+QENG="neighbourcell"', waitoe = True) 
         net_info.update(super().network_info(scan, verbose))
         return net_info
 
@@ -146,16 +153,12 @@ class QuectelModule(Module):
 
 
     def parse_constate(self, constate):
-        if len(constate) < len('+QIACT: '):
-            return False
-        else:
-            vals = constate.split(',')
-            if len(vals) < 4:
-                return False
-            vals2 = vals[3].split('"')
-            self.my_ip = vals2[1]
-            # print('My IP: ' + self.my_ip)
-            return self.my_ip
+        # +QIACT: <contextID>,<context_state>,<context_type>,<IP_address> for each active context
+        for vals in atparser.records(constate, '+QIACT:'):
+            if vals[0] == 1 and len(vals) > 3:
+                self.my_ip = vals[3]
+                return self.my_ip
+        return False
 
 
     def create_packet_session(self, verbose=True):
@@ -163,7 +166,7 @@ class QuectelModule(Module):
         rmutils.write(ser, 'AT+QICSGP=1,1,"' + self.apn + '","","",0', verbose=verbose)
         constate = rmutils.write(ser, 'AT+QIACT?', verbose=verbose)  # Check if we are already connected
         if not self.parse_constate(constate):  # Returns packet session info if in session
-            rmutils.write(ser, 'AT+QIACT=1', verbose=verbose)  # Activate context / create packet session
+            rmutils.write(ser, 'AT+QIACT=1', timeout=150, verbose=verbose)  # Activate context / create packet session
             constate = rmutils.write(ser, 'AT+QIACT?', verbose=verbose)  # Verify that we connected
             self.parse_constate(constate)
             if not self.parse_constate(constate):
@@ -190,7 +193,8 @@ class QuectelModule(Module):
         ser = self.myserial
         self.create_packet_session()
         mycmd = 'AT+QPING=1,\"' + host + '\",4,4'  # Context, host, timeout, pingnum
-        rmutils.write(ser, mycmd, delay=6)  # Write a ping command; Wait timeout plus 2 seconds
+        rmutils.write(ser, mycmd)  # Write a ping command
+        rmutils.wait_urc(ser, 6, self.port_spec)  # Ping results come back via urc; wait timeout plus 2 seconds
 
 
     def lookup(self, host, verbose):
@@ -199,7 +203,7 @@ class QuectelModule(Module):
         rmutils.write(ser, 'AT+QIDNSCFG=1')  # Check DNS server
         mycmd = 'AT+QIDNSGIP=1,\"' + host + '\"'
         rmutils.write(ser, mycmd, timeout=0)  # Write a dns lookup command
-        rmutils.wait_urc(ser, 4,self.com_port)  # Wait up to 4 seconds for results to come back via urc
+        rmutils.wait_urc(ser, 4,self.port_spec)  # Wait up to 4 seconds for results to come back via urc
 
 
     # ========================================================================
@@ -212,20 +216,21 @@ class QuectelModule(Module):
         ser = self.myserial
         self.create_packet_session()
         # Open TCP socket to the host in buffer access mode
-        rmutils.write(ser, 'AT+QICLOSE=0', delay=1)  # Make sure no sockets open
+        rmutils.write(ser, 'AT+QICLOSE=0', timeout=10)  # Make sure no sockets open
         mycmd = 'AT+QIOPEN=1,0,\"TCP\",\"' + host + '\",80,0,0'
-        rmutils.write(ser, mycmd, delay=1)  # Create TCP socket connection as a client
+        rmutils.write(ser, mycmd, timeout=150, terminators=['+QIOPEN:'])  # Create TCP socket connection as a client
         sostate = rmutils.write(ser, 'AT+QISTATE=1,0')  # Check socket state
         if "TCP" not in sostate:  # Try one more time with a delay if not connected
             sostate = rmutils.write(ser, 'AT+QISTATE=1,0', delay=1)  # Check socket state
         # Send HTTP GET
         getpacket = self.get_http_packet(host)
         mycmd = 'AT+QISEND=0,' + str(len(getpacket))
-        rmutils.write(ser, mycmd, getpacket, delay=0)  # Write an http get command
-        rmutils.write(ser, 'AT+QISEND=0,0', delay=5)  # Check how much data sent
-        #rmutils.wait_urc(self.myserial, 5, self.com_port)
+        rmutils.write(ser, mycmd, getpacket, send_timeout=5)  # Write an http get command
+        rmutils.write(ser, 'AT+QISEND=0,0')  # Check how much data sent
+        # Wait for the module to tell us that the response has arrived
+        rmutils.wait_urc(ser, 5, self.port_spec, returnonvalue='+QIURC: "recv"')
         # Read the response
-        http_response = rmutils.write(ser, 'AT+QIRD=0,1500', delay=5)  # Check receive
+        http_response = rmutils.write(ser, 'AT+QIRD=0,1500')  # Check receive
         #rmutils.wait_urc(self.myserial, 5, self.com_port)
         return http_response
 
@@ -235,7 +240,7 @@ class QuectelModule(Module):
     #
 
 
-    def udp_listen(self,listen_port, listen_wait, verbose=True, returnbytes=False):
+    def udp_listen(self,listen_port, listen_wait, verbose=True, returnbytes=False, buffered=False):
         '''Starts listening for UDP packets.
         Parameters
         ----------
@@ -247,6 +252,10 @@ class QuectelModule(Module):
         verbose : bool, optional
         returnbytes : bool, optional
             If True, returns bytes, instead of a string.
+        buffered : bool, optional
+            If True, opens the socket in buffer access mode: the module keeps received packets until they
+            are read with drain_socket, and only says +QIURC: "recv",1 when the first one arrives. Otherwise
+            each packet arrives in a +QIURC: "recv" URC of its own (direct push mode).
         Returns
         -------
         s : bool
@@ -262,8 +271,13 @@ class QuectelModule(Module):
         else:
             return False
         # Open UDP socket for listen
-        mycmd = 'AT+QIOPEN=1,' + read_sock + ',"UDP SERVICE","127.0.0.1",0,'+str(listen_port)+',1'
-        rmutils.write(ser, mycmd, delay=1, verbose=verbose)  # Create UDP socket connection
+        access_mode = '0' if buffered else '1'
+        mycmd = 'AT+QIOPEN=1,' + read_sock + ',"UDP SERVICE","127.0.0.1",0,' + str(listen_port) + ',' + access_mode
+        response = rmutils.write(ser, mycmd, timeout=150, verbose=verbose, terminators=['+QIOPEN:'])  # Create UDP socket connection
+        vals = self.parse_response(response, '+QIOPEN:')
+        if len(vals) > 1 and vals[1] != 0:
+            aerisutils.print_log('Failed to open UDP socket, error ' + str(vals[1]), verbose)
+            return False
         sostate = rmutils.write(ser, 'AT+QISTATE=1,' + read_sock, verbose=verbose)  # Check socket state
         if "UDP" not in sostate:  # Try one more time with a delay if not connected
             sostate = rmutils.write(ser, 'AT+QISTATE=1,' + read_sock, delay=1, verbose=verbose)  # Check socket state
@@ -271,9 +285,57 @@ class QuectelModule(Module):
                 return False
         # Wait for data
         if listen_wait > 0:
-            return rmutils.wait_urc(ser, listen_wait, self.com_port, returnonreset=True, returnbytes=returnbytes)  # Wait up to X seconds for UDP data to come in
+            return rmutils.wait_urc(ser, listen_wait, self.port_spec, returnonreset=True, returnbytes=returnbytes)  # Wait up to X seconds for UDP data to come in
         return True
 
+    def udp_listener_closed(self, urc, verbose=False):
+        '''Closes the socket udp_listen opened, and deactivates the packet data context if the network
+        deactivated it. The module keeps the connectID until then, and fails AT+QIOPEN on it with error 563.
+        See Module.udp_listener_closed.
+        '''
+        ser = self.myserial
+        rmutils.write(ser, 'AT+QICLOSE=1', timeout=10, verbose=verbose)
+        if urc is not None and urc.startswith('+QIURC: "pdpdeact"'):
+            rmutils.write(ser, 'AT+QIDEACT=1', verbose=verbose)
+
+    def drain_socket(self, connect_id=1, verbose=False):
+        '''Reads every packet the module has buffered for a socket opened in buffer access mode, with one
+        AT+QIRD per packet until none are left.
+        The data goes into a buffer that is allocated once and reused by the next drain_socket call.
+        Parameters
+        ----------
+        connect_id : int, optional
+            The socket. Default: 1, the one udp_listen opens.
+        verbose : bool, optional
+            True for verbose output.
+        Returns
+        -------
+        A list of qiurc.Datagram, with payloads that are memoryviews into the buffer; copy a payload to keep
+        it past the next call. For TCP, the remote address is None and a datagram is a piece of the stream.
+        '''
+        buffer = getattr(self, '_drain_buffer', None)
+        if buffer is None:
+            buffer = self._drain_buffer = bytearray(64 * self.QIRD_LENGTH)
+        cmd = 'AT+QIRD=' + str(connect_id) + ',' + str(self.QIRD_LENGTH)
+        pieces = []
+        offset = 0
+        while True:
+            if offset + self.QIRD_LENGTH > len(buffer):
+                # Grow into a new buffer rather than resizing this one, which views from the last call may hold
+                buffer = self._drain_buffer = buffer[:offset] + bytearray(len(buffer))
+            header, length, final = rmutils.read_data(self.myserial, cmd, buffer, offset, verbose=verbose)
+            if header is None or length == 0:
+                if final != 'OK':
+                    aerisutils.print_log('Failed to read from socket ' + str(connect_id) + ': ' + str(final))
+                break
+            fields = atparser.split_fields(header)
+            remote_ip, remote_port = (fields[1], fields[2]) if len(fields) > 2 else (None, None)
+            pieces.append((remote_ip, remote_port, offset, length))
+            offset += length
+        view = memoryview(buffer)
+        return [Datagram(connect_id, remote_ip, remote_port, view[start:start + length])
+                for remote_ip, remote_port, start, length in pieces]
+
     def udp_urcs_to_payloads(self, urcs, verbose=False):
         '''Parses a string of URCs representing UDP packet deliveries into a list of payloads, one per packet.
 
@@ -289,71 +351,10 @@ class QuectelModule(Module):
         list
             An iterable of payloads, each a bytes object.
         '''
-        # state machine:
-        # (initial) -> (receive: +QIURC: "recv") -> (parse <connectID>,<currentrecvlength>,"remote ip",<remoteport><CR><LF>) -> read <currentrecvlength> bytes -> (initial)
-        # (initial) -> (receive: +) -> (read rest of line, output as "unexpected URC") -> (initial)
-        CHAR_CR = 13
-        CHAR_LF = 10
-        URC_HEAD = b'+QIURC: "recv",'
-        urc_regex = re.compile(rb'\+QIURC: "recv",(?P<connectID>\d+),(?P<currentrecvlength>\d+),"(?P<remoteIP>[^"]+)",(?P<remotePort>\d+)')
-        payloads = []
-        current_input = urcs
-        while len(current_input) > 0:
-            aerisutils.print_log('Remaining input: ' + aerisutils.bytes_to_utf_or_hex(current_input), verbose)
-            head = current_input[:len(URC_HEAD)]
-            if head == URC_HEAD:
-                # find the next carriage return
-                next_carriage_return_index = current_input.find(b'\x0D')
-                if next_carriage_return_index == -1:
-                    aerisutils.print_log('Error: no carriage returns after an URC')
-                parse_result = urc_regex.search(current_input[:next_carriage_return_index])
-                aerisutils.print_log('QIURC parse result: ' + str(parse_result), verbose)
-                if not parse_result:
-                    aerisutils.print_log('Error: failed to parse QIURC', verbose=True)
-                connection_id = parse_result.group('connectID')
-                
-                aerisutils.print_log('Found connection ID: ' + aerisutils.bytes_to_utf_or_hex(connection_id), verbose)
-                length = parse_result.group('currentrecvlength')
-                 
-                aerisutils.print_log('Found length of received data: ' + aerisutils.bytes_to_utf_or_hex(length), verbose)
-                remote_ip = parse_result.group('remoteIP')
-                aerisutils.print_log('Found remote IP: ' + aerisutils.bytes_to_utf_or_hex(remote_ip), verbose)
-                remote_port = parse_result.group('remotePort')
-                aerisutils.print_log('Found remote port: ' + aerisutils.bytes_to_utf_or_hex(remote_port), verbose)
-                # advance to the carriage return
-                current_input = current_input[next_carriage_return_index:]
-                
-                # consume the CRLF
-                if not (current_input[0] == CHAR_CR and current_input[1] == CHAR_LF):
-                    aerisutils.print_log('Sanity: the two bytes after the length were not a CRLF')
-                current_input = current_input[2:]
-                # consume the next number of bytes the URC said we would get, and advance that many
-                payload = current_input[:int(length)]
-                extracted_payload_length = len(payload)
-                current_input = current_input[int(length):]
-                if extracted_payload_length != int(length):
-                    aerisutils.print_log(f'Sanity: the packet extracted from the buffer was not {length} bytes long, it was {extracted_payload_length} bytes long. Ignoring packet.')
-                    continue
-                payloads.append(payload)
-                aerisutils.print_log('Found packet: ' + aerisutils.bytes_to_utf_or_hex(payload), verbose)
-                # consume the trailing CRLF
-                if not (current_input[0] == CHAR_CR and current_input[1] == CHAR_LF):
-                    aerisutils.print_log('Sanity: the two characters after the payload were not a CRLF')
-                current_input = current_input[2:]
-            else:
-                # this is not the URC we expected
-                # consume to the next newline, output as a warning or whatever, and try again
-                newline_index = current_input.find(b'\n')
-                if newline_index == -1:
-                    aerisutils.print_log('Warning: no newline at end of unexpected URC: <<' + aerisutils.bytes_to_utf_or_hex(current_input) + '>>')
-                    # consume the rest of the input
-                    current_input = []
-                else:
-                    unexpected_urc = current_input[:newline_index]
-                    # this might be a blank line, i.e., just a CRLF
-                    if unexpected_urc != b'\x0D':
-                        aerisutils.print_log('Warning: found unexpected URC: <<' + aerisutils.bytes_to_utf_or_hex(unexpected_urc) + '>>', verbose=True)
-                    current_input = current_input[newline_index+1:]
+        parser = DatagramParser(verbose)
+        payloads = [datagram.payload for datagram in parser.feed(urcs)]
+        if parser.incomplete:
+            aerisutils.print_log('Sanity: the buffer ended in the middle of a packet. Ignoring packet.')
         return payloads
 
     def udp_echo(self, host, port, echo_delay, echo_wait, verbose=True):
@@ -366,9 +367,9 @@ class QuectelModule(Module):
         else:
             return False
         # Open UDP socket to the host for sending echo command
-        rmutils.write(ser, 'AT+QICLOSE=0', delay=1, verbose=verbose)  # Make sure no sockets open
+        rmutils.write(ser, 'AT+QICLOSE=0', timeout=10, verbose=verbose)  # Make sure no sockets open
         mycmd = 'AT+QIOPEN=1,0,\"UDP\",\"' + echo_host + '\",' + port + ',0,1'
-        rmutils.write(ser, mycmd, delay=1, verbose=verbose)  # Create UDP socket connection as a client
+        rmutils.write(ser, mycmd, timeout=150, verbose=verbose, terminators=['+QIOPEN:'])  # Create UDP socket connection as a client
         sostate = rmutils.write(ser, 'AT+QISTATE=1,0', verbose=verbose)  # Check socket state
         if "UDP" not in sostate:  # Try one more time with a delay if not connected
             sostate = rmutils.write(ser, 'AT+QISTATE=1,0', delay=1, verbose=verbose)  # Check socket state
@@ -377,7 +378,10 @@ class QuectelModule(Module):
         #udppacket = str('Echo test!')
         # print('UDP packet: ' + udppacket)
         mycmd = 'AT+QISEND=0,' + str(len(udppacket))
-        rmutils.write(ser, mycmd, udppacket, delay=0, verbose=verbose)  # Write udp packet
+        sendstate = rmutils.write(ser, mycmd, udppacket, send_timeout=5, verbose=verbose)  # Write udp packet
+        if 'SEND OK' not in sendstate:
+            aerisutils.print_log('Failed to send echo command')
+            return False
         rmutils.write(ser, 'AT+QISEND=0,0', verbose=verbose)  # Check how much data sent
         aerisutils.print_log('Sent echo command: ' + udppacket)
         if echo_wait == 0:
@@ -385,14 +389,11 @@ class QuectelModule(Module):
             return True
         else:
             echo_wait = round(echo_wait + echo_delay)
-            vals = rmutils.wait_urc(ser, echo_wait, self.com_port, returnonreset=True,
-                             returnonvalue='OK')  # Wait up to X seconds to confirm data sent
-            #print('Return: ' + str(vals))
-            vals = rmutils.wait_urc(ser, echo_wait, self.com_port, returnonreset=True,
+            vals = rmutils.wait_urc(ser, echo_wait, self.port_spec, returnonreset=True,
                              returnonvalue='+QIURC:')  # Wait up to X seconds for UDP data to come in
             vals = super().parse_response(vals, '+QIURC:')
             print('Return: ' + str(vals))
-            if len(vals) > 2 and int(vals[2]) == len(udppacket):
+            if len(vals) > 2 and vals[2] == len(udppacket):
                 return True
             else:
                 return False
@@ -430,12 +431,12 @@ class QuectelModule(Module):
         psmsettings = rmutils.write(ser, 'AT+QPSMCFG?',
                                     verbose=verbose)  # Check PSM feature mode and min time threshold
         vals = super().parse_response(psmsettings, '+QPSMCFG:')
-        print('Minimum seconds to enter PSM: ' + vals[0])
-        print('PSM mode: ' + self.psm_mode(int(vals[1])))
+        print('Minimum seconds to enter PSM: ' + str(vals[0]))
+        print('PSM mode: ' + self.psm_mode(vals[1]))
         # Check on urc setting
         psmsettings = rmutils.write(ser, 'AT+QCFG="psm/urc"', verbose=verbose)  # Check if urc enabled
         vals = super().parse_response(psmsettings, '+QCFG: ')
-        print('PSM unsolicited response codes (urc): ' + vals[1])
+        print('PSM unsolicited response codes (urc): ' + str(vals[1]))
         # Query settings
         return super().get_psm_info('+QPSMS', 2, 10, verbose)
 
@@ -510,13 +511,11 @@ class QuectelModule(Module):
         # Issue upload command to destination path
         #mycmd = 'AT+QFUPL="EUFS:/datatx/' + filename+ '",' + str(filesize)
         mycmd = 'AT+QFUPL="' + dst_path + filename+ '",' + str(filesize)
-        rmutils.write(ser, mycmd)
-        i = 0
-        while i < filesize:
-            self.putc(f.read(1))
-            i += 1
-        f.close()
-        rmutils.wait_urc(ser, 5, self.com_port)  # Wait up to 5 seconds for results to come back via urc
+        with self.exclusive():  # No other commands while the module is in data mode
+            rmutils.write(ser, mycmd, terminators=['CONNECT'])  # The module is ready for the data after CONNECT
+            rmutils.write_stream(ser, f, filesize, label='Upload of ' + filename)
+            f.close()
+            rmutils.wait_urc(ser, 5, self.port_spec)  # Wait up to 5 seconds for results to come back via urc
         return True
 
 
@@ -540,13 +539,11 @@ class QuectelModule(Module):
         print('Size of file is ' + str(stats.st_size) + ' bytes')
         f = open(path + filename, 'rb')
         mycmd = 'AT+QFUPL="EUFS:/datatx/' + filename+ '",' + str(filesize)
-        rmutils.write(ser, mycmd)
-        i = 0
-        while i < filesize:
-            self.putc(f.read(1))
-            i += 1
-        f.close()
-        rmutils.wait_urc(ser, 5, self.com_port)  # Wait up to 5 seconds for results to come back via urc
+        with self.exclusive():  # No other commands while the module is in data mode
+            rmutils.write(ser, mycmd, terminators=['CONNECT'])  # The module is ready for the data after CONNECT
+            rmutils.write_stream(ser, f, filesize, label='Upload of ' + filename)
+            f.close()
+            rmutils.wait_urc(ser, 5, self.port_spec)  # Wait up to 5 seconds for results to come back via urc
         return True
 
 
@@ -574,11 +571,12 @@ class QuectelModule(Module):
         #filename = 'oem_app_disable.ini'
         filename = 'oem_app_path.ini'
         mycmd = 'AT+QFDWL="EUFS:/datatx/' + filename + '"'
-        rmutils.write(ser, mycmd)
-        char = ''
-        while char is not None:
-            char = self.getc()
-            print('Char: ' + str(char))
+        with self.exclusive():  # The file comes back in data mode
+            rmutils.write(ser, mycmd)
+            char = ''
+            while char is not None:
+                char = self.getc()
+                print('Char: ' + str(char))
         return True
 
     # ========================================================================
@@ -588,6 +586,7 @@ class QuectelModule(Module):
 
 
     def create_jwt(self, project,clientkey,algorithm):
+      import jwt  # Only needed for MQTT; it also pulls in cryptography
       token_req = {
                   'iat': datetime.datetime.utcnow(),
                   'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=10),
@@ -598,45 +597,45 @@ class QuectelModule(Module):
       return jwt.encode(token_req, private_key, algorithm=algorithm).decode('utf-8')
 
     def configure_mqtt(self, ser, cacert):
-      rmutils.write(ser, 'AT+QMTCFG="version",0,4', delay=1) 
-      rmutils.write(ser, 'AT+QMTCFG="SSL",0,1,3', delay=1) 
-      rmutils.write(ser, 'AT+QSSLCFG="cacert",3,"'+cacert+'"', delay=1) 
-      rmutils.write(ser, 'AT+QSSLCFG="seclevel",3,2', delay=1) 
-      rmutils.write(ser, 'AT+QSSLCFG="sslversion",3,4', delay=1) 
-      rmutils.write(ser, 'AT+QSSLCFG="ciphersuite",3,0xFFFF', delay=1) 
-      rmutils.write(ser, 'AT+QSSLCFG="ignorelocaltime",3,1', delay=1) 
+      rmutils.write(ser, 'AT+QMTCFG="version",0,4')
+      rmutils.write(ser, 'AT+QMTCFG="SSL",0,1,3')
+      rmutils.write(ser, 'AT+QSSLCFG="cacert",3,"'+cacert+'"')
+      rmutils.write(ser, 'AT+QSSLCFG="seclevel",3,2')
+      rmutils.write(ser, 'AT+QSSLCFG="sslversion",3,4')
+      rmutils.write(ser, 'AT+QSSLCFG="ciphersuite",3,0xFFFF')
+      rmutils.write(ser, 'AT+QSSLCFG="ignorelocaltime",3,1')
     
     def mqtt_demo(self, project, region, registry, cacert, clientkey, algorithm, deviceid, verbose):
         ser = self.myserial        
         self.configure_mqtt(ser, cacert)
         rmutils.write(ser, 'AT+QMTOPEN=0,"mqtt.googleapis.com",8883') 
-        vals = rmutils.wait_urc(ser, 10, self.com_port, returnonreset=True, returnonvalue='+QMTOPEN:')  
+        vals = rmutils.wait_urc(ser, 10, self.port_spec, returnonreset=True, returnonvalue='+QMTOPEN:')  
         vals = super().parse_response(vals, '+QMTOPEN:')
         print('Network Status: ' + str(vals))
-        if vals[1] != '0' :
+        if vals[1] != 0 :
           print('Failed to connect to MQTT Network')
         else:
           print('Successfully opened Network to MQTT Server')
           token=self.create_jwt(project,clientkey,algorithm)          
           cmd = 'AT+QMTCONN=0,"projects/'+project+'/locations/'+region+'/registries/'+registry+'/devices/'+deviceid+'","unused","'+token+'"'
           rmutils.write(ser, cmd)
-          vals = rmutils.wait_urc(ser, 10, self.com_port, returnonreset=True, returnonvalue='+QMTCONN:')  
+          vals = rmutils.wait_urc(ser, 10, self.port_spec, returnonreset=True, returnonvalue='+QMTCONN:')  
           vals = super().parse_response(vals, '+QMTCONN:')
           print('Connection Response: ' + str(vals))
-          if vals[2] != '0':
+          if vals[2] != 0:
             print('Unable to establish Connection')
           else:
             print('Successfully Established MQTT Connection')
             rmutils.write(ser, 'AT+QMTSUB=0,1,"/devices/'+deviceid+'/config",1')		
-            vals = rmutils.wait_urc(ser, 5, self.com_port, returnonreset=True, returnonvalue='+QMTRECV:')  
+            vals = rmutils.wait_urc(ser, 5, self.port_spec, returnonreset=True, returnonvalue='+QMTRECV:')  
             vals = super().parse_response(vals, '+QMTRECV:')
             print('Received Message : ' + str(vals))
             rmutils.write(ser, 'AT+QMTPUB=0,1,1,0,"/devices/'+deviceid+'/events"')            
             rmutils.write(ser, 'helloserver'+chr(26))
-            vals = rmutils.wait_urc(ser, 5, self.com_port, returnonreset=True, returnonvalue='+QMTPUB:')  
+            vals = rmutils.wait_urc(ser, 5, self.port_spec, returnonreset=True, returnonvalue='+QMTPUB:')  
             vals = super().parse_response(vals, '+QMTPUB:')
             print('Message Publish Status : ' + str(vals))	
-            rmutils.write(ser, 'AT+QMTDISC=0', delay=1) 
+            rmutils.write(ser, 'AT+QMTDISC=0', timeout=30, terminators=['+QMTDISC:'])
             print('MQTT Connection Closed')	
 
  
@@ -677,22 +676,23 @@ class QuectelModule(Module):
 
     def lwm2m_info(self):
         ser = self.myserial
-        # Check server type
-        rmutils.write(ser, 'AT+QLWM2M="select"') 
-        # Check server config
-        rmutils.write(ser, 'AT+QLWM2M="bootstrap",1') 
-        # Check registration timeout
-        rmutils.write(ser, 'AT+QLWM2M="bootstrap",2')
-        # Check registration server vs bootstrap server
-        rmutils.write(ser, 'AT+QLWM2M="bootstrap",3') 
-        # Check security mode to no security
-        rmutils.write(ser, 'AT+QLWM2M="bootstrap",4') 
-        # Check apn for lwm2m
-        rmutils.write(ser, 'AT+QLWM2M="apn"') 
-        # Check registration endpoint type
-        rmutils.write(ser, 'AT+QLWM2M="endpoint"') 
-        # Check if client enabled
-        rmutils.write(ser, 'AT+QLWM2M="enable"') 
+        with self.batch() as b:
+            # Check server type
+            b.query('AT+QLWM2M="select"')
+            # Check server config
+            b.query('AT+QLWM2M="bootstrap",1')
+            # Check registration timeout
+            b.query('AT+QLWM2M="bootstrap",2')
+            # Check registration server vs bootstrap server
+            b.query('AT+QLWM2M="bootstrap",3')
+            # Check security mode to no security
+            b.query('AT+QLWM2M="bootstrap",4')
+            # Check apn for lwm2m
+            b.query('AT+QLWM2M="apn"')
+            # Check registration endpoint type
+            b.query('AT+QLWM2M="endpoint"')
+            # Check if client enabled
+            b.query('AT+QLWM2M="enable"')
         return True
 
 
@@ -719,22 +719,21 @@ class QuectelModule(Module):
     def gps_info(self):
         ser = self.myserial
         gps_info = {}  # Initialize an empty dictionary object
-        # Check if GPS enabled
-        rmutils.write(ser, 'AT+QGPS?') 
-        # Check if GPSOneExtra is enabled
-        rmutils.write(ser, 'AT+QGPSXTRA?')
-        # Check GPSOneExtra data file
-        rmutils.write(ser, 'AT+QGPSXTRADATA?')
-        # Check output port
-        rmutils.write(ser, 'AT+QGPSCFG="outport"')
-        # Check config of nmea at command
-        rmutils.write(ser, 'AT+QGPSCFG="nmeasrc"')
-        # Check config of nmea sentence type config
-        rmutils.write(ser, 'AT+QGPSCFG="gpsnmeatype"')
-        # Check constellation enabled
-        rmutils.write(ser, 'AT+QGPSCFG="gnssconfig"')
-        # Check if we have a location
-        rmutils.write(ser, 'AT+QGPSLOC=0')
+        with self.batch() as b:
+            # Check if GPS enabled
+            b.query('AT+QGPS?')
+            # Check if GPSOneExtra is enabled
+            b.query('AT+QGPSXTRA?')
+            # Check GPSOneExtra data file
+            b.query('AT+QGPSXTRADATA?')
+            # Check output port
+            b.query('AT+QGPSCFG="outport"')
+            # Check config of nmea at command
+            b.query('AT+QGPSCFG="nmeasrc"')
+            # Check config of nmea sentence type config
+            b.query('AT+QGPSCFG="gpsnmeatype"')
+            # Check constellation enabled
+            b.query('AT+QGPSCFG="gnssconfig"')
         # Get NMEA sentences
         print('Global Positioning System Fix Data')
         #rmutils.write(ser, 'AT+QGPSGNMEA="GGA"')
@@ -784,6 +783,7 @@ class QuectelModule(Module):
         print('Downloading GPSOneExtra data file.')
         #url = 'http://xtrapath1.izatcloud.net/xtra2.bin'
         url = 'http://xtrapath4.izatcloud.net/xtra2.bin'
+        import requests
         r = requests.get(url, allow_redirects=True)
         src_path = str(pathlib.Path.home()) + '/'
         f = open(src_path + 'xtra2.bin', 'wb')
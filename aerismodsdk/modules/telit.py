@@ -16,14 +16,17 @@ limitations under the License.
 
 import aerismodsdk.utils.rmutils as rmutils
 import aerismodsdk.utils.aerisutils as aerisutils
+import aerismodsdk.utils.atparser as atparser
 from aerismodsdk.modules.module import Module
 from urllib.parse import urlsplit
 
 class TelitModule(Module):
 
 
-    def __init__(self, modem_mfg, com_port, apn, verbose=True):
-        super().__init__(modem_mfg, com_port, apn, verbose=True)
+    def __init__(self, modem_mfg, com_port, apn, verbose=True, baudrate=rmutils.DEFAULT_BAUDRATE,
+                 negotiate_baudrate=False):
+        super().__init__(modem_mfg, com_port, apn, verbose=True, baudrate=baudrate,
+                         negotiate_baudrate=negotiate_baudrate)
         super().set_cmd_iccid('CCID')
 
 
@@ -35,28 +38,29 @@ class TelitModule(Module):
 
     def network_info(self, scan, verbose):
         ser = self.myserial
-        # Enable unsolicited reg results
-        rmutils.write(ser, 'AT+CREG=2') 
-        # Quectel-specific advanced configuration
-        #rmutils.write(ser, 'AT+QPSMEXTCFG?') 
-        # Quectel - Network scan sequence
-        #rmutils.write(ser, 'AT+QCFG="nwscanseq"') 
-        # Telit - Network scan mode (GSM / LTE)
-        rmutils.write(ser, 'AT+WS46?') 
-        # Telit - IoT operating mode (CAT-M / NB-IoT)
-        rmutils.write(ser, 'AT#WS46?') 
-        # Quectel - Roaming
-        #rmutils.write(ser, 'AT+QCFG="roamservice"') 
-        # Telit - Bands
-        rmutils.write(ser, 'AT#BND?') 
-        # Telit - Service Domain (PS/CS)
-        rmutils.write(ser, 'AT+CEMODE?') 
-        # Telit-specific network info
-        rmutils.write(ser, 'AT#RFSTS') 
-        # Quectel-specific service cell
-        rmutils.write(ser, 'AT#SERVINFO', waitoe = True) 
-        # Quectel-specific network info
-        #rmutils.write(ser, 'AT+QENG="neighbourcell"', waitoe = True) 
+        with self.batch(timeout=2) as b:
+            # Enable unsolicited reg results
+            b.query('AT+CREG=2')
+            # Quectel-specific advanced configuration
+            #rmutils.write(ser, 'AT+QPSMEXTCFG?') 
+            # Quectel - Network scan sequence
+            #rmutils.write(ser, 'AT+QCFG="nwscanseq"') 
+            # Telit - Network scan mode (GSM / LTE)
+            b.query('AT+WS46?')
+            # Telit - IoT operating mode (CAT-M / NB-IoT)
+            b.query('AT#WS46?')
+            # Quectel - Roaming
+            #rmutils.write(ser, 'AT+QCFG="roamservice"') 
+            # Telit - Bands
+            b.query('AT#BND?')
+            # Telit - Service Domain (PS/CS)
+            b.query('AT+CEMODE?')
+            # Telit-specific network info
+            b.query('AT#RFSTS')
+            # Quectel-specific service cell
+            b.query('AT#SERVINFO')
+            # Quectel-specific network info
+            #rmutils.write(ser, 'AT+QENG="neighbourcell"', waitoe = True) 
         return super().network_info(scan, verbose)
 
 
@@ -126,26 +130,21 @@ class TelitModule(Module):
     def stop_packet_session(self):
         ser = self.myserial
         rmutils.write(ser, 'AT#SGACT=1,0')  # Deactivate context
-        rmutils.wait_urc(ser, 2,self.com_port)
+        rmutils.wait_urc(ser, 2,self.port_spec)
 
     def parse_connection_state(self, constate):
-        if len(constate) < len('#SGACT: '):
-            return False
-        else:
-            vals = constate.split('\r\n')
-            valsr1 = vals[1].split(',')
-            if len(valsr1) < 2:
-                return False
-            elif valsr1[1] == '1':
-                return True
-            return False
+        # #SGACT: <cid>,<stat> for each context
+        for vals in atparser.records(constate, '#SGACT:'):
+            if vals[0] == 1 and len(vals) > 1:
+                return vals[1] == 1
+        return False
 
     def get_module_ip(self, response):
-        if len(response) < len('+CGPADDR: 1,'):
+        values = atparser.values(response, '+CGPADDR:')
+        if len(values) < 2:
             aerisutils.print_log('Module IP Not Found')
         else:
-            values = response.split('\r\n')
-            self.my_ip = values[1].split(',')[1]
+            self.my_ip = values[1]
             aerisutils.print_log('Module IP is ' + self.my_ip)
 
     def create_packet_session(self):
@@ -153,12 +152,12 @@ class TelitModule(Module):
         #rmutils.write(ser, 'AT#SCFG?')  # Prints Socket Configuration
         #constate = rmutils.write(ser, 'AT#SGACT?', verbose=self.verbose)  # Check if we are already connected
         if not self.get_packet_info():  # Check if already in a packet sessiion
-            rmutils.write(ser, 'AT#SGACT=1,1', delay=1, verbose=self.verbose)  # Activate context / create packet session
+            rmutils.write(ser, 'AT#SGACT=1,1', timeout=150, verbose=self.verbose)  # Activate context / create packet session
             # constate = rmutils.write(ser, 'AT#SGACT?', verbose=self.verbose)  # Verify that we connected
             # self.parse_connection_state(constate)
             if not self.get_packet_info():
                 return False
-        response = rmutils.write(ser, 'AT+CGPADDR=1', delay=1)
+        response = rmutils.write(ser, 'AT+CGPADDR=1')
         self.get_module_ip(response)
         return True
 
@@ -179,27 +178,24 @@ class TelitModule(Module):
         ser = self.myserial
         self.create_packet_session()
         rmutils.write(ser, 'AT#HTTPCFG=0,\"' + host + '\",80,0,,,0,120,1')  # Establish HTTP Connection
-        rmutils.write(ser, 'AT#HTTPQRY=0,0,\"' + path + '\"', delay=2)  # Send HTTP Get
-        rmutils.write(ser, 'AT#HTTPRCV=0', delay=2)  # Receive HTTP Response
-        rmutils.write(ser, 'AT#SH=1', delay=2)  # Close socket
+        rmutils.write(ser, 'AT#HTTPQRY=0,0,\"' + path + '\"', timeout=120,
+                      terminators=['#HTTPRING:'])  # Send HTTP Get; wait for the response to arrive
+        rmutils.write(ser, 'AT#HTTPRCV=0', timeout=5)  # Receive HTTP Response
+        rmutils.write(ser, 'AT#SH=1')  # Close socket
 
     def lookup(self, host, verbose):
         ser = self.myserial
         self.create_packet_session()
         mycmd = 'AT#QDNS=\"' + host + '\"'
         rmutils.write(ser, mycmd)
-        rmutils.wait_urc(ser, 2,self.com_port)  # 4 seconds wait time
+        rmutils.wait_urc(ser, 2,self.port_spec)  # 4 seconds wait time
 
     def ping(self, host, verbose):
         ser = self.myserial
         self.create_packet_session()
         mycmd = 'AT#PING=\"' + host + '\",3,100,300,200'
         rmutils.write(ser, mycmd, timeout=2)
-        rmutils.wait_urc(ser, 10,self.com_port)
-
-    def wait_urc(self, timeout, returnonreset=False, returnonvalue=False, verbose=True):
-        rmutils.wait_urc(self.myserial, timeout, self.com_port, returnonreset, returnonvalue,
-                         verbose=verbose)  # Wait up to X seconds for URC
+        rmutils.wait_urc(ser, 10,self.port_spec)
 
     def udp_listen(self, listen_wait, verbose):
         ser = self.myserial
@@ -209,11 +205,11 @@ class TelitModule(Module):
         else:
             return False
         # Open UDP socket for listen
-        rmutils.write(ser, 'AT#SLUDP=1,1,3030', delay=1)  # Starts listener
-        rmutils.write(ser, 'AT#SS', delay=1)
+        rmutils.write(ser, 'AT#SLUDP=1,1,3030')  # Starts listener
+        rmutils.write(ser, 'AT#SS')
         if listen_wait > 0:
-            rmutils.wait_urc(ser, listen_wait, self.com_port, returnonreset=True)  # Wait up to X seconds for UDP data to come in
-            rmutils.write(ser, 'AT#SS', delay=1)
+            rmutils.wait_urc(ser, listen_wait, self.port_spec, returnonreset=True)  # Wait up to X seconds for UDP data to come in
+            rmutils.write(ser, 'AT#SS')
         return True
 
     def udp_echo(self, host, port, echo_delay, echo_wait, verbose=True):
@@ -224,25 +220,25 @@ class TelitModule(Module):
         # Create a packet session in case there is not one
         self.create_packet_session()
         # Close socket if open
-        rmutils.write(ser, 'AT#SL=1,0,' + listen_port + ',0', delay=1)
-        rmutils.write(ser, 'AT#SH=1', delay=1)
+        rmutils.write(ser, 'AT#SL=1,0,' + listen_port + ',0')
+        rmutils.write(ser, 'AT#SH=1')
         # Create UDP socket for sending and receiving
         mycmd = 'AT#SD=1,1,' + echo_port + ',"' + echo_host + '",0,' + listen_port + ',1,0,1'
-        rmutils.write(ser, mycmd, delay=1)
+        rmutils.write(ser, mycmd, timeout=60)
         # Send our UDP packet
         udppacket = str(
             '{"delay":' + str(echo_delay * 1000) + ', "ip":' + self.my_ip 
             + ',"port":' + listen_port + '}' + chr(26))
-        rmutils.write(ser, 'AT#SSEND=1', udppacket, delay=1)  # Sending packets to socket
+        rmutils.write(ser, 'AT#SSEND=1', udppacket, send_timeout=5)  # Sending packets to socket; ends with ctrl-z
         aerisutils.print_log('Sent Echo command to remote UDP server')
         # Wait for data
         if echo_wait > 0:
             echo_wait = round(echo_wait + echo_delay)
             # Wait for data to come in; handle case where we go to sleep
-            rmutils.wait_urc(ser, echo_wait, self.com_port, returnonreset=True,
+            rmutils.wait_urc(ser, echo_wait, self.port_spec, returnonreset=True,
                              returnonvalue='APP RDY')
             # Try to read data
-            rmutils.write(ser, 'AT#SRECV=1,1500,1', delay=1)
+            rmutils.write(ser, 'AT#SRECV=1,1500,1')
 
     # ========================================================================
     #
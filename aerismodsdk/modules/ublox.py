@@ -16,7 +16,7 @@ limitations under the License.
 
 import aerismodsdk.utils.rmutils as rmutils
 import aerismodsdk.utils.aerisutils as aerisutils
-from xmodem import XMODEM
+import aerismodsdk.utils.atparser as atparser
 import time
 import ipaddress
 
@@ -25,8 +25,10 @@ from aerismodsdk.modules.module import Module
 
 class UbloxModule(Module):
 
-    def __init__(self, modem_mfg, com_port, apn, verbose):
-        super(UbloxModule,self).__init__(modem_mfg, com_port, apn, verbose)
+    def __init__(self, modem_mfg, com_port, apn, verbose, baudrate=rmutils.DEFAULT_BAUDRATE,
+                 negotiate_baudrate=False):
+        super(UbloxModule,self).__init__(modem_mfg, com_port, apn, verbose, baudrate=baudrate,
+                                         negotiate_baudrate=negotiate_baudrate)
         rmutils.write(self.myserial, 'AT+CGEREP=1,1', verbose=verbose)  # Enable URCs
 
     def network_set(self, operator_name, format, act=7):
@@ -38,18 +40,14 @@ class UbloxModule(Module):
     #
 
     def parse_constate(self, constate):
-        if len(constate) < len('+QIACT: '):
-            return False
-        else:
-            vals = constate.split(',')
-            if len(vals) < 4:
-                return False
-            vals2 = vals[3].split('"')
-            self.my_ip = vals2[1]
-            # print('My IP: ' + self.my_ip)
-            if self.my_ip == "0.0.0.0":
-                return False
-            return self.my_ip
+        # +CGDCONT: <cid>,<PDP_type>,<APN>,<PDP_addr>,... for each defined context
+        for vals in atparser.records(constate, '+CGDCONT:'):
+            if vals[0] == 1 and len(vals) > 3:
+                self.my_ip = vals[3]
+                if self.my_ip in ('', '0.0.0.0'):
+                    return False
+                return self.my_ip
+        return False
 
     def create_packet_session(self, verbose=True):
         ser = self.myserial
@@ -140,7 +138,7 @@ class UbloxModule(Module):
         # Make http get request; store in get.ffs file
         rmutils.write(ser, 'AT+UHTTPC=0,1,"/","get.ffs"', verbose=verbose)
         # Wait for response
-        vals = rmutils.wait_urc(ser, 60, self.com_port, returnonreset=True,
+        vals = rmutils.wait_urc(ser, 60, self.port_spec, returnonreset=True,
                          returnonvalue='+UUHTTPCR:', verbose=verbose)
         # List files after the request
         rmutils.write(ser, 'AT+ULSTFILE=', verbose=verbose)
@@ -193,7 +191,7 @@ class UbloxModule(Module):
         val = rmutils.write(ser, mycmd, verbose=verbose)      
         # Wait for data up to X seconds
         if listen_wait > 0:
-            rmutils.wait_urc(ser, listen_wait, self.com_port, returnonreset=True)
+            rmutils.wait_urc(ser, listen_wait, self.port_spec, returnonreset=True)
         return True
 
     def udp_echo(self, host, port, echo_delay, echo_wait, verbose=True):
@@ -216,11 +214,12 @@ class UbloxModule(Module):
                     '{"delay":' + str(echo_delay * 1000) + ', "ip":"' 
                     + self.my_ip + '","port":' + str(listen_port) + '}')
         mycmd = 'AT+USOST=' + str(socket_id) + ',"' + echo_host + '",' + str(port) + ',' + str(len(udppacket))
-        rmutils.write(ser, mycmd, udppacket, delay=0, verbose=verbose)  # Write udp packet
+        # The module prompts with '@' before accepting the data, and answers +USOST: <socket>,<length> once sent
+        sendstate = rmutils.write(ser, mycmd, udppacket, prompt='@', send_timeout=5, verbose=verbose)  # Write udp packet
+        if '+USOST:' not in sendstate:
+            aerisutils.print_log('Failed to send echo command')
+            return False
         aerisutils.print_log('Sent echo command: ' + udppacket, verbose)
-        # Always wait long enough to verify packet sent
-        vals = rmutils.wait_urc(ser, 5, self.com_port, returnonvalue='OK', verbose=verbose)
-        #print('Return: ' + str(vals))
         if echo_wait == 0:
             # True indicates we sent the echo
             return True
@@ -229,14 +228,14 @@ class UbloxModule(Module):
             echo_wait = round(echo_wait + echo_delay)
             # vals = rmutils.wait_urc(ser, echo_wait, self.com_port, returnonreset=True,
                              # returnonvalue='APP RDY')  # Wait up to X seconds for UDP data to come in
-            vals = rmutils.wait_urc(ser, echo_wait, self.com_port, returnonreset=True,
+            vals = rmutils.wait_urc(ser, echo_wait, self.port_spec, returnonreset=True,
                              returnonvalue='+UUSORF:', verbose=verbose)
             #print('Return: ' + str(vals))
             mycmd = 'AT+USORF=0,' + str(len(udppacket))
             #vals = rmutils.write(ser, mycmd, verbose=verbose)  # Read from socket
             vals = (super().get_values_for_cmd(mycmd,'+USORF:'))
             #print('Return: ' + str(vals))
-            if len(vals) > 3 and int(vals[3]) == len(udppacket):
+            if len(vals) > 3 and vals[3] == len(udppacket):
                 return True
             else:
                 return False
@@ -309,15 +308,22 @@ class UbloxModule(Module):
 
     def fw_update(self):
         ser = self.myserial
+        self.forget_identity()  # The firmware revision changes
+        from xmodem import XMODEM
         modem = XMODEM(self.getc, self.putc)
         # stream = open('/home/pi/share/fw/0bb_stg1_pkg1-0m_L56A0200_to_L58A0204.bin', 'rb')
         stream = open('/home/pi/share/fw/0bb_stg2_L56A0200_to_L58A0204.bin', 'rb')
-        rmutils.write(ser, 'AT+UFWUPD=3')
-        rmutils.wait_urc(ser, 20, self.com_port)
-        modem.send(stream)
-        stream.close()
-        ser.flushOutput()
-        rmutils.wait_urc(ser, 20, self.com_port)
-        # print(stream)
+        with self.exclusive():  # No other commands during the XMODEM transfer
+            rmutils.write(ser, 'AT+UFWUPD=3')
+            rmutils.wait_urc(ser, 20, self.port_spec)
+            start_time = time.monotonic()
+            success = modem.send(stream)
+            rmutils.print_throughput('Firmware upload (XMODEM)', stream.tell(), time.monotonic() - start_time, ser)
+            if not success:
+                aerisutils.print_log('XMODEM transfer failed')
+            stream.close()
+            ser.flushOutput()
+            rmutils.wait_urc(ser, 20, self.port_spec)
+            # print(stream)
         rmutils.write(ser, 'AT+UFWINSTALL')
         rmutils.write(ser, 'AT+UFWINSTALL?')
@@ -0,0 +1,34 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+from aerismodsdk.simulator.modem import SimulatedModem, SimSocket, CommandError, PENDING
+from aerismodsdk.simulator.quectel import QuectelSimulator
+from aerismodsdk.simulator.telit import TelitSimulator
+from aerismodsdk.simulator.ublox import UbloxSimulator
+from aerismodsdk.manufacturer import Manufacturer
+
+SIMULATORS = {
+    Manufacturer.quectel: QuectelSimulator,
+    Manufacturer.telit: TelitSimulator,
+    Manufacturer.ublox: UbloxSimulator,
+}
+
+
+def simulator_for(modem_mfg, **kwargs):
+    '''Creates (but does not start) the simulator for a Manufacturer. kwargs go to SimulatedModem.'''
+    return SIMULATORS[modem_mfg](**kwargs)
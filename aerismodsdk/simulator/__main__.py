@@ -0,0 +1,51 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import argparse
+import time
+
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.simulator import simulator_for
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m aerismodsdk.simulator',
+                                     description='Runs a simulated module on a pseudo-terminal until interrupted.')
+    parser.add_argument('modem_mfg', choices=[m.name for m in Manufacturer])
+    parser.add_argument('--latency', type=float, default=0, help='Seconds to answer each command.')
+    parser.add_argument('--packet-rate', type=float, default=0, help='Packets per second arriving from the network.')
+    parser.add_argument('--packet-size', type=int, default=32, help='Size of the arriving packets.')
+    parser.add_argument('--poisson', action='store_true', help='Random (Poisson) packet arrivals.')
+    parser.add_argument('--echo-packets', action='store_true', help='Send every packet the SDK sends back to it.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log commands and responses.')
+    args = parser.parse_args(argv)
+    modem = simulator_for(Manufacturer[args.modem_mfg], latency=args.latency, verbose=args.verbose)
+    modem.echo_packets = args.echo_packets
+    with modem:
+        print('Simulated ' + modem.manufacturer + ' ' + modem.model + ' on ' + modem.port)
+        print('Try: aeriscli config (with that port as the comport), then aeriscli info')
+        if args.packet_rate > 0:
+            modem.start_traffic(args.packet_rate, size=args.packet_size, poisson=args.poisson)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
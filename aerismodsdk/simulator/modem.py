@@ -0,0 +1,758 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import collections
+import os
+import random
+import re
+import select
+import threading
+import time
+import tty
+
+import aerismodsdk.utils.aerisutils as aerisutils
+
+CTRL_Z = b'\x1a'
+ESC = b'\x1b'
+
+# Texts for the +CME ERROR codes the simulator uses, shown with AT+CMEE=2
+CME_ERRORS = {
+    3: 'operation not allowed',
+    4: 'operation not supported',
+    10: 'SIM not inserted',
+    30: 'no network service',
+    50: 'incorrect parameters',
+    100: 'unknown',
+}
+
+# Seconds per unit of the 3GPP PSM timers (24.008 GPRS Timer 3 and GPRS Timer 2), by the top 3 bits
+TAU_UNITS = {0b000: 600, 0b001: 3600, 0b010: 36000, 0b011: 2, 0b100: 30, 0b101: 60, 0b110: 1152000}
+ACTIVE_TIME_UNITS = {0b000: 2, 0b001: 60, 0b010: 360}
+
+# Where simulated packets come from unless the caller says otherwise
+DEFAULT_REMOTE = ('35.212.147.4', 3030)
+
+# Returned by a command handler that answers later, e.g. once the data after a prompt has arrived
+PENDING = object()
+
+
+class CommandError(Exception):
+    '''Raised by a command handler to answer with an error; formatted according to AT+CMEE.'''
+
+    def __init__(self, code=100):
+        super().__init__(CME_ERRORS.get(code, str(code)))
+        self.code = code
+
+
+def split_args(args):
+    '''Splits AT command parameters on the commas outside quotes and strips the quotes.'''
+    vals = []
+    current = ''
+    quoted = False
+    for char in args:
+        if char == '"':
+            quoted = not quoted
+        elif char == ',' and not quoted:
+            vals.append(current)
+            current = ''
+        else:
+            current += char
+    vals.append(current)
+    return vals
+
+
+def split_commands(line):
+    '''Splits the text after AT on the semicolons outside quotes, e.g. '+CSQ;+CREG?' into '+CSQ' and '+CREG?'.'''
+    commands = []
+    current = ''
+    quoted = False
+    for char in line:
+        if char == '"':
+            quoted = not quoted
+        if char == ';' and not quoted:
+            commands.append(current)
+            current = ''
+        else:
+            current += char
+    if current or not commands:
+        commands.append(current)
+    return commands
+
+
+class SimSocket:
+    '''A socket opened on a simulated modem.'''
+
+    def __init__(self, socket_id, protocol, remote_host='', remote_port=0, local_port=0, mode=0):
+        self.socket_id = socket_id
+        self.protocol = protocol
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.local_port = local_port
+        self.mode = mode
+        # Packets that arrived and have not been read yet: (payload, remote host, remote port)
+        self.received = collections.deque()
+        # Payloads the SDK sent on this socket
+        self.sent = []
+        # True once the network closed the socket; it keeps its identity until the SDK closes it too
+        self.closed = False
+
+    @property
+    def listening(self):
+        return self.local_port > 0 and not self.remote_port
+
+
+class SimulatedModem:
+    '''A modem on a pseudo-terminal that answers AT commands, for running the SDK without hardware.
+
+    The base class implements the 3GPP commands (27.007 / 27.005) that the SDK uses. The subclasses
+    add the vendor commands. Open port with the SDK as if it were the module's AT port.
+
+    Handlers are looked up in the COMMANDS tables of the class and its bases, subclass first. Each
+    entry is a regular expression matched against one command without its AT prefix, and the name
+    of the handler method, which is called with the match. A handler returns None for a plain OK,
+    a list of information lines (str, or bytes sent as they are) to answer before the OK, or PENDING
+    if it answers later itself; it raises CommandError to answer with an error.
+    '''
+
+    manufacturer = 'Simulated'
+    model = 'AT Modem'
+    revision = 'SIM01A01'
+    imei = '866425030000001'
+    imsi = '310410123456789'
+    iccid = '89014103211234567890'
+    ip_address = '10.170.1.2'
+    operator = 'AT&T'
+    operator_plmn = '310410'
+    # What web servers answer
+    http_response = b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: 13\r\n\r\nHello, world!'
+    # The command the SDK reads the ICCID with, and the prefix of the answer
+    iccid_command = '+CCID'
+    # Prompt sent before the data of a send command
+    data_prompt = b'\r\n> '
+
+    COMMANDS = [
+        (r'$', 'handle_ok'),
+        (r'E(?P<value>[01]?)$', 'handle_echo'),
+        (r'I$', 'handle_ati'),
+        (r'\+C?GMI$', 'handle_gmi'),
+        (r'\+C?GMM$', 'handle_gmm'),
+        (r'\+C?GSN$', 'handle_gsn'),
+        (r'\+C?GMR$', 'handle_gmr'),
+        (r'\+CIMI$', 'handle_cimi'),
+        (r'(?P<cmd>\+I?CCID|\+QCCID)$', 'handle_iccid'),
+        (r'\+CSQ$', 'handle_csq'),
+        (r'\+CMEE=(?P<args>.*)$', 'handle_cmee'),
+        (r'\+CFUN\?$', 'handle_cfun_query'),
+        (r'\+CFUN=(?P<args>.*)$', 'handle_cfun'),
+        (r'\+(?P<cmd>CREG|CGREG|CEREG)=(?P<args>.*)$', 'handle_reg_set'),
+        (r'\+(?P<cmd>CREG|CGREG|CEREG)\?$', 'handle_reg_query'),
+        (r'\+COPS\?$', 'handle_cops_query'),
+        (r'\+COPS=\?$', 'handle_cops_test'),
+        (r'\+COPS=(?P<args>.*)$', 'handle_cops'),
+        (r'\+CGDCONT=(?P<args>.*)$', 'handle_cgdcont'),
+        (r'\+CGDCONT\?$', 'handle_cgdcont_query'),
+        (r'\+CGACT=(?P<args>.*)$', 'handle_cgact'),
+        (r'\+CGACT\?$', 'handle_cgact_query'),
+        (r'\+CGATT\?$', 'handle_cgatt_query'),
+        (r'\+CGPADDR(=(?P<args>.*))?$', 'handle_cgpaddr'),
+        (r'\+CMGS=(?P<args>.*)$', 'handle_cmgs'),
+        (r'\+CRSM=(?P<args>.*)$', 'handle_crsm'),
+        (r'\+CPSMS=(?P<args>.*)$', 'handle_cpsms'),
+        (r'\+CPSMS\?$', 'handle_cpsms_query'),
+        (r'\+CEDRXS=(?P<args>.*)$', 'handle_cedrxs'),
+        (r'\+CEDRXS\?$', 'handle_cedrxs_query'),
+        (r'\+CEDRXRDP$', 'handle_cedrxrdp'),
+    ]
+
+    def __init__(self, latency=0, command_latency=None, network_latency=0.05, echo=True, verbose=False):
+        '''
+        Parameters
+        ----------
+        latency : float or callable, optional
+            Seconds the modem takes to answer a command, or a function that gets the command
+            (without AT) and returns the seconds, e.g. to add jitter. Default: 0.
+        command_latency : dict, optional
+            Seconds to answer particular commands, by command name, e.g. {'+QIACT': 2.0}.
+            Overrides latency for those commands.
+        network_latency : float, optional
+            Seconds until the network answers a request: HTTP responses, DNS and ping results,
+            echoed packets. Default: 0.05.
+        echo : bool, optional
+            Whether command echo starts out on (ATE0 turns it off). Default: True.
+        verbose : bool, optional
+            True to log the commands and responses.
+        '''
+        self.latency = latency
+        self.network_latency = network_latency
+        self.command_latency = command_latency or {}
+        self.echo = echo
+        self.verbose = verbose
+        self.cmee = 1
+        self.cfun = 1
+        self.registration_mode = {'CREG': 0, 'CGREG': 0, 'CEREG': 0}
+        self.registration_status = 1
+        self.tac = '2E0F'
+        self.cell_id = '0A2B3C4D'
+        self.act = 7
+        self.csq = (20, 99)
+        self.contexts = {1: ('IP', '')}
+        self.pdp_active = False
+        self.psm = [0, '', '', '00100001', '00000011']
+        self.edrx = [0, 4, '0101']
+        self.sim_files = {0x6F07: '084903140121436587', 0x2FE2: '98104130123254769807'}
+        self.sockets = {}
+        self.sms_sent = []
+        self.echo_packets = False
+        self.commands = []
+        self.dropped_packets = 0
+        self.master = None
+        self.slave = None
+        self._table = []
+        for klass in type(self).__mro__:
+            for pattern, name in klass.__dict__.get('COMMANDS', ()):
+                self._table.append((re.compile(pattern, re.IGNORECASE), getattr(self, name)))
+        self._send_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._timers = []
+        self._traffic = None
+        self._data = None
+        self._deferred = None
+        self._skip_lf = False
+
+    # ========================================================================
+    #
+    # Running the modem
+    #
+
+    def start(self):
+        '''Creates the pseudo-terminal and starts answering commands. Returns self.'''
+        self.master, self.slave = os.openpty()
+        # Keep the slave open and raw, so the modem does not see its own output before the SDK opens the port
+        tty.setraw(self.slave)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='SimulatedModem ' + self.port, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self.stop_traffic()
+        for timer in self._timers:
+            timer.cancel()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    @property
+    def port(self):
+        '''The device path the SDK should open.'''
+        return os.ttyname(self.slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        pending = bytearray()
+        while not self._stopping.is_set():
+            readable, _, _ = select.select([self.master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                pending += os.read(self.master, 4096)
+            except OSError:
+                return
+            self._process(pending)
+
+    def _process(self, pending):
+        while pending:
+            if self._skip_lf:
+                # Commands end with CR; drop the LF of a CR LF so it does not end up in the data after a prompt
+                self._skip_lf = False
+                if pending[:1] == b'\n':
+                    del pending[:1]
+                    continue
+            if self._data is not None:
+                if not self._take_data(pending):
+                    return
+                continue
+            end = pending.find(b'\r')
+            if end == -1:
+                return
+            line = bytes(pending[:end]).lstrip(b'\n')
+            del pending[:end + 1]
+            self._skip_lf = True
+            if line:
+                self._handle_line(line)
+
+    def _send(self, data):
+        with self._send_lock:
+            while data:
+                written = os.write(self.master, data)
+                data = data[written:]
+
+    # ========================================================================
+    #
+    # Commands
+    #
+
+    def _handle_line(self, line):
+        text = line.decode('latin-1').strip()
+        aerisutils.print_log('Simulator << ' + text, self.verbose)
+        if self.echo:
+            self._send(line + b'\r')
+        if text[:2].upper() != 'AT':
+            self._reply([], self._error(100))
+            return
+        info = []
+        self._deferred = []
+        for command in split_commands(text[2:]):
+            self.commands.append(command)
+            time.sleep(self._latency(command))
+            try:
+                result = self._dispatch(command)
+            except CommandError as e:
+                self._reply(info, self._error(e.code))
+                break
+            if result is PENDING:
+                self._send(self._format(info))
+                break
+            if isinstance(result, str):
+                self._reply(info, result)
+                break
+            info.extend(result or [])
+        else:
+            self._reply(info)
+        self._send_deferred()
+
+    def _dispatch(self, command):
+        for pattern, handler in self._table:
+            match = pattern.match(command)
+            if match:
+                return handler(match)
+        return self.unknown_command(command)
+
+    def unknown_command(self, command):
+        '''Answers commands the simulator does not know. Default: OK, so configuration commands just work.'''
+        return None
+
+    def _latency(self, command):
+        name = re.match(r'[+#&]?[A-Z]*', command.upper()).group(0)
+        if name in self.command_latency:
+            return self.command_latency[name]
+        if callable(self.latency):
+            return self.latency(command)
+        return self.latency
+
+    def _error(self, code):
+        if self.cmee == 0:
+            return 'ERROR'
+        if self.cmee == 2:
+            return '+CME ERROR: ' + CME_ERRORS.get(code, str(code))
+        return '+CME ERROR: ' + str(code)
+
+    def _format(self, info, final=None):
+        out = b''
+        for line in info:
+            out += line if isinstance(line, bytes) else b'\r\n' + line.encode('latin-1') + b'\r\n'
+        if final is not None:
+            out += b'\r\n' + final.encode('latin-1') + b'\r\n'
+        return out
+
+    def _reply(self, info, final='OK'):
+        aerisutils.print_log('Simulator >> ' + str(info) + ' ' + final, self.verbose)
+        self._send(self._format(info, final))
+
+    def expect_data(self, handler, length=None, prompt=None):
+        '''Sends the data prompt and passes the data that follows to handler, which answers like a command handler.
+        Parameters
+        ----------
+        handler : callable
+            Called with the data, as bytes.
+        length : int, optional
+            Number of bytes to read. If None, the data ends with ctrl-Z (ESC cancels it).
+        prompt : bytes, optional
+            Default: data_prompt.
+        Returns
+        -------
+        PENDING, for the command handler to return.
+        '''
+        self._data = (length, handler, bytearray())
+        self._send(self.data_prompt if prompt is None else prompt)
+        return PENDING
+
+    def _take_data(self, pending):
+        length, handler, received = self._data
+        cancelled = False
+        if length is None:
+            end = len(pending)
+            for marker in (CTRL_Z, ESC):
+                index = pending.find(marker)
+                if -1 < index < end:
+                    end = index
+                    cancelled = marker == ESC
+            if end == len(pending):
+                received += pending
+                del pending[:]
+                return False
+            received += pending[:end]
+            del pending[:end + 1]
+        else:
+            chunk = pending[:length - len(received)]
+            received += chunk
+            del pending[:len(chunk)]
+            if len(received) < length:
+                return False
+        self._data = None
+        self._deferred = []
+        if cancelled:
+            self._reply([])
+        else:
+            try:
+                result = handler(bytes(received))
+                if isinstance(result, str):
+                    self._reply([], result)
+                elif result is not PENDING:
+                    self._reply(result or [])
+            except CommandError as e:
+                self._reply([], self._error(e.code))
+        self._send_deferred()
+        return True
+
+    # ========================================================================
+    #
+    # Unsolicited result codes and packets
+    #
+
+    def send_urc(self, urc):
+        '''Sends an unsolicited result code now. A str is framed with CR LF; bytes are sent as they are.'''
+        aerisutils.print_log('Simulator URC >> ' + str(urc), self.verbose)
+        self._send(urc if isinstance(urc, bytes) else b'\r\n' + urc.encode('latin-1') + b'\r\n')
+
+    def send_urc_later(self, delay, urc):
+        '''Sends an unsolicited result code after delay seconds.
+        Called from a command handler, the delay starts once the command has been answered.'''
+        if self._deferred is not None:
+            self._deferred.append((delay, urc))
+            return
+        self._later(delay, self.send_urc, urc)
+
+    def _later(self, delay, function, *args):
+        timer = threading.Timer(delay, function, args)
+        timer.daemon = True
+        self._timers = [t for t in self._timers if t.is_alive()] + [timer]
+        timer.start()
+
+    def _send_deferred(self):
+        deferred, self._deferred = self._deferred, None
+        for delay, urc in deferred or ():
+            if delay > 0:
+                self._later(delay, self.send_urc, urc)
+            else:
+                self.send_urc(urc)
+
+    def deliver_packet(self, payload, remote_host=DEFAULT_REMOTE[0], remote_port=DEFAULT_REMOTE[1], socket_id=None):
+        '''Simulates a packet arriving from the network.
+        Parameters
+        ----------
+        payload : bytes
+        remote_host : str, optional
+        remote_port : int, optional
+        socket_id : int, optional
+            The socket that receives it. Default: the first listening socket, or else the first socket.
+        Returns
+        -------
+        True if a socket received the packet, False if it was dropped because no socket was open.
+        '''
+        sock = self.sockets.get(socket_id) if socket_id is not None else self._receiving_socket()
+        if sock is None or sock.closed:
+            self.dropped_packets += 1
+            return False
+        sock.received.append((payload, remote_host, remote_port))
+        self.packet_arrived(sock, payload, remote_host, remote_port)
+        return True
+
+    def _receiving_socket(self):
+        sockets = sorted((s for s in self.sockets.values() if not s.closed), key=lambda s: (not s.listening, s.socket_id))
+        return sockets[0] if sockets else None
+
+    def packet_arrived(self, sock, payload, remote_host, remote_port):
+        '''Tells the SDK that a packet arrived on sock, the way the vendor does.'''
+        raise NotImplementedError('No socket commands on ' + self.manufacturer + ' ' + self.model)
+
+    def start_traffic(self, rate, size=32, count=None, payload=None, remote=DEFAULT_REMOTE, poisson=False):
+        '''Delivers packets in the background at rate packets per second (see deliver_packet).
+        Parameters
+        ----------
+        rate : float
+            Packets per second.
+        size : int, optional
+            Size of the random payloads. Default: 32.
+        count : int, optional
+            Stop after this many packets. Default: run until stop_traffic.
+        payload : bytes or callable, optional
+            The payload, or a function that gets the packet number and returns it. Default: random bytes.
+        remote : tuple, optional
+            (host, port) the packets come from.
+        poisson : bool, optional
+            True for exponentially distributed gaps between packets; otherwise they are evenly spaced.
+        '''
+        self.stop_traffic()
+        stopping = threading.Event()
+
+        def run():
+            number = 0
+            next_time = time.monotonic()
+            while count is None or number < count:
+                next_time += random.expovariate(rate) if poisson else 1.0 / rate
+                if stopping.wait(max(next_time - time.monotonic(), 0)):
+                    return
+                if callable(payload):
+                    data = payload(number)
+                elif payload is not None:
+                    data = payload
+                else:
+                    data = bytes(random.getrandbits(8) for _ in range(size))
+                try:
+                    self.deliver_packet(data, remote[0], remote[1])
+                except OSError:
+                    return
+                number += 1
+        thread = threading.Thread(target=run, name='SimulatedModem traffic', daemon=True)
+        self._traffic = (thread, stopping)
+        thread.start()
+        return thread
+
+    def stop_traffic(self):
+        if self._traffic is not None:
+            thread, stopping = self._traffic
+            stopping.set()
+            thread.join()
+            self._traffic = None
+
+    def packet_sent(self, sock, payload, remote_host=None, remote_port=None):
+        '''Records a packet the SDK sent. An HTTP GET on a TCP socket is answered with http_response.
+        With echo_packets set, other packets come back after network_latency seconds.'''
+        sock.sent.append(payload)
+        if sock.protocol.upper().startswith('TCP') and payload.lstrip().startswith(b'GET '):
+            self._later(self.network_latency, self.deliver_packet, self.http_response,
+                        sock.remote_host, sock.remote_port, sock.socket_id)
+        elif self.echo_packets:
+            self._later(self.network_latency, self.deliver_packet, payload,
+                        remote_host or sock.remote_host, remote_port or sock.remote_port)
+
+    # ========================================================================
+    #
+    # Network registration
+    #
+
+    def set_registration(self, status, tac=None, cell_id=None, act=None):
+        '''Changes the registration status and sends +CREG/+CGREG/+CEREG URCs where they are enabled.'''
+        self.registration_status = status
+        self.tac = tac or self.tac
+        self.cell_id = cell_id or self.cell_id
+        self.act = self.act if act is None else act
+        for cmd, mode in self.registration_mode.items():
+            if mode > 0:
+                self.send_urc('+' + cmd + ': ' + self._registration_values(mode))
+
+    def _registration_values(self, mode):
+        values = str(self.registration_status)
+        if mode >= 2:
+            values += ',"{0}","{1}",{2}'.format(self.tac, self.cell_id, self.act)
+        return values
+
+    def handle_reg_set(self, match):
+        mode = int(split_args(match.group('args'))[0] or 0)
+        if mode not in (0, 1, 2):
+            raise CommandError(50)
+        self.registration_mode[match.group('cmd').upper()] = mode
+
+    def handle_reg_query(self, match):
+        cmd = match.group('cmd').upper()
+        mode = self.registration_mode[cmd]
+        return ['+{0}: {1},{2}'.format(cmd, mode, self._registration_values(mode))]
+
+    def handle_cops_query(self, match):
+        if self.registration_status not in (1, 5):
+            return ['+COPS: 0']
+        return ['+COPS: 0,0,"{0}",{1}'.format(self.operator, self.act)]
+
+    def handle_cops_test(self, match):
+        return ['+COPS: (2,"{0}","{0}","{1}",{2}),,(0,1,2,3,4),(0,1,2)'.format(
+            self.operator, self.operator_plmn, self.act)]
+
+    def handle_cops(self, match):
+        mode = split_args(match.group('args'))[0]
+        if mode == '2':
+            self.set_registration(0)
+        elif mode in ('0', '1', '4'):
+            self.set_registration(1)
+
+    def handle_csq(self, match):
+        return ['+CSQ: {0},{1}'.format(*self.csq)]
+
+    # ========================================================================
+    #
+    # General commands
+    #
+
+    def handle_ok(self, match):
+        return None
+
+    def handle_echo(self, match):
+        self.echo = match.group('value') == '1'
+
+    def handle_ati(self, match):
+        return [self.manufacturer, self.model, 'Revision: ' + self.revision]
+
+    def handle_gmi(self, match):
+        return [self.manufacturer]
+
+    def handle_gmm(self, match):
+        return [self.model]
+
+    def handle_gsn(self, match):
+        return [self.imei]
+
+    def handle_gmr(self, match):
+        return [self.revision]
+
+    def handle_cimi(self, match):
+        return [self.imsi]
+
+    def handle_iccid(self, match):
+        if match.group('cmd').upper() != self.iccid_command:
+            raise CommandError(4)
+        return [self.iccid_command + ': ' + self.iccid]
+
+    def handle_cmee(self, match):
+        self.cmee = int(match.group('args') or 0)
+
+    def handle_cfun_query(self, match):
+        return ['+CFUN: ' + str(self.cfun)]
+
+    def handle_cfun(self, match):
+        self.cfun = int(split_args(match.group('args'))[0])
+        if self.cfun in (0, 4):
+            self.pdp_active = False
+            self.set_registration(0)
+        else:
+            self.set_registration(1)
+
+    # ========================================================================
+    #
+    # Packet data
+    #
+
+    def handle_cgdcont(self, match):
+        args = split_args(match.group('args'))
+        cid = int(args[0])
+        self.contexts[cid] = (args[1] if len(args) > 1 else 'IP', args[2] if len(args) > 2 else '')
+
+    def handle_cgdcont_query(self, match):
+        lines = []
+        for cid, (pdp_type, apn) in sorted(self.contexts.items()):
+            address = self.ip_address if self.pdp_active and cid == 1 else '0.0.0.0'
+            lines.append('+CGDCONT: {0},"{1}","{2}","{3}",0,0'.format(cid, pdp_type, apn, address))
+        return lines
+
+    def activate_pdp(self, active=True):
+        '''Activates or deactivates the packet data context. Fails when the modem is not registered.'''
+        if active and self.registration_status not in (1, 5):
+            raise CommandError(30)
+        self.pdp_active = active
+
+    def handle_cgact(self, match):
+        args = split_args(match.group('args'))
+        self.activate_pdp(args[0] == '1')
+
+    def handle_cgact_query(self, match):
+        return ['+CGACT: 1,' + ('1' if self.pdp_active else '0')]
+
+    def handle_cgatt_query(self, match):
+        return ['+CGATT: ' + ('1' if self.registration_status in (1, 5) else '0')]
+
+    def handle_cgpaddr(self, match):
+        return ['+CGPADDR: 1,' + (self.ip_address if self.pdp_active else '0.0.0.0')]
+
+    # ========================================================================
+    #
+    # SMS and SIM
+    #
+
+    def handle_cmgs(self, match):
+        destination = split_args(match.group('args'))[0]
+
+        def sent(text):
+            self.sms_sent.append((destination, text))
+            return ['+CMGS: ' + str(len(self.sms_sent))]
+        return self.expect_data(sent)
+
+    def handle_crsm(self, match):
+        args = split_args(match.group('args'))
+        command, file_id = int(args[0]), int(args[1])
+        if command == 176:  # READ BINARY
+            if file_id not in self.sim_files:
+                return ['+CRSM: 106,130,""']  # File not found
+            return ['+CRSM: 144,0,"' + self.sim_files[file_id] + '"']
+        if command in (214, 220):  # UPDATE BINARY, UPDATE RECORD
+            self.sim_files[file_id] = args[5] if len(args) > 5 else ''
+            return ['+CRSM: 144,0,""']
+        raise CommandError(4)
+
+    # ========================================================================
+    #
+    # Power saving
+    #
+
+    def psm_seconds(self):
+        '''Returns the requested (TAU, active time) in seconds; 0 for a deactivated timer.'''
+        tau, active_time = int(self.psm[3], 2), int(self.psm[4], 2)
+        return (TAU_UNITS.get(tau >> 5, 0) * (tau & 0x1f),
+                ACTIVE_TIME_UNITS.get(active_time >> 5, 0) * (active_time & 0x1f))
+
+    def handle_cpsms(self, match):
+        args = split_args(match.group('args'))
+        self.psm = (args + [''] * 5)[:5]
+        self.psm[0] = int(self.psm[0] or 0)
+        self.psm[3] = self.psm[3] or '00100001'
+        self.psm[4] = self.psm[4] or '00000011'
+
+    def handle_cpsms_query(self, match):
+        return ['+CPSMS: {0},,,"{3}","{4}"'.format(*self.psm)]
+
+    def handle_cedrxs(self, match):
+        args = split_args(match.group('args'))
+        self.edrx = [int(args[0] or 0), int(args[1]) if len(args) > 1 else 4, args[2] if len(args) > 2 else '0101']
+
+    def handle_cedrxs_query(self, match):
+        if not self.edrx[0]:
+            return ['+CEDRXS: 0']
+        return ['+CEDRXS: {1},"{2}"'.format(*self.edrx)]
+
+    def handle_cedrxrdp(self, match):
+        if not self.edrx[0]:
+            return ['+CEDRXRDP: 0']
+        return ['+CEDRXRDP: {1},"{2}","{2}","0011"'.format(*self.edrx)]
@@ -0,0 +1,266 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+from aerismodsdk.simulator.modem import SimulatedModem, SimSocket, CommandError, split_args
+
+# Quectel TCP/IP error codes
+SOCKET_IDENTITY_USED = 563
+PDP_NOT_ACTIVE = 566
+
+
+class QuectelSimulator(SimulatedModem):
+    '''Simulates a Quectel BG96: TCP/IP (QIOPEN, QISEND, QIRD, +QIURC), DNS, ping, PSM and file upload.'''
+
+    manufacturer = 'Quectel'
+    model = 'BG96'
+    revision = 'BG96MAR02A07M1G'
+    iccid_command = '+QCCID'
+
+    COMMANDS = [
+        (r'\+QGMR\??$', 'handle_qgmr'),
+        (r'\+QNWINFO$', 'handle_qnwinfo'),
+        (r'\+QENG="(?P<name>[^"]+)"$', 'handle_qeng'),
+        (r'\+QICSGP=(?P<args>.*)$', 'handle_qicsgp'),
+        (r'\+QIACT\?$', 'handle_qiact_query'),
+        (r'\+QIACT=(?P<args>.*)$', 'handle_qiact'),
+        (r'\+QIDEACT=(?P<args>.*)$', 'handle_qideact'),
+        (r'\+QIOPEN=(?P<args>.*)$', 'handle_qiopen'),
+        (r'\+QISTATE(=(?P<args>.*)|\?)$', 'handle_qistate'),
+        (r'\+QICLOSE=(?P<args>.*)$', 'handle_qiclose'),
+        (r'\+QISEND=(?P<args>.*)$', 'handle_qisend'),
+        (r'\+QIRD=(?P<args>.*)$', 'handle_qird'),
+        (r'\+QIDNSCFG=(?P<args>.*)$', 'handle_qidnscfg'),
+        (r'\+QIDNSGIP=(?P<args>.*)$', 'handle_qidnsgip'),
+        (r'\+QPING=(?P<args>.*)$', 'handle_qping'),
+        (r'\+QPSMCFG\?$', 'handle_qpsmcfg_query'),
+        (r'\+QPSMS\?$', 'handle_qpsms_query'),
+        (r'\+QCFG="(?P<name>[^"]+)"(,(?P<args>.*))?$', 'handle_qcfg'),
+        (r'\+QFUPL=(?P<args>.*)$', 'handle_qfupl'),
+        (r'\+QFLST(=(?P<args>.*))?$', 'handle_qflst'),
+        (r'\+QFDEL=(?P<args>.*)$', 'handle_qfdel'),
+    ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.qcfg = {'psm/urc': '0', 'nwscanseq': '020301', 'nwscanmode': '0', 'iotopmode': '2',
+                     'roamservice': '2', 'servicedomain': '1'}
+        self.files = {}
+        self.dns_address = '93.184.216.34'
+
+    def handle_qgmr(self, match):
+        return [self.revision]
+
+    def handle_qnwinfo(self, match):
+        if self.registration_status not in (1, 5):
+            return ['+QNWINFO: No Service']
+        return ['+QNWINFO: "CAT-M1","{0}","LTE BAND 12",5110'.format(self.operator_plmn)]
+
+    def handle_qeng(self, match):
+        if match.group('name') == 'servingcell':
+            return ['+QENG: "servingcell","NOCONN","CAT-M","FDD",{0},{1},{2},261,5110,12,3,3,{3},-95,-11,-64,10,-'.format(
+                self.operator_plmn[:3], self.operator_plmn[3:], self.cell_id, self.tac)]
+        return ['+QENG: "neighbourcell intra","CAT-M",5110,261,-11,-95,-64,0,10,7,16,6,44']
+
+    # ========================================================================
+    #
+    # Packet data and sockets
+    #
+
+    def handle_qicsgp(self, match):
+        args = split_args(match.group('args'))
+        if len(args) > 2:
+            self.contexts[int(args[0])] = ('IP', args[2])
+
+    def handle_qiact_query(self, match):
+        if not self.pdp_active:
+            return []
+        return ['+QIACT: 1,1,1,"' + self.ip_address + '"']
+
+    def handle_qiact(self, match):
+        self.activate_pdp(True)
+
+    def handle_qideact(self, match):
+        self.activate_pdp(False)
+        self.sockets.clear()
+
+    def drop_packet_session(self):
+        '''Simulates the network deactivating the packet data context, which closes every socket.
+        As on the module, the sockets keep their connectIDs until AT+QICLOSE or AT+QIDEACT.'''
+        self.activate_pdp(False)
+        for sock in self.sockets.values():
+            sock.closed = True
+        self.send_urc('+QIURC: "pdpdeact",1')
+
+    def close_socket_remotely(self, socket_id):
+        '''Simulates the network closing a socket. It keeps its connectID until AT+QICLOSE.'''
+        self.sockets[socket_id].closed = True
+        self.send_urc('+QIURC: "closed",' + str(socket_id))
+
+    def handle_qiopen(self, match):
+        # AT+QIOPEN=<contextID>,<connectID>,<service_type>,<IP_address>/<domain_name>,<remote_port>[,<local_port>[,<access_mode>]]
+        args = split_args(match.group('args'))
+        socket_id = int(args[1])
+        vals = (args + ['0', '0'])[:7]
+        if socket_id in self.sockets:
+            error = SOCKET_IDENTITY_USED
+        elif not self.pdp_active:
+            error = PDP_NOT_ACTIVE
+        else:
+            error = 0
+            self.sockets[socket_id] = SimSocket(socket_id, vals[2], vals[3], int(vals[4]), int(vals[5]), int(vals[6]))
+        self.send_urc_later(self.network_latency, '+QIOPEN: {0},{1}'.format(socket_id, error))
+
+    def handle_qistate(self, match):
+        args = split_args(match.group('args') or '')
+        if len(args) > 1 and args[0] == '1':
+            sockets = [self.sockets[int(args[1])]] if int(args[1]) in self.sockets else []
+        else:
+            sockets = sorted(self.sockets.values(), key=lambda s: s.socket_id)
+        # <socket_state>: 2 connected, 4 closing
+        return ['+QISTATE: {0},"{1}","{2}",{3},{4},{6},1,{0},{5},"usbmodem"'.format(
+            s.socket_id, s.protocol, s.remote_host, s.remote_port, s.local_port, s.mode, 4 if s.closed else 2)
+            for s in sockets]
+
+    def handle_qiclose(self, match):
+        self.sockets.pop(int(split_args(match.group('args'))[0]), None)
+
+    def _socket(self, args):
+        sock = self.sockets.get(int(args[0]))
+        if sock is None:
+            raise CommandError(3)
+        return sock
+
+    def handle_qisend(self, match):
+        # AT+QISEND=<connectID>[,<send_length>[,<remoteIP>,<remote_port>]]
+        args = split_args(match.group('args'))
+        sock = self._socket(args)
+        if len(args) > 1 and args[1] == '0':
+            sent = sum(len(p) for p in sock.sent)
+            return ['+QISEND: {0},{0},0'.format(sent)]
+        length = int(args[1]) if len(args) > 1 else None
+        remote = (args[2], int(args[3])) if len(args) > 3 else (None, None)
+
+        def send(data):
+            self.packet_sent(sock, data, *remote)
+            return 'SEND OK'
+        return self.expect_data(send, length)
+
+    def handle_qird(self, match):
+        # AT+QIRD=<connectID>[,<read_length>]
+        args = split_args(match.group('args'))
+        sock = self._socket(args)
+        length = int(args[1]) if len(args) > 1 else 1500
+        if length == 0:
+            unread = sum(len(p[0]) for p in sock.received)
+            return ['+QIRD: {0},{1},{2}'.format(unread, 0, unread)]
+        if not sock.received:
+            return ['+QIRD: 0']
+        if sock.protocol.startswith('TCP'):
+            data = b''.join(p[0] for p in sock.received)
+            sock.received.clear()
+            payload, rest = data[:length], data[length:]
+            if rest:
+                sock.received.append((rest, sock.remote_host, sock.remote_port))
+            return ['+QIRD: ' + str(len(payload)), payload + b'\r\n']
+        payload, remote_host, remote_port = sock.received.popleft()
+        payload = payload[:length]
+        if sock.listening:
+            return ['+QIRD: {0},"{1}",{2}'.format(len(payload), remote_host, remote_port), payload + b'\r\n']
+        return ['+QIRD: ' + str(len(payload)), payload + b'\r\n']
+
+    def packet_arrived(self, sock, payload, remote_host, remote_port):
+        if sock.mode == 0:
+            # Buffer access mode: the SDK reads with AT+QIRD; only the first packet in the buffer is announced
+            if len(sock.received) == 1:
+                self.send_urc('+QIURC: "recv",' + str(sock.socket_id))
+            return
+        # Direct push mode
+        sock.received.pop()
+        if sock.listening:
+            head = '+QIURC: "recv",{0},{1},"{2}",{3}'.format(sock.socket_id, len(payload), remote_host, remote_port)
+        else:
+            head = '+QIURC: "recv",{0},{1}'.format(sock.socket_id, len(payload))
+        self.send_urc(b'\r\n' + head.encode() + b'\r\n' + payload + b'\r\n')
+
+    # ========================================================================
+    #
+    # DNS and ping
+    #
+
+    def handle_qidnscfg(self, match):
+        return ['+QIDNSCFG: 1,"8.8.8.8","8.8.4.4"']
+
+    def handle_qidnsgip(self, match):
+        delay = self.network_latency
+        self.send_urc_later(delay, '+QIURC: "dnsgip",0,1,600')
+        self.send_urc_later(delay, '+QIURC: "dnsgip","' + self.dns_address + '"')
+
+    def handle_qping(self, match):
+        # AT+QPING=<contextID>,<host>[,<timeout>[,<pingnum>]]
+        args = split_args(match.group('args'))
+        count = int(args[3]) if len(args) > 3 else 4
+        delay = self.network_latency
+        urcs = ''.join('\r\n+QPING: 0,"{0}",32,40,255\r\n'.format(self.dns_address) for _ in range(count))
+        urcs += '\r\n+QPING: 0,{0},{0},0,40,40,40\r\n'.format(count)
+        self.send_urc_later(delay, urcs.encode())
+
+    # ========================================================================
+    #
+    # Configuration and PSM
+    #
+
+    def handle_qcfg(self, match):
+        name = match.group('name')
+        if match.group('args') is None:
+            return ['+QCFG: "{0}",{1}'.format(name, self.qcfg.get(name, '0'))]
+        self.qcfg[name] = match.group('args')
+
+    def handle_qpsmcfg_query(self, match):
+        return ['+QPSMCFG: 120,4']
+
+    def handle_qpsms_query(self, match):
+        tau, active_time = self.psm_seconds()
+        return ['+QPSMS: {0},,,"{1}","{2}"'.format(self.psm[0], tau, active_time)]
+
+    # ========================================================================
+    #
+    # Files
+    #
+
+    def handle_qfupl(self, match):
+        # AT+QFUPL=<filename>[,<file_size>[,<timeout>]]
+        args = split_args(match.group('args'))
+        name = args[0]
+        size = int(args[1])
+
+        def uploaded(data):
+            self.files[name] = data
+            checksum = 0
+            for i in range(0, len(data), 2):
+                checksum ^= int.from_bytes(data[i:i + 2].ljust(2, b'\0'), 'big')
+            return ['+QFUPL: {0},{1:x}'.format(len(data), checksum)]
+        return self.expect_data(uploaded, size, prompt=b'\r\nCONNECT\r\n')
+
+    def handle_qflst(self, match):
+        return ['+QFLST: "{0}",{1}'.format(name, len(data)) for name, data in sorted(self.files.items())]
+
+    def handle_qfdel(self, match):
+        name = split_args(match.group('args'))[0]
+        if name == '*':
+            self.files.clear()
+        elif self.files.pop(name, None) is None:
+            raise CommandError(4)
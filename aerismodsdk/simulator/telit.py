@@ -0,0 +1,187 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+from aerismodsdk.simulator.modem import SimulatedModem, SimSocket, CommandError, split_args
+
+# Telit #SS socket states
+SOCKET_CLOSED = 0
+SOCKET_ACTIVE = 1
+SOCKET_LISTENING = 4
+
+
+class TelitSimulator(SimulatedModem):
+    '''Simulates a Telit ME910: sockets (#SGACT, #SD, #SSEND, #SRECV, SRING), HTTP, DNS, ping and PSM.'''
+
+    manufacturer = 'Telit'
+    model = 'ME910C1-WW'
+    revision = 'M0B.660006'
+
+    COMMANDS = [
+        (r'#SGACT\?$', 'handle_sgact_query'),
+        (r'#SGACT=(?P<args>.*)$', 'handle_sgact'),
+        (r'#SD=(?P<args>.*)$', 'handle_sd'),
+        (r'#SL=(?P<args>.*)$', 'handle_sl'),
+        (r'#SLUDP=(?P<args>.*)$', 'handle_sl'),
+        (r'#SH=(?P<args>.*)$', 'handle_sh'),
+        (r'#SS$', 'handle_ss'),
+        (r'#SSEND=(?P<args>.*)$', 'handle_ssend'),
+        (r'#SSENDEXT=(?P<args>.*)$', 'handle_ssendext'),
+        (r'#SRECV=(?P<args>.*)$', 'handle_srecv'),
+        (r'#HTTPCFG=(?P<args>.*)$', 'handle_httpcfg'),
+        (r'#HTTPQRY=(?P<args>.*)$', 'handle_httpqry'),
+        (r'#HTTPRCV=(?P<args>.*)$', 'handle_httprcv'),
+        (r'#QDNS=(?P<args>.*)$', 'handle_qdns'),
+        (r'#PING=(?P<args>.*)$', 'handle_ping'),
+        (r'#CPSMS\?$', 'handle_tcpsms_query'),
+    ]
+
+    # Number of socket connection IDs
+    SOCKETS = 6
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dns_address = '93.184.216.34'
+        self.http_body = None
+
+    # ========================================================================
+    #
+    # Packet data and sockets
+    #
+
+    def handle_sgact_query(self, match):
+        return ['#SGACT: 1,' + ('1' if self.pdp_active else '0')]
+
+    def handle_sgact(self, match):
+        args = split_args(match.group('args'))
+        self.activate_pdp(args[1] == '1')
+        if self.pdp_active:
+            return ['#SGACT: ' + self.ip_address]
+        self.sockets.clear()
+
+    def _connection_id(self, args):
+        connection_id = int(args[0])
+        if not 1 <= connection_id <= self.SOCKETS:
+            raise CommandError(50)
+        return connection_id
+
+    def handle_sd(self, match):
+        # AT#SD=<connId>,<txProt>,<rPort>,<IPaddr>[,<closureType>[,<lPort>[,<connMode>]]]
+        args = split_args(match.group('args'))
+        connection_id = self._connection_id(args)
+        vals = (args + ['0', '0', '0'])[:7]
+        if not self.pdp_active:
+            raise CommandError(3)
+        if vals[6] != '1':
+            raise CommandError(4)  # Only command mode connections are simulated
+        protocol = 'UDP' if vals[1] == '1' else 'TCP'
+        self.sockets[connection_id] = SimSocket(connection_id, protocol, vals[3], int(vals[2]), int(vals[5] or 0))
+
+    def handle_sl(self, match):
+        # AT#SL / AT#SLUDP=<connId>,<listenState>,<listenPort>
+        args = split_args(match.group('args'))
+        connection_id = self._connection_id(args)
+        if args[1] == '1':
+            protocol = 'UDP' if 'SLUDP' in match.group(0).upper() else 'TCP'
+            self.sockets[connection_id] = SimSocket(connection_id, protocol, local_port=int(args[2]))
+        else:
+            self.sockets.pop(connection_id, None)
+
+    def handle_sh(self, match):
+        self.sockets.pop(self._connection_id(split_args(match.group('args'))), None)
+
+    def handle_ss(self, match):
+        lines = []
+        for connection_id in range(1, self.SOCKETS + 1):
+            sock = self.sockets.get(connection_id)
+            if sock is None:
+                lines.append('#SS: {0},{1}'.format(connection_id, SOCKET_CLOSED))
+                continue
+            state = SOCKET_LISTENING if sock.listening else SOCKET_ACTIVE
+            lines.append('#SS: {0},{1},{2},{3},{4},{5}'.format(
+                connection_id, state, self.ip_address, sock.local_port, sock.remote_host, sock.remote_port))
+        return lines
+
+    def _socket(self, args):
+        sock = self.sockets.get(self._connection_id(args))
+        if sock is None:
+            raise CommandError(3)
+        return sock
+
+    def handle_ssend(self, match):
+        sock = self._socket(split_args(match.group('args')))
+        return self.expect_data(lambda data: self.packet_sent(sock, data))
+
+    def handle_ssendext(self, match):
+        args = split_args(match.group('args'))
+        sock = self._socket(args)
+        return self.expect_data(lambda data: self.packet_sent(sock, data), int(args[1]))
+
+    def handle_srecv(self, match):
+        # AT#SRECV=<connId>,<maxByte>[,<UDPInfo>]
+        args = split_args(match.group('args'))
+        sock = self._socket(args)
+        if not sock.received:
+            raise CommandError(4)
+        payload, remote_host, remote_port = sock.received.popleft()
+        payload = payload[:int(args[1])]
+        left = sum(len(p[0]) for p in sock.received)
+        if len(args) > 2 and args[2] == '1':
+            head = '#SRECV: {0},{1},{2},{3},{4}'.format(remote_host, remote_port, sock.socket_id, len(payload), left)
+        else:
+            head = '#SRECV: {0},{1}'.format(sock.socket_id, len(payload))
+        return [head, payload + b'\r\n']
+
+    def packet_arrived(self, sock, payload, remote_host, remote_port):
+        self.send_urc('SRING: ' + str(sock.socket_id))
+
+    # ========================================================================
+    #
+    # HTTP, DNS and ping
+    #
+
+    def handle_httpcfg(self, match):
+        self.http_body = None
+
+    def handle_httpqry(self, match):
+        headers, _, body = self.http_response.partition(b'\r\n\r\n')
+        self.http_body = body
+        self.send_urc_later(self.network_latency, '#HTTPRING: 0,200,"text/html",' + str(len(body)))
+
+    def handle_httprcv(self, match):
+        if self.http_body is None:
+            raise CommandError(3)
+        body, self.http_body = self.http_body, None
+        return [b'\r\n<<<' + body + b'\r\n']
+
+    def handle_qdns(self, match):
+        host = split_args(match.group('args'))[0]
+        return ['#QDNS: "{0}","{1}"'.format(host, self.dns_address)]
+
+    def handle_ping(self, match):
+        # AT#PING=<IPaddr>[,<retryNum>[,<len>[,<timeout>[,<ttl>]]]]
+        args = split_args(match.group('args'))
+        count = int(args[1]) if len(args) > 1 else 4
+        return ['#PING: {0:02d},"{1}",6,50'.format(i + 1, self.dns_address) for i in range(count)]
+
+    # ========================================================================
+    #
+    # PSM
+    #
+
+    def handle_tcpsms_query(self, match):
+        tau, active_time = self.psm_seconds()
+        return ['#CPSMS: {0},{1},{2}'.format(self.psm[0], tau, active_time)]
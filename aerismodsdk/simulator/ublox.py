@@ -0,0 +1,186 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+from aerismodsdk.simulator.modem import SimulatedModem, SimSocket, CommandError, split_args
+
+# u-blox +USOCR protocol numbers
+PROTOCOLS = {'6': 'TCP', '17': 'UDP'}
+
+
+class UbloxSimulator(SimulatedModem):
+    '''Simulates a u-blox SARA-R4: sockets (USOCR, USOST, USORF, +UUSORF), DNS, HTTP client, files and PSM.'''
+
+    manufacturer = 'u-blox'
+    model = 'SARA-R410M-02B'
+    revision = 'L0.0.00.00.05.08'
+    data_prompt = b'@'
+
+    COMMANDS = [
+        (r'\+USOCR=(?P<args>.*)$', 'handle_usocr'),
+        (r'\+USOCL=(?P<args>.*)$', 'handle_usocl'),
+        (r'\+USOLI=(?P<args>.*)$', 'handle_usoli'),
+        (r'\+USOST=(?P<args>.*)$', 'handle_usost'),
+        (r'\+USORF=(?P<args>.*)$', 'handle_usorf'),
+        (r'\+UDNSRN=(?P<args>.*)$', 'handle_udnsrn'),
+        (r'\+UHTTP=(?P<args>.*)$', 'handle_uhttp'),
+        (r'\+UHTTPC=(?P<args>.*)$', 'handle_uhttpc'),
+        (r'\+ULSTFILE=?(?P<args>.*)$', 'handle_ulstfile'),
+        (r'\+URDFILE=(?P<args>.*)$', 'handle_urdfile'),
+        (r'\+UDELFILE=(?P<args>.*)$', 'handle_udelfile'),
+        (r'\+UPSV=(?P<args>.*)$', 'handle_upsv'),
+        (r'\+UPSV\?$', 'handle_upsv_query'),
+        (r'\+CGEREP=(?P<args>.*)$', 'handle_cgerep'),
+        (r'\+CGEREP\?$', 'handle_cgerep_query'),
+        (r'\+UCPSMS\?$', 'handle_ucpsms_query'),
+    ]
+
+    # Number of socket IDs
+    SOCKETS = 7
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dns_address = '93.184.216.34'
+        self.http_profiles = {}
+        self.files = {}
+        self.upsv = 0
+        self.cgerep = (0, 0)
+
+    # ========================================================================
+    #
+    # Sockets
+    #
+
+    def handle_usocr(self, match):
+        # AT+USOCR=<protocol>[,<local_port>]
+        args = split_args(match.group('args'))
+        if args[0] not in PROTOCOLS:
+            raise CommandError(50)
+        free = [i for i in range(self.SOCKETS) if i not in self.sockets]
+        if not free:
+            raise CommandError(3)
+        self.sockets[free[0]] = SimSocket(free[0], PROTOCOLS[args[0]], local_port=int(args[1]) if len(args) > 1 else 0)
+        return ['+USOCR: ' + str(free[0])]
+
+    def _socket(self, args):
+        sock = self.sockets.get(int(args[0]))
+        if sock is None:
+            raise CommandError(3)
+        return sock
+
+    def handle_usocl(self, match):
+        del self.sockets[self._socket(split_args(match.group('args'))).socket_id]
+
+    def handle_usoli(self, match):
+        args = split_args(match.group('args'))
+        self._socket(args).local_port = int(args[1])
+
+    def handle_usost(self, match):
+        # AT+USOST=<socket>,<remote_addr>,<remote_port>,<length>[,<data>]
+        args = split_args(match.group('args'))
+        sock = self._socket(args)
+        remote = (args[1], int(args[2]))
+        length = int(args[3])
+
+        def send(data):
+            self.packet_sent(sock, data, *remote)
+            return ['+USOST: {0},{1}'.format(sock.socket_id, len(data))]
+        if len(args) > 4:
+            return send(args[4].encode('latin-1')[:length])
+        return self.expect_data(send, length)
+
+    def handle_usorf(self, match):
+        # AT+USORF=<socket>,<length>
+        args = split_args(match.group('args'))
+        sock = self._socket(args)
+        if int(args[1]) == 0:
+            return ['+USORF: {0},{1}'.format(sock.socket_id, sum(len(p[0]) for p in sock.received))]
+        if not sock.received:
+            return ['+USORF: {0},"",0,0,""'.format(sock.socket_id)]
+        payload, remote_host, remote_port = sock.received.popleft()
+        payload = payload[:int(args[1])]
+        head = '+USORF: {0},"{1}",{2},{3},"'.format(sock.socket_id, remote_host, remote_port, len(payload))
+        return [b'\r\n' + head.encode() + payload + b'"\r\n']
+
+    def packet_arrived(self, sock, payload, remote_host, remote_port):
+        self.send_urc('+UUSORF: {0},{1}'.format(sock.socket_id, len(payload)))
+
+    # ========================================================================
+    #
+    # DNS and HTTP
+    #
+
+    def handle_udnsrn(self, match):
+        return ['+UDNSRN: "' + self.dns_address + '"']
+
+    def handle_uhttp(self, match):
+        args = split_args(match.group('args'))
+        profile = self.http_profiles.setdefault(int(args[0]), {})
+        if len(args) == 1:
+            profile.clear()
+        else:
+            profile[int(args[1])] = args[2]
+
+    def handle_uhttpc(self, match):
+        # AT+UHTTPC=<profile_id>,<http_command>,<path>,<filename>
+        args = split_args(match.group('args'))
+        profile = int(args[0])
+        if profile not in self.http_profiles:
+            raise CommandError(3)
+        self.files[args[3]] = self.http_response
+        self.send_urc_later(self.network_latency, '+UUHTTPCR: {0},{1},1'.format(profile, args[1]))
+
+    # ========================================================================
+    #
+    # Files
+    #
+
+    def handle_ulstfile(self, match):
+        if not self.files:
+            return ['+ULSTFILE: ']
+        return ['+ULSTFILE: ' + ','.join('"' + name + '"' for name in sorted(self.files))]
+
+    def handle_urdfile(self, match):
+        name = split_args(match.group('args'))[0]
+        if name not in self.files:
+            raise CommandError(4)
+        data = self.files[name]
+        return [b'\r\n+URDFILE: "' + name.encode() + b'",' + str(len(data)).encode() + b',"' + data + b'"\r\n']
+
+    def handle_udelfile(self, match):
+        if self.files.pop(split_args(match.group('args'))[0], None) is None:
+            raise CommandError(4)
+
+    # ========================================================================
+    #
+    # Power saving
+    #
+
+    def handle_upsv(self, match):
+        self.upsv = int(split_args(match.group('args'))[0])
+
+    def handle_upsv_query(self, match):
+        return ['+UPSV: ' + str(self.upsv)]
+
+    def handle_cgerep(self, match):
+        args = split_args(match.group('args'))
+        self.cgerep = (int(args[0]), int(args[1]) if len(args) > 1 else 0)
+
+    def handle_cgerep_query(self, match):
+        return ['+CGEREP: {0},{1}'.format(*self.cgerep)]
+
+    def handle_ucpsms_query(self, match):
+        return ['+UCPSMS: {0},,,"{3}","{4}"'.format(*self.psm)]
@@ -0,0 +1,237 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import collections
+import re
+
+import aerismodsdk.utils.rmutils as rmutils
+
+# One line of a response. prefix is the information response prefix without the colon (e.g. '+CSQ');
+# lines without a prefix (SMS text, +COPS=? continuation ...) have prefix None and the line as their only field.
+Record = collections.namedtuple('Record', ['prefix', 'fields'])
+
+# Field types in SCHEMAS: i = integer, s = string, ? = integer if it looks like one and is not quoted.
+# A trailing * repeats the last type for any further fields; fields past the end of a schema use ?.
+# Quoted fields are strings unless the schema says i. Parenthesized lists (e.g. in +COPS=?) become
+# tuples of ? fields, and empty fields are ''.
+SCHEMAS = {
+    '+CSQ': 'ii',
+    '+CREG': 'iissi',
+    '+CGREG': 'iissi',
+    '+CEREG': 'iissi',
+    '+COPS': 'iisi',
+    '+CCID': 's',
+    '+ICCID': 's',
+    '+QCCID': 's',
+    '+CRSM': 'iis',
+    '+CPSMS': 'iisss',
+    '#CPSMS': 'issss',
+    '+UCPSMS': 'issss',
+    '+CEDRXS': 'is',
+    '+CEDRXRDP': 'isss',
+    '+CGDCONT': 'isss*',
+    '+CGPADDR': 'is*',
+    '#SGACT': 'ii',
+    '+QIACT': 'iiis',
+    '+QIURC': 'sii',
+    '+QNWINFO': 'sssi',
+    '+QPSMS': 'iisss',
+    '+QPSMCFG': 'ii',
+    '+QCFG': 's?*',
+    '+QENG': 's*',
+    '+QGPSGNMEA': 's*',
+    '+QGPSLOC': 's*',
+    '+QMTOPEN': 'ii',
+    '+QMTCONN': 'iii',
+    '+QMTPUB': 'iii',
+    '+QMTRECV': 'iiss',
+    '+USOCR': 'i',
+    '+USORF': 'isiis',
+    '+UDNSRN': 's*',
+}
+
+_PREFIX_CHARACTERS = '+#%^$'
+_PREFIXED_LINE = re.compile(r'([+#%^$][A-Za-z0-9_ ]*?):[ \t]*(.*)$')
+_FINAL_RESULT_CODES = frozenset(rmutils.OK_RESULT_CODES + rmutils.ERROR_RESULT_CODES)
+# One field and the comma after it: "quoted", (group) or bare
+_FIELD = re.compile(r'[ \t]*(?:"([^"]*)"|\(([^)]*)\)|([^,]*?))[ \t]*(,|$)')
+_INTEGER = re.compile(r'-?\d+$').match
+
+
+def _to_int(value, quoted):
+    return int(value) if _INTEGER(value) else value
+
+
+def _to_str(value, quoted):
+    return value
+
+
+def _to_auto(value, quoted):
+    return value if quoted or not _INTEGER(value) else int(value)
+
+
+_FIELD_TYPES = {'i': _to_int, 's': _to_str, '?': _to_auto}
+
+
+def _compile_schema(spec):
+    repeat = _to_auto
+    if spec.endswith('*'):
+        spec = spec[:-1]
+        repeat = _FIELD_TYPES[spec[-1]]
+    return tuple(_FIELD_TYPES[c] for c in spec), repeat
+
+
+_NO_SCHEMA = ((), _to_auto)
+_COMPILED_SCHEMAS = {prefix: _compile_schema(spec) for prefix, spec in SCHEMAS.items()}
+
+
+def _prefix_key(prefix):
+    '''Accepts '+CSQ', '+CSQ:' or '+CSQ: ' for a prefix.'''
+    return prefix.strip().rstrip(':')
+
+
+def split_fields(text, prefix=None):
+    '''Splits the parameters of an information response into typed fields.
+    Parameters
+    ----------
+    text : str
+        The part of the line after the prefix, e.g. '0,0,"AT&T",7'.
+    prefix : str, optional
+        The response prefix, which selects the field types from SCHEMAS.
+    Returns
+    -------
+    A list of fields: int, str, or tuple for a parenthesized list.
+    '''
+    types, repeat = _COMPILED_SCHEMAS.get(prefix, _NO_SCHEMA)
+    if '(' in text:
+        raw = _scan_fields(text)
+    elif '"' in text:
+        raw = _split_quoted(text)
+    else:
+        raw = [(value.strip(), False) for value in text.split(',')]
+    count = len(types)
+    fields = []
+    for index, (value, quoted) in enumerate(raw):
+        if quoted is None:
+            fields.append(value)
+        else:
+            fields.append((types[index] if index < count else repeat)(value, quoted))
+    return fields
+
+
+def _split_quoted(text):
+    '''Splits a line with quoted strings (and no parentheses) into (value, quoted) pairs.'''
+    pieces = text.split('"')
+    last = len(pieces) - 1
+    if last % 2:
+        return _scan_fields(text)  # Unbalanced quotes
+    raw = []
+    for index, piece in enumerate(pieces):
+        if index % 2:
+            raw.append((piece, True))
+            continue
+        # Between two quoted strings: the first part ends the one before, the last part leads up to the next
+        parts = piece.split(',')
+        start = 1 if index > 0 else 0
+        end = len(parts) - 1 if index < last else len(parts)
+        raw.extend((value.strip(), False) for value in parts[start:end])
+    return raw
+
+
+def _scan_fields(text):
+    '''Splits a line field by field with _FIELD. Parenthesized lists come back with quoted None.'''
+    raw = []
+    position = 0
+    while True:
+        match = _FIELD.match(text, position)
+        quoted, group, bare, separator = match.groups()
+        if group is not None:
+            raw.append((tuple(split_fields(group)), None))
+        elif quoted is not None:
+            raw.append((quoted, True))
+        else:
+            raw.append((bare, False))
+        if not separator:
+            return raw
+        position = match.end()
+
+
+def parse_line(line):
+    '''Parses one line of a response (without CR/LF) into a Record.'''
+    match = _PREFIXED_LINE.match(line)
+    if match is None:
+        return Record(None, [line])
+    prefix = match.group(1)
+    return Record(prefix, split_fields(match.group(2), prefix))
+
+
+def tokenize(response, raw=False):
+    '''Splits a response into records in one pass.
+    Parameters
+    ----------
+    response : str or bytes
+        What the module answered to a command, as returned by rmutils.write. Several commands'
+        responses may be concatenated.
+    raw : bool, optional
+        True to keep the information lines as they are, as str, instead of parsing them into Records,
+        for responses that are plain text (ATI, AT+GMM, AT+CIMI ...).
+    Returns
+    -------
+    (records, final) where records is a list of Record for the information lines, without the
+    command echo, and final is the last final result code (e.g. 'OK' or '+CME ERROR: 10') or None.
+    '''
+    if isinstance(response, bytes):
+        response = response.decode('utf-8', errors='replace')
+    records = []
+    final = None
+    for line in response.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        if line in _FINAL_RESULT_CODES or line.startswith(rmutils.ERROR_RESULT_PREFIXES):
+            final = line
+        elif not records and line[:2].upper() == 'AT':
+            continue  # Command echo
+        elif raw:
+            records.append(line)
+        elif line[0] in _PREFIX_CHARACTERS:
+            records.append(parse_line(line))
+        else:
+            records.append(Record(None, [line]))
+    return records, final
+
+
+def records(response, prefix):
+    '''Returns the fields of every line of response that starts with prefix, e.g. each operator of +COPS=?.'''
+    prefix = _prefix_key(prefix)
+    return [record.fields for record in tokenize(response)[0] if record.prefix == prefix]
+
+
+def values(response, prefix):
+    '''Returns the fields of the last line of response that starts with prefix.
+    Returns an empty list if there is no such line or the command failed.
+    '''
+    if not response:
+        return []
+    prefix = _prefix_key(prefix)
+    found, final = tokenize(response)
+    if final is not None and rmutils.is_error_result(final):
+        return []
+    for record in reversed(found):
+        if record.prefix == prefix:
+            return record.fields
+    return []
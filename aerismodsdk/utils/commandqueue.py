@@ -0,0 +1,245 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import concurrent.futures
+import contextlib
+import itertools
+import queue
+import threading
+
+import aerismodsdk.utils.aerisutils as aerisutils
+import aerismodsdk.utils.rmutils as rmutils
+
+# Priority lanes; lower runs first
+URGENT = 0
+NORMAL = 1
+BACKGROUND = 2
+
+
+class CommandQueue:
+    '''Lets several threads share one module: a single worker thread owns the serial port and runs
+    commands one at a time, in priority order, and first come first served within a lane.
+
+    The queue behaves like the serial port for rmutils: rmutils.write and write_stream call
+    run_exclusive, which queues them and blocks until the worker has run them, and wait_urc calls
+    run_sliced, so that a long wait lets more urgent commands run in between. Anything else
+    (read, write, in_waiting ...) goes straight to the port, so it is only safe inside a lease.
+    '''
+
+    def __init__(self, ser, verbose=False):
+        '''
+        Parameters
+        ----------
+        ser : serial port object
+            The open serial port (or SerialReader). The worker thread becomes its only user.
+        verbose : bool, optional
+            True for verbose output.
+        '''
+        self.ser = ser
+        self.verbose = verbose
+        self._jobs = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._local = threading.local()
+        self._lease_holder = None
+        self._thread = None
+        # Set by stop, so that nothing is queued where no worker will run it
+        self._stopped = False
+        self._stop_lock = threading.Lock()
+
+    # ========================================================================
+    #
+    # Thread control
+    #
+
+    def start(self):
+        with self._stop_lock:
+            self._stopped = False
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='CommandQueue ' + str(self.ser.port), daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stops the worker once the job in progress is done. Jobs still queued are cancelled, and
+        submitting more raises RuntimeError until the queue is started again.'''
+        with self._stop_lock:
+            self._stopped = True
+        if self._thread is None:
+            return
+        self._jobs.put((URGENT - 1, next(self._sequence), None))
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        while not self._jobs.empty():
+            job = self._jobs.get_nowait()[2]
+            if job is not None:
+                job.future.cancel()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()[2]
+            if job is None:
+                return
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                job.future.set_result(job.function(self.ser))
+            except BaseException as e:
+                aerisutils.print_log('Command queue job failed: ' + str(e), self.verbose)
+                job.future.set_exception(e)
+
+    # ========================================================================
+    #
+    # Running commands
+    #
+
+    def submit(self, function, priority=None):
+        '''Queues function(ser) to run on the worker thread.
+        Parameters
+        ----------
+        function : callable
+            Called with the serial port; its return value becomes the future's result.
+        priority : int, optional
+            URGENT, NORMAL or BACKGROUND. Default: the calling thread's priority (see priority), else NORMAL.
+        Returns
+        -------
+        A concurrent.futures.Future.
+        Raises
+        ------
+        RuntimeError if the queue has been stopped.
+        '''
+        if priority is None:
+            priority = getattr(self._local, 'priority', NORMAL)
+        job = _Job(function, concurrent.futures.Future())
+        with self._stop_lock:
+            if self._stopped:
+                raise RuntimeError('Command queue for ' + str(self.ser.port) + ' is stopped')
+            self._jobs.put((priority, next(self._sequence), job))
+        return job.future
+
+    def submit_command(self, cmd, priority=None, **kwargs):
+        '''Queues rmutils.write(ser, cmd, **kwargs). Returns a Future for the response.'''
+        return self.submit(lambda ser: rmutils.write(ser, cmd, **kwargs), priority)
+
+    def run_exclusive(self, function):
+        '''Runs function(ser) with the port to itself and returns its result. Runs it right away on the
+        worker thread and in the thread holding the lease, otherwise queues it and waits.'''
+        current = threading.current_thread()
+        if current is self._thread or current is self._lease_holder:
+            return function(self.ser)
+        return self.submit(function).result()
+
+    def run_sliced(self, function):
+        '''Runs function(ser) again and again until it is done, and returns a list of what each call returned.
+        function returns a tuple (result, done). Each call is queued again by the worker as soon as the one
+        before returns, so jobs that other threads queued in the same or a more urgent lane run in between;
+        less urgent ones wait until it is done. Runs right away on the worker thread and in the thread
+        holding the lease.'''
+        results = []
+        current = threading.current_thread()
+        if current is self._thread or current is self._lease_holder:
+            while True:
+                result, done = function(self.ser)
+                results.append(result)
+                if done:
+                    return results
+        priority = getattr(self._local, 'priority', NORMAL)
+        finished = concurrent.futures.Future()
+
+        def step(ser):
+            try:
+                result, done = function(ser)
+                results.append(result)
+                if not done:
+                    queue_step()
+            except BaseException as e:
+                # Also when the queue was stopped, and the next step could not be queued
+                finished.set_exception(e)
+                raise
+            if done:
+                finished.set_result(results)
+
+        def queue_step():
+            future = self.submit(step, priority)
+            # The queue was stopped before the step ran
+            future.add_done_callback(lambda f: finished.cancel() if f.cancelled() else None)
+
+        queue_step()
+        return finished.result()
+
+    @contextlib.contextmanager
+    def priority(self, priority):
+        '''Runs the commands the calling thread queues in the with block at priority, e.g.
+            with queue.priority(BACKGROUND):
+                module.network_info(False, False)
+        '''
+        previous = getattr(self._local, 'priority', NORMAL)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    @contextlib.contextmanager
+    def lease(self, priority=URGENT):
+        '''Gives the calling thread the port to itself for the with block, once the job in progress is done.
+        Use it for data mode transfers (AT+QFUPL, XMODEM) and other sequences that must not be interleaved.
+        Commands the lease holder writes through the queue run right away; other threads wait.
+        Yields the serial port.
+        '''
+        if threading.current_thread() is self._lease_holder:
+            yield self.ser
+            return
+        granted = threading.Event()
+        released = threading.Event()
+
+        def hold(ser):
+            granted.set()
+            released.wait()
+
+        future = self.submit(hold, priority)
+        # Also wakes up if the queue is stopped before the lease is granted
+        future.add_done_callback(lambda f: granted.set())
+        granted.wait()
+        if future.cancelled():
+            raise concurrent.futures.CancelledError('Command queue for ' + str(self.ser.port) + ' was stopped')
+        self._lease_holder = threading.current_thread()
+        try:
+            yield self.ser
+        finally:
+            self._lease_holder = None
+            released.set()
+            future.result()
+
+    # ========================================================================
+    #
+    # Serial port interface
+    #
+
+    def close(self):
+        self.stop()
+        self.ser.close()
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+class _Job:
+    __slots__ = ('function', 'future')
+
+    def __init__(self, function, future):
+        self.function = function
+        self.future = future
@@ -0,0 +1,94 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import json
+import os
+import pathlib
+import threading
+import time
+
+import aerismodsdk.utils.aerisutils as aerisutils
+
+# Next to ~/.aeris_config, which holds the rest of the SDK's configuration
+DEFAULT_CACHE_PATH = str(pathlib.Path.home()) + '/.aeris_identity'
+VERSION = 1
+
+
+class IdentityCache:
+    '''Remembers what Module.get_info found out about each module (IMEI, IMSI, ICCID, model, firmware ...)
+    in a JSON file, so that it survives from one process to the next.
+
+    Entries are keyed by serial port and IMEI. The cache does not check anything itself: Module checks
+    the IMEI and ICCID before it trusts an entry, and removes the entries for its port on reset,
+    firmware update or a SIM change.
+    '''
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(com_port, imei):
+        return str(com_port) + ' ' + str(imei)
+
+    def _load(self):
+        try:
+            with open(self.path) as cache_file:
+                cache = json.load(cache_file)
+        except (IOError, ValueError):
+            return {}
+        if cache.get('version') != VERSION:
+            return {}
+        return cache.get('modules', {})
+
+    def _save(self, modules):
+        temporary = self.path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(temporary, 'w') as cache_file:
+                json.dump({'version': VERSION, 'modules': modules}, cache_file, indent=4, sort_keys=True)
+            os.replace(temporary, self.path)
+        except (IOError, OSError) as e:
+            aerisutils.print_log('Could not write identity cache ' + self.path + ': ' + str(e))
+
+    def get(self, com_port, imei):
+        '''Returns the cached info for the module with imei on com_port, or None.'''
+        with self._lock:
+            info = self._load().get(self._key(com_port, imei))
+        if info is not None:
+            info.pop('cached_at', None)
+        return info
+
+    def put(self, com_port, info):
+        '''Caches info (as returned by Module.get_info, which must include the imei) for com_port.'''
+        info = dict(info, cached_at=time.time())
+        with self._lock:
+            modules = self._load()
+            modules[self._key(com_port, info['imei'])] = info
+            self._save(modules)
+
+    def remove(self, com_port, imei=None):
+        '''Forgets the module with imei on com_port, or every module seen on com_port if imei is None.'''
+        with self._lock:
+            modules = self._load()
+            if imei is not None:
+                keys = [self._key(com_port, imei)]
+            else:
+                keys = [key for key in modules if key.rsplit(' ', 1)[0] == str(com_port)]
+            if any(key in modules for key in keys):
+                for key in keys:
+                    modules.pop(key, None)
+                self._save(modules)
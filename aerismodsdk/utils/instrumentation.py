@@ -0,0 +1,304 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+import aerismodsdk.utils.aerisutils as aerisutils
+
+# One AT command (or one wait for URCs) as seen by rmutils.write / rmutils.wait_urc.
+#   command: the command verb, e.g. 'AT+QIACT=' (see rmutils.command_verb), or 'URC' for wait_urc
+#   start, end: time.monotonic() when the command was written and when its response ended
+#   bytes_out, bytes_in: bytes written to and read from the module
+#   final: the final result code, or None if none arrived
+#   error: True if the final result code is an error (ERROR, +CME ERROR: ...)
+#   timed_out: True if the timeout expired before the final result code (or the awaited URC) arrived
+CommandRecord = collections.namedtuple('CommandRecord', ['command', 'start', 'end', 'bytes_out', 'bytes_in',
+                                                         'final', 'error', 'timed_out'])
+
+_sinks = []
+_sinks_lock = threading.Lock()
+
+
+def add_sink(sink):
+    '''Sends a CommandRecord for each AT command to sink, which needs a handle(record) method
+    and may have a close() method. Returns the sink.'''
+    with _sinks_lock:
+        _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def close_sinks():
+    '''Closes and removes every sink, e.g. at exit so that file sinks write their last state.'''
+    with _sinks_lock:
+        sinks = list(_sinks)
+        del _sinks[:]
+    for sink in sinks:
+        close = getattr(sink, 'close', None)
+        if close is not None:
+            close()
+
+
+def enabled():
+    '''True if any sink is registered. Callers check this first so that instrumentation costs nothing when unused.'''
+    return bool(_sinks)
+
+
+def emit(record):
+    for sink in list(_sinks):
+        try:
+            sink.handle(record)
+        except Exception as e:
+            aerisutils.print_log('Error in instrumentation sink ' + type(sink).__name__ + ': ' + str(e))
+
+
+# ========================================================================
+#
+# In-memory histogram
+#
+
+def percentile(values, p):
+    '''Returns the value that p percent of values do not exceed (nearest rank), like Histogram.percentile
+    does for recorded durations.'''
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+class Histogram:
+    '''Records durations in log-linear buckets, like an HDR histogram: values are kept to within
+    1/SUB_BUCKETS of their magnitude (about 1.6%) from 1 microsecond up, in little memory.'''
+
+    SUB_BUCKET_BITS = 7
+    SUB_BUCKETS = 1 << (SUB_BUCKET_BITS - 1)
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        seconds = max(seconds, 0.0)
+        index = self._index(int(seconds * 1000000))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def _index(self, micros):
+        if micros < 2 * self.SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - self.SUB_BUCKET_BITS
+        return 2 * self.SUB_BUCKETS + (shift - 1) * self.SUB_BUCKETS + (micros >> shift) - self.SUB_BUCKETS
+
+    def _highest_value(self, index):
+        '''The largest value, in microseconds, that falls into the bucket at index.'''
+        if index < 2 * self.SUB_BUCKETS:
+            return index
+        shift, top = divmod(index - 2 * self.SUB_BUCKETS, self.SUB_BUCKETS)
+        shift += 1
+        return ((top + self.SUB_BUCKETS + 1) << shift) - 1
+
+    def percentile(self, p):
+        '''Returns the duration in seconds that p percent of the recorded durations do not exceed.'''
+        if self.count == 0:
+            return 0.0
+        wanted = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                return min(self._highest_value(index) / 1000000.0, self.max)
+        return self.max
+
+
+class LatencyHistogram:
+    '''Sink that keeps a Histogram and error and timeout counts per command verb.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = {}
+
+    def handle(self, record):
+        with self._lock:
+            stats = self.commands.get(record.command)
+            if stats is None:
+                stats = self.commands[record.command] = {'histogram': Histogram(), 'errors': 0, 'timeouts': 0,
+                                                         'bytes_out': 0, 'bytes_in': 0}
+            stats['histogram'].record(record.end - record.start)
+            stats['errors'] += record.error
+            stats['timeouts'] += record.timed_out
+            stats['bytes_out'] += record.bytes_out
+            stats['bytes_in'] += record.bytes_in
+
+    def summary(self):
+        '''Returns a dict of command verb to count, total_s, p50_s, p95_s, p99_s, max_s, errors, timeouts and bytes.'''
+        with self._lock:
+            summary = {}
+            for command, stats in self.commands.items():
+                histogram = stats['histogram']
+                summary[command] = {
+                    'count': histogram.count,
+                    'total_s': histogram.total,
+                    'p50_s': histogram.percentile(50),
+                    'p95_s': histogram.percentile(95),
+                    'p99_s': histogram.percentile(99),
+                    'max_s': histogram.max,
+                    'errors': stats['errors'],
+                    'timeouts': stats['timeouts'],
+                    'bytes_out': stats['bytes_out'],
+                    'bytes_in': stats['bytes_in'],
+                }
+            return summary
+
+
+# ========================================================================
+#
+# File sinks
+#
+
+class PrometheusTextfile:
+    '''Sink that writes Prometheus metrics to a file for the node exporter's textfile collector.
+
+    The file is replaced atomically at most every interval seconds, and on close.
+    '''
+
+    # Upper bounds of the duration histogram buckets, in seconds
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, path, interval=15, labels=None):
+        '''
+        Parameters
+        ----------
+        path : str
+            The metrics file, e.g. /var/lib/node_exporter/textfile_collector/aeris_modem.prom.
+        interval : float, optional
+            Minimum seconds between rewrites of the file. Default: 15.
+        labels : dict, optional
+            Labels added to every metric, e.g. {'device': 'gateway-17'}.
+        '''
+        self.path = path
+        self.interval = interval
+        self.labels = labels or {}
+        self._lock = threading.Lock()
+        # One thread at a time writes the file, which goes through a single temporary file
+        self._write_lock = threading.Lock()
+        self._commands = {}
+        self._last_write = None
+
+    def handle(self, record):
+        duration = record.end - record.start
+        with self._lock:
+            stats = self._commands.get(record.command)
+            if stats is None:
+                stats = self._commands[record.command] = {'buckets': [0] * len(self.BUCKETS), 'count': 0, 'sum': 0.0,
+                                                          'errors': 0, 'timeouts': 0, 'bytes_out': 0, 'bytes_in': 0}
+            for i, bound in enumerate(self.BUCKETS):
+                if duration <= bound:
+                    stats['buckets'][i] += 1
+            stats['count'] += 1
+            stats['sum'] += duration
+            stats['errors'] += record.error
+            stats['timeouts'] += record.timed_out
+            stats['bytes_out'] += record.bytes_out
+            stats['bytes_in'] += record.bytes_in
+            due = self._last_write is None or time.monotonic() - self._last_write >= self.interval
+            if due:
+                # Claimed now, so that threads emitting at the same time do not write too
+                self._last_write = time.monotonic()
+        if due:
+            self.write()
+
+    def _labels(self, command, **extra):
+        labels = dict(self.labels, command=command, **extra)
+        return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                              for k, v in sorted(labels.items())) + '}'
+
+    def render(self):
+        lines = ['# HELP aeris_at_command_duration_seconds Time from writing an AT command to its final result code.',
+                 '# TYPE aeris_at_command_duration_seconds histogram']
+        with self._lock:
+            commands = sorted(self._commands.items())
+            for command, stats in commands:
+                for bound, count in zip(self.BUCKETS, stats['buckets']):
+                    lines.append('aeris_at_command_duration_seconds_bucket{0} {1}'.format(
+                        self._labels(command, le=bound), count))
+                lines.append('aeris_at_command_duration_seconds_bucket{0} {1}'.format(
+                    self._labels(command, le='+Inf'), stats['count']))
+                lines.append('aeris_at_command_duration_seconds_sum{0} {1}'.format(self._labels(command), stats['sum']))
+                lines.append('aeris_at_command_duration_seconds_count{0} {1}'.format(self._labels(command), stats['count']))
+            for name, key, text in (('errors', 'errors', 'AT commands that ended with an error result code.'),
+                                    ('timeouts', 'timeouts', 'AT commands that got no final result code in time.'),
+                                    ('sent_bytes', 'bytes_out', 'Bytes written to the module.'),
+                                    ('received_bytes', 'bytes_in', 'Bytes read from the module.')):
+                lines.append('# HELP aeris_at_command_{0}_total {1}'.format(name, text))
+                lines.append('# TYPE aeris_at_command_{0}_total counter'.format(name))
+                for command, stats in commands:
+                    lines.append('aeris_at_command_{0}_total{1} {2}'.format(name, self._labels(command), stats[key]))
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        with self._write_lock:
+            text = self.render()
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w') as metrics:
+                metrics.write(text)
+            os.replace(temporary, self.path)
+        with self._lock:
+            self._last_write = time.monotonic()
+
+    def close(self):
+        self.write()
+
+
+class JsonLinesSink:
+    '''Sink that appends each record to a file as one JSON object per line.'''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+        # Records carry monotonic times; this converts them to wall clock time
+        self._offset = time.time() - time.monotonic()
+
+    def handle(self, record):
+        line = json.dumps({
+            'command': record.command,
+            'start': round(record.start + self._offset, 6),
+            'duration': round(record.end - record.start, 6),
+            'bytes_out': record.bytes_out,
+            'bytes_in': record.bytes_in,
+            'final': record.final,
+            'error': record.error,
+            'timed_out': record.timed_out,
+        })
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
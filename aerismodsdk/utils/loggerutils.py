@@ -11,3 +11,13 @@ def set_level(verbose):
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
+
+
+def set_stream(stream):
+    '''Sends log output to stream, e.g. sys.stderr while stdout carries results. Returns the previous stream.'''
+    previous = None
+    for handler in logger.handlers:
+        if isinstance(handler, logging.StreamHandler):
+            previous = handler.stream
+            handler.stream = stream
+    return previous
@@ -0,0 +1,194 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import ctypes
+import ctypes.util
+import glob
+import os
+import select
+import time
+
+# inotify(7) constants
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# How often to look for the port when inotify is not available
+POLL_INTERVAL = 0.1
+
+USB_PORT_PREFIX = 'usb:'
+# Ports of the form replay:<capture file> play back a capture (see serialcapture)
+REPLAY_PORT_PREFIX = 'replay:'
+
+_libc = None
+
+
+def resolve_com_port(com_port, sysfs_root='/sys', dev_root='/dev'):
+    '''Turns a configured COM port into a device path.
+    Parameters
+    ----------
+    com_port : str
+        One of:
+        - a tty suffix as stored by 'aeriscli config', e.g. 'USB2' for /dev/ttyUSB2;
+        - a device path, e.g. /dev/ttyUSB2 or a pty;
+        - 'usb:<vendor id>:<product id>[:<interface number>]' with hex ids, e.g. 'usb:2c7c:0296:2',
+          which finds the tty of that USB interface through sysfs, so it keeps working when
+          the ttyUSB numbering changes;
+        - 'replay:<capture file>[?speed=<factor>]', which is returned unchanged.
+    Returns
+    -------
+    The device path, or None if no USB device matches.
+    '''
+    if com_port.startswith(USB_PORT_PREFIX):
+        vals = com_port[len(USB_PORT_PREFIX):].split(':')
+        interface = int(vals[2]) if len(vals) > 2 and vals[2] != '' else None
+        return find_usb_serial(vals[0], vals[1], interface, sysfs_root=sysfs_root, dev_root=dev_root)
+    if com_port.startswith('/') or com_port.startswith(REPLAY_PORT_PREFIX):
+        return com_port
+    return dev_root + '/tty' + com_port
+
+
+def find_usb_serial(vendor_id, product_id, interface=None, sysfs_root='/sys', dev_root='/dev'):
+    '''Finds the tty of a USB serial interface by looking through sysfs.
+    Parameters
+    ----------
+    vendor_id : str
+        USB vendor ID in hex, e.g. '2c7c' for Quectel.
+    product_id : str
+        USB product ID in hex, e.g. '0296' for the BG96.
+    interface : int, optional
+        USB interface number, e.g. 2 for the BG96 AT port. If None, the first matching tty is returned.
+    Returns
+    -------
+    The device path, e.g. /dev/ttyUSB2, or None if no tty matches.
+    '''
+    vendor_id = vendor_id.lower().zfill(4)
+    product_id = product_id.lower().zfill(4)
+    for tty_dir in sorted(glob.glob(sysfs_root + '/class/tty/*')):
+        device = os.path.join(tty_dir, 'device')
+        if not os.path.exists(device):
+            continue  # Virtual terminals have no device
+        # ttyACM devices link to the USB interface; ttyUSB devices link to a port below the interface
+        path = os.path.realpath(device)
+        interface_number = None
+        while len(path) > len(sysfs_root):
+            if interface_number is None:
+                interface_number = _read_sysfs_attribute(path, 'bInterfaceNumber')
+            if os.path.exists(os.path.join(path, 'idVendor')):
+                if (_read_sysfs_attribute(path, 'idVendor') == vendor_id
+                        and _read_sysfs_attribute(path, 'idProduct') == product_id
+                        and (interface is None or
+                             (interface_number is not None and int(interface_number, 16) == interface))):
+                    return os.path.join(dev_root, os.path.basename(tty_dir))
+                break
+            path = os.path.dirname(path)
+    return None
+
+
+def _read_sysfs_attribute(path, name):
+    try:
+        with open(os.path.join(path, name)) as attribute:
+            return attribute.read().strip().lower()
+    except IOError:
+        return None
+
+
+class DirectoryWatcher:
+    '''Wakes up when entries are created in (or moved into, or change attributes in) a directory, using inotify.'''
+
+    def __init__(self, directory):
+        libc = _load_libc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, directory.encode(), IN_CREATE | IN_MOVED_TO | IN_ATTRIB) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch failed for ' + directory)
+
+    def wait(self, timeout):
+        '''Blocks up to timeout seconds for a change. Returns True if there was one.'''
+        readable, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass  # Drain the events; the caller checks for the port itself
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1  # Raises AttributeError where inotify does not exist
+        _libc = libc
+    return _libc
+
+
+def open_watcher(directory):
+    '''Returns a DirectoryWatcher for directory, or None if inotify is not available.'''
+    try:
+        return DirectoryWatcher(directory)
+    except (OSError, AttributeError):
+        return None
+
+
+def wait_for_port(com_port, timeout, sysfs_root='/sys', dev_root='/dev'):
+    '''Waits up to timeout seconds for a COM port to appear.
+    Wakes as soon as the device node is created (via inotify), instead of polling.
+    Parameters
+    ----------
+    com_port : str
+        A COM port as accepted by resolve_com_port.
+    timeout : float
+        Maximum number of seconds to wait.
+    Returns
+    -------
+    The device path, or None if the port did not appear in time.
+    '''
+    deadline = time.monotonic() + timeout
+    port = resolve_com_port(com_port, sysfs_root, dev_root)
+    if com_port.startswith(REPLAY_PORT_PREFIX):
+        return port
+    if port is not None and os.path.exists(port):
+        return port
+    directory = os.path.dirname(port) if port is not None and not com_port.startswith(USB_PORT_PREFIX) else dev_root
+    watcher = open_watcher(directory)
+    try:
+        while True:
+            # Check after the watch is in place, so a node created in between is not missed
+            port = resolve_com_port(com_port, sysfs_root, dev_root)
+            if port is not None and os.path.exists(port):
+                return port
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if watcher is not None:
+                watcher.wait(remaining)
+            else:
+                time.sleep(min(POLL_INTERVAL, remaining))
+    finally:
+        if watcher is not None:
+            watcher.close()
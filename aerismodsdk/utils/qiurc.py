@@ -0,0 +1,103 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import collections
+import re
+
+import aerismodsdk.utils.aerisutils as aerisutils
+
+# A UDP datagram delivered by a Quectel module in direct push mode. remote_ip and remote_port are None
+# if the URC did not include them (only UDP SERVICE sockets do).
+Datagram = collections.namedtuple('Datagram', ['conn_id', 'remote_ip', 'remote_port', 'payload'])
+
+# +QIURC: "recv",<connectID>,<currentrecvlength>[,"<remote IP address>",<remote port>]<CR><LF><data>
+RECV_HEADER = re.compile(rb'\+QIURC: "recv",(\d+),(\d+)(?:,"([^"]*)",(\d+))?\r?')
+# Longest line we keep waiting for the end of; anything longer is not a +QIURC header
+MAX_LINE = 256
+
+
+class DatagramParser:
+    '''Parses the +QIURC: "recv" URCs in a Quectel module's output into Datagrams as the bytes arrive.
+
+    Feed it the output in chunks of any size (e.g. each return of rmutils.wait_urc with returnbytes=True):
+    a header or payload that is cut off at the end of a chunk is kept and completed by the next one.
+    Other lines are logged and skipped.
+    '''
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self._buffer = bytearray()
+        self._header = None  # (conn_id, remote_ip, remote_port, length) of the datagram being received
+
+    @property
+    def incomplete(self):
+        '''True if the input so far ends in the middle of a URC or its payload.'''
+        return self._header is not None or len(self._buffer.strip()) > 0
+
+    def reset(self):
+        '''Drops any partial URC, e.g. after the socket was closed.'''
+        del self._buffer[:]
+        self._header = None
+
+    def feed(self, data):
+        '''Parses the next chunk of module output.
+        Parameters
+        ----------
+        data : bytes
+        Returns
+        -------
+        list of Datagram
+            The datagrams completed by this chunk, in order.
+        '''
+        buffer = self._buffer
+        buffer += data
+        datagrams = []
+        position = 0
+        end = len(buffer)
+        with memoryview(buffer) as view:
+            while position < end:
+                if self._header is not None:
+                    conn_id, remote_ip, remote_port, length = self._header
+                    if end - position < length:
+                        break
+                    datagrams.append(Datagram(conn_id, remote_ip, remote_port, bytes(view[position:position + length])))
+                    position += length
+                    self._header = None
+                    continue  # The CRLF after the payload is skipped as a blank line
+                newline = buffer.find(b'\n', position)
+                if newline == -1:
+                    if end - position > MAX_LINE:
+                        self._unexpected(view[position:end])
+                        position = end
+                    break
+                match = RECV_HEADER.fullmatch(buffer, position, newline)
+                if match is not None:
+                    conn_id, length, remote_ip, remote_port = match.groups()
+                    self._header = (int(conn_id), None if remote_ip is None else remote_ip.decode(),
+                                    None if remote_port is None else int(remote_port), int(length))
+                    if self.verbose:
+                        aerisutils.print_log('QIURC recv: ' + bytes(view[position:newline]).decode(errors='replace'))
+                else:
+                    self._unexpected(view[position:newline])
+                position = newline + 1
+        del buffer[:position]
+        return datagrams
+
+    def _unexpected(self, line):
+        line = bytes(line).rstrip(b'\r')
+        if line:
+            aerisutils.print_log('Warning: found unexpected URC: <<' + aerisutils.bytes_to_utf_or_hex(line) + '>>')
@@ -0,0 +1,150 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import collections
+import threading
+import time
+
+import aerismodsdk.utils.aerisutils as aerisutils
+import aerismodsdk.utils.atparser as atparser
+
+# The registration domains: circuit switched, GPRS (2G/3G packet) and EPS (LTE)
+DOMAINS = ('+CREG', '+CGREG', '+CEREG')
+# <stat> values that mean registered: home network and roaming
+REGISTERED = (1, 5)
+
+# The registration in one domain. area is the LAC or TAC and cell_id the cell, both as hex strings, and
+# act the access technology, when the module reports them (mode 2). timestamp is time.monotonic() when
+# the module reported it.
+Registration = collections.namedtuple('Registration', ['domain', 'stat', 'area', 'cell_id', 'act', 'timestamp'])
+# A change in one domain; previous is None for the first report
+Transition = collections.namedtuple('Transition', ['domain', 'previous', 'current'])
+
+
+class RegistrationState:
+    '''The network registration of a module, kept current from the +CREG, +CGREG and +CEREG URCs.
+
+    Feed it URCs with handle_urc (Module.track_registration subscribes it to the SerialReader) and the
+    responses to AT+CREG? etc. with update_from_response. Threads can wait for registration with
+    wait_until_registered, and callbacks get each Transition.
+    '''
+
+    def __init__(self, verbose=False, history=100):
+        '''
+        Parameters
+        ----------
+        verbose : bool, optional
+            True to log each transition.
+        history : int, optional
+            How many transitions to keep in self.transitions.
+        '''
+        self.verbose = verbose
+        self.transitions = collections.deque(maxlen=history)
+        self._registrations = {}
+        self._searching_since = {}
+        self._attach_latency = {}
+        self._callbacks = []
+        self._cond = threading.Condition()
+
+    def add_callback(self, callback):
+        '''Calls callback with each Transition. Callbacks run on the thread that reports the change
+        (for URCs, the reader thread), so they should return quickly.'''
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def update(self, domain, stat, area=None, cell_id=None, act=None, timestamp=None):
+        '''Records the registration in domain (e.g. '+CEREG') reported by the module.'''
+        current = Registration(domain, stat, area, cell_id, act, time.monotonic() if timestamp is None else timestamp)
+        with self._cond:
+            previous = self._registrations.get(domain)
+            self._registrations[domain] = current
+            if previous is not None and previous[1:5] == current[1:5]:
+                return
+            if stat in REGISTERED:
+                searching_since = self._searching_since.pop(domain, None)
+                if searching_since is not None:
+                    self._attach_latency[domain] = current.timestamp - searching_since
+            elif previous is None or previous.stat in REGISTERED:
+                self._searching_since[domain] = current.timestamp
+            transition = Transition(domain, previous, current)
+            self.transitions.append(transition)
+            self._cond.notify_all()
+        aerisutils.print_log('Registration ' + domain + ': ' + str(previous and previous.stat) + ' -> ' + str(stat),
+                             self.verbose)
+        for callback in list(self._callbacks):
+            try:
+                callback(transition)
+            except Exception as e:
+                aerisutils.print_log('Error in registration callback: ' + str(e))
+
+    def _update_fields(self, domain, fields, timestamp=None):
+        # <stat>[,<lac/tac>,<ci>[,<AcT>]]; +CEREG mode 3 and up append cause values, which we ignore
+        if not fields or not isinstance(fields[0], int):
+            return
+        area, cell_id, act = [(fields[i] if i < len(fields) and fields[i] != '' else None) for i in (1, 2, 3)]
+        self.update(domain, fields[0], None if area is None else str(area),
+                    None if cell_id is None else str(cell_id), act, timestamp)
+
+    def handle_urc(self, urc):
+        '''Updates the state from a +CREG/+CGREG/+CEREG URC (a serialreader.Urc).'''
+        prefix, _, text = urc.line.partition(':')
+        # Not atparser.values: its schema is for the query response, which starts with <n>
+        self._update_fields(prefix.strip(), atparser.split_fields(text.strip()), urc.timestamp)
+
+    def update_from_response(self, response):
+        '''Updates the state from the response to AT+CREG?, AT+CGREG? and/or AT+CEREG?.'''
+        records, final = atparser.tokenize(response)
+        for record in records:
+            if record.prefix in DOMAINS:
+                self._update_fields(record.prefix, record.fields[1:])  # Skip <n>
+
+    def get(self, domain):
+        '''Returns the latest Registration in domain, or None if the module has not reported it.'''
+        with self._cond:
+            return self._registrations.get(domain)
+
+    def is_registered(self, domains=None):
+        '''True if the module is registered in any of domains (default: any domain).'''
+        with self._cond:
+            return self._registered(domains) is not None
+
+    def _registered(self, domains):
+        for domain in domains or DOMAINS:
+            registration = self._registrations.get(domain)
+            if registration is not None and registration.stat in REGISTERED:
+                return registration
+        return None
+
+    def wait_until_registered(self, timeout, domains=None):
+        '''Waits up to timeout seconds for the module to register in any of domains (default: any).
+        Returns the Registration, or None on timeout.'''
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                registration = self._registered(domains)
+                remaining = deadline - time.monotonic()
+                if registration is not None or remaining <= 0:
+                    return registration
+                self._cond.wait(remaining)
+
+    def attach_latency(self, domain):
+        '''Seconds from the module reporting that it was not registered in domain to it reporting that it
+        was, for the latest registration; None if it has not been seen registering.'''
+        with self._cond:
+            return self._attach_latency.get(domain)
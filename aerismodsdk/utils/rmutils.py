@@ -14,39 +14,70 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import collections
+import re
 import time
+import weakref
 import serial
-import usb.core
-import glob
 import aerismodsdk.utils.aerisutils as aerisutils
+import aerismodsdk.utils.instrumentation as instrumentation
+import aerismodsdk.utils.portutils as portutils
+import aerismodsdk.utils.serialcapture as serialcapture
 
 
-# A function that tries to list serial ports on most common platforms
 def find_serial(com_port, verbose=False, timeout=1):
-    # Assume Linux or something else
-    check_port = com_port
-    start_time = time.time()
-    elapsed_time = 0
-    aerisutils.vprint(verbose, aerisutils.get_date_time_str() + ' Searching for port: ' + check_port)
-    while elapsed_time < timeout:
-        ports = glob.glob('/dev/ttyA*') + glob.glob('/dev/ttyS*') + glob.glob('/dev/ttyUSB*')
-        # print(ports)
-        if check_port in ports:
-            aerisutils.vprint(verbose, aerisutils.get_date_time_str() + ' COM port found: ' + check_port)
-            return True
-        time.sleep(1)
-        elapsed_time = time.time() - start_time
-    aerisutils.vprint(verbose, aerisutils.get_date_time_str() + ' COM port not found: ' + check_port)
+    '''Waits up to timeout seconds for a serial port to appear, e.g. after the module resets.
+    Parameters
+    ----------
+    com_port : str
+        The port: a device path such as /dev/ttyUSB2, or anything else portutils.resolve_com_port accepts.
+    verbose : bool, optional
+    timeout : float, optional
+        Seconds to wait. Default: 1.
+    Returns
+    -------
+    True if the port was found.
+    '''
+    aerisutils.vprint(verbose, aerisutils.get_date_time_str() + ' Searching for port: ' + com_port)
+    port = portutils.wait_for_port(com_port, timeout)
+    if port is not None:
+        aerisutils.vprint(verbose, aerisutils.get_date_time_str() + ' COM port found: ' + port)
+        return True
+    aerisutils.vprint(verbose, aerisutils.get_date_time_str() + ' COM port not found: ' + com_port)
     return False
 
 
-def open_serial(modem_port):
+# Baud rate used unless the module config says otherwise
+DEFAULT_BAUDRATE = 115200
+# Rates negotiate_baudrate tries, fastest first
+NEGOTIATED_BAUDRATES = (921600, 460800)
+# Size of the writes used to stream files to the module
+UPLOAD_CHUNK_SIZE = 1024
+
+# File that open_serial records every port it opens to; see set_capture_file
+capture_file = None
+
+
+def set_capture_file(path):
+    '''Records the traffic of ports opened from now on to a capture file (None to stop).
+    The capture can be played back by opening the port replay:<path>.'''
+    global capture_file
+    capture_file = path
+
+
+def open_serial(modem_port, baudrate=DEFAULT_BAUDRATE):
     myserial = None
+    if modem_port.startswith(portutils.REPLAY_PORT_PREFIX):
+        try:
+            return serialcapture.open_replay(modem_port)
+        except (IOError, ValueError, IndexError) as e:
+            print("Could not open replay port: " + str(e))
+            return None
     # configure the serial connections (the parameters differs on the device you are connecting to)
     try:
         myserial = serial.Serial(
             port=modem_port,
-            baudrate=115200,
+            baudrate=baudrate,
             parity=serial.PARITY_NONE,
             stopbits=serial.STOPBITS_ONE,
             bytesize=serial.EIGHTBITS,
@@ -59,57 +90,569 @@ def open_serial(modem_port):
         myserial.sendBreak()
         myserial.reset_input_buffer()
         myserial.reset_output_buffer()        
-    except serial.serialutil.SerialException:
+    except (serial.serialutil.SerialException, ValueError):
         myserial = None
         print("Could not open serial port")
+    if myserial is not None and capture_file is not None:
+        myserial = serialcapture.CaptureSerial(myserial, capture_file)
     return myserial
 
 
-def write(ser, cmd, moredata=None, waitoe=False, delay=0, timeout=1.0, verbose=True):
-# waitoe means 'wait for ok or error'
+def set_port_baudrate(ser, baudrate):
+    '''Changes the baud rate of the port (not the module). Returns False if the port does not support it.'''
+    try:
+        ser.baudrate = baudrate
+    except (serial.serialutil.SerialException, ValueError):
+        return False
+    reset_input_buffer(ser)
+    return True
+
+
+def check_baudrate(ser, attempts=2):
+    '''Checks that the module answers an AT command at the port's current baud rate.'''
+    for i in range(attempts):
+        response = write(ser, 'AT', timeout=0.5, verbose=False)
+        if response is not None and 'OK' in response:
+            return True
+        reset_input_buffer(ser)
+    return False
+
+
+def get_supported_baudrates(ser, verbose=True):
+    '''Returns the set of baud rates the module lists for AT+IPR=?, or None if it does not list them.'''
+    response = write(ser, 'AT+IPR=?', verbose=verbose)
+    if response is None or '+IPR:' not in response:
+        return None
+    ranges = response[response.find('+IPR:'):]
+    # The first list holds the auto-bauding rates (if any) and the fixed rates
+    start = ranges.find('(')
+    end = ranges.find(')', start)
+    if start == -1 or end == -1:
+        return None
+    return set(int(rate) for rate in re.findall(r'\d+', ranges[start:end]))
+
+
+def negotiate_baudrate(ser, baudrates=NEGOTIATED_BAUDRATES, verbose=True):
+    '''Steps the module and the port up to the fastest baud rate that both accept.
+    Each candidate is set with AT+IPR and verified with a round trip; if the round trip fails,
+    the module is put back to the previous rate.
+    If the module does not answer at the port's rate (e.g. it kept a rate negotiated earlier),
+    the candidates are tried to find it first.
+    Parameters
+    ----------
+    ser : serial port object
+        The open serial port.
+    baudrates : iterable of int, optional
+        Candidate rates. Default: 921600 and 460800.
+    verbose : bool, optional
+        True to print verbose output.
+    Returns
+    -------
+    The baud rate in use afterwards.
+    '''
+    original_baudrate = ser.baudrate
+    if not check_baudrate(ser):
+        for baudrate in sorted(baudrates, reverse=True):
+            if set_port_baudrate(ser, baudrate) and check_baudrate(ser):
+                aerisutils.print_log('Module answers at {0} baud'.format(baudrate), verbose)
+                break
+        else:
+            set_port_baudrate(ser, original_baudrate)
+            aerisutils.print_log('Module does not answer; staying at {0} baud'.format(original_baudrate))
+            return original_baudrate
+    supported = get_supported_baudrates(ser, verbose=verbose)
+    for baudrate in sorted(baudrates, reverse=True):
+        current = ser.baudrate
+        if baudrate <= current:
+            break
+        if supported is not None and baudrate not in supported:
+            continue
+        response = write(ser, 'AT+IPR=' + str(baudrate), verbose=verbose)
+        if response is None or 'OK' not in response:
+            continue
+        if set_port_baudrate(ser, baudrate) and check_baudrate(ser):
+            aerisutils.print_log('Baud rate set to {0}'.format(baudrate), verbose)
+            return baudrate
+        # Fall back: tell the module to return to the rate that worked, at whichever rate it is now listening
+        aerisutils.print_log('No response at {0} baud; falling back to {1}'.format(baudrate, current), verbose)
+        write(ser, 'AT+IPR=' + str(current), timeout=0.5, verbose=verbose)
+        set_port_baudrate(ser, current)
+        if not check_baudrate(ser):
+            write(ser, 'AT+IPR=' + str(current), timeout=0.5, verbose=verbose)
+    return ser.baudrate
+
+
+def write_stream(ser, stream, size, label='Upload', chunk_size=UPLOAD_CHUNK_SIZE, verbose=True):
+    '''Writes size bytes from a file object to the module in chunks and reports the throughput achieved.
+    Returns
+    -------
+    The number of bytes written.
+    '''
+    run_exclusive = getattr(ser, 'run_exclusive', None)
+    if run_exclusive is not None:  # A CommandQueue: run it when the port is ours
+        return run_exclusive(lambda port: write_stream(port, stream, size, label, chunk_size, verbose))
+    written = 0
+    start_time = time.monotonic()
+    while written < size:
+        chunk = stream.read(min(chunk_size, size - written))
+        if not chunk:
+            break
+        ser.write(chunk)
+        written += len(chunk)
+    ser.flush()  # Wait until the data has actually left the port
+    print_throughput(label, written, time.monotonic() - start_time, ser, verbose)
+    return written
+
+
+def print_throughput(label, size, elapsed, ser=None, verbose=True):
+    '''Logs how many bytes per second a transfer achieved, and the line rate for comparison.'''
+    rate = size / elapsed if elapsed > 0 else 0
+    message = '{0}: {1} bytes in {2:.2f}s ({3:.0f} bytes/s'.format(label, size, elapsed, rate)
+    baudrate = getattr(ser, 'baudrate', None)
+    if baudrate:
+        # 10 bits per byte on the wire: start bit, 8 data bits, stop bit
+        message += ', {0:.0%} of {1} baud'.format(rate * 10 / baudrate, baudrate)
+    aerisutils.print_log(message + ')', verbose)
+
+
+# Final result codes (ITU-T V.250, 3GPP TS 27.007 and TS 27.005) that end a command response
+OK_RESULT_CODES = ('OK',)
+ERROR_RESULT_CODES = ('ERROR', 'NO CARRIER', 'NO DIALTONE', 'BUSY', 'NO ANSWER')
+ERROR_RESULT_PREFIXES = ('+CME ERROR:', '+CMS ERROR:')
+# Prompt the module sends when it is ready to accept data (e.g. AT+QISEND, AT#SSEND, AT+CMGS)
+DATA_PROMPT = '>'
+# Result codes that end the response to the data sent after a prompt
+SEND_RESULT_CODES = ('SEND OK', 'SEND FAIL', 'OK')
+
+# Initial size of the wait_urc receive buffer; it grows if a single line is longer
+RECEIVE_BUFFER_SIZE = 4096
+# Longest wait_urc keeps a CommandQueue's port before commands other threads queued get a turn
+URC_WAIT_SLICE = 0.5
+# Bytes read past the point where a read stopped, per serial port; see unread
+_unread = weakref.WeakKeyDictionary()
+
+
+# The command part of an AT command line: its name and type, without parameters, e.g. AT+QIACT= or AT+COPS=?
+COMMAND_VERB = re.compile(r'^(AT[+#&$%^]?[A-Z0-9]*)(=\?|=|\?)?', re.IGNORECASE)
+
+
+def command_verb(cmd):
+    '''Returns the name and type of an AT command without its parameters, e.g. 'AT+QIACT=' for 'AT+QIACT=1'.'''
+    match = COMMAND_VERB.match(cmd.strip())
+    if match is None:
+        return cmd.strip()[:16]
+    return match.group(1).upper() + (match.group(2) or '')
+
+
+def is_final_result(line, terminators=None):
+    '''Checks whether a single response line ends the response to a command.
+    Parameters
+    ----------
+    line : str
+        One line of module output, without the trailing CR/LF.
+    terminators : iterable of str, optional
+        Custom terminators; a line that starts with one of these ends the response.
+        If given, these replace 'OK' as the successful terminator. Errors always end the response.
+    Returns
+    -------
+    True if the line is a final result code (or matches a custom terminator).
+    '''
+    line = line.strip()
+    if is_error_result(line):
+        return True
+    if terminators is None:
+        return line in OK_RESULT_CODES
+    for terminator in terminators:
+        if line.startswith(terminator):
+            return True
+    return False
+
+
+def unread(ser, data):
+    '''Puts data back, so that the next read from ser through read_chunk returns it first.'''
+    if data:
+        _unread.setdefault(ser, bytearray())[:0] = data
+
+
+def discard_unread(ser, verbose=False):
+    '''Forgets the data put back on ser with unread.'''
+    stale = _unread.pop(ser, None)
+    if stale:
+        aerisutils.print_log('Discarding unread output: ' + aerisutils.bytes_to_utf_or_hex(bytes(stale)), verbose)
+
+
+def reset_input_buffer(ser):
+    '''Discards everything received on ser that has not been read yet, including the data put back with unread.'''
+    discard_unread(ser)
+    ser.reset_input_buffer()
+
+
+def is_error_result(line):
+    '''Checks whether a single response line is an error result code (ERROR, +CME ERROR: ..., NO CARRIER ...).'''
+    line = line.strip()
+    return line in ERROR_RESULT_CODES or line.startswith(ERROR_RESULT_PREFIXES)
+
+
+def read_chunk(ser, timeout):
+    '''Blocks up to timeout seconds for data to arrive, then returns all of the bytes that are available.'''
+    pending = _unread.pop(ser, None)
+    if pending:
+        return bytes(pending)
+    ser.timeout = max(timeout, 0)
+    data = ser.read(1)
+    if data:
+        waiting = ser.in_waiting
+        if waiting > 0:
+            data = data + ser.read(waiting)
+    return data
+
+
+def scan_response(response, line_start, terminators=None):
+    '''Looks for the final result code in the lines of response that start at or after line_start.
+    Parameters
+    ----------
+    response : bytes or bytearray
+        The response read so far.
+    line_start : int
+        Offset of the first line that has not been checked yet.
+    terminators : iterable of str, optional
+        Custom terminators; see read_response.
+    Returns
+    -------
+    final : str or None
+        The line that ended the response, or None if it has not arrived yet.
+    line_start : int
+        Offset to resume scanning from when more of the response arrives.
+    '''
+    newline_index = response.find(b'\n', line_start)
+    while newline_index > -1:
+        line = response[line_start:newline_index].decode('utf-8', errors='replace')
+        line_start = newline_index + 1
+        if is_final_result(line, terminators):
+            return line.strip(), line_start
+        newline_index = response.find(b'\n', line_start)
+    # A prompt is not followed by a newline, so also check the unfinished line
+    if terminators is not None:
+        tail = response[line_start:].decode('utf-8', errors='replace').strip()
+        if tail and tail in terminators:
+            return tail, line_start
+    return None, line_start
+
+
+def read_response(ser, timeout, terminators=None):
+    '''Reads a command response until its final result code arrives or the timeout expires.
+    Parameters
+    ----------
+    ser : serial port object
+        The serial port the module is communicating on.
+    timeout : float
+        Maximum number of seconds to wait for the final result code.
+    terminators : iterable of str, optional
+        Custom terminators; see is_final_result. A terminator also matches an unfinished last line
+        exactly, so that prompts like '> ' (which are not followed by a newline) are recognized.
+    Returns
+    -------
+    response : bytes
+        Everything read from the port.
+    final : str or None
+        The line that ended the response, or None if the timeout expired first.
+    '''
+    original_timeout = ser.timeout
+    response = bytearray()
+    final = None
+    line_start = 0
+    deadline = time.monotonic() + timeout
+    try:
+        while final is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            chunk = read_chunk(ser, remaining)
+            if not chunk:
+                break
+            response += chunk
+            final, line_start = scan_response(response, line_start, terminators)
+    finally:
+        ser.timeout = original_timeout
+    return bytes(response), final
+
+
+def write(ser, cmd, moredata=None, waitoe=False, delay=0, timeout=1.0, verbose=True, terminators=None,
+          prompt=DATA_PROMPT, send_timeout=None):
+    '''Writes an AT command to the module and returns its response.
+    Returns as soon as a final result code (OK, ERROR, +CME ERROR, +CMS ERROR, NO CARRIER ...) is read,
+    or when the timeout expires.
+    Parameters
+    ----------
+    ser : serial port object
+        The serial port the module is communicating on.
+    cmd : str
+        The command to send, without the trailing CR/LF.
+    moredata : str or bytes, optional
+        Data to send once the module prompts for it (e.g. the payload of AT+QISEND or AT+CMGS).
+        The data is only sent after the prompt arrives; the response then also includes the result
+        of the send (SEND OK, SEND FAIL, OK or an error).
+    waitoe : bool, optional
+        Wait for 'OK' or 'ERROR'. Doubles the timeout for commands known to respond slowly. Default: False.
+    delay : float, optional
+        Extra seconds to allow for the response on top of the timeout. Default: 0.
+    timeout : float, optional
+        Seconds to wait for the final result code. Default: 1.0.
+    verbose : bool, optional
+        True to print verbose output.
+    terminators : iterable of str, optional
+        Custom terminators that end the response instead of 'OK', e.g. ['+QIOPEN:'] to wait for
+        the URC that reports the result of an asynchronous command. Errors always end the response.
+    prompt : str, optional
+        The prompt the module sends before accepting moredata. Default: '>'.
+    send_timeout : float, optional
+        Seconds to wait for the result of sending moredata. Default: the same as timeout.
+    Returns
+    -------
+    The response decoded from UTF-8, or None if the serial port is not open.
+    '''
     if ser is None:
         print('Serial port is not open')
         return None
+    run_exclusive = getattr(ser, 'run_exclusive', None)
+    if run_exclusive is not None:  # A CommandQueue: run it when the port is ours
+        return run_exclusive(lambda port: write(port, cmd, moredata, waitoe, delay, timeout, verbose, terminators,
+                                                prompt, send_timeout))
+    start = time.monotonic()
     aerisutils.vprint(verbose, ">> " + cmd)
-    myoutbytes = bytearray()
-    myoututf8 = ''
+    if cmd[:2].upper() == 'AT':
+        # Output nobody read before this command is not part of its response
+        discard_unread(ser, verbose)
+    command = cmd
     cmd = cmd + '\r\n'
-    ser.write(cmd.encode())
-    if delay > 0:
-        time.sleep(delay)
-    start_time = time.time()
-    elapsed_time = 0
-    while ser.inWaiting() == 0 and elapsed_time < timeout:
-        time.sleep(0.005)
-        elapsed_time = time.time() - start_time
-        # print("Elapsed time: " + str(elapsed_time))
-    #counter = 0
-    while ser.inWaiting() > 0 or waitoe:
-        #counter = counter + 1
-        #myoutbytes.append(ser.read()[0])
-        myoutbytes = ser.readline()
-        # if counter > 100:
-        # print('More than 100 chars read from serial port.')
-        # If, for example, the module receives a UDP packet and writes that UDP packet's payload as an URC, this consumption might read that payload.
-        # Use the error-handling strategy of 'replace' to mangle the output, but not crash.
-        myoututf8 = myoututf8 + myoutbytes.decode("utf-8", errors='replace')  # Change to utf-8
-        if waitoe:
-            #print('Checking for OK')
-            if 'OK' in myoututf8 or 'ERROR' in myoututf8:
-                #print('Found OK')
-                waitoe = False
-            elif (time.time() - start_time) > (timeout * 2):
-                waitoe = False
-    if moredata is not None:
-        # print('More data length: ' + str(len(moredata)))
-        aerisutils.vprint(verbose, 'More data: ' + moredata)
-        time.sleep(1)
-        ser.write(moredata.encode())
-        time.sleep(1)
+    bytes_out = ser.write(cmd.encode()) or len(cmd)
+    if waitoe:
+        timeout = timeout * 2
+    if moredata is not None and terminators is None:
+        terminators = (prompt,)
+    myoutbytes, final = read_response(ser, timeout + delay, terminators)
+    if final is None:
+        aerisutils.vprint(verbose, 'No final result code within {0}s'.format(timeout + delay))
+    elif moredata is not None:
+        if is_error_result(final):
+            aerisutils.vprint(verbose, 'Not sending more data after ' + final)
+        else:
+            # The module is waiting for the data
+            if isinstance(moredata, str):
+                moredata = moredata.encode()
+            aerisutils.vprint(verbose, 'More data: ' + aerisutils.bytes_to_utf_or_hex(moredata))
+            bytes_out += ser.write(moredata) or len(moredata)
+            send_timeout = timeout if send_timeout is None else send_timeout
+            sendbytes, final = read_response(ser, send_timeout, SEND_RESULT_CODES)
+            myoutbytes += sendbytes
+            if final is None:
+                aerisutils.vprint(verbose, 'No send result within {0}s'.format(send_timeout))
+    # If, for example, the module receives a UDP packet and writes that UDP packet's payload as an URC, this consumption might read that payload.
+    # Use the error-handling strategy of 'replace' to mangle the output, but not crash.
+    myoututf8 = myoutbytes.decode("utf-8", errors='replace')
     aerisutils.vprint(verbose, "<< " + myoututf8.strip())
+    if instrumentation.enabled():
+        instrumentation.emit(instrumentation.CommandRecord(
+            command_verb(command), start, time.monotonic(), bytes_out, len(myoutbytes), final,
+            final is not None and is_error_result(final), final is None))
     return myoututf8
 
 
+def read_data(ser, cmd, buffer, offset=0, timeout=1.0, verbose=True):
+    '''Writes a command whose response carries binary data, such as AT+QIRD, and reads the data into buffer.
+    The response is a header line that starts with the length of the data, e.g. +QIRD: <length>,"<IP>",<port>,
+    then that many bytes of data, then the final result code. Unlike write, the data is not scanned for
+    result codes, so it may contain anything.
+    Parameters
+    ----------
+    ser : serial port object
+        The serial port the module is communicating on.
+    cmd : str
+        The command to send, without the trailing CR/LF.
+    buffer : bytearray
+        Where the data goes. Grown if the data does not fit.
+    offset : int, optional
+        Where in buffer the data goes.
+    timeout : float, optional
+        Seconds to wait for the final result code. Default: 1.0.
+    verbose : bool, optional
+        True to print verbose output.
+    Returns
+    -------
+    header : str or None
+        The rest of the header line after the prefix, e.g. '12,"10.0.0.1",3030', or None if there was none.
+    length : int
+        Bytes of data written to buffer at offset.
+    final : str or None
+        The final result code, or None if the timeout expired first.
+    '''
+    if ser is None:
+        print('Serial port is not open')
+        return None, 0, None
+    run_exclusive = getattr(ser, 'run_exclusive', None)
+    if run_exclusive is not None:  # A CommandQueue: run it when the port is ours
+        return run_exclusive(lambda port: read_data(port, cmd, buffer, offset, timeout, verbose))
+    start = time.monotonic()
+    aerisutils.vprint(verbose, '>> ' + cmd)
+    prefix = (response_prefix(cmd) or '').encode()
+    discard_unread(ser, verbose)  # Output nobody read before this command is not part of its response
+    bytes_out = ser.write((cmd + '\r\n').encode()) or len(cmd) + 2
+    original_timeout = ser.timeout
+    response = bytearray()
+    header = None
+    length = 0
+    data_end = None  # Offset in response after the data, once the header has arrived
+    final = None
+    line_start = 0
+    deadline = start + timeout
+    try:
+        while final is None:
+            if data_end is None:
+                # Look for the header, or a final result code in its place
+                newline_index = response.find(b'\n', line_start)
+                while newline_index > -1:
+                    line = bytes(response[line_start:newline_index]).strip()
+                    line_start = newline_index + 1
+                    if prefix and line.startswith(prefix):
+                        header = line[len(prefix):].decode('utf-8', errors='replace').strip()
+                        length = int(header.split(',', 1)[0] or 0)
+                        data_end = line_start + length
+                        break
+                    if is_final_result(line.decode('utf-8', errors='replace')):
+                        final = line.decode('utf-8', errors='replace')
+                        break
+                    newline_index = response.find(b'\n', line_start)
+            if data_end is not None and line_start < data_end <= len(response):
+                if len(buffer) < offset + length:
+                    buffer.extend(bytes(offset + length - len(buffer)))
+                with memoryview(response) as view:
+                    buffer[offset:offset + length] = view[line_start:data_end]
+                line_start = data_end
+            if data_end is not None and line_start >= data_end:
+                final, line_start = scan_response(response, line_start)
+            if final is not None:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            chunk = read_chunk(ser, remaining)
+            if not chunk:
+                break
+            response += chunk
+    finally:
+        ser.timeout = original_timeout
+    if final is None:
+        aerisutils.vprint(verbose, 'No final result code within {0}s'.format(timeout))
+    aerisutils.vprint(verbose, '<< ' + (prefix.decode() + ' ' + header if header is not None else '') +
+                      ' (' + str(length) + ' bytes) ' + (final or ''))
+    if instrumentation.enabled():
+        instrumentation.emit(instrumentation.CommandRecord(
+            command_verb(cmd), start, time.monotonic(), bytes_out, len(response), final,
+            final is not None and is_error_result(final), final is None))
+    return header, length, final
+
+
+# Longest command line write_batch builds by chaining commands with ';'
+MAX_CHAINED_LENGTH = 256
+# Commands whose information response has no +<name>: prefix, so it cannot be picked out of a chained response
+UNPREFIXED_RESPONSES = ('+CIMI', '+GMI', '+GMM', '+GSN', '+GMR', '+CGMI', '+CGMM', '+CGMR', '+CGSN')
+# The response to one command of a batch: the response as write returns it, and its final result code
+CommandResult = collections.namedtuple('CommandResult', ['command', 'response', 'final'])
+# The name of an extended command and its quoted first parameter, e.g. +QCFG and "band in AT+QCFG="band"
+RESPONSE_PREFIX = re.compile(r'^AT([+#][A-Z0-9]+)(=("[^"]*))?', re.IGNORECASE)
+
+
+def response_prefix(cmd):
+    '''Returns the start of the information lines of the response to cmd, e.g. '+CREG:' for AT+CREG?
+    and '+QCFG: "band' for AT+QCFG="band", or None if the lines do not start with the command name.'''
+    match = RESPONSE_PREFIX.match(cmd.strip())
+    if match is None or match.group(1).upper() in UNPREFIXED_RESPONSES:
+        return None
+    prefix = match.group(1).upper() + ':'
+    if match.group(3):
+        prefix += ' ' + match.group(3)
+    return prefix
+
+
+def _result(cmd, response):
+    if response is None:
+        return CommandResult(cmd, None, None)
+    lines = [line.strip() for line in response.split('\n') if line.strip()]
+    final = lines[-1] if lines and is_final_result(lines[-1]) else None
+    return CommandResult(cmd, response, final)
+
+
+def write_batch(ser, cmds, timeout=1.0, verbose=True, max_length=MAX_CHAINED_LENGTH):
+    '''Writes several AT commands with as few round trips as possible and returns their responses.
+    Consecutive commands whose responses can be told apart by their prefix are chained into one command
+    line (AT+CREG?;+COPS?;+CSQ, see ITU-T V.250), the others are written one at a time. If a chained line
+    fails, or its response has lines that cannot be matched to a command, its commands are written
+    again one at a time, so batches should only hold queries and settings that can be repeated.
+    Parameters
+    ----------
+    ser : serial port object
+        The serial port the module is communicating on.
+    cmds : list of str
+        The commands, without the trailing CR/LF.
+    timeout : float, optional
+        Seconds to wait for the response to each command; a chained line gets the sum. Default: 1.0.
+    verbose : bool, optional
+        True to print verbose output.
+    max_length : int, optional
+        Longest command line to build. Default: MAX_CHAINED_LENGTH.
+    Returns
+    -------
+    A CommandResult for each command, in order. The responses look like those of write, so the
+    same parsing applies.
+    '''
+    results = [None] * len(cmds)
+    chain = []
+
+    def flush():
+        if len(chain) == 1:
+            index, _ = chain[0]
+            results[index] = _result(cmds[index], write(ser, cmds[index], timeout=timeout, verbose=verbose))
+        elif chain:
+            _write_chain(ser, cmds, chain, results, timeout, verbose)
+        del chain[:]
+
+    for index, cmd in enumerate(cmds):
+        prefix = response_prefix(cmd)
+        if prefix is None:
+            flush()
+            results[index] = _result(cmd, write(ser, cmd, timeout=timeout, verbose=verbose))
+            continue
+        length = sum(len(cmds[i]) - 1 for i, _ in chain) + len(cmd)
+        if length > max_length or any(p.startswith(prefix) or prefix.startswith(p) for _, p in chain):
+            flush()
+        chain.append((index, prefix))
+    flush()
+    return results
+
+
+def _write_chain(ser, cmds, chain, results, timeout, verbose):
+    line = cmds[chain[0][0]] + ''.join(';' + cmds[index].strip()[2:] for index, _ in chain[1:])
+    response = write(ser, line, timeout=timeout * len(chain), verbose=verbose)
+    result = _result(line, response)
+    infos = [[] for _ in chain]
+    matched = result.final in OK_RESULT_CODES
+    if matched:
+        lines = [l.strip() for l in response.split('\n') if l.strip()][:-1]
+        for info_line in lines:
+            owners = [i for i, (_, prefix) in enumerate(chain) if info_line.startswith(prefix)]
+            if not owners:
+                matched = False
+                break
+            infos[owners[0]].append(info_line)
+    if not matched:
+        aerisutils.vprint(verbose, 'Writing the chained commands one at a time')
+        for index, _ in chain:
+            results[index] = _result(cmds[index], write(ser, cmds[index], timeout=timeout, verbose=verbose))
+        return
+    for (index, _), info in zip(chain, infos):
+        response = ''.join('\r\n' + info_line + '\r\n' for info_line in info) + '\r\nOK\r\n'
+        results[index] = CommandResult(cmds[index], response, 'OK')
+
 def wait_urc(ser, timeout, com_port, returnonreset=False, returnonvalue=False, verbose=True, returnbytes=False):
     '''Wait for unsolicited result codes from the module.
     Parameters
@@ -118,8 +661,8 @@ def wait_urc(ser, timeout, com_port, returnonreset=False, returnonvalue=False, v
         The serial port the module is communicating on.
     timeout : int
         How many seconds to wait
-    com_port : int
-        The com port associated with the module
+    com_port : str
+        The COM port as configured, e.g. a usb: port, which is resolved again if the port has to be reopened
     returnonreset : bool, optional
         If truthy, this method will return as soon as there is a problem. Default: False.
     returnonvalue : any, optional
@@ -131,51 +674,123 @@ def wait_urc(ser, timeout, com_port, returnonreset=False, returnonvalue=False, v
     Returns
     ------
     Either a bytes or a string, depending on the returnbytes parameter.
+    Only complete lines are returned; anything read after the last returned line is kept for the next read.
     '''
-    
-    mybytes = bytearray()
-    myfinalout = None
-    if returnbytes:
-        myfinalout = b''
-    else:
-        myfinalout = ''
-    start_time = time.time()
-    elapsed_time = 0
+    if not instrumentation.enabled():
+        return _wait_urc(ser, timeout, com_port, returnonreset, returnonvalue, verbose, returnbytes)
+    start = time.monotonic()
+    urcs = _wait_urc(ser, timeout, com_port, returnonreset, returnonvalue, verbose, returnbytes)
+    received = urcs.encode() if isinstance(urcs, str) else urcs
+    found = None
+    if returnonvalue:
+        value = returnonvalue if isinstance(returnonvalue, bytes) else str(returnonvalue).encode()
+        if value in received:
+            found = value.decode('utf-8', errors='replace')
+    instrumentation.emit(instrumentation.CommandRecord(
+        'URC', start, time.monotonic(), 0, len(received), found, False, bool(returnonvalue) and found is None))
+    return urcs
+
+
+def _wait_urc(ser, timeout, com_port, returnonreset, returnonvalue, verbose, returnbytes):
     aerisutils.print_log('Starting to wait up to {0}s for URC; returning bytes: {1}'.format(timeout, returnbytes), verbose)
-    while elapsed_time < timeout:
-        try:
-            while ser.inWaiting() > 0:
-                mybyte = ser.read()[0]
-                mybytes.append(mybyte)
-                if mybyte == 10:  # Newline
-                    if returnbytes:
-                        oneline = mybytes
-                        myfinalout = myfinalout + mybytes
-                        aerisutils.print_log("<< " + aerisutils.bytes_to_utf_or_hex(oneline.strip()), verbose)
-                    else:
-                        try:
-                            oneline = mybytes.decode("utf-8")
-                        except UnicodeDecodeError as e:
-                            aerisutils.print_log('Error in wait_urc')
-                            return myfinalout
-                        myfinalout = myfinalout + oneline
-                        aerisutils.print_log("<< " + oneline.strip(), verbose)
-                    if returnonvalue:
-                        if oneline.find(returnonvalue) > -1:
-                            return myfinalout
-                    mybytes = bytearray()
-        except IOError:
-            aerisutils.print_log('Exception while waiting for URC.', verbose)
-            ser.close()
-            find_serial(com_port, verbose=True, timeout=(timeout - elapsed_time))
-            if returnonreset:
-                return myfinalout
-            else:
-                ser.open()
-        time.sleep(0.5)
-        elapsed_time = time.time() - start_time
+    run_sliced = getattr(ser, 'run_sliced', None)
+    if run_sliced is None:
+        urcs = _read_urcs(ser, timeout, com_port, returnonreset, returnonvalue, verbose, returnbytes)[0]
+    else:
+        # A CommandQueue: wait in slices, so that the wait only holds up the commands that other threads
+        # queue in the same or a more urgent lane until the end of the slice
+        deadline = time.monotonic() + timeout
+        # The unfinished line a slice ends with; it stays with this wait, so the commands run between
+        # slices do not read it
+        leftover = bytearray()
+
+        def wait_slice(port):
+            remaining = deadline - time.monotonic()
+            urcs, done = _read_urcs(port, min(remaining, URC_WAIT_SLICE), com_port, returnonreset, returnonvalue,
+                                    verbose, returnbytes, leftover)
+            done = done or remaining <= URC_WAIT_SLICE
+            if done:
+                unread(port, leftover)
+            return urcs, done
+        urcs = (b'' if returnbytes else '').join(run_sliced(wait_slice))
     aerisutils.print_log('Finished waiting for URC.', verbose)
-    return myfinalout
+    return urcs
+
+
+def _read_urcs(ser, timeout, com_port, returnonreset, returnonvalue, verbose, returnbytes, leftover=None):
+    '''Does the waiting for wait_urc. Returns the URCs, and True if it stopped before the timeout.
+    If leftover (a bytearray) is given, it is read first, and on timeout the unfinished line goes into it
+    instead of back to the port.'''
+    if returnonvalue and returnbytes and isinstance(returnonvalue, str):
+        returnonvalue = returnonvalue.encode()
+    received = bytearray(max(RECEIVE_BUFFER_SIZE, len(leftover or b'')))
+    received_length = 0
+    if leftover:
+        received_length = len(leftover)
+        received[:received_length] = leftover
+        del leftover[:]
+    lines = []
+    empty = b'' if returnbytes else ''
+    original_timeout = ser.timeout
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                # Blocks until data arrives, then takes everything that is available
+                chunk = read_chunk(ser, remaining)
+            except IOError:
+                aerisutils.print_log('Exception while waiting for URC.', verbose)
+                ser.close()
+                find_serial(com_port, verbose=True, timeout=deadline - time.monotonic())
+                if returnonreset:
+                    return empty.join(lines), True
+                # A usb: port can come back as another /dev/ttyUSBn after the module resets
+                port = portutils.resolve_com_port(com_port)
+                if port is not None and port != ser.port:
+                    ser.port = port
+                ser.open()
+                continue
+            if not chunk and getattr(ser, 'drained', False):
+                unread(ser, received[:received_length])
+                return empty.join(lines), True  # A replayed capture has nothing more to send until the next write
+            if received_length + len(chunk) > len(received):
+                received.extend(bytes(max(len(received), len(chunk))))
+            received[received_length:received_length + len(chunk)] = chunk
+            received_length += len(chunk)
+            line_start = 0
+            newline_index = received.find(b'\n', 0, received_length)
+            while newline_index > -1:
+                oneline = bytes(received[line_start:newline_index + 1])
+                line_start = newline_index + 1
+                if not returnbytes:
+                    try:
+                        oneline = oneline.decode('utf-8')
+                    except UnicodeDecodeError:
+                        aerisutils.print_log('Error in wait_urc')
+                        return empty.join(lines), True
+                lines.append(oneline)
+                if verbose:
+                    aerisutils.print_log('<< ' + (aerisutils.bytes_to_utf_or_hex(oneline.strip()) if returnbytes else oneline.strip()), verbose)
+                if returnonvalue and oneline.find(returnonvalue) > -1:
+                    # Leave anything after this line for the next read
+                    unread(ser, received[line_start:received_length])
+                    return empty.join(lines), True
+                newline_index = received.find(b'\n', line_start, received_length)
+            # Keep the unfinished line at the start of the buffer
+            received[0:received_length - line_start] = received[line_start:received_length]
+            received_length -= line_start
+        if leftover is not None:
+            leftover[:] = received[:received_length]
+        else:
+            unread(ser, received[:received_length])
+    finally:
+        if ser.is_open:
+            ser.timeout = original_timeout
+    return empty.join(lines), False
+
 
 def bytes_or_utf(b, want_bytes=False, verbose=False):
     aerisutils.print_log(f'Returning bytes: {want_bytes} from something that is bytes {isinstance(b, bytes)}', verbose)
@@ -188,6 +803,7 @@ def bytes_or_utf(b, want_bytes=False, verbose=False):
 
 # TODO Unused method, should be removed if not needed
 def find_modem():
+    import usb.core
     # find USB devices
     dev = usb.core.find(find_all=True)
     # loop through devices, printing vendor and product ids in decimal and hex
@@ -0,0 +1,356 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import struct
+import sys
+import threading
+import time
+import collections
+
+import aerismodsdk.utils.aerisutils as aerisutils
+from aerismodsdk.utils.portutils import REPLAY_PORT_PREFIX
+
+# File layout: a session header, then one record per chunk; later sessions append another header.
+#   header: MAGIC (8 bytes), version (1 byte), wall clock start time (float64)
+#   record: direction (1 byte), seconds since the session started (float64, monotonic), length (uint32), data
+MAGIC = b'AERISCAP'
+VERSION = 1
+HEADER = struct.Struct('<8sBd')
+RECORD = struct.Struct('<BdI')
+TX = ord('>')
+RX = ord('<')
+
+# One chunk of a capture
+Record = collections.namedtuple('Record', ['direction', 'timestamp', 'data'])
+
+
+class ReplayError(Exception):
+    '''Raised by ReplaySerial when the bytes written differ from the capture.'''
+
+
+def read_capture(path):
+    '''Reads a capture file. Returns a list of sessions, each a list of Records.'''
+    sessions = []
+    with open(path, 'rb') as capture:
+        data = capture.read()
+    offset = 0
+    while offset < len(data):
+        if data[offset:offset + len(MAGIC)] == MAGIC:
+            magic, version, start_time = HEADER.unpack_from(data, offset)
+            if version != VERSION:
+                raise ValueError('Unsupported capture version {0} in {1}'.format(version, path))
+            sessions.append([])
+            offset += HEADER.size
+            continue
+        if not sessions or offset + RECORD.size > len(data):
+            raise ValueError('Corrupt capture file ' + path + ' at offset ' + str(offset))
+        direction, timestamp, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        sessions[-1].append(Record(direction, timestamp, data[offset:offset + length]))
+        offset += length
+    return sessions
+
+
+class CaptureSerial:
+    '''Wraps a serial port and appends every chunk written to or read from it to a capture file.'''
+
+    def __init__(self, ser, path):
+        '''
+        Parameters
+        ----------
+        ser : serial port object
+            The open port to capture.
+        path : str
+            The capture file. A new session is appended if it already exists.
+        '''
+        self.ser = ser
+        self.path = path
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self._file.flush()
+
+    def _record(self, direction, data):
+        if not data:
+            return
+        with self._lock:
+            self._file.write(RECORD.pack(direction, time.monotonic() - self._start, len(data)))
+            self._file.write(data)
+            self._file.flush()
+
+    def write(self, data):
+        written = self.ser.write(data)
+        self._record(TX, bytes(data))
+        return written
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        self._record(RX, data)
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        data = self.ser.read_until(expected, size)
+        self._record(RX, data)
+        return data
+
+    def readline(self):
+        return self.read_until(b'\n')
+
+    @property
+    def timeout(self):
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.ser.timeout = timeout
+
+    @property
+    def baudrate(self):
+        return self.ser.baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        self.ser.baudrate = baudrate
+
+    @property
+    def port(self):
+        return self.ser.port
+
+    @port.setter
+    def port(self, port):
+        self.ser.port = port
+
+    def close(self):
+        self.ser.close()
+        with self._lock:
+            self._file.close()
+
+    def __getattr__(self, name):
+        # in_waiting, is_open, port, reset_input_buffer ... come from the port
+        return getattr(self.ser, name)
+
+
+class ReplaySerial:
+    '''A serial port object that plays back a capture.
+
+    Bytes the capture read from the module become readable once everything the capture wrote
+    before them has been written again, at their original pace scaled by speed. Writes are
+    checked against the capture.
+    '''
+
+    def __init__(self, path, speed=0, session=0, strict=True):
+        '''
+        Parameters
+        ----------
+        path : str
+            The capture file.
+        speed : float, optional
+            1 for the original timing, 10 for ten times faster, 0 for no delays at all. Default: 0.
+        session : int, optional
+            Which session in the file to play back. Default: the first.
+        strict : bool, optional
+            True to raise ReplayError when a write differs from the capture; otherwise it is logged.
+        '''
+        self.port = REPLAY_PORT_PREFIX + path
+        self.records = read_capture(path)[session]
+        self.speed = speed
+        self.strict = strict
+        self.timeout = 1
+        self.baudrate = None
+        self.is_open = True
+        self._index = 0
+        self._tx_offset = 0
+        self._rx = bytearray()
+        self._anchor = (time.monotonic(), 0.0)
+
+    # ========================================================================
+    #
+    # Playback
+    #
+
+    def _due(self, record):
+        if not self.speed:
+            return 0
+        anchor_time, anchor_timestamp = self._anchor
+        return anchor_time + (record.timestamp - anchor_timestamp) / self.speed
+
+    def _release(self, size=None):
+        '''Makes due RX records readable, stopping once size bytes are readable.
+        Returns the time the next RX record is due, or None if it waits for a write or the capture is over.'''
+        while self._index < len(self.records):
+            record = self.records[self._index]
+            if record.direction != RX:
+                return None  # Waiting for the client to write
+            due = self._due(record)
+            if size is not None and len(self._rx) >= size or due > time.monotonic():
+                return due
+            self._rx += record.data
+            self._index += 1
+        return None
+
+    def _scaled(self, seconds):
+        return seconds / self.speed if self.speed else 0
+
+    def _wait(self, size, timeout):
+        '''Waits until size bytes are readable or timeout seconds (already scaled) have passed.'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            due = self._release(size)
+            if len(self._rx) >= size:
+                return
+            now = time.monotonic()
+            if due is None:
+                # Nothing more will arrive until the client writes
+                if deadline is not None and deadline > now:
+                    time.sleep(deadline - now)
+                return
+            if deadline is not None and due > deadline:
+                time.sleep(max(deadline - now, 0))
+                return
+            time.sleep(max(due - now, 0))
+
+    def write(self, data):
+        data = bytes(data)
+        view = memoryview(data)
+        while view:
+            if self._index >= len(self.records):
+                self._mismatch('Write past the end of the capture: ' + aerisutils.bytes_to_utf_or_hex(bytes(view)))
+                break
+            record = self.records[self._index]
+            if record.direction == RX:
+                # The capture read this before writing; it is available now
+                self._rx += record.data
+                self._index += 1
+                continue
+            expected = record.data[self._tx_offset:self._tx_offset + len(view)]
+            if bytes(view[:len(expected)]) != expected:
+                self._mismatch('Expected write ' + aerisutils.bytes_to_utf_or_hex(expected) + ' but got '
+                               + aerisutils.bytes_to_utf_or_hex(bytes(view[:len(expected)])))
+            view = view[len(expected):]
+            self._tx_offset += len(expected)
+            if self._tx_offset == len(record.data):
+                self._index += 1
+                self._tx_offset = 0
+                self._anchor = (time.monotonic(), record.timestamp)
+        return len(data)
+
+    def _mismatch(self, message):
+        if self.strict:
+            raise ReplayError(message)
+        aerisutils.print_log('Replay: ' + message)
+
+    # ========================================================================
+    #
+    # Serial port interface
+    #
+
+    def read(self, size=1):
+        self._wait(size, None if self.timeout is None else self._scaled(self.timeout))
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        deadline = None if self.timeout is None else time.monotonic() + self._scaled(self.timeout)
+        while self._rx.find(expected) == -1 and (size is None or len(self._rx) < size):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            available = len(self._rx)
+            self._wait(available + 1, remaining)
+            if len(self._rx) == available:
+                break
+        index = self._rx.find(expected)
+        end = len(self._rx) if index == -1 else index + len(expected)
+        if size is not None:
+            end = min(end, size)
+        data = bytes(self._rx[:end])
+        del self._rx[:end]
+        return data
+
+    def readline(self):
+        return self.read_until(b'\n')
+
+    @property
+    def in_waiting(self):
+        # Without delays, one captured chunk at a time, so reads see the captured chunk boundaries
+        self._release(1 if not self.speed else None)
+        return len(self._rx)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def isOpen(self):
+        return self.is_open
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def reset_input_buffer(self):
+        # The capture already shows what the module sent; keep it so the replay stays faithful
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def sendBreak(self, duration=0.25):
+        pass
+
+    def send_break(self, duration=0.25):
+        pass
+
+    @property
+    def drained(self):
+        '''True when nothing is readable and nothing more will arrive until the next write.'''
+        return not self.in_waiting and (self.finished or self.records[self._index].direction == TX)
+
+    @property
+    def finished(self):
+        '''True once every record has been played back.'''
+        return self._index >= len(self.records)
+
+
+def open_replay(port):
+    '''Opens a ReplaySerial for a port of the form replay:<path>[?speed=<factor>].'''
+    path = port[len(REPLAY_PORT_PREFIX):]
+    speed = 0
+    if '?speed=' in path:
+        path, speed = path.split('?speed=', 1)
+        speed = float(speed)
+    return ReplaySerial(path, speed=speed)
+
+
+def dump(path, out=sys.stdout):
+    '''Prints a capture file, one line per record.'''
+    for number, session in enumerate(read_capture(path)):
+        out.write('Session {0}\n'.format(number))
+        for record in session:
+            out.write('{0:10.6f} {1} {2!r}\n'.format(record.timestamp, chr(record.direction), record.data))
+
+
+if __name__ == '__main__':
+    dump(sys.argv[1])
@@ -0,0 +1,401 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import queue
+import re
+import threading
+import time
+
+import aerismodsdk.utils.aerisutils as aerisutils
+import aerismodsdk.utils.rmutils as rmutils
+
+# URC prefixes that are commonly worth subscribing to
+DEFAULT_URC_PREFIXES = ('+QIURC:', '+CREG:', '+CGREG:', '+CEREG:', '+CMTI:', '+QMTRECV:', '+QMTSTAT:',
+                        '+UUSORF:', '+UUSORD:', '+UUSOCL:', 'SRING:', '+CGEV:', 'APP RDY')
+
+# URCs that are followed by raw payload bytes; the 'length' group says how many
+PAYLOAD_URC_PATTERNS = [
+    # Quectel direct push mode: +QIURC: "recv",<connectID>,<currentrecvlength>[,"<remote IP>",<remote port>]<CR><LF><data>
+    re.compile(rb'^\+QIURC: "recv",\d+,(?P<length>\d+)'),
+]
+
+# Most bytes of the command stream kept for a reader; older ones are dropped
+MAX_STREAM_BYTES = 64 * 1024
+
+# Command responses whose header line is followed by raw data bytes; the 'length' group says how many
+PAYLOAD_RESPONSE_PATTERNS = [
+    # Quectel buffer access mode: +QIRD: <read_actual_length>[,"<remote IP>",<remote port>]<CR><LF><data>
+    re.compile(rb'^\+QIRD: (?P<length>\d+)(,"[^"]*",\d+)?$'),
+]
+
+# An unsolicited result code read by the SerialReader
+Urc = collections.namedtuple('Urc', ['prefix', 'line', 'payload', 'timestamp'])
+
+# Matches the command verbs of an AT command line, e.g. +CEREG in AT+CEREG?, and each verb of a chain
+# such as AT+CREG?;+CEREG?
+COMMAND_VERB = re.compile(rb'(?:^AT|;)\s*([+#&][A-Z0-9]+)', re.IGNORECASE)
+
+
+class UrcDemultiplexer:
+    '''Splits a module's byte stream into the command stream and URCs.
+
+    URCs whose line starts with a subscribed prefix are routed to their subscribers. Everything else,
+    including URCs nobody subscribed to, is passed to the emit callback as the command stream.
+    Lines that start with the response prefix of the command in progress (e.g. +CEREG: while AT+CEREG?
+    is waiting for its final result code), or of any command chained with it, stay in the command stream
+    even if they are subscribed.
+    '''
+
+    def __init__(self, emit, verbose=False):
+        '''
+        Parameters
+        ----------
+        emit : callable
+            Called with each piece of the command stream, as bytes.
+        verbose : bool, optional
+            True for verbose output.
+        '''
+        self.emit = emit
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._buffer = bytearray()
+        self._pending_prefixes = None
+        self._passthrough = False
+        self._urc_line = None
+        self._urc_payload = None
+        self._payload_remaining = 0
+        self._data_remaining = 0
+
+    def subscribe(self, prefix, callback=None):
+        '''Routes URCs starting with prefix to a callback, or to a queue if no callback is given.
+        Callbacks run on the thread that feeds the demultiplexer, so they should return quickly.
+        Parameters
+        ----------
+        prefix : str
+            The start of the URC line, e.g. '+CMTI:' or 'SRING:'.
+        callback : callable, optional
+            Called with a Urc for each matching URC.
+        Returns
+        -------
+        The callback, or a queue.Queue that receives each Urc. Pass it to unsubscribe when done.
+        '''
+        if callback is None:
+            handle = queue.Queue()
+            handler = handle.put
+        else:
+            handle = callback
+            handler = callback
+        with self._lock:
+            self._subscriptions.setdefault(prefix.encode(), []).append((handle, handler))
+        return handle
+
+    def unsubscribe(self, prefix, handle):
+        with self._lock:
+            handlers = self._subscriptions.get(prefix.encode(), [])
+            handlers[:] = [h for h in handlers if h[0] != handle]
+            if not handlers:
+                self._subscriptions.pop(prefix.encode(), None)
+
+    def command_sent(self, data):
+        '''Tells the demultiplexer that data was written to the module, so it can track the command in progress.'''
+        verbs = COMMAND_VERB.findall(data) if data[:2].upper() == b'AT' else []
+        if verbs:
+            self._pending_prefixes = tuple(verb.upper() + b':' for verb in verbs)
+
+    def feed(self, data):
+        buf = self._buffer
+        buf += data
+        while buf:
+            if self._data_remaining > 0:
+                # Data in a command response goes to the command stream as it is, whatever it looks like
+                chunk = bytes(buf[:self._data_remaining])
+                del buf[:len(chunk)]
+                self._data_remaining -= len(chunk)
+                self.emit(chunk)
+                continue
+            if self._payload_remaining > 0:
+                chunk = buf[:self._payload_remaining]
+                del buf[:len(chunk)]
+                self._urc_payload += chunk
+                self._payload_remaining -= len(chunk)
+                if self._payload_remaining == 0:
+                    self._dispatch(self._urc_line, bytes(self._urc_payload))
+                continue
+            newline_index = buf.find(b'\n')
+            if self._passthrough:
+                # We are in the middle of a line that already went to the command stream
+                end = len(buf) if newline_index == -1 else newline_index + 1
+                self.emit(bytes(buf[:end]))
+                del buf[:end]
+                self._passthrough = newline_index == -1
+                continue
+            if newline_index == -1:
+                # An unfinished line: hold it only if it may still turn into a subscribed URC.
+                # Otherwise pass it on now, so that prompts like '> ' reach the command stream.
+                if not self._may_be_urc(bytes(buf)):
+                    self.emit(bytes(buf))
+                    del buf[:]
+                    self._passthrough = True
+                break
+            line = bytes(buf[:newline_index + 1])
+            del buf[:newline_index + 1]
+            self._handle_line(line)
+
+    def _handle_line(self, line):
+        stripped = line.strip()
+        if self._pending_prefixes is not None:
+            if rmutils.is_final_result(stripped.decode('utf-8', errors='replace')):
+                self._pending_prefixes = None
+            elif stripped.startswith(self._pending_prefixes):
+                self.emit(line)
+                for pattern in PAYLOAD_RESPONSE_PATTERNS:
+                    match = pattern.match(stripped)
+                    if match:
+                        self._data_remaining = int(match.group('length'))
+                return
+        for pattern in PAYLOAD_URC_PATTERNS:
+            match = pattern.match(stripped)
+            if match:
+                self._urc_line = line
+                self._urc_payload = bytearray()
+                self._payload_remaining = int(match.group('length'))
+                if self._payload_remaining == 0:
+                    self._dispatch(line, b'')
+                return
+        self._dispatch(line, None)
+
+    def _dispatch(self, line, payload):
+        stripped = line.strip()
+        with self._lock:
+            handlers = None
+            for prefix, prefix_handlers in self._subscriptions.items():
+                if stripped.startswith(prefix):
+                    handlers = [h[1] for h in prefix_handlers]
+                    break
+        if not handlers:
+            self.emit(line + (payload or b''))
+            return
+        urc = Urc(prefix.decode(), stripped.decode('utf-8', errors='replace'), payload, time.monotonic())
+        aerisutils.print_log('<< URC: ' + urc.line, self.verbose)
+        for handler in handlers:
+            try:
+                handler(urc)
+            except Exception as e:
+                aerisutils.print_log('Error in URC handler for ' + urc.prefix + ': ' + str(e))
+
+    def _may_be_urc(self, partial):
+        partial = partial.lstrip(b'\r')
+        if not partial:
+            return True
+        with self._lock:
+            for prefix in self._subscriptions:
+                if prefix.startswith(partial) or partial.startswith(prefix):
+                    return True
+        return False
+
+
+class SerialReader:
+    '''Owns a serial port with a background thread that routes URCs to subscribers (see UrcDemultiplexer).
+
+    The reader behaves like a serial port object (write, read, in_waiting, timeout ...) for the command
+    stream, so it can be passed to rmutils in place of the port.
+    '''
+
+    def __init__(self, ser, verbose=False, poll_interval=0.1):
+        '''
+        Parameters
+        ----------
+        ser : serial port object
+            The open serial port. The reader thread becomes the only reader of this port.
+        verbose : bool, optional
+            True for verbose output.
+        poll_interval : float, optional
+            Seconds the reader thread blocks on the port before checking whether it should stop.
+        '''
+        self.ser = ser
+        self.verbose = verbose
+        self.poll_interval = poll_interval
+        self.timeout = ser.timeout
+        self.error = None
+        self.demux = UrcDemultiplexer(self._emit, verbose=verbose)
+        self._stream = bytearray()
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    # ========================================================================
+    #
+    # Thread control
+    #
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self.error = None
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='SerialReader ' + str(self.ser.port), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        self.ser.timeout = self.poll_interval
+        while not self._stopping.is_set():
+            try:
+                data = self.ser.read(1)
+                if data:
+                    waiting = self.ser.in_waiting
+                    if waiting > 0:
+                        data = data + self.ser.read(waiting)
+                    self.demux.feed(data)
+            except (IOError, OSError) as e:
+                aerisutils.print_log('Serial reader stopped: ' + str(e), self.verbose)
+                with self._cond:
+                    self.error = e
+                    self._cond.notify_all()
+                return
+
+    def _emit(self, data):
+        with self._cond:
+            self._stream += data
+            excess = len(self._stream) - MAX_STREAM_BYTES
+            if excess > 0:
+                # Nobody is reading the command stream, e.g. a daemon between calls
+                del self._stream[:excess]
+            self._cond.notify_all()
+
+    # ========================================================================
+    #
+    # Subscriptions
+    #
+
+    def subscribe(self, prefix, callback=None):
+        '''See UrcDemultiplexer.subscribe. Callbacks run on the reader thread.'''
+        return self.demux.subscribe(prefix, callback)
+
+    def unsubscribe(self, prefix, handle):
+        self.demux.unsubscribe(prefix, handle)
+
+    def wait_for(self, prefix, timeout):
+        '''Waits up to timeout seconds for the next URC starting with prefix. Returns the Urc or None.'''
+        urcs = self.subscribe(prefix)
+        try:
+            return urcs.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        finally:
+            self.unsubscribe(prefix, urcs)
+
+    # ========================================================================
+    #
+    # Serial port interface for the command stream
+    #
+
+    def write(self, data):
+        if data[:2].upper() == b'AT':
+            # Output nobody read before this command is not part of its response
+            rmutils.discard_unread(self, self.verbose)
+            with self._cond:
+                if self._stream:
+                    aerisutils.print_log('Discarding unread output: ' + aerisutils.bytes_to_utf_or_hex(bytes(self._stream)),
+                                         self.verbose)
+                    del self._stream[:]
+        self.demux.command_sent(data)
+        return self.ser.write(data)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cond:
+            while len(self._stream) < size and self.error is None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            data = bytes(self._stream[:size])
+            del self._stream[:size]
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                index = self._stream.find(expected)
+                if index > -1:
+                    end = index + len(expected)
+                    break
+                if size is not None and len(self._stream) >= size:
+                    end = size
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if self.error is not None or (remaining is not None and remaining <= 0):
+                    end = len(self._stream)
+                    break
+                self._cond.wait(remaining)
+            if size is not None:
+                end = min(end, size)
+            data = bytes(self._stream[:end])
+            del self._stream[:end]
+        return data
+
+    def readline(self):
+        return self.read_until(b'\n')
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            return len(self._stream)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def reset_input_buffer(self):
+        rmutils.discard_unread(self)
+        with self._cond:
+            del self._stream[:]
+
+    @property
+    def port(self):
+        return self.ser.port
+
+    @port.setter
+    def port(self, port):
+        self.ser.port = port
+
+    @property
+    def is_open(self):
+        return self.ser.is_open
+
+    def isOpen(self):
+        return self.is_open
+
+    def open(self):
+        self.ser.open()
+        self.start()
+
+    def close(self):
+        self.stop()
+        self.ser.close()
+
+    def __getattr__(self, name):
+        # Anything not handled here (flushOutput, reset_output_buffer, sendBreak ...) goes to the port
+        return getattr(self.ser, name)
@@ -12,16 +12,49 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+
 from aerismodsdk.utils import aerisutils
 from aerismodsdk.model import shoulder_tap
 
 
+# Shoulder-tap message type (e.g. b'01') to the ShoulderTapParser subclass that parses it
+PARSERS = {}
+
+
+def register_parser(parser_class):
+    '''Registers a ShoulderTapParser subclass for its message_type. Can be used as a class decorator.'''
+    PARSERS[parser_class.message_type] = parser_class
+    return parser_class
+
+
+class ShoulderTapParser:
+    '''Parses one type of shoulder-tap packet. Subclasses set message_type and implement parse.'''
+    message_type = None
+
+    @classmethod
+    def parse(cls, body, imsi, verbose=False):
+        '''Parses the packet after the STX character and message type.
+        Parameters
+        ----------
+        body : memoryview
+            The rest of the packet. Slice it rather than copying it.
+        imsi : str
+            The IMSI of this device.
+        verbose : bool, optional
+            True for verbose output.
+        Returns
+        -------
+        BaseShoulderTap or None if there was a problem.'''
+        raise NotImplementedError
+
+
 def parse_shoulder_tap(packet, imsi, verbose=False):
     '''Parses a "packet" into a shoulder-tap.
     Parameters
     ----------
     packet : bytes
-        Binary representation of a single shoulder-tap packet.
+        Binary representation of a single shoulder-tap packet. Any bytes-like object, e.g. a memoryview.
     imsi : str
         The IMSI of this device.
     verbose : bool, optional
@@ -31,27 +64,56 @@ def parse_shoulder_tap(packet, imsi, verbose=False):
     shoulder_tap : BaseShoulderTap
         The parsed shoulder-tap.
         May be None if there was a problem.'''
-    # the UDP0 scheme is:
+    # A shoulder-tap packet is:
     # one STX character
-    # two characters representing the shoulder-tap-type: "01" is UDP0
-    # four characters representing the sequence number
-    # two characters representing the length of the payload
-    # X bytes of binary data
-    # one ETX character
-    aerisutils.print_log('The entire packet is: <' + aerisutils.bytes_to_utf_or_hex(packet) + '>', verbose)
+    # two characters representing the shoulder-tap-type, e.g. "01" for UDP0
+    # the rest, as defined by the shoulder-tap-type
+    view = memoryview(packet)
+    if verbose:
+        aerisutils.print_log('The entire packet is: <' + aerisutils.bytes_to_utf_or_hex(bytes(view)) + '>', verbose)
     # STX is ASCII value 2 / Unicode code point U+0002
     STX = 2
     # parse first character: it should be STX
-    if packet[0] != STX:
+    if len(view) == 0 or view[0] != STX:
         aerisutils.print_log('Error: first character was not STX', verbose=True)
         return None
-    # parse next two characters: they should be "01"
-    message_type = packet[1:3]
-    if message_type == b'01':
-        return parse_udp0_packet(packet[3:], imsi, verbose=verbose)
-    else:
-        aerisutils.print_log('Error: message type was not 01 for Udp0; it was ' + aerisutils.bytes_to_utf_or_hex(message_type), verbose=True)
+    # parse next two characters: they select the parser
+    message_type = bytes(view[1:3])
+    parser = PARSERS.get(message_type)
+    if parser is None:
+        aerisutils.print_log('Error: unknown message type ' + aerisutils.bytes_to_utf_or_hex(message_type), verbose=True)
         return None
+    return parser.parse(view[3:], imsi, verbose=verbose)
+
+
+def parse_many(datagrams, imsi, verbose=False):
+    '''Parses a burst of shoulder-tap packets.
+    Parameters
+    ----------
+    datagrams : iterable
+        Bytes-like packets, or objects with the packet in a payload attribute such as qiurc.Datagram.
+    imsi : str
+        The IMSI of this device.
+    verbose : bool, optional
+        True for verbose output.
+    Returns
+    -------
+    A list of the shoulder-taps that parsed, in order.'''
+    taps = []
+    for datagram in datagrams:
+        tap = parse_shoulder_tap(getattr(datagram, 'payload', datagram), imsi, verbose)
+        if tap is not None:
+            taps.append(tap)
+    return taps
+
+
+@register_parser
+class Udp0Parser(ShoulderTapParser):
+    message_type = b'01'
+
+    @classmethod
+    def parse(cls, body, imsi, verbose=False):
+        return parse_udp0_packet(body, imsi, verbose)
 
 
 def parse_udp0_packet(packet, imsi, verbose=False):
@@ -60,6 +122,7 @@ def parse_udp0_packet(packet, imsi, verbose=False):
     ----------
     packet : bytes
         The portion of the packet after the first three bytes, i.e., starting at the sequence number.
+        Any bytes-like object; only the payload is copied out of it.
     imsi : str
         The IMSI of this device.
     verbose : bool, optional
@@ -67,21 +130,31 @@ def parse_udp0_packet(packet, imsi, verbose=False):
     Returns
     -------
     Udp0ShoulderTap or None if there was a problem.'''
-    ETX = b'\x03'
-    sequence_hex = packet[:4]
+    # the UDP0 scheme is:
+    # four characters representing the sequence number
+    # two characters representing the length of the payload
+    # X bytes of binary data
+    # one ETX character
+    ETX = 3
+    packet = memoryview(packet)
+    # The header is parsed from one small copy, as int() does not take a memoryview
+    header = bytes(packet[:6])
+    sequence_hex = header[:4]
     # length check: sequence_hex should be 4 bytes long
     if len(sequence_hex) != 4:
         aerisutils.print_log(f'Error: did not get enough sequence number bytes; expected 4, got {len(sequence_hex)}', verbose=True)
         return None
-    aerisutils.print_log(f'Sequence number binary: {sequence_hex}', verbose=verbose)
-    try: 
+    if verbose:
+        aerisutils.print_log(f'Sequence number binary: {sequence_hex}', verbose=verbose)
+    try:
         sequence_decimal = int(sequence_hex, base=16)
     except ValueError:
         aerisutils.print_log('Error: Sequence number was not hexadecimal', verbose=True)
         return None
 
-    payload_length_hex = packet[4:6]
-    aerisutils.print_log(f'Payload length in hex: {payload_length_hex}', verbose=verbose)
+    payload_length_hex = header[4:6]
+    if verbose:
+        aerisutils.print_log(f'Payload length in hex: {payload_length_hex}', verbose=verbose)
     # Length check: payload_length_check should be 2 bytes
     if len(payload_length_hex) != 2:
         aerisutils.print_log(f'Error: did not get enough payload length bytes; expected 2, got {len(payload_length_hex)}', verbose=True)
@@ -92,16 +165,149 @@ def parse_udp0_packet(packet, imsi, verbose=False):
         aerisutils.print_log('Error: payload length was not hexadecimal', verbose=True)
         return None
 
-    payload = packet[6:6+payload_length_decimal]
-    if len(payload) != payload_length_decimal:
+    if len(packet) < 6 + payload_length_decimal:
         aerisutils.print_log('Error: extracted payload length was not expected.', True)
         return None
-    if len(payload) == 0:
-        payload = None
 
-    final_character = packet[6+payload_length_decimal:7+payload_length_decimal]
-    if final_character != ETX:
+    if len(packet) < 7 + payload_length_decimal or packet[6 + payload_length_decimal] != ETX:
+        final_character = bytes(packet[6 + payload_length_decimal:7 + payload_length_decimal])
         aerisutils.print_log(f'Error: byte after the payload was not an ETX; it was (binary) {final_character}', verbose=True)
         return None
 
+    payload = bytes(packet[6:6 + payload_length_decimal]) if payload_length_decimal > 0 else None
     return shoulder_tap.Udp0ShoulderTap(payload, sequence_decimal, imsi)
+
+
+# Udp0 sequence numbers are 16 bits and wrap around
+SEQUENCE_MODULUS = 0x10000
+
+
+class ShoulderTapWindow:
+    '''Drops repeated shoulder taps and, optionally, puts taps back in sequence-number order.
+
+    AerFrame retries shoulder taps, so the same tap (same sequence number) can arrive several times.
+    The window remembers the last `size` sequence numbers in a bitmap relative to the highest one seen,
+    so memory stays the same however long it runs. Sequence numbers are compared modulo 2**16: a number
+    up to half the sequence space ahead of the highest one is newer, anything else is older. A tap older
+    than the window is taken as the sender starting over, and the window restarts at it.
+    Use one window per device.
+    '''
+
+    def __init__(self, size=1024, reorder=0, reorder_timeout=2.0):
+        '''
+        Parameters
+        ----------
+        size : int, optional
+            How many sequence numbers back duplicates are recognized. At most half the sequence space.
+        reorder : int, optional
+            How many taps may be held back waiting for a missing sequence number. 0 passes taps on
+            in arrival order.
+        reorder_timeout : float, optional
+            Seconds a tap is held back at most before the missing taps before it are given up on.
+        '''
+        if not 0 < size <= SEQUENCE_MODULUS // 2:
+            raise ValueError('Window size must be between 1 and ' + str(SEQUENCE_MODULUS // 2))
+        self.size = size
+        self.reorder = reorder
+        self.reorder_timeout = reorder_timeout
+        self.duplicates = 0
+        self.gaps = 0
+        self.out_of_order = 0
+        self.restarts = 0
+        self._highest = None
+        self._seen = 0  # Bit i is set if sequence number highest - i was seen
+        self._mask = (1 << size) - 1
+        self._next = None  # The next sequence number to pass on when reordering
+        self._held = {}  # Sequence number to (tap, time it arrived)
+
+    def counters(self):
+        '''Returns a dict of duplicates, gaps (sequence numbers skipped when a newer tap arrived),
+        out_of_order (taps that arrived after a newer one) and restarts.'''
+        return {'duplicates': self.duplicates, 'gaps': self.gaps, 'out_of_order': self.out_of_order,
+                'restarts': self.restarts}
+
+    def add(self, tap, now=None):
+        '''Adds a tap that just arrived.
+        Returns
+        -------
+        A list of the taps to handle now, in order: empty for a duplicate or a tap held back for reordering.
+        '''
+        now = time.monotonic() if now is None else now
+        sequence = tap.payloadId % SEQUENCE_MODULUS
+        restarts = self.restarts
+        if not self._remember(sequence):
+            return []
+        if self.reorder <= 0:
+            return [tap]
+        taps = []
+        if self.restarts != restarts:
+            taps = self.flush()  # What is held back belongs to the old sequence
+            self._next = None
+        if self._next is None:
+            self._next = sequence
+        ahead = (sequence - self._next) % SEQUENCE_MODULUS
+        if ahead >= SEQUENCE_MODULUS // 2:
+            # Later than taps that were already passed on, so too late to put back in order
+            return taps + [tap]
+        self._held[sequence] = (tap, now)
+        return taps + self._release(now)
+
+    def expire(self, now=None):
+        '''Returns the held-back taps whose missing predecessors have taken longer than reorder_timeout.'''
+        if not self._held:
+            return []
+        return self._release(time.monotonic() if now is None else now)
+
+    def flush(self):
+        '''Returns all held-back taps, in order.'''
+        taps = []
+        while self._held:
+            self._skip_to_held()
+            taps += self._drain()
+        return taps
+
+    def _remember(self, sequence):
+        '''Marks sequence as seen and updates the counters. Returns False if it was seen before.'''
+        if self._highest is None:
+            self._highest, self._seen = sequence, 1
+            return True
+        ahead = (sequence - self._highest) % SEQUENCE_MODULUS
+        if ahead == 0:
+            self.duplicates += 1
+            return False
+        if ahead < SEQUENCE_MODULUS // 2:
+            self.gaps += ahead - 1
+            self._seen = ((self._seen << ahead) | 1) & self._mask
+            self._highest = sequence
+            return True
+        behind = SEQUENCE_MODULUS - ahead
+        if behind >= self.size:
+            self.restarts += 1
+            self._highest, self._seen = sequence, 1
+            return True
+        if self._seen >> behind & 1:
+            self.duplicates += 1
+            return False
+        self._seen |= 1 << behind
+        self.out_of_order += 1
+        return True
+
+    def _release(self, now):
+        taps = self._drain()
+        while self._held and (len(self._held) > self.reorder or
+                              now - min(arrived for _, arrived in self._held.values()) >= self.reorder_timeout):
+            self._skip_to_held()
+            taps += self._drain()
+        return taps
+
+    def _drain(self):
+        '''Passes on held taps for as long as the next sequence number is among them.'''
+        taps = []
+        while self._next in self._held:
+            taps.append(self._held.pop(self._next)[0])
+            self._next = (self._next + 1) % SEQUENCE_MODULUS
+        return taps
+
+    def _skip_to_held(self):
+        '''Gives up on the missing taps before the earliest held one.'''
+        self._next = min(self._held, key=lambda sequence: (sequence - self._next) % SEQUENCE_MODULUS)
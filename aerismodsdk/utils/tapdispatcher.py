@@ -0,0 +1,184 @@
+"""
+Copyright 2020 Aeris Communications Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import queue
+import threading
+import time
+
+import aerismodsdk.utils.aerisutils as aerisutils
+from aerismodsdk.utils.instrumentation import Histogram
+
+# What dispatch does when the queue is full
+BLOCK = 'block'  # Wait for a worker to take a tap off the queue
+DROP = 'drop'  # Drop the new tap and count it
+
+
+class ShoulderTapDispatcher:
+    '''Runs shoulder-tap handlers on a pool of worker threads, so that the loop receiving the taps
+    never waits for a slow handler.
+
+    Taps wait in a queue of bounded depth; when it is full, dispatch either blocks or drops the tap,
+    depending on the policy. Each worker runs every handler on one tap at a time, in the order the
+    handlers were added. How long each handler takes is kept in a Histogram per handler.
+    '''
+
+    def __init__(self, workers=4, queue_depth=100, policy=BLOCK, verbose=False):
+        '''
+        Parameters
+        ----------
+        workers : int, optional
+            Number of worker threads.
+        queue_depth : int, optional
+            How many taps may wait for a worker.
+        policy : str, optional
+            BLOCK or DROP: what dispatch does when queue_depth taps are already waiting.
+        verbose : bool, optional
+            True for verbose output.
+        '''
+        if policy not in (BLOCK, DROP):
+            raise ValueError('Unknown policy ' + str(policy))
+        self.workers = workers
+        self.policy = policy
+        self.verbose = verbose
+        self.dispatched = 0
+        self.dropped = 0
+        self._taps = queue.Queue(maxsize=queue_depth)
+        self._lock = threading.Lock()
+        self._handlers = []  # (name, handler, stats)
+        self._threads = []
+
+    # ========================================================================
+    #
+    # Handlers
+    #
+
+    def add_handler(self, handler, name=None):
+        '''Calls handler(tap) for each dispatched tap, on a worker thread. Returns the handler.'''
+        stats = {'histogram': Histogram(), 'errors': 0}
+        with self._lock:
+            self._handlers.append((name or getattr(handler, '__name__', repr(handler)), handler, stats))
+        return handler
+
+    def remove_handler(self, handler):
+        with self._lock:
+            self._handlers = [h for h in self._handlers if h[1] != handler]
+
+    # ========================================================================
+    #
+    # Thread control
+    #
+
+    def start(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name='ShoulderTapDispatcher ' + str(len(self._threads)),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        '''Stops the workers once the taps already queued are handled.'''
+        for _ in self._threads:
+            self._taps.put(None)
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        while True:
+            tap = self._taps.get()
+            if tap is None:
+                return
+            with self._lock:
+                handlers = list(self._handlers)
+            for name, handler, stats in handlers:
+                start = time.monotonic()
+                try:
+                    handler(tap)
+                    failed = False
+                except Exception as e:
+                    aerisutils.print_log('Error in shoulder-tap handler ' + name + ': ' + str(e))
+                    failed = True
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    stats['histogram'].record(elapsed)
+                    stats['errors'] += failed
+
+    # ========================================================================
+    #
+    # Dispatching
+    #
+
+    def dispatch(self, tap, timeout=None):
+        '''Queues tap for the handlers. Does not wait for them to run.
+        Parameters
+        ----------
+        tap : BaseShoulderTap
+            The tap.
+        timeout : float, optional
+            With the BLOCK policy, seconds to wait for room in the queue at most before dropping the tap.
+            By default, waits as long as it takes.
+        Returns
+        -------
+        True if the tap was queued, False if it was dropped.
+        '''
+        try:
+            if self.policy == BLOCK:
+                self._taps.put(tap, timeout=timeout)
+            else:
+                self._taps.put_nowait(tap)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            aerisutils.print_log('Shoulder-tap queue full, dropped ' + str(tap.getRequestId()), self.verbose)
+            return False
+        with self._lock:
+            self.dispatched += 1
+        return True
+
+    def run(self, taps):
+        '''Dispatches every tap from an iterable, e.g. Module.get_shoulder_taps, until it ends.'''
+        self.start()
+        for tap in taps:
+            if tap is not None:
+                self.dispatch(tap)
+
+    def summary(self):
+        '''Returns a dict of dispatched, dropped and queued tap counts, and under handlers, a dict of
+        handler name to count, total_s, p50_s, p95_s, p99_s, max_s and errors.'''
+        with self._lock:
+            handlers = {}
+            for name, _, stats in self._handlers:
+                histogram = stats['histogram']
+                handlers[name] = {
+                    'count': histogram.count,
+                    'total_s': histogram.total,
+                    'p50_s': histogram.percentile(50),
+                    'p95_s': histogram.percentile(95),
+                    'p99_s': histogram.percentile(99),
+                    'max_s': histogram.max,
+                    'errors': stats['errors'],
+                }
+            return {'dispatched': self.dispatched, 'dropped': self.dropped, 'queued': self._taps.qsize(),
+                    'handlers': handlers}
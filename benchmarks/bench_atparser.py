@@ -0,0 +1,111 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Throughput benchmark for the AT response tokenizer (aerismodsdk.utils.atparser).
+
+Parses a corpus of recorded responses over and over and reports responses and megabytes per second,
+next to the prefix/split parsing Module.parse_response used before the tokenizer. By default the corpus
+is recorded from the Quectel simulator; --capture uses the responses in a serial capture file instead.
+
+    python -m benchmarks.bench_atparser [--capture FILE] [--seconds S] [--json FILE]
+"""
+
+import argparse
+import json
+import time
+
+from aerismodsdk.simulator import QuectelSimulator
+from aerismodsdk.utils import atparser, rmutils, serialcapture
+
+COMMANDS = ['AT+CSQ', 'AT+CREG?', 'AT+CEREG?', 'AT+COPS?', 'AT+COPS=?', 'AT+QCCID', 'AT+QNWINFO',
+            'AT+QENG="servingcell"', 'AT+QENG="neighbourcell"', 'AT+CGDCONT?', 'AT+QIACT?',
+            'AT+CRSM=176,28423,0,0,0', 'AT+CPSMS?', 'AT+CEDRXRDP', 'AT+QCFG="band"']
+
+
+def record_simulator():
+    '''Returns the responses of the Quectel simulator to COMMANDS.'''
+    modem = QuectelSimulator().start()
+    ser = rmutils.open_serial(modem.port)
+    try:
+        rmutils.write(ser, 'AT+QIACT=1', verbose=False)
+        return [rmutils.write(ser, cmd, verbose=False) for cmd in COMMANDS]
+    finally:
+        ser.close()
+        modem.stop()
+
+
+def read_responses(path):
+    '''Returns the responses in a capture file: what the module sent after each write.'''
+    responses = []
+    for session in serialcapture.read_capture(path):
+        response = b''
+        for record in session:
+            if record.direction == serialcapture.TX:
+                if response:
+                    responses.append(response.decode('utf-8', errors='replace'))
+                response = b''
+            else:
+                response += record.data
+        if response:
+            responses.append(response.decode('utf-8', errors='replace'))
+    return responses
+
+
+def legacy_parse(response):
+    '''The prefix/split parsing Module.parse_response did before atparser, for every prefixed line.'''
+    values = []
+    for line in response.split('\r\n'):
+        if ':' in line and line[:1] in '+#':
+            prefix = line[:line.index(':') + 1]
+            stripped = response.rstrip('OK\r\n').lstrip()
+            values.append(stripped[stripped.rfind(prefix) + len(prefix):].lstrip().split(','))
+    return values
+
+
+def run(parse, responses, seconds):
+    '''Parses responses with parse for about seconds. Returns (responses parsed, elapsed seconds).'''
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for response in responses:
+            parse(response)
+        count += len(responses)
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--capture', help='serial capture file to take the responses from')
+    parser.add_argument('--seconds', type=float, default=2.0, help='seconds to run each parser')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    responses = read_responses(args.capture) if args.capture else record_simulator()
+    size = sum(len(r) for r in responses)
+    results = {'responses': len(responses), 'bytes': size}
+    for name, parse in (('atparser', atparser.tokenize), ('legacy', legacy_parse)):
+        count, elapsed = run(parse, responses, args.seconds)
+        results[name] = {'responses_per_s': count / elapsed,
+                         'mb_per_s': count * size / len(responses) / elapsed / 1e6}
+        print('{0:10} {1:10.0f} responses/s {2:8.2f} MB/s'.format(
+            name, results[name]['responses_per_s'], results[name]['mb_per_s']))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
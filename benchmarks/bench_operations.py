@@ -0,0 +1,238 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Times the SDK's high-level operations and the AT commands they send.
+
+Runs each operation a number of times against the pty simulator (default) or a real module, and
+reports p50/p95/p99 latency per operation and per AT command, the bytes moved, and how the time
+splits into waiting on serial I/O, sleeping and the rest (parsing, logging). --json writes the
+results, so that runs can be compared across SDK versions and modem firmware.
+
+    python -m benchmarks.bench_operations quectel [--port /dev/ttyUSB2] [--iterations N] [--json FILE]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import threading
+import time
+
+import aerismodsdk
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.modulefactory import module_factory
+from aerismodsdk.simulator import simulator_for
+from aerismodsdk.utils import rmutils
+from aerismodsdk.utils.instrumentation import percentile
+
+ECHO_HOST = '35.212.147.4'
+ECHO_PORT = 3030
+
+OPERATIONS = {
+    'get_info': lambda module, args: module.get_info(),
+    'network_info': lambda module, args: module.network_info(False, False),
+    'sim_info': lambda module, args: module.sim_info(False),
+    'create_packet_session': lambda module, args: module.create_packet_session(),
+    'udp_echo': lambda module, args: module.udp_echo(ECHO_HOST, ECHO_PORT, 0, args.echo_wait, verbose=False),
+}
+
+# Lines that end a command's response, including the result of a send command
+FINAL_RESULTS = rmutils.SEND_RESULT_CODES
+
+
+class TimedSerial:
+    '''Wraps a serial port and accounts the time spent in reads and writes, per AT command.
+
+    A command record starts when a line beginning with AT is written and ends with its final
+    result code. Reads after that (e.g. waiting for URCs) only count towards the operation.
+    '''
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.commands = []
+        self.io_wait = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._current = None
+        self._response = bytearray()
+        self._line_start = 0
+
+    def write(self, data):
+        data = bytes(data)
+        now = time.monotonic()
+        if data[:2].upper() == b'AT':
+            self._current = {'command': rmutils.command_verb(data.decode('utf-8', errors='replace')),
+                             'start': now, 'end': now, 'bytes_out': 0, 'bytes_in': 0, 'io_wait': 0.0}
+            self.commands.append(self._current)
+            self._response = bytearray()
+            self._line_start = 0
+        written = self.ser.write(data)
+        self._account(self._current, now, len(data), 0)
+        return written
+
+    def read(self, size=1):
+        start = time.monotonic()
+        data = self.ser.read(size)
+        current = self._current
+        self._account(current, start, 0, len(data))
+        if current is not None and data:
+            self._response += data
+            final, self._line_start = rmutils.scan_response(self._response, self._line_start, FINAL_RESULTS)
+            if final is not None:
+                self._current = None
+        return data
+
+    def _account(self, command, start, bytes_out, bytes_in):
+        now = time.monotonic()
+        self.io_wait += now - start
+        self.bytes_out += bytes_out
+        self.bytes_in += bytes_in
+        if command is not None:
+            command['io_wait'] += now - start
+            command['bytes_out'] += bytes_out
+            command['bytes_in'] += bytes_in
+            command['end'] = now
+
+    @property
+    def timeout(self):
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.ser.timeout = timeout
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+@contextlib.contextmanager
+def count_sleep(totals):
+    '''Adds the seconds the calling thread spends in time.sleep to totals['sleep'].'''
+    thread = threading.current_thread()
+    sleep = time.sleep
+
+    def counting_sleep(seconds):
+        start = time.monotonic()
+        sleep(seconds)
+        if threading.current_thread() is thread:
+            totals['sleep'] += time.monotonic() - start
+    time.sleep = counting_sleep
+    try:
+        yield totals
+    finally:
+        time.sleep = sleep
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': max(values) * 1000,
+    }
+
+
+def run_operation(module, timed, name, args):
+    runs = []
+    commands = {}
+    for _ in range(args.iterations):
+        timed.commands = []
+        io_wait, bytes_in, bytes_out = timed.io_wait, timed.bytes_in, timed.bytes_out
+        totals = {'sleep': 0.0}
+        with count_sleep(totals), contextlib.redirect_stdout(io.StringIO()):
+            start = time.monotonic()
+            OPERATIONS[name](module, args)
+            elapsed = time.monotonic() - start
+        runs.append({'elapsed': elapsed, 'io_wait': timed.io_wait - io_wait, 'sleep': totals['sleep'],
+                     'bytes_in': timed.bytes_in - bytes_in, 'bytes_out': timed.bytes_out - bytes_out,
+                     'commands': len(timed.commands)})
+        for command in timed.commands:
+            commands.setdefault(command['command'], []).append(command)
+    result = summarize([r['elapsed'] for r in runs])
+    for key in ('io_wait', 'sleep', 'bytes_in', 'bytes_out', 'commands'):
+        result[key + '_per_run'] = sum(r[key] for r in runs) / len(runs)
+    result['other_per_run'] = sum(
+        r['elapsed'] - r['io_wait'] - r['sleep'] for r in runs) / len(runs)
+    return result, commands
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modem_mfg', choices=[m.name for m in Manufacturer])
+    parser.add_argument('--port', help='serial port of a real module; default: run against the simulator')
+    parser.add_argument('--apn', default='lpiot.aer.net')
+    parser.add_argument('--iterations', type=int, default=20, help='runs of each operation')
+    parser.add_argument('--operations', default=','.join(OPERATIONS), help='comma-separated operations to run')
+    parser.add_argument('--latency', type=float, default=0.005, help='simulator seconds per command')
+    parser.add_argument('--echo-wait', type=int, default=1, help='seconds udp_echo waits for the echo')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    modem_mfg = Manufacturer[args.modem_mfg]
+    simulator = None
+    port = args.port
+    if port is None:
+        simulator = simulator_for(modem_mfg, latency=args.latency).start()
+        simulator.echo_packets = True
+        port = simulator.port
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            module = module_factory().get(modem_mfg, port, args.apn, verbose=False)
+        if module.get_serial() is None:
+            raise SystemExit('Could not open ' + port)
+        timed = TimedSerial(module.myserial)
+        module.myserial = timed
+        with contextlib.redirect_stdout(io.StringIO()):
+            info = module.get_info()
+        results = {
+            'sdk_version': aerismodsdk.__version__,
+            'python': platform.python_version(),
+            'modem': {'manufacturer': args.modem_mfg, 'model': info.get('model'), 'firmware': info.get('rev'),
+                      'simulated': simulator is not None, 'port': port},
+            'iterations': args.iterations,
+            'operations': {},
+            'commands': {},
+        }
+        commands = {}
+        for name in args.operations.split(','):
+            result, op_commands = run_operation(module, timed, name, args)
+            results['operations'][name] = result
+            for verb, records in op_commands.items():
+                commands.setdefault(verb, []).extend(records)
+            print('{0:24} p50 {p50_ms:8.1f} ms  p95 {p95_ms:8.1f} ms  p99 {p99_ms:8.1f} ms  '
+                  'io {io_wait_per_run:6.3f}s  sleep {sleep_per_run:6.3f}s  other {other_per_run:6.3f}s  '
+                  '{bytes_out_per_run:6.0f} B out {bytes_in_per_run:6.0f} B in  {commands_per_run:4.0f} cmds'.format(
+                      name, **result))
+        print()
+        for verb, records in sorted(commands.items(), key=lambda c: -sum(r['end'] - r['start'] for r in c[1])):
+            summary = summarize([r['end'] - r['start'] for r in records])
+            summary['io_wait_ms'] = sum(r['io_wait'] for r in records) / len(records) * 1000
+            summary['bytes_out'] = sum(r['bytes_out'] for r in records) / len(records)
+            summary['bytes_in'] = sum(r['bytes_in'] for r in records) / len(records)
+            results['commands'][verb] = summary
+            print('{0:24} n {count:5}  p50 {p50_ms:8.2f} ms  p95 {p95_ms:8.2f} ms  p99 {p99_ms:8.2f} ms  '
+                  '{bytes_out:5.0f} B out {bytes_in:6.0f} B in'.format(verb, **summary))
+        if args.json:
+            with open(args.json, 'w') as out:
+                json.dump(results, out, indent=2, sort_keys=True)
+    finally:
+        if simulator is not None:
+            simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Throughput benchmark for the Quectel +QIURC "recv" parser (aerismodsdk.utils.qiurc).
+
+Builds a buffer of UDP packet URCs and parses it whole and in chunks of --chunk bytes, the way output
+arrives from rmutils.wait_urc, and reports datagrams and megabytes per second. For buffers of up to
+--legacy-max datagrams it also times the slicing parser udp_urcs_to_payloads used before, whose cost
+grows with the square of the buffer size.
+
+    python -m benchmarks.bench_qiurc [--datagrams 1000 10000] [--size BYTES] [--chunk BYTES] [--json FILE]
+"""
+
+import argparse
+import json
+import re
+import time
+
+from aerismodsdk.utils import aerisutils
+from aerismodsdk.utils.qiurc import DatagramParser
+
+
+def build_buffer(datagrams, size):
+    payload = bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+    urc = b'+QIURC: "recv",1,' + str(size).encode() + b',"10.0.0.1",3030\r\n' + payload + b'\r\n'
+    return urc * datagrams
+
+
+def legacy_urcs_to_payloads(urcs, verbose=False):
+    '''The essentials of the parser udp_urcs_to_payloads used before DatagramParser: it slices the rest of
+    the buffer after every field and formats log strings whether or not they are printed.'''
+    urc_regex = re.compile(rb'\+QIURC: "recv",(?P<connectID>\d+),(?P<currentrecvlength>\d+),"(?P<remoteIP>[^"]+)",(?P<remotePort>\d+)')
+    payloads = []
+    current_input = urcs
+    while len(current_input) > 0:
+        aerisutils.print_log('Remaining input: ' + aerisutils.bytes_to_utf_or_hex(current_input), verbose)
+        if current_input[:len(b'+QIURC: "recv",')] == b'+QIURC: "recv",':
+            next_carriage_return_index = current_input.find(b'\r')
+            parse_result = urc_regex.search(current_input[:next_carriage_return_index])
+            length = int(parse_result.group('currentrecvlength'))
+            current_input = current_input[next_carriage_return_index:][2:]
+            payloads.append(current_input[:length])
+            aerisutils.print_log('Found packet: ' + aerisutils.bytes_to_utf_or_hex(current_input[:length]), verbose)
+            current_input = current_input[length:][2:]
+        else:
+            current_input = current_input[current_input.find(b'\n') + 1:]
+    return payloads
+
+
+def parse_whole(data, chunk):
+    return len(DatagramParser().feed(data))
+
+
+def parse_chunked(data, chunk):
+    parser = DatagramParser()
+    count = 0
+    for start in range(0, len(data), chunk):
+        count += len(parser.feed(data[start:start + chunk]))
+    return count
+
+
+def parse_legacy(data, chunk):
+    return len(legacy_urcs_to_payloads(data))
+
+
+def timed(parse, data, chunk, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = parse(data, chunk)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--datagrams', type=int, nargs='+', default=[1000, 10000], help='datagrams per buffer')
+    parser.add_argument('--size', type=int, default=64, help='payload bytes per datagram')
+    parser.add_argument('--chunk', type=int, default=4096, help='bytes per feed for the chunked run')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each; the fastest counts')
+    parser.add_argument('--legacy-max', type=int, default=1000, help='largest buffer to time the old parser on')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for datagrams in args.datagrams:
+        data = build_buffer(datagrams, args.size)
+        runs = [('whole', parse_whole), ('chunked', parse_chunked)]
+        if datagrams <= args.legacy_max:
+            runs.append(('legacy', parse_legacy))
+        for name, parse in runs:
+            count, elapsed = timed(parse, data, args.chunk, args.repeat)
+            assert count == datagrams, (name, count)
+            result = {'datagrams': datagrams, 'bytes': len(data), 'parser': name, 'seconds': elapsed,
+                      'datagrams_per_s': datagrams / elapsed, 'mb_per_s': len(data) / elapsed / 1e6}
+            results.append(result)
+            print('{datagrams:6} datagrams {parser:8} {seconds:8.4f} s {datagrams_per_s:10.0f} datagrams/s '
+                  '{mb_per_s:7.2f} MB/s'.format(**result))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
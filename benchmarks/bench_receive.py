@@ -0,0 +1,96 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Burst receive benchmark for shoulder taps: Quectel direct push mode against buffer access mode.
+
+Listens with Module.get_shoulder_taps on the pty simulator, delivers --burst shoulder-tap packets at once,
+and reports how long it takes until the last tap is yielded, taps per second, and how many AT+QIRD
+round trips buffer access mode needed. --latency adds that many seconds to each AT command the simulator
+answers, to stand in for a real module.
+
+    python -m benchmarks.bench_receive [--burst 100 500] [--size BYTES] [--latency S] [--json FILE]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import queue
+import threading
+import time
+
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.modulefactory import module_factory
+from aerismodsdk.simulator import QuectelSimulator
+
+
+def build_packet(sequence, size):
+    return b'\x0201' + '{0:04x}{1:02x}'.format(sequence % 0x10000, size).encode() + b'a' * size + b'\x03'
+
+
+def run_burst(burst, size, latency, buffered):
+    modem = QuectelSimulator(latency=latency).start()
+    module = module_factory().get(Manufacturer.quectel, modem.port, 'testapn', verbose=False)
+    taps = queue.Queue()
+
+    def listen():
+        for tap in module.get_shoulder_taps(buffered=buffered):
+            taps.put(tap)
+    threading.Thread(target=listen, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not modem.sockets and time.monotonic() < deadline:
+        time.sleep(0.01)
+    commands = len(modem.commands)
+    start = time.perf_counter()
+    for sequence in range(burst):
+        modem.deliver_packet(build_packet(sequence, size))
+    received = 0
+    try:
+        while received < burst:
+            taps.get(timeout=30)
+            received += 1
+    except queue.Empty:
+        pass
+    elapsed = time.perf_counter() - start
+    reads = len([command for command in modem.commands[commands:] if command.startswith('+QIRD=')])
+    module.get_serial().close()
+    modem.stop()
+    return {'mode': 'buffered' if buffered else 'push', 'burst': burst, 'received': received,
+            'seconds': elapsed, 'taps_per_s': received / elapsed, 'qird_round_trips': reads}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--burst', type=int, nargs='+', default=[100, 500], help='packets per burst')
+    parser.add_argument('--size', type=int, default=64, help='payload bytes per packet, at most 255')
+    parser.add_argument('--latency', type=float, default=0, help='seconds the simulator takes per AT command')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for burst in args.burst:
+        for buffered in (False, True):
+            with contextlib.redirect_stdout(io.StringIO()):  # The SDK's own logging
+                result = run_burst(burst, args.size, args.latency, buffered)
+            results.append(result)
+            print('{burst:5} packets {mode:8} {received:5} taps {seconds:8.3f} s {taps_per_s:8.0f} taps/s '
+                  '{qird_round_trips:5} AT+QIRD'.format(**result))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
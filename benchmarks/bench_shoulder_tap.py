@@ -0,0 +1,124 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Benchmark for shoulder-tap parsing (aerismodsdk.utils.shoulder_tap) and the memory held per tap.
+
+Parses bursts of Udp0 packets with parse_many and with the slicing parser used before the parser
+registry, which copied the rest of the packet at each step, and reports taps per second. It then
+reports the bytes tracemalloc sees per Udp0ShoulderTap while --held taps are kept.
+
+    python -m benchmarks.bench_shoulder_tap [--taps 1000 10000] [--size BYTES] [--held N] [--json FILE]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from aerismodsdk.model.shoulder_tap import Udp0ShoulderTap
+from aerismodsdk.utils import aerisutils
+from aerismodsdk.utils.shoulder_tap import parse_many
+
+IMSI = '310410123456789'
+
+
+def build_packets(taps, size):
+    payload = bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+    return [b'\x0201' + '{0:04x}{1:02x}'.format(sequence % 0x10000, size).encode() + payload + b'\x03'
+            for sequence in range(taps)]
+
+
+def legacy_parse(packet, imsi):
+    '''The essentials of parse_shoulder_tap before the parser registry: an if/else on the message type,
+    a slice, so a copy, of the rest of the packet for each field, and log strings formatted whether or
+    not they are printed.'''
+    aerisutils.print_log('The entire packet is: <' + aerisutils.bytes_to_utf_or_hex(packet) + '>', False)
+    if packet[0] != 2:
+        return None
+    if packet[1:3] != b'01':
+        return None
+    packet = packet[3:]
+    sequence_hex = packet[:4]
+    if len(sequence_hex) != 4:
+        return None
+    aerisutils.print_log(f'Sequence number binary: {sequence_hex}', False)
+    sequence_decimal = int(sequence_hex, base=16)
+    payload_length_hex = packet[4:6]
+    aerisutils.print_log(f'Payload length in hex: {payload_length_hex}', False)
+    payload_length_decimal = int(payload_length_hex, base=16)
+    payload = packet[6:6 + payload_length_decimal]
+    if len(payload) != payload_length_decimal:
+        return None
+    if packet[6 + payload_length_decimal:7 + payload_length_decimal] != b'\x03':
+        return None
+    return Udp0ShoulderTap(payload or None, sequence_decimal, imsi)
+
+
+def parse_registry(packets):
+    return len(parse_many(packets, IMSI))
+
+
+def parse_legacy(packets):
+    return len([tap for tap in (legacy_parse(packet, IMSI) for packet in packets) if tap is not None])
+
+
+def timed(parse, packets, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = parse(packets)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+
+def bytes_per_tap(held):
+    '''Bytes allocated per tap object, not counting its payload.'''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    taps = [Udp0ShoulderTap(None, sequence, IMSI) for sequence in range(held)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(taps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--taps', type=int, nargs='+', default=[1000, 10000], help='packets per burst')
+    parser.add_argument('--size', type=int, default=140, help='payload bytes per packet, at most 255')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each; the fastest counts')
+    parser.add_argument('--held', type=int, default=100000, help='taps to hold for the memory measurement')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for taps in args.taps:
+        packets = build_packets(taps, args.size)
+        for name, parse in [('registry', parse_registry), ('legacy', parse_legacy)]:
+            count, elapsed = timed(parse, packets, args.repeat)
+            assert count == taps, (name, count)
+            result = {'taps': taps, 'parser': name, 'seconds': elapsed, 'taps_per_s': taps / elapsed}
+            results.append(result)
+            print('{taps:6} taps {parser:8} {seconds:8.4f} s {taps_per_s:10.0f} taps/s'.format(**result))
+    held = {'held': args.held, 'bytes_per_tap': bytes_per_tap(args.held)}
+    results.append(held)
+    print('{held} taps held: {bytes_per_tap:.0f} bytes per tap'.format(**held))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Cold-start benchmark for the aeriscli entry point.
+
+Times `aeriscli --help` (python -m aerismodsdk.cli --help) in fresh interpreters, breaks the import
+of aerismodsdk.cli down with python -X importtime, and checks that the heavy optional dependencies
+(RPi.GPIO, jwt, cryptography, requests, xmodem, usb) are not imported until a command needs them.
+
+    python -m benchmarks.bench_startup [--runs N] [--top N] [--budget-ms MS] [--json FILE]
+
+The budget applies to the time aeriscli adds on top of starting a bare interpreter (python -c pass),
+which depends on the site packages installed. Exits with status 1 if the median is over the budget. Run it twice after changing code,
+or with bytecode writing on, so that compiling does not count.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import aerismodsdk
+from aerismodsdk.utils.instrumentation import percentile
+
+# Modules that only some commands need, and that aerismodsdk.cli must not import up front
+DEFERRED_MODULES = ('RPi', 'jwt', 'cryptography', 'requests', 'xmodem', 'usb')
+
+
+def time_command(args, runs):
+    '''Returns the wall times in seconds of running the interpreter with args, runs times.'''
+    times = []
+    for _ in range(runs):
+        start = time.monotonic()
+        subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.monotonic() - start)
+    return times
+
+
+def import_times(runs):
+    '''Returns {module: [cumulative microseconds per run]} from python -X importtime.'''
+    times = {}
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import aerismodsdk.cli'],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        for line in process.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            times.setdefault(name.strip(), []).append(int(cumulative_us))
+    return times
+
+
+def deferred_imports():
+    '''Returns the DEFERRED_MODULES that importing aerismodsdk.cli pulls in.'''
+    code = ('import json, sys\n'
+            'import aerismodsdk.cli\n'
+            'print(json.dumps(sorted(set(m.split(".")[0] for m in sys.modules))))')
+    output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            universal_newlines=True, check=True).stdout
+    loaded = set(json.loads(output))
+    return [name for name in DEFERRED_MODULES if name in loaded]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='interpreters to start for each measurement')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to list')
+    parser.add_argument('--budget-ms', type=float, default=100, help='budget in ms for the time aeriscli --help adds to interpreter start')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    bare_times = time_command(['-c', 'pass'], args.runs)
+    help_times = time_command(['-m', 'aerismodsdk.cli', '--help'], args.runs)
+    imports = import_times(args.runs)
+    medians = {name: percentile(values, 50) / 1000.0 for name, values in imports.items()}
+    loaded = deferred_imports()
+    results = {
+        'sdk_version': aerismodsdk.__version__,
+        'python': sys.version.split()[0],
+        'bytecode_cache': not sys.dont_write_bytecode and not os.environ.get('PYTHONDONTWRITEBYTECODE'),
+        'help_ms': {'p50': percentile(help_times, 50) * 1000, 'p95': percentile(help_times, 95) * 1000,
+                    'min': min(help_times) * 1000},
+        'interpreter_ms': percentile(bare_times, 50) * 1000,
+        'import_cli_ms': medians.get('aerismodsdk.cli'),
+        'slowest_imports_ms': dict(sorted(medians.items(), key=lambda m: -m[1])[:args.top]),
+        'deferred_modules_loaded': loaded,
+    }
+    print('aeriscli --help: p50 {p50:.1f} ms, p95 {p95:.1f} ms, min {min:.1f} ms'.format(**results['help_ms']))
+    overhead_ms = results['help_ms']['p50'] - results['interpreter_ms']
+    results['overhead_ms'] = overhead_ms
+    print('bare interpreter: p50 {0:.1f} ms, aeriscli overhead {1:.1f} ms'.format(results['interpreter_ms'], overhead_ms))
+    print('import aerismodsdk.cli: {0:.1f} ms (median cumulative)'.format(results['import_cli_ms'] or 0))
+    for name, ms in results['slowest_imports_ms'].items():
+        print('  {0:8.1f} ms  {1}'.format(ms, name))
+    if loaded:
+        print('Imported up front but only needed by some commands: ' + ', '.join(loaded))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    if overhead_ms > args.budget_ms:
+        print('Over the {0:.0f} ms budget'.format(args.budget_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark for rmutils.wait_urc against a pty-simulated modem.
+
+Reports how many bytes per second wait_urc can take in, and the latency from the
+moment a URC is written to the modem side of the pty until wait_urc returns it.
+
+    python -m benchmarks.bench_wait_urc [--bytes N] [--urcs N] [--interval S]
+"""
+
+import argparse
+import os
+import threading
+import time
+
+from aerismodsdk.utils import rmutils
+from aerismodsdk.utils.instrumentation import percentile
+
+
+def bench_throughput(master, ser, total_bytes):
+    line = b'+QIURC: "recv",1,32,"10.0.0.1",3030\r\n' + b'x' * 32 + b'\r\n'
+    count = max(1, total_bytes // len(line))
+    data = line * count + b'DONE\r\n'
+
+    def feed():
+        view = memoryview(data)
+        while view:
+            written = os.write(master, view[:65536])
+            view = view[written:]
+    start = time.monotonic()
+    threading.Thread(target=feed, daemon=True).start()
+    urcs = rmutils.wait_urc(ser, 60, None, returnonvalue=b'DONE', verbose=False, returnbytes=True)
+    elapsed = time.monotonic() - start
+    return len(urcs), elapsed
+
+
+def bench_latency(master, ser, urcs, interval):
+    sent = {}
+
+    def feed():
+        for seq in range(urcs):
+            time.sleep(interval)
+            sent[seq] = time.monotonic()
+            os.write(master, b'\r\n+BENCH: ' + str(seq).encode() + b'\r\n')
+    threading.Thread(target=feed, daemon=True).start()
+    latencies = []
+    while len(latencies) < urcs:
+        out = rmutils.wait_urc(ser, 5, None, returnonvalue='+BENCH:', verbose=False)
+        received = time.monotonic()
+        if '+BENCH:' not in out:
+            break
+        seq = int(out.split('+BENCH: ')[1].strip())
+        latencies.append(received - sent[seq])
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bytes', type=int, default=4 * 1024 * 1024, help='bytes to stream for the throughput test')
+    parser.add_argument('--urcs', type=int, default=200, help='URCs to send for the latency test')
+    parser.add_argument('--interval', type=float, default=0.01, help='seconds between URCs in the latency test')
+    args = parser.parse_args()
+
+    master, slave = os.openpty()
+    ser = rmutils.open_serial(os.ttyname(slave))
+    try:
+        received, elapsed = bench_throughput(master, ser, args.bytes)
+        print('throughput: {0} bytes in {1:.3f}s = {2:.0f} bytes/s'.format(received, elapsed, received / elapsed))
+        latencies = bench_latency(master, ser, args.urcs, args.interval)
+        print('latency over {0} URCs: p50 {1:.2f} ms, p99 {2:.2f} ms, max {3:.2f} ms'.format(
+            len(latencies), percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+            max(latencies) * 1000))
+    finally:
+        ser.close()
+        os.close(master)
+
+
+if __name__ == '__main__':
+    main()
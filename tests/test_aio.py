@@ -0,0 +1,146 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import threading
+import unittest
+
+from aerismodsdk import aio
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.model.shoulder_tap import Udp0ShoulderTap
+from aerismodsdk.utils import rmutils
+
+
+class ScriptedModem:
+    '''Answers AT commands written to a pty from a table of responses; unknown commands get OK.'''
+    def __init__(self, responses):
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        self.responses = responses
+        self.received_data = []
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        pending = b''
+        while True:
+            try:
+                pending += os.read(self.master, 1024)
+            except OSError:
+                return
+            while b'\r\n' in pending:
+                command, pending = pending.split(b'\r\n', 1)
+                response = self.responses.get(command.decode(), b'\r\nOK\r\n')
+                if callable(response):
+                    response = response()
+                os.write(self.master, response)
+                if response.endswith(b'> '):
+                    # Data mode: the command says how many bytes follow
+                    length = int(command.split(b',')[-1])
+                    while len(pending) < length:
+                        pending += os.read(self.master, 1024)
+                    self.received_data.append(pending[:length])
+                    pending = pending[length:]
+                    os.write(self.master, b'\r\nSEND OK\r\n')
+
+
+class AsyncModuleTests(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 10))
+
+    def open_module(self, modem):
+        return self.run_async(aio.open_module(Manufacturer.quectel, modem.port, 'lpiot.aer.net', verbose=False))
+
+    def test_serial_connection(self):
+        modem = ScriptedModem({'AT+CSQ': b'\r\n+CSQ: 20,99\r\n\r\nOK\r\n'})
+
+        async def run():
+            reader, writer = await aio.open_serial_connection(modem.port)
+            writer.write(b'AT+CSQ\r\n')
+            await writer.drain()
+            response = await reader.readuntil(b'OK\r\n')
+            writer.close()
+            return response
+        self.assertIn(b'+CSQ: 20,99', self.run_async(run()))
+
+    def test_get_info(self):
+        modem = ScriptedModem({
+            'AT+CIMI': b'\r\n310170000000001\r\n\r\nOK\r\n',
+            'AT+QCCID': b'\r\n+QCCID: 8901170000000000001\r\n\r\nOK\r\n',
+            'AT+GMI': b'\r\nQuectel\r\n\r\nOK\r\n',
+            'AT+GSN': b'\r\n866425030000001\r\n\r\nOK\r\n',
+        })
+        module = self.open_module(modem)
+        self.assertIsInstance(module, aio.AsyncQuectelModule)
+        info = self.run_async(module.get_info())
+        module.close()
+        self.assertEqual('310170000000001', info['imsi'])
+        self.assertEqual('8901170000000000001', info['iccid'])
+        self.assertEqual('866425030000001', info['imei'])
+
+    def test_concurrent_modules_share_the_loop(self):
+        modems = [ScriptedModem({'AT+CSQ': b'\r\n+CSQ: ' + str(i).encode() + b',99\r\n\r\nOK\r\n'}) for i in range(3)]
+        modules = [self.open_module(modem) for modem in modems]
+
+        async def run():
+            return await asyncio.gather(*[module.command('AT+CSQ') for module in modules])
+        responses = self.run_async(run())
+        for module in modules:
+            module.close()
+        for i, response in enumerate(responses):
+            self.assertIn('+CSQ: ' + str(i) + ',99', response)
+
+    def test_udp_send(self):
+        modem = ScriptedModem({
+            'AT+QIACT?': b'\r\n+QIACT: 1,1,1,"10.0.0.2"\r\n\r\nOK\r\n',
+            'AT+QIOPEN=1,0,"UDP","1.2.3.4",3030,0,1': b'\r\nOK\r\n\r\n+QIOPEN: 0,0\r\n',
+            'AT+QISEND=0,5': b'\r\n> ',
+        })
+        module = self.open_module(modem)
+        self.assertTrue(self.run_async(module.udp_send('1.2.3.4', 3030, 'hello')))
+        module.close()
+        self.assertEqual([b'hello'], modem.received_data)
+
+    def test_shoulder_taps(self):
+        packet = b'\x020100010d' + b'Hello, world!' + b'\x03'
+        urc = b'\r\n+QIURC: "recv",1,' + str(len(packet)).encode() + b',"1.2.3.4",3030\r\n' + packet + b'\r\n'
+        modem = ScriptedModem({
+            'AT+CIMI': b'\r\n310170000000001\r\n\r\nOK\r\n',
+            'AT+QIACT?': b'\r\n+QIACT: 1,1,1,"10.0.0.2"\r\n\r\nOK\r\n',
+            'AT+QIOPEN=1,1,"UDP SERVICE","127.0.0.1",0,23747,1': b'\r\nOK\r\n\r\n+QIOPEN: 1,0\r\n',
+            'AT+QISTATE=1,1': lambda: b'\r\n+QISTATE: 1,"UDP SERVICE","127.0.0.1",0,23747,2,1,1,0,"usbmodem"\r\n\r\nOK\r\n' + urc,
+        })
+        module = self.open_module(modem)
+
+        async def run():
+            taps = module.shoulder_taps()
+            tap = await taps.__anext__()
+            await taps.aclose()
+            return tap
+        tap = self.run_async(run())
+        module.close()
+        self.assertIsInstance(tap, Udp0ShoulderTap)
+        self.assertEqual(b'Hello, world!', tap.payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
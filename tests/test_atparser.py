@@ -0,0 +1,60 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from aerismodsdk.utils import atparser
+
+
+class TokenizeTests(unittest.TestCase):
+    def test_typed_fields(self):
+        records, final = atparser.tokenize('AT+CSQ;+COPS?\r\r\n+CSQ: 20,99\r\n+COPS: 0,0,"AT&T, Inc",7\r\n\r\nOK\r\n')
+        self.assertEqual('OK', final)
+        self.assertEqual([('+CSQ', [20, 99]), ('+COPS', [0, 0, 'AT&T, Inc', 7])], records)
+
+    def test_schema_keeps_strings(self):
+        self.assertEqual(['89014103211118510720'], atparser.values('\r\n+QCCID: 89014103211118510720\r\n\r\nOK\r\n', '+QCCID:'))
+        self.assertEqual([144, 0, '0012'], atparser.values('+CRSM: 144,0,0012\r\nOK\r\n', '+CRSM'))
+
+    def test_multi_line_responses(self):
+        response = ('\r\n+COPS: (2,"AT&T","AT&T","310410",7),(1,"T-Mobile","TMO","310260",8),,(0,1,2,3,4),(0,1,2)\r\n'
+                    '\r\nOK\r\n')
+        fields = atparser.values(response, '+COPS:')
+        self.assertEqual((2, 'AT&T', 'AT&T', '310410', 7), fields[0])
+        self.assertEqual('', fields[2])
+        self.assertEqual((0, 1, 2, 3, 4), fields[3])
+        response = ('+CMGL: 1,"REC UNREAD","+15555550100",,"20/01/01,12:00:00+00"\r\nhello, world\r\n'
+                    '+CMGL: 2,"REC READ","+15555550101",,"20/01/02,12:00:00+00"\r\nagain\r\nOK\r\n')
+        records, final = atparser.tokenize(response)
+        self.assertEqual([(None, ['hello, world']), (None, ['again'])], [r for r in records if r.prefix is None])
+        self.assertEqual([1, 2], [fields[0] for fields in atparser.records(response, '+CMGL')])
+
+    def test_raw_lines(self):
+        lines, final = atparser.tokenize('ATI\r\r\nQuectel\r\nBG96\r\nRevision: BG96MAR02A07M1G\r\n\r\nOK\r\n', raw=True)
+        self.assertEqual(['Quectel', 'BG96', 'Revision: BG96MAR02A07M1G'], lines)
+        self.assertEqual('OK', final)
+        self.assertEqual((['+CGSN: 490154203237518'], '+CME ERROR: 10'),
+                         atparser.tokenize('\r\n+CGSN: 490154203237518\r\n+CME ERROR: 10\r\n', raw=True))
+
+    def test_repeated_prefix_and_errors(self):
+        response = '\r\n+CEREG: 5\r\n\r\n+CEREG: 2,1,"1A2B","01A2B3C",7\r\n\r\nOK\r\n'
+        self.assertEqual([2, 1, '1A2B', '01A2B3C', 7], atparser.values(response, '+CEREG:'))
+        self.assertEqual([[5], [2, 1, '1A2B', '01A2B3C', 7]], atparser.records(response, '+CEREG'))
+        self.assertEqual([], atparser.values('\r\n+CME ERROR: 10\r\n', '+CSQ:'))
+        self.assertEqual([], atparser.values('\r\nOK\r\n', '+CSQ:'))
+
+
+if __name__ == '__main__':
+    unittest.main()
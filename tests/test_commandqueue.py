@@ -0,0 +1,143 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import threading
+import time
+import unittest
+
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.modulefactory import module_factory
+from aerismodsdk.simulator import QuectelSimulator
+from aerismodsdk.utils import commandqueue, rmutils
+
+
+class CommandQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.modem = QuectelSimulator().start()
+        self.module = module_factory().get(Manufacturer.quectel, self.modem.port, 'testapn', verbose=False)
+        self.queue = self.module.start_command_queue()
+
+    def tearDown(self):
+        self.queue.close()
+        self.modem.stop()
+
+    def test_submit_command(self):
+        future = self.queue.submit_command('AT+CSQ', verbose=False)
+        self.assertIn('+CSQ: 20,99', future.result(timeout=2))
+
+    def test_priority_lanes(self):
+        order = []
+        with self.module.exclusive():
+            # Queued while the port is leased, so they run in priority order afterwards
+            futures = [self.queue.submit(lambda ser, lane=lane: order.append(lane), priority)
+                       for lane, priority in (('background', commandqueue.BACKGROUND),
+                                              ('normal', commandqueue.NORMAL),
+                                              ('urgent', commandqueue.URGENT))]
+        for future in futures:
+            future.result(timeout=2)
+        self.assertEqual(['urgent', 'normal', 'background'], order)
+
+    def test_lease_keeps_other_threads_waiting(self):
+        responses = []
+        with self.module.exclusive():
+            poller = threading.Thread(target=lambda: responses.append(
+                rmutils.write(self.module.myserial, 'AT+CSQ', verbose=False)))
+            poller.start()
+            time.sleep(0.2)
+            self.assertEqual([], responses)
+            # The lease holder's own commands run right away
+            self.assertIn('OK', rmutils.write(self.module.myserial, 'AT', verbose=False))
+        poller.join(2)
+        self.assertIn('+CSQ: 20,99', responses[0])
+
+    def test_stop_ends_waiting_lease(self):
+        errors = []
+
+        def wait_for_lease():
+            try:
+                with self.queue.lease():
+                    pass
+            except concurrent.futures.CancelledError as e:
+                errors.append(e)
+        with self.queue.lease():
+            waiter = threading.Thread(target=wait_for_lease)
+            waiter.start()
+            time.sleep(0.1)  # Its lease is queued before the queue stops
+            stopper = threading.Thread(target=self.queue.stop)
+            stopper.start()
+            time.sleep(0.2)
+        stopper.join(2)
+        waiter.join(2)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(1, len(errors))
+
+    def test_submit_after_stop(self):
+        self.queue.stop()
+        with self.assertRaises(RuntimeError):
+            self.queue.submit(lambda ser: None)
+        with self.assertRaises(RuntimeError):
+            rmutils.write(self.module.myserial, 'AT', verbose=False)
+
+    def test_urc_wait_lets_commands_through(self):
+        urcs = []
+        waiter = threading.Thread(target=lambda: urcs.append(
+            rmutils.wait_urc(self.module.myserial, 5, None, returnonvalue='+CMTI:', verbose=False)))
+        waiter.start()
+        time.sleep(0.2)
+        background = self.queue.submit(lambda ser: 'background', commandqueue.BACKGROUND)
+        start = time.monotonic()
+        self.assertIn('+CSQ: 20,99', self.queue.submit_command('AT+CSQ', verbose=False).result(timeout=2))
+        self.assertLess(time.monotonic() - start, 1)
+        # Less urgent jobs still wait for the end of the wait
+        self.assertFalse(background.done())
+        self.modem.send_urc('+CMTI: "SM",1')
+        waiter.join(2)
+        self.assertIn('+CMTI: "SM",1', urcs[0])
+        self.assertEqual('background', background.result(timeout=2))
+
+    def test_urc_split_across_slices(self):
+        urcs = []
+        waiter = threading.Thread(target=lambda: urcs.append(
+            rmutils.wait_urc(self.module.myserial, 5, None, returnonvalue='+CMTI:', verbose=False)))
+        waiter.start()
+        time.sleep(0.1)
+        # The slice ends in the middle of the URC, and another thread's command runs before the next one
+        self.modem.send_urc(b'\r\n+CMTI: "SM"')
+        time.sleep(rmutils.URC_WAIT_SLICE + 0.1)
+        response = self.queue.submit_command('AT+CSQ', verbose=False).result(timeout=2)
+        self.modem.send_urc(b',1\r\n')
+        waiter.join(2)
+        self.assertEqual('\r\n+CSQ: 20,99\r\n\r\nOK\r\n', response)
+        self.assertEqual('\r\n+CMTI: "SM",1\r\n', urcs[0])
+
+    def test_threads_share_module(self):
+        self.modem.echo_packets = True
+        responses = []
+
+        def poll():
+            with self.module.priority(commandqueue.BACKGROUND):
+                for _ in range(20):
+                    responses.append(rmutils.write(self.module.myserial, 'AT+CSQ', verbose=False))
+        poller = threading.Thread(target=poll)
+        poller.start()
+        self.assertTrue(self.module.udp_echo('35.212.147.4', 3030, 0, 1, verbose=False))
+        poller.join(10)
+        self.assertEqual(20, len(responses))
+        # udp_echo leaves the echoed payload unread, so one poll may pick it up before its own response
+        self.assertTrue(all(r.endswith('\r\n+CSQ: 20,99\r\n\r\nOK\r\n') for r in responses), responses)
+
+
+if __name__ == '__main__':
+    unittest.main()
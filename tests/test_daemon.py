@@ -0,0 +1,98 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+from aerismodsdk.daemon import DaemonClient, DaemonError, ModuleDaemon
+from aerismodsdk.utils.loggerutils import logger
+
+
+class FakeModule:
+    '''Records calls the way a Module would print and log while talking to the modem.'''
+    def __init__(self):
+        self.reader_started = False
+        self.calls = []
+
+    def start_reader(self):
+        self.reader_started = True
+
+    def get_info(self):
+        self.calls.append('get_info')
+        print('>> ATI')
+        logger.info('Modem info read')
+        return {'imsi': '310170000000001'}
+
+    def wait_urc(self, timeout, verbose=True):
+        raise IOError('Serial port went away')
+
+    def get_shoulder_taps(self, port=23747):
+        self.calls.append('get_shoulder_taps')
+        yield None
+
+    def get_serial(self):
+        return self
+
+
+class DaemonTests(unittest.TestCase):
+    def setUp(self):
+        self.socket_path = os.path.join(tempfile.mkdtemp(), 'daemon.sock')
+        self.module = FakeModule()
+        self.daemon = ModuleDaemon(self.module, self.socket_path)
+        threading.Thread(target=self.daemon.serve_forever, daemon=True).start()
+        self.client = DaemonClient(self.socket_path, timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        self.daemon.shutdown()
+        self.daemon.server_close()
+
+    def test_call_returns_result_and_output(self):
+        self.assertTrue(self.module.reader_started)
+        self.assertTrue(self.client.ping())
+        with unittest.mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            info = self.client.get_info()
+        self.assertEqual({'imsi': '310170000000001'}, info)
+        self.assertIn('>> ATI', stdout.getvalue())
+        self.assertIn('Modem info read', stdout.getvalue())
+        self.assertEqual(['get_info'], self.module.calls)
+
+    def test_errors_are_raised_in_the_client(self):
+        with self.assertRaises(DaemonError):
+            self.client.wait_urc(1)
+        with self.assertRaises(DaemonError):
+            self.client.no_such_method()
+        # The connection is still usable after an error
+        self.assertTrue(self.client.ping())
+
+    def test_calls_that_cannot_cross_the_socket(self):
+        with self.assertRaisesRegex(DaemonError, 'generator'):
+            self.client.get_shoulder_taps()
+        with self.assertRaisesRegex(DaemonError, 'cannot be sent to the daemon'):
+            self.client.get_info(object())
+        with self.assertRaisesRegex(DaemonError, 'FakeModule, which cannot be sent'):
+            self.client.get_serial()
+        self.assertEqual([], self.module.calls)
+
+    def test_not_running(self):
+        client = DaemonClient(self.socket_path + '.missing')
+        self.assertFalse(client.ping())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import unittest
+
+from aerismodsdk import fleet
+from aerismodsdk.simulator import QuectelSimulator, UbloxSimulator
+
+
+class FleetTests(unittest.TestCase):
+    def setUp(self):
+        self.modems = [QuectelSimulator().start(), QuectelSimulator().start(), UbloxSimulator().start()]
+        self.devices = [fleet.Device('slot' + str(i), modem_mfg, modem.port, 'testapn', 115200)
+                        for i, (modem, modem_mfg) in enumerate(zip(self.modems, ['quectel', 'quectel', 'ublox']))]
+
+    def tearDown(self):
+        for modem in self.modems:
+            modem.stop()
+
+    def test_run(self):
+        streamed = []
+        results, summary = fleet.FleetRunner(self.devices, workers=2).run('get_info', 2, on_result=streamed.append)
+        self.assertEqual(6, len(results))
+        self.assertEqual(results, streamed)
+        self.assertTrue(all(r['ok'] for r in results), results)
+        imsis = {r['device']: r['result']['imsi'] for r in results}
+        self.assertEqual({d.name: m.imsi for d, m in zip(self.devices, self.modems)}, imsis)
+        self.assertEqual(3, summary['devices'])
+        self.assertEqual(6, summary['ok'])
+        self.assertGreater(summary['throughput'], 0)
+        self.assertLessEqual(summary['p50'], summary['max'])
+        json.loads(fleet.to_json_line(results[0]))
+
+    def test_port_that_does_not_open(self):
+        devices = [fleet.Device('missing', 'quectel', '/dev/does-not-exist', 'testapn', 115200)]
+        results, summary = fleet.FleetRunner(devices).run('get_info')
+        self.assertFalse(results[0]['ok'])
+        self.assertIn('/dev/does-not-exist', results[0]['error'])
+        self.assertEqual(1, summary['failed'])
+
+    def test_load_inventory(self):
+        inventory = {'defaults': {'modemMfg': 'quectel', 'apn': 'testapn'},
+                     'devices': [{'name': 'slot1', 'comPort': '/dev/ttyUSB2'},
+                                 {'comPort': '/dev/ttyUSB6', 'modemMfg': 'telit', 'baudRate': 921600}]}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rack.json')
+            with open(path, 'w') as inventory_file:
+                json.dump(inventory, inventory_file)
+            devices = fleet.load_inventory(path)
+        self.assertEqual([fleet.Device('slot1', 'quectel', '/dev/ttyUSB2', 'testapn', 115200),
+                          fleet.Device('/dev/ttyUSB6', 'telit', '/dev/ttyUSB6', 'testapn', 921600)], devices)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import tempfile
+import unittest
+
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.modulefactory import module_factory
+from aerismodsdk.simulator import QuectelSimulator
+from aerismodsdk.utils import instrumentation
+from aerismodsdk.utils.identitycache import IdentityCache
+
+
+class IdentityCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.modem = QuectelSimulator().start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = IdentityCache(os.path.join(self.directory.name, 'identity'))
+        self.writes = instrumentation.add_sink(instrumentation.LatencyHistogram())
+        self.modules = []
+
+    def tearDown(self):
+        instrumentation.remove_sink(self.writes)
+        for module in self.modules:
+            module.get_serial().close()
+        self.modem.stop()
+        self.directory.cleanup()
+
+    def open_module(self):
+        '''Opens the module the way a new aeriscli process would.'''
+        module = module_factory().get(Manufacturer.quectel, self.modem.port, 'testapn', verbose=False)
+        module.use_identity_cache(self.cache)
+        self.modules.append(module)
+        return module
+
+    def round_trips(self):
+        return sum(stats['count'] for stats in self.writes.summary().values())
+
+    def test_cached_across_modules(self):
+        info = self.open_module().get_info()
+        self.assertEqual(self.modem.imei, info['imei'])
+        self.assertEqual(info, self.cache.get(self.modem.port, self.modem.imei))
+        module = self.open_module()
+        start = self.round_trips()
+        self.assertEqual(info, module.get_info())
+        # AT+GSN and AT+QCCID to check the module and SIM, and setting the PDP context
+        self.assertEqual(3, self.round_trips() - start)
+        start = self.round_trips()
+        self.assertEqual(self.modem.imsi, module.get_imsi())
+        self.assertEqual(start, self.round_trips())
+
+    def test_sim_change_invalidates(self):
+        self.open_module().get_info()
+        self.modem.iccid = '89014103219999999999'
+        self.modem.imsi = '310410999999999'
+        info = self.open_module().get_info()
+        self.assertEqual('89014103219999999999', info['iccid'])
+        self.assertEqual('310410999999999', info['imsi'])
+        self.assertEqual(info, self.cache.get(self.modem.port, self.modem.imei))
+
+    def test_forget_identity(self):
+        module = self.open_module()
+        module.get_info()
+        module.forget_identity()
+        self.assertIsNone(self.cache.get(self.modem.port, self.modem.imei))
+        self.assertIsNone(module.get_cached_info())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from aerismodsdk.utils import instrumentation, rmutils
+from tests.test_rmutils import PtyResponder
+
+
+class InstrumentationTests(unittest.TestCase):
+    def setUp(self):
+        self.modem = PtyResponder()
+        self.ser = rmutils.open_serial(self.modem.port)
+        self.histogram = instrumentation.add_sink(instrumentation.LatencyHistogram())
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        instrumentation.close_sinks()
+        self.ser.close()
+        self.directory.cleanup()
+
+    def test_write_records_command(self):
+        records = []
+        sink = type('Sink', (), {'handle': lambda self, record: records.append(record)})()
+        instrumentation.add_sink(sink)
+        self.modem.respond(b'\r\n+CSQ: 20,99\r\n\r\nOK\r\n')
+        self.modem.respond(b'\r\n+CME ERROR: 30\r\n')
+        self.modem.start()
+        rmutils.write(self.ser, 'AT+CSQ', timeout=2, verbose=False)
+        rmutils.write(self.ser, 'AT+QIACT=1', timeout=2, verbose=False)
+        rmutils.write(self.ser, 'AT+COPS=?', timeout=0.2, verbose=False)
+        self.assertEqual(['AT+CSQ', 'AT+QIACT=', 'AT+COPS=?'], [r.command for r in records])
+        self.assertEqual((8, 21, 'OK', False, False), records[0][3:])
+        self.assertEqual(('+CME ERROR: 30', True, False), records[1][5:])
+        self.assertEqual((None, False, True), records[2][5:])
+        self.assertTrue(all(r.end >= r.start for r in records))
+        summary = self.histogram.summary()
+        self.assertEqual(1, summary['AT+QIACT=']['errors'])
+        self.assertEqual(1, summary['AT+COPS=?']['timeouts'])
+        self.assertGreaterEqual(summary['AT+COPS=?']['p99_s'], 0.2)
+
+    def test_wait_urc_records_timeout(self):
+        master, slave = os.openpty()
+        ser = rmutils.open_serial(os.ttyname(slave))
+        threading.Timer(0.1, os.write, (master, b'\r\n+CMTI: "SM",1\r\n')).start()
+        rmutils.wait_urc(ser, 2, None, returnonvalue='+CMTI:', verbose=False)
+        rmutils.wait_urc(ser, 0.2, None, returnonvalue='+CMTI:', verbose=False)
+        ser.close()
+        urcs = self.histogram.summary()['URC']
+        self.assertEqual(2, urcs['count'])
+        self.assertEqual(1, urcs['timeouts'])
+
+    def test_file_sinks(self):
+        jsonl = os.path.join(self.directory.name, 'commands.jsonl')
+        textfile = os.path.join(self.directory.name, 'modem.prom')
+        instrumentation.add_sink(instrumentation.JsonLinesSink(jsonl))
+        instrumentation.add_sink(instrumentation.PrometheusTextfile(textfile, labels={'device': 'gw1'}))
+        self.modem.respond(b'\r\nOK\r\n')
+        self.modem.start()
+        rmutils.write(self.ser, 'AT+CFUN=1', timeout=2, verbose=False)
+        instrumentation.close_sinks()
+        with open(jsonl) as lines:
+            record = json.loads(lines.readline())
+        self.assertEqual('AT+CFUN=', record['command'])
+        self.assertEqual('OK', record['final'])
+        with open(textfile) as metrics:
+            text = metrics.read()
+        self.assertIn('aeris_at_command_duration_seconds_count{command="AT+CFUN=",device="gw1"} 1', text)
+        self.assertIn('aeris_at_command_duration_seconds_bucket{command="AT+CFUN=",device="gw1",le="+Inf"} 1', text)
+        self.assertIn('aeris_at_command_errors_total{command="AT+CFUN=",device="gw1"} 0', text)
+
+    def test_textfile_written_from_threads(self):
+        textfile = os.path.join(self.directory.name, 'modem.prom')
+        sink = instrumentation.PrometheusTextfile(textfile, interval=0)
+        errors = []
+
+        def emit():
+            try:
+                for _ in range(50):
+                    sink.handle(instrumentation.CommandRecord('AT+CSQ', 0.0, 0.01, 8, 21, 'OK', False, False))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=emit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sink.close()
+        self.assertEqual([], errors)
+        with open(textfile) as metrics:
+            self.assertIn('aeris_at_command_duration_seconds_count{command="AT+CSQ"} 400', metrics.read())
+
+    def test_histogram_percentiles(self):
+        histogram = instrumentation.Histogram()
+        for micros in range(1, 10001):
+            histogram.record(micros / 1000000.0)
+        self.assertAlmostEqual(0.005, histogram.percentile(50), delta=0.0001)
+        self.assertAlmostEqual(0.0099, histogram.percentile(99), delta=0.0002)
+        self.assertEqual(0.01, histogram.percentile(100))
+
+    def test_percentile(self):
+        values = [micros / 1000000.0 for micros in range(10000, 0, -1)]
+        self.assertEqual(0.005, instrumentation.percentile(values, 50))
+        self.assertEqual(0.0099, instrumentation.percentile(values, 99))
+        self.assertEqual(0.01, instrumentation.percentile(values, 100))
+        self.assertEqual(0.000001, instrumentation.percentile(values, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from aerismodsdk.utils import portutils
+
+
+class ResolveComPortTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.sysfs = os.path.join(self.root, 'sys')
+        # A Quectel BG96 with two ttyUSB ports and a USB ACM modem, laid out like sysfs
+        self.add_usb_tty('ttyUSB0', 'usb1/1-1/1-1:1.0/ttyUSB0', '2c7c', '0296', '00')
+        self.add_usb_tty('ttyUSB3', 'usb1/1-1/1-1:1.2/ttyUSB3', '2c7c', '0296', '02')
+        self.add_usb_tty('ttyACM0', 'usb1/1-2/1-2:1.0', '1bc7', '1101', '00')
+        os.makedirs(os.path.join(self.sysfs, 'class/tty/tty1'))
+
+    def add_usb_tty(self, name, device_path, vendor_id, product_id, interface):
+        device = os.path.join(self.sysfs, 'devices', device_path)
+        os.makedirs(device)
+        interface_dir = device if name.startswith('ttyACM') else os.path.dirname(device)
+        self.write(interface_dir, 'bInterfaceNumber', interface)
+        usb_device = os.path.dirname(interface_dir)
+        self.write(usb_device, 'idVendor', vendor_id)
+        self.write(usb_device, 'idProduct', product_id)
+        tty_dir = os.path.join(self.sysfs, 'class/tty', name)
+        os.makedirs(tty_dir)
+        os.symlink(device, os.path.join(tty_dir, 'device'))
+
+    def write(self, directory, name, value):
+        with open(os.path.join(directory, name), 'w') as attribute:
+            attribute.write(value + '\n')
+
+    def resolve(self, com_port):
+        return portutils.resolve_com_port(com_port, sysfs_root=self.sysfs, dev_root='/dev')
+
+    def test_config_and_path_ports(self):
+        self.assertEqual('/dev/ttyUSB2', self.resolve('USB2'))
+        self.assertEqual('/dev/pts/3', self.resolve('/dev/pts/3'))
+
+    def test_usb_interface(self):
+        self.assertEqual('/dev/ttyUSB3', self.resolve('usb:2c7c:0296:2'))
+        self.assertEqual('/dev/ttyUSB0', self.resolve('usb:2C7C:296'))
+        self.assertEqual('/dev/ttyACM0', self.resolve('usb:1bc7:1101:0'))
+        self.assertIsNone(self.resolve('usb:2c7c:0296:4'))
+        self.assertIsNone(self.resolve('usb:1234:5678'))
+
+
+class WaitForPortTests(unittest.TestCase):
+    def test_wakes_when_port_appears(self):
+        directory = tempfile.mkdtemp()
+        port = os.path.join(directory, 'ttyUSB2')
+        threading.Timer(0.2, open, (port, 'w')).start()
+        start_time = time.monotonic()
+        self.assertEqual(port, portutils.wait_for_port(port, 5))
+        self.assertLess(time.monotonic() - start_time, 0.5)
+
+    def test_timeout(self):
+        port = os.path.join(tempfile.mkdtemp(), 'ttyUSB2')
+        self.assertIsNone(portutils.wait_for_port(port, 0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
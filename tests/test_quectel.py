@@ -12,10 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import queue
+import threading
+import time
 import unittest
 
 from aerismodsdk.manufacturer import Manufacturer
 from aerismodsdk.modulefactory import module_factory
+from aerismodsdk.simulator import QuectelSimulator
+from aerismodsdk.utils.qiurc import Datagram, DatagramParser
 
 
 class QuectelTests(unittest.TestCase):
@@ -36,6 +41,16 @@ class QuectelTests(unittest.TestCase):
         return urc[:urc.find(b'\x0A')+1]
 
 
+    def test_parse_cmd_response(self):
+        my_module = module_factory().get(Manufacturer.quectel, '1', 'anyapn', verbose=False)
+        # Values that end with O or K are kept whole
+        self.assertEqual('BG96-LOOK', my_module.parse_cmd_single_response('\r\nBG96-LOOK\r\n\r\nOK\r\n'))
+        self.assertEqual(['Quectel', 'BG96'], my_module.parse_cmd_response('\r\nQuectel\r\nBG96\r\n\r\nOK\r\n'))
+        self.assertEqual('', my_module.parse_cmd_single_response('\r\nOK\r\n'))
+        self.assertFalse(my_module.parse_cmd_single_response('\r\n+CME ERROR: 10\r\n'))
+        self.assertIsNone(my_module.parse_cmd_single_response(None))
+        self.assertIsNone(my_module.parse_cmd_response(None))
+
     def test_parse_one_line_urc(self):
         sent_payloads = [b'Hello, world!']
         expected_payloads = []
@@ -121,6 +136,107 @@ class QuectelTests(unittest.TestCase):
 
         self.assertEqual(expected_payloads, payloads)
 
+    def test_parser_completes_packets_across_chunks(self):
+        expected_payloads = [b'payload\x0A1', b'second pay\x0Aload', b'']
+        urcs = b''
+        for p in expected_payloads:
+            urcs += self.create_urc(p) + b'+CTZV: 1\x0D\x0A'
+        for chunk_size in (1, 2, 7, 20, len(urcs)):
+            parser = DatagramParser()
+            datagrams = []
+            for start in range(0, len(urcs), chunk_size):
+                datagrams += parser.feed(urcs[start:start + chunk_size])
+            self.assertEqual([Datagram(1, '1.1.1.1', 65534, p) for p in expected_payloads], datagrams)
+            self.assertFalse(parser.incomplete)
+
+    def test_parser_without_remote_address(self):
+        parser = DatagramParser()
+        self.assertEqual([], parser.feed(b'+QIURC: "recv",0,5\r\nhel'))
+        self.assertTrue(parser.incomplete)
+        self.assertEqual([Datagram(0, None, None, b'hello')], parser.feed(b'lo\r\n'))
+
+
+class ShoulderTapListenerTests(unittest.TestCase):
+    def setUp(self):
+        self.modem = QuectelSimulator().start()
+        self.module = module_factory().get(Manufacturer.quectel, self.modem.port, 'testapn', verbose=False)
+        self.taps = queue.Queue()
+
+    def tearDown(self):
+        self.module.get_serial().close()
+        self.modem.stop()
+
+    def listen(self):
+        def run():
+            for tap in self.module.get_shoulder_taps(port=23747):
+                self.taps.put((tap, time.monotonic()))
+        threading.Thread(target=run, daemon=True).start()
+        deadline = time.monotonic() + 10
+        while len(self.modem.sockets) == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def opens(self):
+        return len([command for command in self.modem.commands if command.startswith('+QIOPEN=')])
+
+    def test_taps_yielded_as_they_arrive(self):
+        self.listen()
+        for sequence in (1, 2):
+            sent = time.monotonic()
+            self.modem.deliver_packet(b'\x020100' + '{0:02x}'.format(sequence).encode() + b'05hello\x03')
+            tap, received = self.taps.get(timeout=5)
+            self.assertLess(received - sent, 1)
+            self.assertEqual(self.modem.imsi + '-' + str(sequence), tap.getRequestId())
+            self.assertEqual(b'hello', tap.payload)
+        self.assertEqual(1, self.opens())
+
+    def test_buffered_taps_drained_together(self):
+        def run():
+            for tap in self.module.get_shoulder_taps(port=23747, buffered=True):
+                self.taps.put((tap, time.monotonic()))
+        threading.Thread(target=run, daemon=True).start()
+        deadline = time.monotonic() + 10
+        while len(self.modem.sockets) == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(0, self.modem.sockets[1].mode)
+        for sequence in range(1, 6):
+            self.modem.deliver_packet(b'\x020100' + '{0:02x}'.format(sequence).encode() + b'03a\r\n\x03')
+        taps = [self.taps.get(timeout=5)[0] for _ in range(5)]
+        self.assertEqual([1, 2, 3, 4, 5], [tap.payloadId for tap in taps])
+        self.assertEqual([b'a\r\n'] * 5, [tap.payload for tap in taps])
+        reads = [command for command in self.modem.commands if command.startswith('+QIRD=')]
+        # One read per packet, and one per drain that finds the buffer empty
+        self.assertLess(len(reads), 5 + 5)
+        self.assertEqual(1, self.opens())
+
+    def reopened(self):
+        deadline = time.monotonic() + 10
+        while (self.opens() < 2 or 1 not in self.modem.sockets or self.modem.sockets[1].closed) \
+                and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(2, self.opens())
+        # What the listener sent to close the old socket and context before opening the new socket
+        opens = [i for i, command in enumerate(self.modem.commands) if command.startswith('+QIOPEN=')]
+        return [command for command in self.modem.commands[opens[0]:opens[1]]
+                if command.startswith(('+QICLOSE', '+QIDEACT', '+QIACT='))]
+
+    def test_reopens_after_pdp_deactivation(self):
+        self.listen()
+        self.modem.drop_packet_session()
+        commands = self.reopened()
+        self.assertEqual(['+QICLOSE=1', '+QIDEACT=1', '+QIACT=1'], commands)
+        self.modem.deliver_packet(b'\x0201000300\x03')
+        tap, _ = self.taps.get(timeout=5)
+        self.assertEqual(self.modem.imsi + '-3', tap.getRequestId())
+
+    def test_reopens_after_socket_closed(self):
+        self.listen()
+        self.modem.close_socket_remotely(1)
+        commands = self.reopened()
+        self.assertEqual(['+QICLOSE=1'], commands)
+        self.modem.deliver_packet(b'\x0201000400\x03')
+        tap, _ = self.taps.get(timeout=5)
+        self.assertEqual(self.modem.imsi + '-4', tap.getRequestId())
+
 
 if __name__ == '__main__':
     unittest.main()
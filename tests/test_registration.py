@@ -0,0 +1,79 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+import time
+import unittest
+
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.modulefactory import module_factory
+from aerismodsdk.simulator import QuectelSimulator
+from aerismodsdk.utils.registration import RegistrationState
+from aerismodsdk.utils.serialreader import Urc
+
+
+class RegistrationStateTests(unittest.TestCase):
+    def test_urcs_and_responses(self):
+        state = RegistrationState()
+        transitions = []
+        state.add_callback(transitions.append)
+        state.update_from_response('\r\n+CREG: 2,1,"1A2B","0001",0\r\n+CEREG: 2,2\r\n\r\nOK\r\n')
+        self.assertEqual((1, '1A2B', '0001', 0), state.get('+CREG')[1:5])
+        self.assertFalse(state.is_registered(['+CEREG']))
+        state.handle_urc(Urc('+CEREG:', '+CEREG: 5,"00C3","01A2D001",7', None, time.monotonic()))
+        self.assertEqual((5, '00C3', '01A2D001', 7), state.get('+CEREG')[1:5])
+        self.assertTrue(state.is_registered(['+CEREG']))
+        self.assertIsNotNone(state.attach_latency('+CEREG'))
+        # Repeats of the same registration are not transitions
+        state.handle_urc(Urc('+CEREG:', '+CEREG: 5,"00C3","01A2D001",7', None, time.monotonic()))
+        self.assertEqual(['+CREG', '+CEREG', '+CEREG'], [t.domain for t in transitions])
+        self.assertEqual(2, transitions[-1].previous.stat)
+
+
+class TrackRegistrationTests(unittest.TestCase):
+    def setUp(self):
+        self.modem = QuectelSimulator().start()
+        self.module = module_factory().get(Manufacturer.quectel, self.modem.port, 'testapn', verbose=False)
+
+    def tearDown(self):
+        self.module.get_serial().close()
+        self.modem.stop()
+
+    def test_track_while_registered(self):
+        self.modem.set_registration(1, tac='2B3C', cell_id='0A0B0C0D', act=7)
+        state = self.module.track_registration()
+        for domain in ('+CREG', '+CGREG', '+CEREG'):
+            self.assertEqual((1, '2B3C', '0A0B0C0D', 7), state.get(domain)[1:5])
+        self.assertIsNotNone(self.module.wait_until_registered(0.1, ['+CEREG']))
+
+    def test_wait_until_registered(self):
+        self.modem.set_registration(2)
+        state = self.module.track_registration()
+        self.assertFalse(state.is_registered())
+        threading.Timer(0.3, self.modem.set_registration, (1,), {'tac': '2B3C', 'cell_id': '0A0B0C0D'}).start()
+        registration = self.module.wait_until_registered(5, ['+CEREG'])
+        self.assertEqual((1, '2B3C', '0A0B0C0D'), registration[1:4])
+        self.assertGreaterEqual(state.attach_latency('+CEREG'), 0.2)
+
+    def test_network_info_from_urcs(self):
+        self.module.track_registration()
+        self.modem.set_registration(5)
+        time.sleep(0.2)
+        net_info = self.module.network_info(False, verbose=False)
+        self.assertEqual('5: Registered; roaming', net_info['reg_status_eps'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import select
+import threading
+import time
+import unittest
+import unittest.mock
+
+from aerismodsdk.utils import portutils, rmutils
+
+
+class PtyResponder:
+    '''Answers each command written to a pty with a canned response, optionally after a delay.'''
+    def __init__(self):
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        self.responses = []
+
+    def respond(self, response, delay=0):
+        self.responses.append((response, delay))
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        for response, delay in self.responses:
+            command = b''
+            while not command.endswith(b'\r\n'):
+                command += os.read(self.master, 1024)
+            time.sleep(delay)
+            os.write(self.master, response)
+
+
+class WriteTests(unittest.TestCase):
+    def setUp(self):
+        self.modem = PtyResponder()
+        self.ser = rmutils.open_serial(self.modem.port)
+
+    def tearDown(self):
+        self.ser.close()
+
+    def test_final_result_codes(self):
+        self.assertTrue(rmutils.is_final_result('OK'))
+        self.assertTrue(rmutils.is_final_result('ERROR'))
+        self.assertTrue(rmutils.is_final_result('+CME ERROR: 10'))
+        self.assertTrue(rmutils.is_final_result('+CMS ERROR: 500'))
+        self.assertTrue(rmutils.is_final_result('NO CARRIER'))
+        self.assertFalse(rmutils.is_final_result('+CSQ: 20,99'))
+        self.assertFalse(rmutils.is_final_result('OK', terminators=['+QIOPEN:']))
+        self.assertTrue(rmutils.is_final_result('+QIOPEN: 1,0', terminators=['+QIOPEN:']))
+
+    def test_command_verb(self):
+        self.assertEqual('AT+QIACT=', rmutils.command_verb('AT+QIACT=1'))
+        self.assertEqual('AT+COPS=?', rmutils.command_verb('AT+COPS=?'))
+        self.assertEqual('AT+CEREG?', rmutils.command_verb('at+cereg?\r\n'))
+        self.assertEqual('AT#SGACT=', rmutils.command_verb('AT#SGACT=1,1'))
+        self.assertEqual('ATI', rmutils.command_verb('ATI'))
+
+    def test_partial_urc_left_out_of_next_response(self):
+        os.write(self.modem.master, b'\r\n+CMTI: "SM"')
+        self.assertEqual('\r\n', rmutils.wait_urc(self.ser, 0.3, None, returnonvalue='+CMTI:', verbose=False))
+        self.modem.respond(b'\r\n+CSQ: 20,99\r\n\r\nOK\r\n')
+        self.modem.start()
+        self.assertEqual('\r\n+CSQ: 20,99\r\n\r\nOK\r\n', rmutils.write(self.ser, 'AT+CSQ', verbose=False))
+
+    def test_returns_on_ok(self):
+        self.modem.respond(b'\r\n+CSQ: 20,99\r\n\r\nOK\r\n')
+        self.modem.start()
+        start_time = time.monotonic()
+        response = rmutils.write(self.ser, 'AT+CSQ', timeout=5)
+        self.assertLess(time.monotonic() - start_time, 1)
+        self.assertIn('+CSQ: 20,99', response)
+        self.assertTrue(response.strip().endswith('OK'))
+
+    def test_waits_for_slow_response(self):
+        self.modem.respond(b'\r\nOK\r\n', delay=1.5)
+        self.modem.start()
+        response = rmutils.write(self.ser, 'AT+QIACT=1', timeout=5)
+        self.assertEqual('OK', response.strip())
+
+    def test_cme_error(self):
+        self.modem.respond(b'\r\n+CME ERROR: 10\r\n')
+        self.modem.start()
+        response = rmutils.write(self.ser, 'AT+CIMI', timeout=5)
+        self.assertIn('+CME ERROR: 10', response)
+
+    def test_custom_terminator(self):
+        self.modem.respond(b'\r\nOK\r\n\r\n+QIOPEN: 1,0\r\n')
+        self.modem.start()
+        response = rmutils.write(self.ser, 'AT+QIOPEN=1,1,"UDP SERVICE","127.0.0.1",0,3030,1',
+                                 timeout=5, terminators=['+QIOPEN:'])
+        self.assertIn('+QIOPEN: 1,0', response)
+
+    def test_data_mode_send(self):
+        def run():
+            command = b''
+            while not command.endswith(b'\r\n'):
+                command += os.read(self.modem.master, 1024)
+            os.write(self.modem.master, b'\r\n> ')
+            data = b''
+            while len(data) < 5:
+                data += os.read(self.modem.master, 1024)
+            self.received = data
+            os.write(self.modem.master, b'\r\nSEND OK\r\n')
+        threading.Thread(target=run, daemon=True).start()
+        start_time = time.monotonic()
+        response = rmutils.write(self.ser, 'AT+QISEND=0,5', 'hello', send_timeout=5)
+        self.assertLess(time.monotonic() - start_time, 0.5)
+        self.assertEqual(b'hello', self.received)
+        self.assertTrue(response.strip().endswith('SEND OK'))
+
+    def test_data_mode_error(self):
+        self.modem.respond(b'\r\n+CME ERROR: 50\r\n')
+        self.modem.start()
+        response = rmutils.write(self.ser, 'AT+QISEND=0,5', 'hello', timeout=5)
+        self.assertIn('+CME ERROR: 50', response)
+        # The payload was not sent
+        readable, _, _ = select.select([self.modem.master], [], [], 0.2)
+        self.assertEqual([], readable)
+
+    def test_read_data(self):
+        # The data looks like the end of the response, and is not taken for it
+        self.modem.respond(b'\r\n+QIRD: 8,"1.1.1.1",5000\r\n\r\nOK\r\n\r\n\r\nOK\r\n')
+        self.modem.respond(b'\r\n+QIRD: 0\r\n\r\nOK\r\n')
+        self.modem.start()
+        buffer = bytearray(4)
+        header, length, final = rmutils.read_data(self.ser, 'AT+QIRD=1,1500', buffer, 2, timeout=5, verbose=False)
+        self.assertEqual(('8,"1.1.1.1",5000', 8, 'OK'), (header, length, final))
+        self.assertEqual(b'\r\nOK\r\n\r\n', buffer[2:10])
+        self.assertEqual(('0', 0, 'OK'), rmutils.read_data(self.ser, 'AT+QIRD=1,1500', buffer, timeout=5, verbose=False))
+
+    def test_timeout(self):
+        self.modem.respond(b'\r\n+CSQ: 20,99\r\n')
+        self.modem.start()
+        self.ser.write(b'AT+CSQ\r\n')
+        response, final = rmutils.read_response(self.ser, 0.5)
+        self.assertIn(b'+CSQ: 20,99', response)
+        self.assertIsNone(final)
+
+
+class WaitUrcTests(unittest.TestCase):
+    def setUp(self):
+        self.master, slave = os.openpty()
+        self.ser = rmutils.open_serial(os.ttyname(slave))
+
+    def tearDown(self):
+        self.ser.close()
+
+    def test_returns_on_value_without_polling_delay(self):
+        threading.Timer(0.2, os.write, (self.master, b'\r\n+CMTI: "SM",1\r\n')).start()
+        start_time = time.monotonic()
+        urcs = rmutils.wait_urc(self.ser, 5, None, returnonvalue='+CMTI:', verbose=False)
+        self.assertLess(time.monotonic() - start_time, 0.4)
+        self.assertEqual('\r\n+CMTI: "SM",1\r\n', urcs)
+
+    def test_keeps_output_after_value(self):
+        os.write(self.master, b'\r\nOK\r\n\r\n+UUSORF: 0,12\r\n')
+        time.sleep(0.1)
+        self.assertEqual('\r\nOK\r\n', rmutils.wait_urc(self.ser, 1, None, returnonvalue='OK', verbose=False))
+        urcs = rmutils.wait_urc(self.ser, 1, None, returnonvalue='+UUSORF:', verbose=False)
+        self.assertEqual('\r\n+UUSORF: 0,12\r\n', urcs)
+
+    def test_returns_bytes_until_timeout(self):
+        os.write(self.master, b'+QIURC: "recv",1,2\r\n\xff\xfe\r\n+QIURC')
+        urcs = rmutils.wait_urc(self.ser, 0.5, None, verbose=False, returnbytes=True)
+        self.assertEqual(b'+QIURC: "recv",1,2\r\n\xff\xfe\r\n', urcs)
+
+    def test_reset_discards_unread_data(self):
+        os.write(self.master, b'\r\n+CEREG: 5\r\n\r\n+QIURC')
+        self.assertEqual('\r\n+CEREG: 5\r\n\r\n', rmutils.wait_urc(self.ser, 0.3, None, verbose=False))
+        rmutils.reset_input_buffer(self.ser)
+        self.assertEqual(b'', rmutils.read_chunk(self.ser, 0.1))
+
+    def test_reopens_where_usb_port_comes_back(self):
+        # After a reset, the module's interface comes back as another tty
+        master, slave = os.openpty()
+        new_port = os.ttyname(slave)
+        os.close(self.master)
+        threading.Timer(0.5, os.write, (master, b'\r\nAPP RDY\r\n')).start()
+        with unittest.mock.patch.object(portutils, 'resolve_com_port', return_value=new_port):
+            urcs = rmutils.wait_urc(self.ser, 5, 'usb:2c7c:0296:2', returnonvalue='APP RDY', verbose=False)
+        self.assertEqual('\r\nAPP RDY\r\n', urcs)
+        self.assertEqual(new_port, self.ser.port)
+        os.close(master)
+
+
+class BaudrateModem:
+    '''Answers AT, AT+IPR=? and AT+IPR=<rate> on a pty. Rates in unusable stop it answering until AT+IPR sets a usable rate.'''
+    def __init__(self, unusable=()):
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        self.unusable = unusable
+        self.rate = 115200
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        pending = b''
+        while True:
+            try:
+                pending += os.read(self.master, 1024)
+            except OSError:
+                return
+            while b'\r\n' in pending:
+                command, pending = pending.split(b'\r\n', 1)
+                if command == b'AT+IPR=?':
+                    response = b'\r\n+IPR: (0,9600,115200,460800,921600),()\r\n\r\nOK\r\n'
+                elif command.startswith(b'AT+IPR='):
+                    response = b'\r\nOK\r\n'
+                    self.rate = int(command[7:])
+                elif self.rate in self.unusable:
+                    continue
+                else:
+                    response = b'\r\nOK\r\n'
+                os.write(self.master, response)
+
+
+class NegotiateBaudrateTests(unittest.TestCase):
+    def test_steps_up_to_fastest_rate(self):
+        modem = BaudrateModem()
+        ser = rmutils.open_serial(modem.port)
+        self.assertEqual(921600, rmutils.negotiate_baudrate(ser, verbose=False))
+        self.assertEqual(921600, ser.baudrate)
+        self.assertEqual(921600, modem.rate)
+        ser.close()
+
+    def test_falls_back_when_round_trip_fails(self):
+        modem = BaudrateModem(unusable=(921600,))
+        ser = rmutils.open_serial(modem.port)
+        self.assertEqual(460800, rmutils.negotiate_baudrate(ser, verbose=False))
+        self.assertEqual(460800, modem.rate)
+        ser.close()
+
+    def test_write_stream(self):
+        master, slave = os.openpty()
+        ser = rmutils.open_serial(os.ttyname(slave))
+        data = bytes(range(256)) * 4
+        self.assertEqual(len(data), rmutils.write_stream(ser, io.BytesIO(data), len(data), verbose=False))
+        received = b''
+        while len(received) < len(data):
+            received += os.read(master, 4096)
+        self.assertEqual(data, received)
+        ser.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.modulefactory import module_factory
+from aerismodsdk.utils import rmutils, serialcapture
+
+PACKETS = b'+QIURC: "recv",1,5,"1.1.1.1",5000\r\nhello\r\n+QIURC: "recv",1,2,"1.1.1.1",5000\r\n\x00\xff\r\n'
+
+
+class SerialCaptureTests(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.cap')
+        os.close(handle)
+        os.remove(self.path)
+
+    def tearDown(self):
+        rmutils.set_capture_file(None)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def capture_session(self):
+        '''Records an AT+CSQ exchange followed by two UDP packet URCs. Returns what rmutils read.'''
+        master, slave = os.openpty()
+        rmutils.set_capture_file(self.path)
+        ser = rmutils.open_serial(os.ttyname(slave))
+        rmutils.set_capture_file(None)
+
+        def run():
+            command = b''
+            while not command.endswith(b'\r\n'):
+                command += os.read(master, 1024)
+            os.write(master, b'\r\n+CSQ: 20,99\r\n\r\nOK\r\n')
+            time.sleep(0.3)
+            os.write(master, PACKETS)
+        threading.Thread(target=run, daemon=True).start()
+        response = rmutils.write(ser, 'AT+CSQ', timeout=2, verbose=False)
+        urcs = rmutils.wait_urc(ser, 1, None, verbose=False, returnbytes=True)
+        ser.close()
+        os.close(master)
+        return response, urcs
+
+    def test_capture_file(self):
+        self.capture_session()
+        sessions = serialcapture.read_capture(self.path)
+        self.assertEqual(1, len(sessions))
+        records = sessions[0]
+        self.assertEqual((serialcapture.TX, b'AT+CSQ\r\n'), (records[0].direction, records[0].data))
+        received = b''.join(r.data for r in records if r.direction == serialcapture.RX)
+        self.assertEqual(b'\r\n+CSQ: 20,99\r\n\r\nOK\r\n' + PACKETS, received)
+        timestamps = [r.timestamp for r in records]
+        self.assertEqual(sorted(timestamps), timestamps)
+
+    def test_replay_at_full_speed(self):
+        response, urcs = self.capture_session()
+        ser = rmutils.open_serial('replay:' + self.path)
+        start_time = time.monotonic()
+        self.assertEqual(response, rmutils.write(ser, 'AT+CSQ', timeout=2, verbose=False))
+        self.assertEqual(urcs, rmutils.wait_urc(ser, 1, None, verbose=False, returnbytes=True))
+        self.assertLess(time.monotonic() - start_time, 0.5)
+        self.assertTrue(ser.finished)
+        my_module = module_factory().get(Manufacturer.quectel, '1', 'anyapn', verbose=False)
+        self.assertEqual([b'hello', b'\x00\xff'], my_module.udp_urcs_to_payloads(urcs))
+
+    def test_replay_original_timing(self):
+        self.capture_session()
+        ser = serialcapture.ReplaySerial(self.path, speed=1)
+        ser.write(b'AT+CSQ\r\n')
+        ser.timeout = 2
+        self.assertEqual(b'\r\n', ser.read_until(b'\n'))
+        start_time = time.monotonic()
+        while PACKETS[:10] not in ser.read(ser.in_waiting or 1):
+            pass
+        # The packets came about 0.3 seconds after the response
+        self.assertGreater(time.monotonic() - start_time, 0.2)
+
+    def test_replay_detects_different_command(self):
+        self.capture_session()
+        ser = serialcapture.ReplaySerial(self.path)
+        with self.assertRaises(serialcapture.ReplayError):
+            ser.write(b'AT+CEREG?\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+import unittest
+
+from aerismodsdk.utils import rmutils, serialreader
+from aerismodsdk.utils.serialreader import SerialReader
+
+
+class SerialReaderTests(unittest.TestCase):
+    def setUp(self):
+        self.master, slave = os.openpty()
+        self.reader = SerialReader(rmutils.open_serial(os.ttyname(slave))).start()
+
+    def tearDown(self):
+        self.reader.close()
+
+    def respond(self, response):
+        '''Writes response once the next command has been sent to the module.'''
+        def run():
+            command = b''
+            while not command.endswith(b'\r\n'):
+                command += os.read(self.master, 1024)
+            os.write(self.master, response)
+        threading.Thread(target=run, daemon=True).start()
+
+    def test_urc_routed_out_of_command_response(self):
+        sms = self.reader.subscribe('+CMTI:')
+        self.respond(b'\r\n+CSQ: 20,99\r\n\r\n+CMTI: "SM",3\r\n\r\nOK\r\n')
+        response = rmutils.write(self.reader, 'AT+CSQ', timeout=2)
+        self.assertIn('+CSQ: 20,99', response)
+        self.assertNotIn('+CMTI', response)
+        urc = sms.get(timeout=2)
+        self.assertEqual('+CMTI: "SM",3', urc.line)
+
+    def test_unsubscribed_urc_stays_in_stream(self):
+        os.write(self.master, b'\r\n+CEREG: 5\r\n')
+        urcs = rmutils.wait_urc(self.reader, 1, None, returnonvalue='+CEREG:', verbose=False)
+        self.assertIn('+CEREG: 5', urcs)
+
+    def test_pending_command_keeps_its_response(self):
+        registrations = self.reader.subscribe('+CEREG:')
+        self.respond(b'\r\n+CEREG: 2,1\r\n\r\nOK\r\n')
+        response = rmutils.write(self.reader, 'AT+CEREG?', timeout=2)
+        self.assertIn('+CEREG: 2,1', response)
+        self.assertTrue(registrations.empty())
+
+    def test_payload_urc(self):
+        received = self.reader.subscribe('+QIURC:')
+        os.write(self.master, b'+QIURC: "recv",1,8,"1.1.1.1",5000\r\npay\nload\r\n')
+        urc = received.get(timeout=2)
+        self.assertEqual(b'pay\nload', urc.payload)
+
+    def test_response_data_not_taken_for_urcs(self):
+        received = self.reader.subscribe('+QIURC:')
+        self.respond(b'\r\n+QIRD: 12\r\n+QIURC: "x"\r\n\r\nOK\r\n')
+        buffer = bytearray(12)
+        self.assertEqual(12, rmutils.read_data(self.reader, 'AT+QIRD=0,1500', buffer, timeout=2, verbose=False)[1])
+        self.assertEqual(b'+QIURC: "x"\r', bytes(buffer))
+        self.assertTrue(received.empty())
+
+    def test_stale_output_discarded_before_command(self):
+        os.write(self.master, b'\r\n+CEREG: 5\r\n\r\nRDY\r\n')
+        time.sleep(0.2)
+        self.respond(b'\r\n+CSQ: 20,99\r\n\r\nOK\r\n')
+        self.assertEqual('\r\n+CSQ: 20,99\r\n\r\nOK\r\n', rmutils.write(self.reader, 'AT+CSQ', timeout=2))
+
+    def test_reset_discards_unread_data(self):
+        rmutils.unread(self.reader, b'+QIURC')
+        self.reader.reset_input_buffer()
+        self.assertEqual(b'', rmutils.read_chunk(self.reader, 0.1))
+
+    def test_unread_data_discarded_before_command(self):
+        rmutils.unread(self.reader, b'+QIURC')
+        self.reader.write(b'AT+CSQ\r\n')
+        self.assertEqual(b'', rmutils.read_chunk(self.reader, 0.1))
+
+    def test_stream_is_bounded(self):
+        for _ in range(3):
+            os.write(self.master, b'x' * serialreader.MAX_STREAM_BYTES)
+        deadline = time.monotonic() + 5
+        while self.reader.in_waiting < serialreader.MAX_STREAM_BYTES and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.2)
+        self.assertEqual(serialreader.MAX_STREAM_BYTES, self.reader.in_waiting)
+
+    def test_prompt_passes_through(self):
+        self.reader.subscribe('+QIURC:')
+        os.write(self.master, b'\r\n> ')
+        response, final = rmutils.read_response(self.reader, 2, terminators=['>'])
+        self.assertEqual('>', final)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,7 +15,8 @@
 import unittest
 
 from aerismodsdk.utils import shoulder_tap
-from aerismodsdk.model.shoulder_tap import Udp0ShoulderTap
+from aerismodsdk.utils.qiurc import Datagram
+from aerismodsdk.model.shoulder_tap import BaseShoulderTap, Udp0ShoulderTap
 
 
 class ShoulderTapTest(unittest.TestCase):
@@ -83,5 +84,83 @@ class ShoulderTapTest(unittest.TestCase):
         result = shoulder_tap.parse_shoulder_tap(packet, self.imsi, True)
         self.assertIsNone(result)
 
+    def test_parse_memoryview(self):
+        packet = bytearray(b'\x020100010d' + b'Hello, world!' + b'\x03')
+        result = shoulder_tap.parse_shoulder_tap(memoryview(packet), self.imsi)
+        packet[10] = ord('J')  # The payload is a copy, not a view of the packet
+        self.assertEqual(b'Hello, world!', result.payload)
+        self.assertIsInstance(result.payload, bytes)
+
+    def test_parse_unknown_message_type(self):
+        self.assertIsNone(shoulder_tap.parse_shoulder_tap(b'\x0299000100\x03', self.imsi))
+        self.assertIsNone(shoulder_tap.parse_shoulder_tap(b'', self.imsi))
+
+    def test_registered_parser(self):
+        @shoulder_tap.register_parser
+        class EchoParser(shoulder_tap.ShoulderTapParser):
+            message_type = b'99'
+
+            @classmethod
+            def parse(cls, body, imsi, verbose=False):
+                return BaseShoulderTap(bytes(body), 'echo', imsi)
+        self.addCleanup(shoulder_tap.PARSERS.pop, b'99')
+        result = shoulder_tap.parse_shoulder_tap(b'\x0299abc', self.imsi)
+        self.assertEqual(b'abc', result.payload)
+        self.assertEqual('echo', result.getRequestId())
+
+    def test_parse_many(self):
+        packets = [b'\x0201000100\x03', b'\x02010002', Datagram(1, '1.1.1.1', 3030, b'\x0201000302\x01\x02\x03')]
+        results = shoulder_tap.parse_many(packets, self.imsi)
+        self.assertEqual([1, 3], [result.payloadId for result in results])
+        self.assertEqual(b'\x01\x02', results[1].payload)
+
+    def test_taps_have_no_dict(self):
+        result = shoulder_tap.parse_shoulder_tap(b'\x0201000100\x03', self.imsi)
+        self.assertFalse(hasattr(result, '__dict__'))
+
+
+class ShoulderTapWindowTest(unittest.TestCase):
+    imsi = '123456789012345'
+
+    def sequences(self, window, sequences, now=0):
+        taps = []
+        for sequence in sequences:
+            taps += window.add(Udp0ShoulderTap(None, sequence, self.imsi), now=now)
+        return [tap.payloadId for tap in taps]
+
+    def test_drops_repeats_across_wraparound(self):
+        window = shoulder_tap.ShoulderTapWindow(size=64)
+        self.assertEqual([65533, 65535, 0, 65534, 2], self.sequences(window, [65533, 65535, 65535, 0, 65534, 65533, 2, 0]))
+        self.assertEqual({'duplicates': 3, 'gaps': 2, 'out_of_order': 1, 'restarts': 0}, window.counters())
+        # Older than the window: the sender started over
+        self.assertEqual([40000, 40001], self.sequences(window, [40000, 40001, 40001]))
+        self.assertEqual(1, window.counters()['restarts'])
+
+    def test_reorders_within_window(self):
+        window = shoulder_tap.ShoulderTapWindow(reorder=3, reorder_timeout=2)
+        self.assertEqual([65535], self.sequences(window, [65535]))
+        self.assertEqual([], self.sequences(window, [1, 2]))
+        self.assertEqual([0, 1, 2], self.sequences(window, [0, 2]))
+        # 3 is missing: give up on it once too many taps are held back ...
+        self.assertEqual([], self.sequences(window, [4, 5, 6]))
+        self.assertEqual([4, 5, 6, 7], self.sequences(window, [7]))
+        # ... or once they were held too long
+        self.assertEqual([], self.sequences(window, [9], now=10))
+        self.assertEqual([], window.expire(now=11))
+        self.assertEqual([9], [tap.payloadId for tap in window.expire(now=12)])
+        # Too late to put in order
+        self.assertEqual([3], self.sequences(window, [3]))
+        self.assertEqual([], self.sequences(window, [12]))
+        self.assertEqual([12], [tap.payloadId for tap in window.flush()])
+
+    def test_memory_stays_bounded(self):
+        window = shoulder_tap.ShoulderTapWindow(size=128, reorder=4)
+        for sequence in range(3 * 65536):
+            self.sequences(window, [sequence % 65536, (sequence + 2) % 65536])
+        self.assertLess(window._seen.bit_length(), 129)
+        self.assertLessEqual(len(window._held), 4)
+        self.assertEqual(0, window.counters()['restarts'])
+
+
 if __name__ == '__main__':
     unittest.main()
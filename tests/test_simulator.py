@@ -0,0 +1,196 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import unittest
+
+from aerismodsdk.manufacturer import Manufacturer
+from aerismodsdk.modulefactory import module_factory
+from aerismodsdk.simulator import QuectelSimulator, TelitSimulator, UbloxSimulator
+from aerismodsdk.utils import instrumentation, rmutils
+
+
+class SimulatorTestCase(unittest.TestCase):
+    simulator = None
+    modem_mfg = None
+
+    def setUp(self):
+        self.modem = self.simulator().start()
+        self.module = module_factory().get(self.modem_mfg, self.modem.port, 'testapn', verbose=False)
+        self.ser = self.module.get_serial()
+
+    def tearDown(self):
+        self.ser.close()
+        self.modem.stop()
+
+
+class QuectelSimulatorTests(SimulatorTestCase):
+    simulator = QuectelSimulator
+    modem_mfg = Manufacturer.quectel
+
+    def test_get_info(self):
+        info = self.module.get_info()
+        self.assertEqual('QUECTEL', info['maker'])
+        self.assertEqual(self.modem.imsi, info['imsi'])
+        self.assertEqual(self.modem.iccid, info['iccid'])
+        self.assertEqual(self.modem.imei, info['imei'])
+
+    def test_get_info_without_iccid(self):
+        self.modem.iccid_command = '+CCID'
+        info = self.module.get_info()
+        self.assertIsNone(info['iccid'])
+        self.assertEqual(self.modem.imsi, info['imsi'])
+
+    def test_udp_packets(self):
+        self.assertTrue(self.module.udp_listen(23747, 0, verbose=False))
+        self.modem.start_traffic(100, count=3, payload=lambda n: b'packet ' + bytes([48 + n]))
+        urcs = rmutils.wait_urc(self.ser, 0.5, None, verbose=False, returnbytes=True)
+        self.assertEqual([b'packet 0', b'packet 1', b'packet 2'], self.module.udp_urcs_to_payloads(urcs))
+
+    def test_udp_echo(self):
+        self.modem.echo_packets = True
+        self.assertTrue(self.module.udp_echo('35.212.147.4', 3030, 0, 1, verbose=False))
+
+    def test_http_get(self):
+        self.assertIn('Hello, world!', self.module.http_get('example.com', verbose=False))
+
+    def test_sms_send(self):
+        self.assertTrue(self.module.sms_send('+15555550100', 'hello', verbose=False))
+        self.assertEqual([('+15555550100', b'hello')], self.modem.sms_sent)
+
+    def test_sim_read_binary(self):
+        self.assertEqual(self.modem.sim_files[0x6F07], self.module.sim_read_binary('6F07'))
+
+    def test_psm(self):
+        self.module.enable_psm(3600, 60, verbose=False)
+        self.assertEqual((3600, 60), self.modem.psm_seconds())
+        settings = self.module.get_psm_info(verbose=False)
+        self.assertEqual(3600, settings['tau_request'])
+
+
+class TelitSimulatorTests(SimulatorTestCase):
+    simulator = TelitSimulator
+    modem_mfg = Manufacturer.telit
+
+    def test_packet_session(self):
+        self.assertTrue(self.module.create_packet_session())
+        self.assertEqual(self.modem.ip_address, self.module.my_ip)
+
+    def test_psm(self):
+        self.module.enable_psm(3600, 60, verbose=False)
+        settings = self.module.get_psm_info(verbose=False)
+        self.assertEqual(3600, settings['tau_network'])
+        self.assertEqual(60, settings['active_time_network'])
+
+    def test_udp_echo(self):
+        self.modem.echo_packets = True
+        self.module.udp_echo('35.212.147.4', 3030, 0, 0)
+        time.sleep(0.2)
+        response = rmutils.write(self.ser, 'AT#SRECV=1,1500,1', verbose=False)
+        self.assertIn('#SRECV: 35.212.147.4,3030,1,', response)
+        self.assertIn(self.modem.sockets[1].sent[0].decode(), response)
+
+
+class UbloxSimulatorTests(SimulatorTestCase):
+    simulator = UbloxSimulator
+    modem_mfg = Manufacturer.ublox
+
+    def test_udp_echo(self):
+        self.modem.echo_packets = True
+        self.assertTrue(self.module.udp_echo('35.212.147.4', 3030, 0, 1, verbose=False))
+
+    def test_http_get(self):
+        self.assertIn('Hello, world!', self.module.http_get('example.com', verbose=False))
+
+    def test_psm(self):
+        self.module.enable_psm(3600, 60, verbose=False)
+        settings = self.module.get_psm_info(verbose=False)
+        self.assertEqual(3600, settings['tau_network'])
+
+
+class SimulatedModemTests(SimulatorTestCase):
+    simulator = QuectelSimulator
+    modem_mfg = Manufacturer.quectel
+
+    def test_latency(self):
+        self.modem.latency = 0.2
+        start_time = time.monotonic()
+        rmutils.write(self.ser, 'AT+CSQ', verbose=False)
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.2)
+
+    def test_chained_commands(self):
+        response = rmutils.write(self.ser, 'AT+CSQ;+CIMI', verbose=False)
+        self.assertIn('+CSQ: 20,99', response)
+        self.assertIn(self.modem.imsi, response)
+
+    def test_error(self):
+        self.assertIn('+CME ERROR: 3', rmutils.write(self.ser, 'AT+QIRD=5', verbose=False))
+
+    def test_registration_urc(self):
+        rmutils.write(self.ser, 'AT+CEREG=2', verbose=False)
+        self.modem.set_registration(5)
+        urcs = rmutils.wait_urc(self.ser, 1, None, returnonvalue='+CEREG:', verbose=False)
+        self.assertIn('+CEREG: 5,"2E0F","0A2B3C4D",7', urcs)
+
+
+
+class CommandBatchTests(SimulatorTestCase):
+    simulator = QuectelSimulator
+    modem_mfg = Manufacturer.quectel
+
+    def setUp(self):
+        super().setUp()
+        self.writes = instrumentation.add_sink(instrumentation.LatencyHistogram())
+
+    def tearDown(self):
+        instrumentation.remove_sink(self.writes)
+        super().tearDown()
+
+    def round_trips(self):
+        return sum(stats['count'] for stats in self.writes.summary().values())
+
+    def test_chains_prefixed_queries(self):
+        with self.module.batch() as b:
+            creg = b.query('AT+CREG?')
+            csq = b.query('AT+CSQ')
+            cimi = b.query('AT+CIMI')
+            band = b.query('AT+QCFG="band"')
+            scan = b.query('AT+QCFG="nwscanseq"')
+        self.assertEqual(3, self.round_trips())
+        self.assertEqual('\r\n+CSQ: 20,99\r\n\r\nOK\r\n', b.response(csq))
+        self.assertIn('+CREG: ', b.response(creg))
+        self.assertNotIn('+CSQ', b.response(creg))
+        self.assertIn(self.modem.imsi, b.response(cimi))
+        self.assertIn('+QCFG: "band"', b.response(band))
+        self.assertIn('+QCFG: "nwscanseq"', b.response(scan))
+        self.assertEqual('OK', b[scan].final)
+
+    def test_failed_chain_is_retried_one_at_a_time(self):
+        with self.module.batch() as b:
+            csq = b.query('AT+CSQ')
+            qird = b.query('AT+QIRD=5')
+        self.assertEqual(3, self.round_trips())
+        self.assertIn('+CSQ: 20,99', b.response(csq))
+        self.assertEqual('+CME ERROR: 3', b[qird].final)
+
+    def test_network_info(self):
+        net_info = self.module.network_info(False, False)
+        self.assertEqual('CAT-M1', net_info['act'])
+        self.assertEqual('1: Registered; home network', net_info['reg_status_eps'])
+        self.assertEqual(3, self.round_trips())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import subprocess
+import sys
+import unittest
+
+from benchmarks.bench_startup import DEFERRED_MODULES
+
+
+class StartupTests(unittest.TestCase):
+    def test_cli_import_defers_optional_dependencies(self):
+        code = ('import json, sys\n'
+                'import aerismodsdk.cli\n'
+                'print(json.dumps(sorted(sys.modules)))')
+        output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True,
+                                universal_newlines=True).stdout
+        loaded = set(name.split('.')[0] for name in json.loads(output))
+        self.assertEqual([], [name for name in DEFERRED_MODULES if name in loaded])
+
+    def test_help_without_optional_dependencies(self):
+        # aeriscli --help must work even where RPi.GPIO cannot be installed
+        process = subprocess.run([sys.executable, '-m', 'aerismodsdk.cli', '--help'], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(0, process.returncode, process.stderr)
+        self.assertIn('pi', process.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
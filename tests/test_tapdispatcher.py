@@ -0,0 +1,80 @@
+# Copyright 2020 Aeris Communications Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+import time
+import unittest
+
+from aerismodsdk.model.shoulder_tap import Udp0ShoulderTap
+from aerismodsdk.utils.tapdispatcher import ShoulderTapDispatcher, BLOCK, DROP
+
+
+def taps(count):
+    return [Udp0ShoulderTap(None, sequence, '310410123456789') for sequence in range(count)]
+
+
+class ShoulderTapDispatcherTests(unittest.TestCase):
+    def test_slow_handlers_do_not_hold_up_receiving(self):
+        handled = []
+        dispatcher = ShoulderTapDispatcher(workers=4, queue_depth=20, policy=BLOCK)
+        dispatcher.add_handler(lambda tap: time.sleep(0.2), name='slow')
+        dispatcher.add_handler(lambda tap: handled.append(tap.payloadId), name='record')
+        start_time = time.monotonic()
+        dispatcher.run(taps(8))
+        self.assertLess(time.monotonic() - start_time, 0.1)
+        dispatcher.stop()
+        # Four workers: two rounds of 0.2 s, not eight
+        self.assertLess(time.monotonic() - start_time, 1)
+        self.assertEqual(list(range(8)), sorted(handled))
+        summary = dispatcher.summary()
+        self.assertEqual(8, summary['dispatched'])
+        self.assertEqual(8, summary['handlers']['slow']['count'])
+        self.assertGreaterEqual(summary['handlers']['slow']['p50_s'], 0.19)
+
+    def test_full_queue(self):
+        release = threading.Event()
+        with ShoulderTapDispatcher(workers=1, queue_depth=2, policy=DROP) as dispatcher:
+            dispatcher.add_handler(lambda tap: release.wait(5))
+            results = [dispatcher.dispatch(tap) for tap in taps(5)]
+            time.sleep(0.1)
+            # The worker holds one tap and two wait, or it has not yet taken the first
+            self.assertIn(results, ([True, True, False, False, False], [True, True, True, False, False]))
+            self.assertEqual(results.count(False), dispatcher.summary()['dropped'])
+            release.set()
+        blocking = ShoulderTapDispatcher(workers=1, queue_depth=1, policy=BLOCK).start()
+        blocking.add_handler(lambda tap: time.sleep(0.3))
+        self.assertTrue(blocking.dispatch(taps(1)[0]))
+        time.sleep(0.05)
+        self.assertTrue(blocking.dispatch(taps(1)[0]))
+        self.assertFalse(blocking.dispatch(taps(1)[0], timeout=0.05))
+        start_time = time.monotonic()
+        self.assertTrue(blocking.dispatch(taps(1)[0]))
+        self.assertGreater(time.monotonic() - start_time, 0.1)
+        blocking.stop()
+
+    def test_handler_errors_are_counted(self):
+        def fail(tap):
+            raise ValueError('bad tap')
+        handled = []
+        with ShoulderTapDispatcher(workers=2) as dispatcher:
+            dispatcher.add_handler(fail)
+            dispatcher.add_handler(handled.append)
+            dispatcher.run(taps(3))
+        self.assertEqual(3, len(handled))
+        self.assertEqual(3, dispatcher.summary()['handlers']['fail']['errors'])
+
+
+if __name__ == '__main__':
+    unittest.main()